@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Контроль допуска запросов (admission control) по классам маршрутов
+
+Тяжелые маршруты (выгрузка всего каталога, экспорт и импорт Excel) могут занимать воркер
+на секунды; несколько админов или краулер, запустившие их одновременно, не должны
+вытеснять покупателей с /products и /orders. Поэтому:
+- у каждого класса свой предел одновременных запросов и ограниченная очередь ожидания;
+- все классы делят общую емкость воркера (Config.ADMISSION_CAPACITY), освободившееся место
+  получает ожидающий запрос самого приоритетного класса (оформление заказа - первым);
+- запрос, которому не хватило места в очереди, сразу получает 429 (тяжелые) или 503
+  с Retry-After; ждавший дольше Config.ADMISSION_MAX_WAIT_SECONDS - 503.
+
+Классифицируются только перечисленные маршруты; остальные (статика, /health, /metrics,
+лента /events/prices, постановка фоновых задач ?background=true на маршрутах из BACKGROUND_ROUTES)
+проходят без ограничений.
+Счетчики - в памяти процесса: при нескольких воркерах у каждого свои очереди и метрики.
+"""
+
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from config import Config
+from instrumentation import Histogram, _escape, _render_histogram
+
+
+class RouteClass:
+    """Класс маршрутов: предел одновременных запросов, очередь ожидания и счетчики"""
+
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, reject_status: int, retry_after: int):
+        self.name = name
+        self.priority = priority  # меньше - раньше получает освободившееся место
+        self.limit = limit
+        self.queue_size = queue_size
+        self.reject_status = reject_status
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiters: deque = deque()
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "timeout": 0}
+        self.wait_time = Histogram()
+
+
+# Классы маршрутов; пределы задаются в Config (ADMISSION_*)
+ROUTE_CLASSES = (
+    RouteClass("orders", 0, Config.ADMISSION_ORDERS_LIMIT, Config.ADMISSION_ORDERS_QUEUE, 503, 1),
+    RouteClass("catalog", 1, Config.ADMISSION_CATALOG_LIMIT, Config.ADMISSION_CATALOG_QUEUE, 503, 1),
+    RouteClass("heavy", 2, Config.ADMISSION_HEAVY_LIMIT, Config.ADMISSION_HEAVY_QUEUE, 429, 30),
+)
+
+# (класс, метод, путь); путь с "*" на конце - префикс
+ROUTE_RULES = (
+    ("orders", "POST", "/orders"),
+    ("orders", "POST", "/cart/evaluate"),
+    ("orders", "POST", "/promo-codes/check"),
+    ("orders", "POST", "/promo-codes/check-batch"),
+
+    ("heavy", "GET", "/all-products"),
+    ("heavy", "GET", "/export-products"),
+    ("heavy", "GET", "/export-prices"),
+    ("heavy", "GET", "/api/excel/export/*"),
+    ("heavy", "POST", "/api/excel/import/*"),
+    ("heavy", "POST", "/api/excel/update-or-create/*"),
+    ("heavy", "POST", "/api/excel/changesets/*"),
+    ("heavy", "POST", "/import-prices"),
+    ("heavy", "GET", "/api/admin/image-integrity"),
+
+    ("catalog", "GET", "/products"),
+    ("catalog", "GET", "/products/*"),
+    ("catalog", "POST", "/products/batch"),
+    ("catalog", "POST", "/variants/batch"),
+    ("catalog", "POST", "/prices/batch"),
+    ("catalog", "GET", "/categories"),
+    ("catalog", "GET", "/facets"),
+    ("catalog", "GET", "/search*"),
+    ("catalog", "GET", "/models/*"),
+    ("catalog", "GET", "/hierarchy/*"),
+    ("catalog", "GET", "/product-images/*"),
+    ("catalog", "GET", "/color-schemes/*"),
+    ("catalog", "GET", "/variant-schemes/*"),
+    ("catalog", "GET", "/level2-descriptions/*"),
+)
+
+# Маршруты, которые сами обрабатывают ?background=true: ставят фоновую задачу и сразу отвечают
+# (очередь задач ограничена job_runner). Остальным параметр не дает обойти ограничения
+BACKGROUND_ROUTES = frozenset({
+    ("POST", "/api/excel/import/products"),
+    ("POST", "/api/excel/update-or-create/products"),
+    ("POST", "/import-prices"),
+    ("GET", "/api/excel/export/products"),
+    ("GET", "/export-products"),
+    ("GET", "/export-prices"),
+    ("GET", "/api/admin/image-integrity"),
+})
+
+
+class Rejected(Exception):
+    def __init__(self, route_class: RouteClass, reason: str):
+        self.route_class = route_class
+        self.reason = reason
+
+
+class AdmissionController:
+    """Общая емкость воркера и очереди классов (все вызовы - из event loop)"""
+
+    def __init__(self, capacity: int = Config.ADMISSION_CAPACITY, max_wait: float = Config.ADMISSION_MAX_WAIT_SECONDS,
+                 route_classes=ROUTE_CLASSES, rules=ROUTE_RULES, background_routes=BACKGROUND_ROUTES):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.classes: Dict[str, RouteClass] = {route_class.name: route_class for route_class in route_classes}
+        self._by_priority = sorted(self.classes.values(), key=lambda route_class: route_class.priority)
+        self._exact: Dict[Tuple[str, str], RouteClass] = {}
+        self._prefixes: List[Tuple[str, str, RouteClass]] = []
+        for name, method, path in rules:
+            if path.endswith("*"):
+                self._prefixes.append((method, path[:-1], self.classes[name]))
+            else:
+                self._exact[(method, path)] = self.classes[name]
+        self._background_routes = background_routes
+        self.active = 0
+
+    def classify(self, method: str, path: str, query_string: bytes = b"") -> Optional[RouteClass]:
+        """Класс запроса; None - без ограничений"""
+        route_class = self._exact.get((method, path))
+        if route_class is None:
+            for rule_method, prefix, candidate in self._prefixes:
+                if rule_method == method and path.startswith(prefix):
+                    route_class = candidate
+                    break
+        # Постановка фоновой задачи отвечает сразу; очередь задач ограничена job_runner
+        if route_class is not None and b"background=" in query_string and (method, path) in self._background_routes:
+            if parse_qs(query_string.decode("latin-1")).get("background", [""])[0].lower() in ("true", "1"):
+                return None
+        return route_class
+
+    def _has_room(self, route_class: RouteClass) -> bool:
+        return route_class.active < route_class.limit and self.active < self.capacity
+
+    def _grant(self, route_class: RouteClass):
+        route_class.active += 1
+        route_class.admitted += 1
+        self.active += 1
+
+    async def acquire(self, route_class: RouteClass):
+        """Дождаться места или выбросить Rejected"""
+        if not route_class.waiters and self._has_room(route_class) and not self._waiting_before(route_class):
+            self._grant(route_class)
+            route_class.wait_time.observe(0.0)
+            return
+
+        if len(route_class.waiters) >= route_class.queue_size:
+            route_class.rejected["queue_full"] += 1
+            raise Rejected(route_class, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Место выдано в момент таймаута - не теряем его
+                route_class.wait_time.observe(time.perf_counter() - started)
+                return
+            route_class.rejected["timeout"] += 1
+            raise Rejected(route_class, "timeout")
+        except asyncio.CancelledError:
+            # Клиент отключился: место, выданное одновременно с отменой, возвращаем
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class)
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            if waiter in route_class.waiters:
+                route_class.waiters.remove(waiter)
+        route_class.wait_time.observe(time.perf_counter() - started)
+
+    def _waiting_before(self, route_class: RouteClass) -> bool:
+        """Ждут ли запросы более приоритетных классов, которым сейчас хватило бы места"""
+        for other in self._by_priority:
+            if other.priority >= route_class.priority:
+                return False
+            if other.waiters and other.active < other.limit:
+                return True
+        return False
+
+    def release(self, route_class: RouteClass):
+        route_class.active -= 1
+        self.active -= 1
+        # Освободившееся место - ожидающим по приоритету классов, внутри класса - по очереди
+        for candidate in self._by_priority:
+            while candidate.waiters and self._has_room(candidate):
+                waiter = candidate.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._grant(candidate)
+                waiter.set_result(True)
+            if self.active >= self.capacity:
+                break
+
+    def snapshot(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "max_wait_seconds": self.max_wait,
+            "classes": {
+                route_class.name: {
+                    "priority": route_class.priority,
+                    "limit": route_class.limit,
+                    "queue_size": route_class.queue_size,
+                    "active": route_class.active,
+                    "queue_depth": len(route_class.waiters),
+                    "admitted": route_class.admitted,
+                    "rejected": dict(route_class.rejected),
+                    "wait_seconds_total": round(route_class.wait_time.total, 6),
+                }
+                for route_class in self._by_priority
+            },
+        }
+
+    def render_prometheus(self) -> str:
+        """Очереди и отказы в формате Prometheus (дополняет /metrics)"""
+        lines: List[str] = []
+        lines.append("# HELP yo_admission_active_requests Выполняющиеся запросы класса")
+        lines.append("# TYPE yo_admission_active_requests gauge")
+        for route_class in self._by_priority:
+            lines.append(f'yo_admission_active_requests{{class="{_escape(route_class.name)}"}} {route_class.active}')
+
+        lines.append("# HELP yo_admission_queue_depth Запросы класса, ожидающие места")
+        lines.append("# TYPE yo_admission_queue_depth gauge")
+        for route_class in self._by_priority:
+            lines.append(f'yo_admission_queue_depth{{class="{_escape(route_class.name)}"}} {len(route_class.waiters)}')
+
+        lines.append("# HELP yo_admission_admitted_total Допущенные запросы класса")
+        lines.append("# TYPE yo_admission_admitted_total counter")
+        for route_class in self._by_priority:
+            lines.append(f'yo_admission_admitted_total{{class="{_escape(route_class.name)}"}} {route_class.admitted}')
+
+        lines.append("# HELP yo_admission_rejected_total Отклоненные запросы: очередь заполнена или ожидание слишком долгое")
+        lines.append("# TYPE yo_admission_rejected_total counter")
+        for route_class in self._by_priority:
+            for reason, count in route_class.rejected.items():
+                lines.append(f'yo_admission_rejected_total{{class="{_escape(route_class.name)}",reason="{reason}"}} {count}')
+
+        lines.append("# HELP yo_admission_wait_seconds Время ожидания места в очереди")
+        lines.append("# TYPE yo_admission_wait_seconds histogram")
+        for route_class in self._by_priority:
+            _render_histogram(lines, "yo_admission_wait_seconds", f'class="{_escape(route_class.name)}"', route_class.wait_time)
+
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный экземпляр для процесса
+admission = AdmissionController()
+
+
+class AdmissionControlMiddleware:
+    """
+    Чистое ASGI middleware: допуск запроса до маршрутизации, место освобождается после
+    отправки всего ответа (включая стриминговые). Подключается внешним, чтобы отказ ничего не стоил.
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.controller.classify(scope["method"], scope["path"], scope.get("query_string", b""))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(route_class)
+        except Rejected as e:
+            await self._reject(send, e)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+    async def _reject(self, send, rejected: Rejected):
+        route_class = rejected.route_class
+        if rejected.reason == "queue_full":
+            status = route_class.reject_status
+            detail = "Слишком много одновременных запросов, повторите позже"
+        else:
+            status = 503
+            detail = "Сервер перегружен, повторите позже"
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(route_class.retry_after).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
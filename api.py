@@ -1,22 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Response
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Response, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
-from database import get_db
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, RedirectResponse, JSONResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import and_, or_, func, select
+from database import get_db, SessionLocal
 from models import Product, Category, ProductImage, Level2Description, Order, OrderItem, PromoCode
-from price_storage import get_price, get_all_prices, set_price, update_prices
+from price_storage import get_price, get_prices, get_all_prices, set_price, update_prices
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Optional, TypedDict
+from datetime import datetime, timedelta
 from a2wsgi import ASGIMiddleware
 import json
 import io
-import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from excel_handler import ExcelHandler
+import csv
+import orjson
+# pandas/openpyxl/excel_handler импортируются внутри Excel эндпоинтов - это ускоряет холодный старт воркеров
 from manual_price_manager import manual_price_manager
+from order_service import allocate_order_number, consume_promo_code
+from promo_engine import promo_engine
+from cart_quote import evaluate_cart, verify_quote, quotes_enabled, InvalidQuote, QUOTES_DISABLED_MESSAGE
+from instrumentation import install_instrumentation, metrics, METRICS_ENABLED
+from slow_query_log import install_slow_query_log, slow_query_log
+from cache_coherence import CacheCoherenceMiddleware
+from admission import AdmissionControlMiddleware, admission
+from catalog_cards import catalog_cards, MAX_INLINE_RESULTS
+from hierarchy_index import hierarchy_index
+from facet_index import facet_index, SORTS as FACET_SORTS
+from product_enricher import ProductEnricher, category_name, IN_CHUNK_SIZE
+from job_runner import job_runner, JobQueueFull
+from image_integrity import scan_images
+from price_events import price_events
+from variant_matrix import variant_matrix, color_scheme, variant_scheme
 from config import Config
 import os
 
@@ -34,83 +49,6 @@ def normalize_color_name(color: str) -> str:
     # Просто приводим к нижнему регистру и заменяем пробелы на дефисы
     return color.lower().replace(' ', '-')
 
-def get_product_images(product, db: Session):
-    """Получить массив изображений товара из таблицы ProductImage"""
-    images = []
-    
-    # Сначала попробуем получить изображения из specifications
-    try:
-        specs = json.loads(product.specifications) if product.specifications else {}
-        images_data = specs.get('images', [])
-        
-        for img_data in images_data:
-            if isinstance(img_data, dict):
-                # Новый формат: {"url": "...", "alt": "..."}
-                images.append(img_data["url"])
-            elif isinstance(img_data, str):
-                # Новый формат: массив строк
-                images.append(img_data)
-                
-    except json.JSONDecodeError:
-        pass
-    
-    # Если не нашли в specifications, ищем в таблице ProductImage по (level_2, color)
-    if not images and product.level_2 and product.color:
-        try:
-            # Сначала пробуем точное совпадение
-            product_image = db.query(ProductImage).filter(
-                ProductImage.level_2 == product.level_2,
-                ProductImage.color == product.color
-            ).first()
-            
-            # Если не нашли, пробуем нормализованный поиск
-            if not product_image:
-                all_images = db.query(ProductImage).all()
-                product_level2_normalized = product.level_2.lower().replace(' ', '').replace('-', '').replace('series', '').replace('s11', 'series11').replace('sportband', '')
-                product_color_normalized = product.color.lower().replace(' ', '').replace('-', '').replace('/', '').replace('_', '')
-                
-                for img in all_images:
-                    img_level2_normalized = img.level_2.lower().replace(' ', '').replace('-', '').replace('series', '').replace('s11', 'series11').replace('sportband', '')
-                    img_color_normalized = img.color.lower().replace(' ', '').replace('-', '').replace('/', '').replace('_', '')
-                    
-                    # Если цвет содержит "/", пробуем первую часть
-                    if '/' in product.color:
-                        color_first_part = product.color.split('/')[0].lower().replace(' ', '').replace('-', '')
-                        if color_first_part in img_color_normalized or img_color_normalized in color_first_part:
-                            product_color_normalized = img_color_normalized
-                    
-                    level2_match = (img_level2_normalized == product_level2_normalized or 
-                                   product_level2_normalized in img_level2_normalized or 
-                                   img_level2_normalized in product_level2_normalized)
-                    
-                    color_match = (img_color_normalized == product_color_normalized or
-                                  product_color_normalized in img_color_normalized or
-                                  img_color_normalized in product_color_normalized)
-                    
-                    if level2_match and color_match:
-                        product_image = img
-                        break
-            
-            if product_image and product_image.img_list:
-                images_data = json.loads(product_image.img_list)
-                
-                # Обработка double-encoded JSON (если после парсинга получили строку)
-                if isinstance(images_data, str):
-                    images_data = json.loads(images_data)
-                
-                # Теперь обрабатываем массив
-                if isinstance(images_data, list):
-                    for img_data in images_data:
-                        if isinstance(img_data, dict):
-                            images.append(img_data["url"])
-                        elif isinstance(img_data, str):
-                            images.append(img_data)
-        except (json.JSONDecodeError, TypeError):
-            pass
-    
-    # Если изображений нет, вернем пустой список
-    return images
-
 def parse_images_from_string(images_str: str) -> List[str]:
     """Парсить строку изображений разделенных запятыми в JSON массив"""
     if not images_str or not images_str.strip():
@@ -122,13 +60,55 @@ def parse_images_from_string(images_str: str) -> List[str]:
     # Конвертируем в JSON массив строк
     return json.dumps(image_urls)
 
-app = FastAPI(title="Yo Store API", version="1.0.0")
+# ORJSONResponse по умолчанию: сериализация больших списков товаров в разы быстрее стандартного json
+app = FastAPI(title="Yo Store API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Метрики производительности (METRICS_ENABLED=true): гистограммы маршрутов, счетчики SQL, Server-Timing
+from database import engine as db_engine
+install_instrumentation(app, db_engine)
+
+# Журнал медленных SQL запросов с планами (SLOW_QUERY_LOG_ENABLED=true, порог SLOW_QUERY_THRESHOLD_MS)
+install_slow_query_log(db_engine)
+
+# Сброс локальных кэшей воркера, если данные изменил другой процесс
+app.add_middleware(CacheCoherenceMiddleware)
+
+# Пределы одновременных запросов по классам маршрутов (подключается последним - внешний слой)
+if Config.ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+
+@app.on_event("startup")
+async def warm_caches():
+    """Прогреть кэш цен при старте воркера, чтобы первый запрос не читал файл"""
+    get_all_prices()
+
+@app.on_event("startup")
+async def start_job_runner():
+    """Пул фоновых задач: прерванные перезапуском задачи запускаются заново или помечаются failed"""
+    job_runner.start()
+
+@app.on_event("startup")
+async def warn_insecure_secret_key():
+    if not quotes_enabled():
+        print(f"⚠️  {QUOTES_DISABLED_MESSAGE} (задайте случайный SECRET_KEY не короче 16 символов)")
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    job_runner.shutdown()
+
+# Ключ scope: запрос пришел через WSGI обертку (Passenger), а не напрямую в ASGI сервер
+WSGI_SCOPE_KEY = "yo.wsgi"
+
+async def _wsgi_app(scope, receive, send):
+    if scope["type"] == "http":
+        scope = {**scope, WSGI_SCOPE_KEY: True}
+    await app(scope, receive, send)
+
 # WSGI wrapper for Passenger
-application = ASGIMiddleware(app)
+application = ASGIMiddleware(_wsgi_app)
 
 # --- Simple Admin Auth (cookie-based) ---
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'yo_admin')
@@ -167,6 +147,77 @@ class ProductResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ProductRow(TypedDict):
+    """
+    Строка товара для горячих списков (/all-products, /products, /search): те же поля, что ProductResponse,
+    но без создания и повторной валидации Pydantic модели на каждую строку
+    """
+    id: int
+    sku: Optional[str]
+    name: str
+    description: str
+    brand: str
+    model: str
+    category_name: str
+    level_2: Optional[str]
+    image_url: str
+    images: List[str]
+    specifications: dict
+    price: Optional[float]
+    old_price: Optional[float]
+    discount_percentage: Optional[float]
+    currency: str
+    is_available: bool
+    is_parse: Optional[bool]
+
+def product_row(is_available: bool = True, is_parse: Optional[bool] = True, **fields) -> ProductRow:
+    """ProductRow с умолчаниями ProductResponse для is_available и is_parse"""
+    return ProductRow(**fields, is_available=is_available, is_parse=is_parse)
+
+def product_rows_response(rows: List[ProductRow]):
+    """
+    Ответ со списком товаров: сразу ORJSONResponse (response_model не валидирует готовый Response)
+    При STRICT_RESPONSE_VALIDATION=true строки проходят через ProductResponse, как раньше (для тестов)
+    """
+    if Config.STRICT_RESPONSE_VALIDATION:
+        return [ProductResponse(**row) for row in rows]
+    return ORJSONResponse(rows)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(request: Request, stream: bool) -> bool:
+    """Потоковый режим: ?stream=1 или Accept: application/x-ndjson"""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(chunks, model=None) -> StreamingResponse:
+    """
+    Потоковый ответ: один JSON объект на строку, пачка строк - одна запись в сокет
+    chunks - генератор списков строк (сам открывает и закрывает сессию БД);
+    model - проверить строки Pydantic моделью при STRICT_RESPONSE_VALIDATION=true
+    """
+    def lines():
+        for rows in chunks:
+            if model is not None and Config.STRICT_RESPONSE_VALIDATION:
+                rows = [model(**row).model_dump(mode="json") for row in rows]
+            yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
+    
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+def stream_query_chunks(statement, build_rows):
+    """
+    Читать запрос пачками по Config.NDJSON_CHUNK_SIZE (yield_per - курсор БД, а не весь результат в памяти)
+    и отдавать build_rows(пачка товаров, enricher); сессия своя - ответ живет дольше зависимости get_db
+    """
+    db = SessionLocal()
+    try:
+        enricher = ProductEnricher(db, stream=True)
+        result = db.execute(statement.execution_options(yield_per=Config.NDJSON_CHUNK_SIZE)).scalars()
+        for chunk in result.partitions():
+            yield build_rows(chunk, enricher)
+            enricher.forget_products()
+    finally:
+        db.close()
+
 class CategoryResponse(BaseModel):
     id: int
     name: str
@@ -202,7 +253,25 @@ class ProductDetailResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ProductBatchRequest(BaseModel):
+    ids: List[int] = []
+    skus: List[str] = []
+
+class VariantBatchRequest(BaseModel):
+    models: List[str]
+
+class PriceBatchRequest(BaseModel):
+    skus: List[str]
+
 # --- Helpers ---
+def check_batch_size(count: int) -> None:
+    """Ограничение размера пакетного запроса (BATCH_MAX_ITEMS)"""
+    if count > Config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много элементов в запросе: {count} (максимум {Config.BATCH_MAX_ITEMS})"
+        )
+
 def ensure_category_exists(db: Session, level0: Optional[str], level1: Optional[str] = None, level2: Optional[str] = None) -> None:
     """Создать записи в таблице Category для уровней, если их нет."""
     try:
@@ -294,89 +363,198 @@ async def get_categories(db: Session = Depends(get_db)):
     
     return result
 
+ALL_PRODUCTS_ORDER = (Product.level_0, Product.level_1, Product.level_2.desc(), Product.sku)
+
+def all_products_rows(products: List[Product], enricher: ProductEnricher) -> List[ProductRow]:
+    """Строки /all-products для пачки товаров (цены и изображения пачки читаются одним обращением)"""
+    enricher.load(products, descriptions=False, images=True)
+    rows = []
+    for product in products:
+        # Получаем данные о цене с безопасными значениями по умолчанию
+        price_data = enricher.price(product) or {}
+        
+        # Получаем изображения
+        images = enricher.images(product)
+        
+        rows.append(product_row(
+            id=product.id,
+            sku=product.sku,
+            name=product.name,
+            description="",  # поле description удалено
+            brand=product.brand,
+            model=product.level_2 or "",
+            category_name=category_name(product),
+            level_2=product.level_2,
+            image_url=images[0] if images else "/static/images/placeholder.jpg",
+            images=images,
+            specifications=enricher.specifications(product),
+            price=price_data.get('price', 0.0),
+            old_price=price_data.get('old_price', 0.0),
+            discount_percentage=price_data.get('discount_percentage', 0.0),
+            currency=price_data.get('currency', 'RUB'),
+            is_available=True,
+            is_parse=price_data.get('is_parse', True)
+        ))
+    return rows
+
 @app.get("/all-products", response_model=List[ProductResponse])
-async def get_all_products(db: Session = Depends(get_db)):
-    """Endpoint для получения всех товаров без группировки"""
+def get_all_products(request: Request, stream: bool = False, db: Session = Depends(get_db)):
+    """
+    Endpoint для получения всех товаров без группировки (def - выполняется в пуле потоков, не блокируя event loop)
+    ?stream=1 или Accept: application/x-ndjson - NDJSON по мере чтения каталога, память не зависит от его размера
+    """
+    if wants_ndjson(request, stream):
+        return ndjson_response(
+            stream_query_chunks(select(Product).order_by(*ALL_PRODUCTS_ORDER), all_products_rows),
+            model=ProductResponse
+        )
+    
     try:
         # Простой запрос всех товаров
-        results = db.query(Product).order_by(Product.level_0, Product.level_1, Product.level_2.desc(), Product.sku).all()
+        results = db.query(Product).order_by(*ALL_PRODUCTS_ORDER).all()
         
         print(f"📊 Найдено {len(results)} результатов в БД")
         
-        products = []
-        for idx, product in enumerate(results):
-            print(f"🔄 Обрабатываем товар {idx + 1}/{len(results)}: ID {product.id}")
-            
-            # Получаем цену из JSON файла
-            price_data = get_price(product.sku)
-            
-            # Получаем данные о цене с безопасными значениями по умолчанию
-            if price_data is None:
-                product_price = 0.0
-                product_old_price = 0.0
-                product_discount = 0.0
-                product_currency = "RUB"
-                product_is_parse = True
-            else:
-                product_price = price_data.get('price', 0.0)
-                product_old_price = price_data.get('old_price', 0.0)
-                product_discount = price_data.get('discount_percentage', 0.0)
-                product_currency = price_data.get('currency', 'RUB')
-                product_is_parse = price_data.get('is_parse', True)
-            
-            # Получаем изображения
-            images = get_product_images(product, db)
-            image_url = images[0] if images else "/static/images/placeholder.jpg"
-            
-            # Получаем спецификации
-            try:
-                specifications = json.loads(product.specifications) if product.specifications else {}
-            except json.JSONDecodeError:
-                specifications = {}
-            
-            # Проверяем description
-            desc = ""
-            if True:  # description всегда None, так как поле удалено
-                print(f"⚠️  Товар ID {product.id} имеет description=None, заменяем на пустую строку")
-            
-            products.append(ProductResponse(
-                id=product.id,
-                sku=product.sku,
-                name=product.name,
-                description=desc,
-                brand=product.brand,
-                model=product.level_2 or "",
-                category_name=f"{product.level_0} / {product.level_1} / {product.level_2}" if product.level_1 and product.level_2 else product.level_0,
-                level_2=product.level_2,
-                image_url=image_url,
-                images=images,
-                specifications=specifications,
-                price=product_price,
-                old_price=product_old_price,
-                discount_percentage=product_discount,
-                currency=product_currency,
-                is_available=True,
-                is_parse=product_is_parse
-            ))
-        
-        return products
+        return product_rows_response(all_products_rows(results, ProductEnricher(db)))
     except Exception as e:
         print(f"❌ Ошибка в get_all_products: {e}")
         return []
 
+def model_price_object(best_variant_price: Optional[dict], fallback_sku: str) -> dict:
+    """
+    Цена карточки модели: вариант с минимальной ценой (old_price и скидка от него же),
+    без цен у вариантов - цена представительного товара
+    """
+    if best_variant_price is None:
+        return get_price(fallback_sku) or {
+            'price': 0.0,
+            'old_price': 0.0,
+            'discount_percentage': 0.0,
+            'currency': 'RUB'
+        }
+
+    min_price = best_variant_price.get('price', 0.0)
+    # Если old_price не указан, используем price
+    min_old_price = best_variant_price.get('old_price') or min_price
+    price_obj = {
+        'price': min_price,
+        'old_price': min_old_price,
+        'currency': best_variant_price.get('currency', 'RUB')
+    }
+    # Вычисляем discount_percentage
+    if min_old_price and min_old_price > min_price:
+        price_obj['discount_percentage'] = ((min_old_price - min_price) / min_old_price) * 100
+    else:
+        price_obj['discount_percentage'] = 0.0
+    return price_obj
+
+def model_card_response(product: Product, price_obj: dict, enricher: ProductEnricher) -> ProductRow:
+    """Карточка модели для /products: товар-представитель + описание level_2 + изображения + цена"""
+    images = enricher.images(product)
+    
+    return product_row(
+        id=product.id,
+        sku=product.sku,
+        name=product.name,
+        description=enricher.description_text(product),
+        brand=product.brand,
+        model=product.level_2 or "",
+        category_name=category_name(product),
+        level_2=product.level_2,
+        image_url=images[0] if images else '',
+        images=images,
+        specifications=enricher.specifications(product),
+        price=price_obj.get('price', 0.0),
+        old_price=price_obj.get('old_price', 0.0),
+        discount_percentage=price_obj.get('discount_percentage', 0.0),
+        currency=price_obj.get('currency', 'RUB'),
+    )
+
+def split_facet_values(value: Optional[str]) -> List[str]:
+    """?color=Black,White -> ["Black", "White"] (несколько значений одного фасета - ИЛИ)"""
+    if not value:
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+def facet_filters(brand, level0, level1, level2, color, disk, sim, ram, screen_size, band_size) -> dict:
+    """Фильтры запроса в формате facet_index (уровни каталога - одно значение, характеристики - список)"""
+    return {
+        "brand": [brand] if brand else [],
+        "level0": [level0] if level0 else [],
+        "level1": [level1] if level1 else [],
+        "level2": [level2] if level2 else [],
+        "color": split_facet_values(color),
+        "disk": split_facet_values(disk),
+        "sim": split_facet_values(sim),
+        "ram": split_facet_values(ram),
+        "screen_size": split_facet_values(screen_size),
+        "band_size": split_facet_values(band_size),
+    }
+
 @app.get("/products", response_model=List[ProductResponse])
 async def get_products(
     brand: Optional[str] = None,
     level0: Optional[str] = None,
     level1: Optional[str] = None,
     level2: Optional[str] = None,
+    color: Optional[str] = None,
+    disk: Optional[str] = None,
+    sim: Optional[str] = None,
+    ram: Optional[str] = None,
+    screen_size: Optional[str] = None,
+    band_size: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    sort: Optional[str] = None,
     limit: int = 20,
     offset: int = 0,
     db: Session = Depends(get_db)
 ):
-    """Get unique product models (grouped by level2) with optional hierarchical filters"""
-    # Простая логика: получаем все товары, затем группируем в Python
-    query = db.query(Product)
+    """
+    Get unique product models (grouped by level2) with optional hierarchical filters
+    Фильтры по характеристикам (color, disk, sim, ram, screen_size, band_size - через запятую),
+    диапазон цен и sort=price/-price обрабатываются фасетным индексом в памяти (facet_index):
+    цена карточки - минимальная среди подходящих вариантов
+    """
+    return product_rows_response(product_model_rows(
+        db, brand, level0, level1, level2, color, disk, sim, ram, screen_size, band_size,
+        price_min, price_max, sort, limit, offset
+    ))
+
+def product_model_rows(
+    db: Session,
+    brand: Optional[str] = None,
+    level0: Optional[str] = None,
+    level1: Optional[str] = None,
+    level2: Optional[str] = None,
+    color: Optional[str] = None,
+    disk: Optional[str] = None,
+    sim: Optional[str] = None,
+    ram: Optional[str] = None,
+    screen_size: Optional[str] = None,
+    band_size: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    sort: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[ProductRow]:
+    """Строки /products (карточки моделей); бот в одном процессе с API вызывает напрямую"""
+    if sort is not None and sort not in FACET_SORTS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная сортировка: {sort}")
+    
+    if any(value is not None for value in (color, disk, sim, ram, screen_size, band_size, price_min, price_max, sort)):
+        filters = facet_filters(brand, level0, level1, level2, color, disk, sim, ram, screen_size, band_size)
+        cards = facet_index.search(filters, price_min, price_max, sort)[offset:offset + limit]
+        products_by_id = {
+            product.id: product
+            for product in db.query(Product).filter(Product.id.in_([card["product_id"] for card in cards])).all()
+        }
+        enricher = ProductEnricher(db).load(products_by_id.values(), prices=False)
+        return [
+            model_card_response(products_by_id[card["product_id"]], model_price_object(card["best"], products_by_id[card["product_id"]].sku), enricher)
+            for card in cards if card["product_id"] in products_by_id
+        ]
     
     # Применяем фильтры
     filters = []
@@ -389,11 +567,6 @@ async def get_products(
         filters.append(Product.level_1 == level1)
     if level2:
         filters.append(Product.level_2 == level2)
-        
-    
-    # Применяем фильтры
-    if filters:
-        query = query.filter(and_(*filters))
     
     # Используем подкеру для получения одного представительного товара из каждой модели
     subquery = db.query(
@@ -407,307 +580,145 @@ async def get_products(
     
     # Применяем лимит и отступ
     results = final_query.offset(offset).limit(limit).all()
+    enricher = ProductEnricher(db).load(results, prices=False)
     
     products = []
     for product in results:
         # Для карточки модели нужно найти минимальную цену среди всех вариантов этой модели
-        # Получаем все товары этой модели
-        all_model_products = db.query(Product).filter(
+        model_skus = [sku for (sku,) in db.query(Product.sku).filter(
             Product.level_2 == product.level_2,
             Product.brand == product.brand
-        ).all()
-        
-        # Находим минимальную цену среди всех вариантов
-        min_price = None
-        min_old_price = None
-        currency = "RUB"
-        best_variant_price = None  # Сохраняем весь объект цены для варианта с минимальной ценой
-        
-        for model_product in all_model_products:
-            variant_price = get_price(model_product.sku)
-            if variant_price:
-                variant_price_value = variant_price.get('price', 0.0)
-                if min_price is None or variant_price_value < min_price:
-                    min_price = variant_price_value
-                    best_variant_price = variant_price  # Сохраняем весь объект
-                    currency = variant_price.get('currency', 'RUB')
-        
-        # Если не нашли цену, используем цену представительного товара
-        if min_price is None:
-            price_data = get_price(product.sku)
-            if price_data:
-                price_obj = price_data
-            else:
-                price_obj = {
-                    'price': 0.0,
-                    'old_price': 0.0,
-                    'discount_percentage': 0.0,
-                    'currency': 'RUB'
-                }
-        else:
-            # Используем old_price от варианта с минимальной ценой
-            if best_variant_price:
-                min_old_price = best_variant_price.get('old_price')
-                # Если old_price не указан, используем price
-                if not min_old_price:
-                    min_old_price = min_price
-            else:
-                min_old_price = min_price
-            
-            # Формируем объект с минимальной ценой
-            price_obj = {
-                'price': min_price,
-                'old_price': min_old_price,
-                'currency': currency
-            }
-            # Вычисляем discount_percentage
-            if min_old_price and min_old_price > min_price:
-                price_obj['discount_percentage'] = ((min_old_price - min_price) / min_old_price) * 100
-            else:
-                price_obj['discount_percentage'] = 0.0
+        ).all()]
         
-        try:
-            specifications = json.loads(product.specifications) if product.specifications else {}
-        except json.JSONDecodeError:
-            specifications = {}
-        
-        # Получаем описание из level2_descriptions
-        desc = ""
-        level2_specs = {}
-        if product.level_2:
-            level2_desc = db.query(Level2Description).filter(Level2Description.level_2 == product.level_2).first()
-            if level2_desc:
-                desc = level2_desc.description or ""
-                if level2_desc.details:
-                    try:
-                        level2_specs = json.loads(level2_desc.details) if isinstance(level2_desc.details, str) else level2_desc.details
-                    except json.JSONDecodeError:
-                        level2_specs = {}
-        
-        # Объединяем характеристики из level2_descriptions с существующими specifications
-        all_specifications = {**level2_specs, **specifications}
-        
-        images = get_product_images(product, db)
-        
-        # Получаем название категории из level полей
-        category_name = product.level_0 or "Без категории"
-        if product.level_1:
-            category_name += f" / {product.level_1}"
-        if product.level_2:
-            category_name += f" / {product.level_2}"
-        
-        products.append(ProductResponse(
-            id=product.id,
-            sku=product.sku,
-            name=product.name,
-            description=desc,
-            brand=product.brand,
-            model=product.level_2 or "",
-            category_name=category_name,
-            level_2=product.level_2,
-            image_url=images[0] if images else '',
-            images=images,
-            specifications=specifications,
-            price=price_obj.get('price', 0.0),
-            old_price=price_obj.get('old_price', 0.0),
-            discount_percentage=price_obj.get('discount_percentage', 0.0),
-            currency=price_obj.get('currency', 'RUB'),
-        ))
+        # Сохраняем весь объект цены для варианта с минимальной ценой
+        best_variant_price = None
+        for variant_price in get_prices(model_skus).values():
+            if best_variant_price is None or variant_price.get('price', 0.0) < best_variant_price.get('price', 0.0):
+                best_variant_price = variant_price
+        
+        products.append(model_card_response(product, model_price_object(best_variant_price, product.sku), enricher))
     
     return products
 
+def model_skus(models: List[str]) -> List[str]:
+    """SKU моделей level_2 (короткая сессия: SSE соединение держится долго, соединение с БД ему не нужно)"""
+    db = SessionLocal()
+    try:
+        return [sku for (sku,) in db.query(Product.sku).filter(Product.level_2.in_(models))]
+    finally:
+        db.close()
+
+@app.get("/events/prices")
+async def price_events_feed(request: Request, level_2: Optional[str] = None, skus: Optional[str] = None):
+    """
+    Лента изменений цен и остатков (Server-Sent Events) для открытых сессий WebApp
+    event: price - [{sku, price, old_price}], event: stock - [{sku, stock}], event: reset - перечитать цены целиком
+    level_2, skus - только изменения этих моделей/SKU (через запятую); Last-Event-ID - продолжить с пропущенных
+    
+    Только для запуска под ASGI сервером (uvicorn): через WSGI обертку (Passenger, api.application)
+    каждый открытый поток занимал бы WSGI процесс на всю сессию, поэтому там лента отключена -
+    204 No Content, и EventSource не переподключается
+    """
+    if request.scope.get(WSGI_SCOPE_KEY):
+        return Response(status_code=204)
+    
+    sku_filter = None
+    if level_2 or skus:
+        sku_filter = set(split_facet_values(skus))
+        models = split_facet_values(level_2)
+        if models:
+            sku_filter.update(await run_in_threadpool(model_skus, models))
+    
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    return StreamingResponse(
+        price_events.stream(sku_filter, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/facets")
+async def get_facets(
+    brand: Optional[str] = None,
+    level0: Optional[str] = None,
+    level1: Optional[str] = None,
+    level2: Optional[str] = None,
+    color: Optional[str] = None,
+    disk: Optional[str] = None,
+    sim: Optional[str] = None,
+    ram: Optional[str] = None,
+    screen_size: Optional[str] = None,
+    band_size: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+):
+    """
+    Счетчики фасетов для текущих фильтров (те же параметры, что у /products)
+    Для каждого фасета значения считаются без учета фильтра по самому фасету,
+    поэтому выбранный цвет не скрывает остальные цвета; price - диапазон цен без учета price_min/price_max
+    """
+    filters = facet_filters(brand, level0, level1, level2, color, disk, sim, ram, screen_size, band_size)
+    return facet_index.facet_counts(filters, price_min, price_max)
+
 @app.get("/products/{model}/variants")
 async def get_model_variants(model: str, db: Session = Depends(get_db)):
-    """Get all variants and their prices for a specific model (level_2)"""
+    """
+    Get all variants and their prices for a specific model (level_2)
+    Отдается из матрицы вариантов в памяти (variant_matrix): оси выбора, сетка SKU, изображения по цветам
+    """
     import urllib.parse
     # Декодируем URL параметр
     model = urllib.parse.unquote(model)
     
-    # Сначала попробуем найти основной продукт с полными спецификациями
-    main_product = db.query(Product).filter(
-        Product.level_2 == model,
-        Product.specifications.like('%variants%')
-    ).first()
-    
-    if main_product:
-        # Найден основной продукт с вложенными вариантами
-        specifications = {}
-        try:
-            if main_product.specifications:
-                specifications = json.loads(main_product.specifications)
-        except json.JSONDecodeError:
-            pass
-        
-        variants = []
-        
-        # Извлекаем варианты из specifications.variants
-        if 'variants' in specifications:
-            # Сортируем варианты по цвету (в алфавитном порядке)
-            sorted_variants = sorted(specifications['variants'], key=lambda x: x.get('specifications', {}).get('color', ''))
-            
-            for variant_info in sorted_variants:
-                # Находим цену для этого варианта по SKU из JSON файла
-                price_data = get_price(variant_info['sku'])
-                
-                variant_specs = variant_info.get('specifications', {})
-                
-                # Получаем изображения для цвета из основного продукта
-                variant_color = variant_specs.get('color', '')
-                variant_color_normalized = variant_color.lower().replace(' ', '-')
-                variant_images = []
-                
-                if 'images' in specifications:
-                    for img_info in specifications['images']:
-                        if isinstance(img_info, dict) and 'color' in img_info:
-                            img_color = img_info.get('color', '').lower()
-                            if img_color == variant_color_normalized:
-                                variant_images.append(img_info.get('url', ''))
-                        elif isinstance(img_info, str):
-                            # Прямой URL - пытаемся определить цвет из пути
-                            img_path = img_info.lower()
-                            if variant_color_normalized in img_path:
-                                variant_images.append(img_info)
-                
-                variant_data = {
-                    "sku": variant_info['sku'],
-                    "name": variant_info['name'],
-                    "price": price_data.get('price', 0.0) if price_data else 0.0,
-                    "old_price": price_data.get('old_price', 0.0) if price_data else 0.0,
-                    "discount_percentage": price_data.get('discount_percentage', 0.0) if price_data else 0.0,
-                    "currency": price_data.get('currency', 'RUB') if price_data else "RUB",
-                    "stock": variant_info.get('stock', 0),
-                    "is_available": variant_info.get('is_available', True),
-                    
-                    # Добавляем спецификации варианта
-                    "color": variant_specs.get('color', ''),
-                    "memory": variant_specs.get('memory', ''),
-                    "sim_type": variant_specs.get('sim_type', ''),
-                    "ram": variant_specs.get('ram', ''),  # RAM для ноутбуков
-                    "screen_size": variant_specs.get('screen_size', ''),  # Размер экрана
-                    "band_size": variant_specs.get('band_size', ''),  # Размер ремешка
-                    
-                    # Изображения для этого цвета
-                    "images": variant_images,
-                    "main_image": variant_images[0] if variant_images else ""
-                }
-                
-                variants.append(variant_data)
-        
-        return {
-            "model": model,
-            "variants": variants,
-            "total_variants": len(variants)
-        }
-    
-    # Fallback: Если основного продукта нет, найдем все варианты для данной модели
-    variants_query = db.query(Product).filter(Product.level_2 == model).order_by(Product.specifications)  # Сортируем по specifications
-    
-    variants = []
-    for product in variants_query.all():
-        # Получаем цену из JSON файла
-        price_data = get_price(product.sku)
-        
-        # Получаем спецификации варианта
-        specifications = {}
-        try:
-            if product.specifications:
-                specifications = json.loads(product.specifications)
-        except json.JSONDecodeError:
-            pass
-        
-        # Получаем изображения
-        images = get_product_images(product, db)
-        
-        # Используем поля из модели Product напрямую, fallback на specifications
-        color = product.color if product.color else specifications.get('color', '')
-        memory = product.disk if product.disk else specifications.get('disk', specifications.get('memory', ''))
-        sim_type = product.sim_config if product.sim_config else specifications.get('sim_config', specifications.get('sim_type', ''))
-        ram = specifications.get('ram', '')  # RAM для ноутбуков
-        screen_size = specifications.get('screen_size', '')  # Размер экрана
-        band_size = specifications.get('band_size', '')  # Размер ремешка
-        
-        variant_data = {
-            "sku": product.sku,
-            "name": product.name,
-            "price": price_data.get('price', 0.0) if price_data else 0.0,
-            "old_price": price_data.get('old_price', 0.0) if price_data else 0.0,
-            "discount_percentage": price_data.get('discount_percentage', 0.0) if price_data else 0.0,
-            "currency": price_data.get('currency', 'RUB') if price_data else "RUB",
-            "stock": product.stock,
-            "is_available": product.is_available,
-            
-            # Добавляем спецификации варианта (цвет, память, SIM, RAM, screen_size, band_size)
-            "color": color,
-            "memory": memory,
-            "sim_type": sim_type,
-            "ram": ram,  # RAM для ноутбуков
-            "screen_size": screen_size,  # Размер экрана
-            "band_size": band_size,  # Размер ремешка
-            
-            # Изображения для этого варианта (один цвет обычно)
-            "images": images,
-            "main_image": images[0] if images else ""
-        }
-        
-        variants.append(variant_data)
-    
-    # Сортируем варианты по цвету для fallback случая
-    variants.sort(key=lambda x: x.get('color', ''))
-    
-    return {
-        "model": model,
-        "variants": variants,
-        "total_variants": len(variants)
-    }
+    return variant_matrix.get(model, db)
 
-@app.get("/products/{product_id}", response_model=ProductDetailResponse)
-async def get_product(product_id: int, db: Session = Depends(get_db)):
-    """Get detailed product information"""
-    product = db.query(Product).filter(Product.id == product_id).first()
-    
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Получаем цену из JSON файла
-    price_data = get_price(product.sku)
-    
-    if not price_data:
-        raise HTTPException(status_code=404, detail="Price not found for this product")
-    
-    try:
-        specifications = json.loads(product.specifications) if product.specifications else {}
-    except json.JSONDecodeError:
-        specifications = {}
-    
-    # Получаем описание из level2_descriptions
-    desc = ""
-    level2_specs = {}
-    if product.level_2:
-        level2_desc = db.query(Level2Description).filter(Level2Description.level_2 == product.level_2).first()
-        if level2_desc:
-            desc = level2_desc.description or ""
-            if level2_desc.details:
-                try:
-                    level2_specs = json.loads(level2_desc.details) if isinstance(level2_desc.details, str) else level2_desc.details
-                except json.JSONDecodeError:
-                    level2_specs = {}
+@app.get("/models/{level_2}/page")
+async def get_model_page(level_2: str, request: Request, db: Session = Depends(get_db)):
+    """
+    Все данные страницы модели одним ответом: варианты с ценами, изображения по цветам,
+    описание level_2 и схемы цветов/вариантов (строятся из данных товаров)
+    Ответ с ETag: при совпадении If-None-Match возвращается 304 без тела
+    """
+    import hashlib
+    import urllib.parse
+    model = urllib.parse.unquote(level_2)
     
-    # Объединяем характеристики из level2_descriptions с существующими specifications
-    all_specifications = {**level2_specs, **specifications}
+    matrix = variant_matrix.get(model, db)
+    description = find_level2_description(db, model)
+    if not matrix["variants"] and not description:
+        raise HTTPException(status_code=404, detail=f"Модель не найдена: {model}")
     
-    images = get_product_images(product, db)
+    page = {
+        **matrix,
+        "description": level2_description_payload(description) if description else None,
+        "schemes": {**color_scheme(matrix), **variant_scheme(matrix)},
+    }
     
+    body = json.dumps(page, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    # no-cache: клиент хранит ответ, но перепроверяет его по ETag (цены меняются)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def product_detail_response(product: Product, enricher: ProductEnricher) -> ProductDetailResponse:
+    """
+    Карточка товара для /products/{product_id} и /products/batch (цена товара уже проверена)
+    Характеристики модели из Level2Description дополняются specifications товара
+    """
+    price_data = enricher.price(product)
+    images = enricher.images(product)
     return ProductDetailResponse(
         id=product.id,
         sku=product.sku,
         name=product.name,
-        description=desc,
+        description=enricher.description_text(product),
         brand=product.brand,
         model=product.level_2 or "",
         category_name=product.level_0 or "Без категории",
         image_url=images[0] if images else '',
         images=images,
-        specifications=all_specifications,
+        specifications={**enricher.level2_details(product), **enricher.specifications(product)},
         price=price_data.get('price', 0.0),
         old_price=price_data.get('old_price', 0.0),
         discount_percentage=price_data.get('discount_percentage', 0.0),
@@ -716,25 +727,99 @@ async def get_product(product_id: int, db: Session = Depends(get_db)):
         created_at=product.created_at.isoformat()
     )
 
-@app.get("/search")
-async def search_products(
-    q: str,
-    limit: int = 20,
-    db: Session = Depends(get_db)
-):
-    """Search products by SKU, name, brand, or level_2 - returns all matching products"""
-    search_term = f"%{q}%"
+@app.post("/products/batch")
+async def get_products_batch(request: ProductBatchRequest, db: Session = Depends(get_db)):
+    """
+    Несколько товаров одним запросом (по id и/или SKU), например для восстановления корзины
+    Один запрос товаров, один запрос описаний, один запрос изображений моделей и одно чтение цен;
+    товары без цены попадают в missing, как 404 у /products/{product_id}
+    """
+    ids = list(dict.fromkeys(request.ids))
+    skus = list(dict.fromkeys(request.skus))
+    check_batch_size(len(ids) + len(skus))
     
-    # Создаем фильтры для поиска - приоритет поиску по SKU
-    # Сначала ищем точное совпадение по SKU, затем частичное
-    search_filters = [
-        Product.is_available == True,
-        (
-            Product.sku.ilike(search_term) |
-            Product.name.ilike(search_term) |
-            Product.brand.ilike(search_term) |
-            Product.level_2.ilike(search_term)
-        )
+    filters = []
+    if ids:
+        filters.append(Product.id.in_(ids))
+    if skus:
+        filters.append(Product.sku.in_(skus))
+    products = db.query(Product).filter(or_(*filters)).all() if filters else []
+    
+    enricher = ProductEnricher(db).load(products)
+    
+    by_id = {product.id: product for product in products}
+    by_sku = {product.sku: product for product in products}
+    ordered = [by_id[product_id] for product_id in ids if product_id in by_id]
+    ordered += [by_sku[sku] for sku in skus if sku in by_sku and by_sku[sku].id not in ids]
+    ordered = [product for product in ordered if enricher.price(product)]
+    # Изображения - только записи моделей пачки (вся таблица - если нет точной пары level_2 + цвет)
+    enricher.load(ordered, prices=False, descriptions=False, images=True)
+    
+    result = [product_detail_response(product, enricher) for product in ordered]
+    
+    found_ids = {product.id for product in result}
+    found_skus = {product.sku for product in result}
+    return {
+        "products": result,
+        "missing": {
+            "ids": [product_id for product_id in ids if product_id not in found_ids],
+            "skus": [sku for sku in skus if sku not in found_skus],
+        }
+    }
+
+@app.post("/variants/batch")
+async def get_variants_batch(request: VariantBatchRequest, db: Session = Depends(get_db)):
+    """Варианты нескольких моделей (level_2) одним запросом: {model: ответ /products/{model}/variants}"""
+    check_batch_size(len(request.models))
+    return {"models": variant_matrix.get_many(request.models, db)}
+
+@app.post("/prices/batch")
+async def get_prices_batch(request: PriceBatchRequest):
+    """Цены нескольких SKU одним чтением кэша цен"""
+    check_batch_size(len(request.skus))
+    prices = get_prices(request.skus)
+    return {
+        "prices": prices,
+        "missing": [sku for sku in dict.fromkeys(request.skus) if sku not in prices]
+    }
+
+@app.get("/products/{product_id}", response_model=ProductDetailResponse)
+async def get_product(product_id: int, db: Session = Depends(get_db)):
+    """Get detailed product information"""
+    product = db.query(Product).filter(Product.id == product_id).first()
+    
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    enricher = ProductEnricher(db).load([product])
+    if not enricher.price(product):
+        raise HTTPException(status_code=404, detail="Price not found for this product")
+    
+    return product_detail_response(product, enricher)
+
+@app.get("/search")
+async def search_products(
+    q: str,
+    limit: int = 20,
+    db: Session = Depends(get_db)
+):
+    """Search products by SKU, name, brand, or level_2 - returns all matching products"""
+    return product_rows_response(search_product_rows(db, q, limit))
+
+def search_product_rows(db: Session, q: str, limit: int = 20) -> List[ProductRow]:
+    """Строки /search; бот в одном процессе с API вызывает напрямую"""
+    search_term = f"%{q}%"
+    
+    # Создаем фильтры для поиска - приоритет поиску по SKU
+    # Сначала ищем точное совпадение по SKU, затем частичное
+    search_filters = [
+        Product.is_available == True,
+        (
+            Product.sku.ilike(search_term) |
+            Product.name.ilike(search_term) |
+            Product.brand.ilike(search_term) |
+            Product.level_2.ilike(search_term)
+        )
     ]
     
     # Возвращаем ВСЕ товары, которые подходят под поисковый запрос (без группировки)
@@ -749,63 +834,27 @@ async def search_products(
     
     # Применяем лимит
     results = final_query.limit(limit).all()
+    enricher = ProductEnricher(db).load(results)
     
     products = []
     for product in results:
         # Получаем цену для конкретного товара (SKU)
-        price_data = get_price(product.sku)
-        if price_data:
-            price_obj = price_data
-        else:
-            price_obj = {
-                'price': 0.0,
-                'old_price': 0.0,
-                'discount_percentage': 0.0,
-                'currency': 'RUB'
-            }
+        price_obj = enricher.price(product) or {}
+        images = enricher.images(product)
         
-        try:
-            specifications = json.loads(product.specifications) if product.specifications else {}
-        except json.JSONDecodeError:
-            specifications = {}
-        
-        # Получаем описание из level2_descriptions
-        desc = ""
-        level2_specs = {}
-        if product.level_2:
-            level2_desc = db.query(Level2Description).filter(Level2Description.level_2 == product.level_2).first()
-            if level2_desc:
-                desc = level2_desc.description or ""
-                if level2_desc.details:
-                    try:
-                        level2_specs = json.loads(level2_desc.details) if isinstance(level2_desc.details, str) else level2_desc.details
-                    except json.JSONDecodeError:
-                        level2_specs = {}
-        
-        # Объединяем характеристики из level2_descriptions с существующими specifications
-        all_specifications = {**level2_specs, **specifications}
-        
-        images = get_product_images(product, db)
-        
-        # Получаем название категории из level полей
-        category_name = product.level_0 or "Без категории"
-        if product.level_1:
-            category_name += f" / {product.level_1}"
-        if product.level_2:
-            category_name += f" / {product.level_2}"
-        
-        products.append(ProductResponse(
+        products.append(product_row(
             id=product.id,
             sku=product.sku,
             name=product.name,
-            description=desc,
+            description=enricher.description_text(product),
             brand=product.brand,
             model=product.level_2 or "",
-            category_name=category_name,
+            category_name=category_name(product),
             level_2=product.level_2,
             image_url=images[0] if images else '',
             images=images,
-            specifications=all_specifications,
+            # Объединяем характеристики из level2_descriptions с существующими specifications
+            specifications={**enricher.level2_details(product), **enricher.specifications(product)},
             price=price_obj.get('price', 0.0),
             old_price=price_obj.get('old_price', 0.0),
             discount_percentage=price_obj.get('discount_percentage', 0.0),
@@ -814,6 +863,13 @@ async def search_products(
     
     return products
 
+@app.get("/search/cards")
+async def search_model_cards(q: str = "", limit: int = MAX_INLINE_RESULTS, offset: int = 0):
+    """Поиск по предрасчитанным карточкам моделей (inline режим бота) - без запросов к БД"""
+    limit = max(1, min(limit, MAX_INLINE_RESULTS))
+    cards, next_offset = catalog_cards.search(q, limit=limit, offset=max(offset, 0))
+    return {"cards": cards, "next_offset": next_offset}
+
 @app.get("/webapp")
 async def webapp():
     """Serve the web app"""
@@ -886,10 +942,65 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Метрики в формате Prometheus (доступны при METRICS_ENABLED=true)"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Метрики отключены")
+    
+    # Если задан METRICS_TOKEN - пускаем только с токеном или из админки
+    if Config.METRICS_TOKEN and not is_admin_authenticated(request):
+        if request.headers.get("authorization") != f"Bearer {Config.METRICS_TOKEN}":
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    content = metrics.render_prometheus()
+    if Config.ADMISSION_CONTROL_ENABLED:
+        content += admission.render_prometheus()
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/admission")
+async def get_admission_stats(_: bool = Depends(require_admin)):
+    """Очереди и отказы контроля допуска по классам маршрутов"""
+    if not Config.ADMISSION_CONTROL_ENABLED:
+        return {"success": True, "enabled": False}
+    return {"success": True, "enabled": True, **admission.snapshot()}
+
+@app.get("/api/admin/slow-queries")
+async def get_slow_queries(limit: int = 50, sort: str = "total", _: bool = Depends(require_admin)):
+    """Медленные SQL запросы, сгруппированные по отпечаткам (sort: total|max|count)"""
+    if slow_query_log is None:
+        return {"success": True, "enabled": False, "fingerprints": [], "recent": []}
+    
+    limit = max(1, min(limit, 500))
+    return {"success": True, "enabled": True, **slow_query_log.report(limit=limit, sort=sort)}
+
+@app.delete("/api/admin/slow-queries")
+async def reset_slow_queries(_: bool = Depends(require_admin)):
+    """Очистить журнал медленных запросов"""
+    if slow_query_log is not None:
+        slow_query_log.reset()
+    return {"success": True}
+
+@app.get("/api/admin/image-integrity")
+def check_image_integrity(check_urls: bool = False, background: bool = False, _: bool = Depends(require_admin),
+                          db: Session = Depends(get_db)):
+    """
+    Проверить ссылки на изображения: отсутствующие, поврежденные, слишком большие файлы и дубликаты
+    check_urls=true - проверять и внешние URL; background=true - фоновой задачей, отчет - в /jobs/{id}
+    """
+    if background:
+        return submit_job("image_scan_urls" if check_urls else "image_scan")
+    
+    try:
+        return {"success": True, **scan_images(db, check_urls=check_urls)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка проверки изображений: {str(e)}")
+
 # Excel Management API
 @app.get("/api/excel/template/products")
 async def download_products_template():
     """Скачать шаблон Excel файла для добавления товаров"""
+    from excel_handler import ExcelHandler
     excel_handler = ExcelHandler()
     template_data = excel_handler.create_products_template()
     
@@ -902,6 +1013,7 @@ async def download_products_template():
 @app.get("/api/excel/template/prices")
 async def download_prices_template():
     """Скачать шаблон Excel файла для обновления цен"""
+    from excel_handler import ExcelHandler
     excel_handler = ExcelHandler()
     template_data = excel_handler.create_prices_template()
     
@@ -911,167 +1023,176 @@ async def download_prices_template():
         headers={"Content-Disposition": "attachment; filename=prices_template.xlsx"}
     )
 
-@app.post("/api/excel/import/products")
-async def import_products_from_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Импортировать товары из Excel файла"""
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
+def run_products_import(file_content: bytes, db: Session, progress=None) -> dict:
+    """Импорт товаров (и листа изображений) из Excel; progress(done, total) - для фоновой задачи"""
+    from excel_handler import ExcelHandler
+    
+    # Парсим Excel файл
+    excel_handler = ExcelHandler()
+    products_data = excel_handler.parse_products_excel(file_content)
     
+    # Также парсим изображения если есть лист "Изображения"
+    images_data = []
     try:
-        # Читаем содержимое файла
-        file_content = await file.read()
-        
-        # Парсим Excel файл
-        excel_handler = ExcelHandler()
-        products_data = excel_handler.parse_products_excel(file_content)
-        
-        # Также парсим изображения если есть лист "Изображения"
-        images_data = []
+        images_data = excel_handler.parse_images_excel(file_content)
+    except Exception as e:
+        print(f"Предупреждение: Не удалось загрузить изображения: {e}")
+    
+    # Добавляем товары в базу данных
+    added_count = 0
+    errors = []
+    
+    for i, product_data in enumerate(products_data):
+        if progress:
+            progress(i, len(products_data))
         try:
-            images_data = excel_handler.parse_images_excel(file_content)
-        except Exception as e:
-            print(f"Предупреждение: Не удалось загрузить изображения: {e}")
-        
-        # Добавляем товары в базу данных
-        added_count = 0
-        errors = []
-        
-        for i, product_data in enumerate(products_data):
-            try:
-                # Проверяем, что указаны обязательные поля level0
-                if not product_data.get('level0'):
-                    errors.append(f"Товар {i+1}: Не указана основная категория (level0)")
-                    continue
-                
-                # Проверяем обязательные поля для генерации SKU
-                if not product_data.get('brand') or not product_data.get('level2'):
-                    errors.append(f"Товар {i+1}: Не указан бренд или модель, необходимые для генерации SKU")
+            # Проверяем, что указаны обязательные поля level0
+            if not product_data.get('level0'):
+                errors.append(f"Товар {i+1}: Не указана основная категория (level0)")
+                continue
+            
+            # Проверяем обязательные поля для генерации SKU
+            if not product_data.get('brand') or not product_data.get('level2'):
+                errors.append(f"Товар {i+1}: Не указан бренд или модель, необходимые для генерации SKU")
+                continue
+            
+            # Генерируем временный уникальный SKU если не указан
+            if product_data.get('sku'):
+                # Проверяем уникальность SKU
+                existing = db.query(Product).filter(Product.sku == product_data['sku']).first()
+                if existing:
+                    errors.append(f"Товар {i+1}: SKU '{product_data['sku']}' уже существует")
                     continue
-                
-                # Генерируем временный уникальный SKU если не указан
-                if product_data.get('sku'):
-                    # Проверяем уникальность SKU
-                    existing = db.query(Product).filter(Product.sku == product_data['sku']).first()
-                    if existing:
-                        errors.append(f"Товар {i+1}: SKU '{product_data['sku']}' уже существует")
-                        continue
-                    sku = product_data['sku']
-                else:
-                    # Генерируем уникальный SKU на основе данных и timestamp
-                    import time
-                    timestamp = int(time.time() * 1000) % 100000  # последние 5 цифр timestamp
-                    sku = f"{product_data['brand'][:3].upper()}{product_data['level2'][:5].upper()}{timestamp}"
-                
-                # Создать товар
-                parsed_images = parse_images_from_string(product_data['image_url'])
-                
-                # Сформировать specifications из данных
-                specs = dict(product_data.get('specifications') or {})
-                if product_data.get('color'):
-                    specs['color'] = product_data['color']
-                if product_data.get('ram'):
-                    specs['ram'] = product_data['ram']
-                if product_data.get('disk'):
-                    specs['disk'] = product_data['disk']
-                if product_data.get('sim_config'):
-                    specs['sim_config'] = product_data['sim_config']
+                sku = product_data['sku']
+            else:
+                # Генерируем уникальный SKU на основе данных и timestamp
+                import time
+                timestamp = int(time.time() * 1000) % 100000  # последние 5 цифр timestamp
+                sku = f"{product_data['brand'][:3].upper()}{product_data['level2'][:5].upper()}{timestamp}"
+            
+            # Создать товар
+            parsed_images = parse_images_from_string(product_data['image_url'])
+            
+            # Сформировать specifications из данных
+            specs = dict(product_data.get('specifications') or {})
+            if product_data.get('color'):
+                specs['color'] = product_data['color']
+            if product_data.get('ram'):
+                specs['ram'] = product_data['ram']
+            if product_data.get('disk'):
+                specs['disk'] = product_data['disk']
+            if product_data.get('sim_config'):
+                specs['sim_config'] = product_data['sim_config']
+
+            db_product = Product(
+                sku=sku,
+                name=product_data['name'],
+                level_0=product_data['level0'],
+                level_1=product_data.get('level1'),
+                level_2=product_data.get('level2'),
+                brand=product_data['brand'],
+                specifications=json.dumps(specs),
+                stock=product_data['stock'],
+                is_available=True
+            )
+            
+            db.add(db_product)
+            db.flush()  # Получить ID
 
-                db_product = Product(
-                    sku=sku,
-                    name=product_data['name'],
-                    level_0=product_data['level0'],
-                    level_1=product_data.get('level1'),
-                    level_2=product_data.get('level2'),
-                    brand=product_data['brand'],
-                    specifications=json.dumps(specs),
-                    stock=product_data['stock'],
-                    is_available=True
+            # Ensure categories exist
+            ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
+            
+            # Создать начальную цену в JSON файле
+            set_price(
+                sku=sku,
+                price=product_data['price'],
+                old_price=product_data['price'],
+                currency=product_data.get('currency', 'RUB'),
+                is_parse=product_data.get('is_parse', True)
+            )
+            
+            # Создать запись изображений в ProductImage если есть изображения
+            if parsed_images and product_data.get('level2') and product_data.get('color'):
+                product_image = ProductImage(
+                    level_2=product_data['level2'],
+                    color=product_data['color'],
+                    img_list=json.dumps(parsed_images)
                 )
-                
-                db.add(db_product)
-                db.flush()  # Получить ID
-
-                # Ensure categories exist
-                ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
-                
-                # Создать начальную цену в JSON файле
-                set_price(
-                    sku=sku,
-                    price=product_data['price'],
-                    old_price=product_data['price'],
-                    currency=product_data.get('currency', 'RUB'),
-                    is_parse=product_data.get('is_parse', True)
+                db.add(product_image)
+            
+            added_count += 1
+            
+        except Exception as e:
+            errors.append(f"Товар {i+1}: {str(e)}")
+    
+    db.commit()
+    
+    # Обрабатываем изображения если они есть
+    images_added = 0
+    images_updated = 0
+    images_errors = []
+    
+    for image_data in images_data:
+        try:
+            # Ищем существующую запись
+            existing_image = db.query(ProductImage).filter(
+                ProductImage.level_2 == image_data['level_2'],
+                ProductImage.color == image_data['color']
+            ).first()
+            
+            # Конвертируем список изображений в JSON
+            img_list_json = json.dumps(image_data['img_list'])
+            
+            if existing_image:
+                # Обновляем существующую запись
+                existing_image.img_list = img_list_json
+                images_updated += 1
+            else:
+                # Создаем новую запись
+                new_image = ProductImage(
+                    level_2=image_data['level_2'],
+                    color=image_data['color'],
+                    img_list=img_list_json
                 )
+                db.add(new_image)
+                images_added += 1
                 
-                # Создать запись изображений в ProductImage если есть изображения
-                if parsed_images and product_data.get('level2') and product_data.get('color'):
-                    product_image = ProductImage(
-                        level_2=product_data['level2'],
-                        color=product_data['color'],
-                        img_list=json.dumps(parsed_images)
-                    )
-                    db.add(product_image)
-                
-                added_count += 1
-                
-            except Exception as e:
-                errors.append(f"Товар {i+1}: {str(e)}")
-        
+        except Exception as e:
+            images_errors.append(f"Ошибка при обработке изображений {image_data['level_2']} - {image_data['color']}: {str(e)}")
+    
+    # Сохраняем изменения изображений
+    if images_data:
         db.commit()
-        
-        # Обрабатываем изображения если они есть
-        images_added = 0
-        images_updated = 0
-        images_errors = []
-        
-        for image_data in images_data:
-            try:
-                # Ищем существующую запись
-                existing_image = db.query(ProductImage).filter(
-                    ProductImage.level_2 == image_data['level_2'],
-                    ProductImage.color == image_data['color']
-                ).first()
-                
-                # Конвертируем список изображений в JSON
-                img_list_json = json.dumps(image_data['img_list'])
-                
-                if existing_image:
-                    # Обновляем существующую запись
-                    existing_image.img_list = img_list_json
-                    images_updated += 1
-                else:
-                    # Создаем новую запись
-                    new_image = ProductImage(
-                        level_2=image_data['level_2'],
-                        color=image_data['color'],
-                        img_list=img_list_json
-                    )
-                    db.add(new_image)
-                    images_added += 1
-                    
-            except Exception as e:
-                images_errors.append(f"Ошибка при обработке изображений {image_data['level_2']} - {image_data['color']}: {str(e)}")
-        
-        # Сохраняем изменения изображений
-        if images_data:
-            db.commit()
-        
-        return {
-            "message": "Импорт завершен",
-            "added": added_count,
-            "errors": errors,
-            "total_processed": len(products_data),
-            "images_added": images_added,
-            "images_updated": images_updated,
-            "images_errors": images_errors
-        }
-        
+    
+    return {
+        "message": "Импорт завершен",
+        "added": added_count,
+        "errors": errors,
+        "total_processed": len(products_data),
+        "images_added": images_added,
+        "images_updated": images_updated,
+        "images_errors": images_errors
+    }
+
+@app.post("/api/excel/import/products")
+async def import_products_from_excel(file: UploadFile = File(...), background: bool = False, db: Session = Depends(get_db)):
+    """Импортировать товары из Excel файла (background=true - фоновой задачей, ответ - id задачи)"""
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
+    if background:
+        return await run_in_threadpool(submit_job, "import_products", file)
+    
+    try:
+        # Читаем содержимое файла
+        file_content = await file.read()
+        return await run_in_threadpool(run_products_import, file_content, db)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка при импорте: {str(e)}")
 
 @app.post("/api/excel/import/prices")
 async def import_prices_from_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """Обновить цены из Excel файла"""
+    from excel_handler import ExcelHandler
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
     
@@ -1109,202 +1230,262 @@ async def import_prices_from_excel(file: UploadFile = File(...), db: Session = D
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка при обновлении цен: {str(e)}")
 
-@app.post("/api/excel/update-or-create/products")
-async def update_or_create_products_from_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Массовое обновление существующих товаров (по SKU) или добавление новых"""
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
-    
-    try:
-        # Читаем содержимое файла
-        file_content = await file.read()
-        
-        # Парсим Excel файл
-        excel_handler = ExcelHandler()
-        products_data = excel_handler.parse_products_excel(file_content)
-        
-        # Также парсим изображения если есть лист "Изображения"
-        images_data = []
+def apply_product_rows(rows: List[dict], db: Session, progress=None) -> dict:
+    """
+    Записать строки листа товаров: обновить существующие по SKU или добавить новые
+    rows - только новые и измененные строки ([{"position": i, "data": product_data}] из diff_products);
+    цены записываются одним сохранением после коммита
+    """
+    added_count = 0
+    updated_count = 0
+    errors = []
+    prices = {}
+    
+    skus = [row['data']['sku'] for row in rows if row['data'].get('sku')]
+    existing_products = {}
+    for start in range(0, len(skus), IN_CHUNK_SIZE):
+        for product in db.query(Product).filter(Product.sku.in_(skus[start:start + IN_CHUNK_SIZE])):
+            existing_products[product.sku] = product
+    
+    for i, row in enumerate(rows):
+        if progress:
+            progress(i, len(rows))
+        product_data = row['data']
         try:
-            images_data = excel_handler.parse_images_excel(file_content)
-        except Exception as e:
-            print(f"Предупреждение: Не удалось загрузить изображения: {e}")
-        
-        added_count = 0
-        updated_count = 0
-        errors = []
-        
-        for i, product_data in enumerate(products_data):
-            try:
-                # Генерируем SKU если не указан
-                if not product_data.get('sku'):
-                    import time
-                    timestamp = int(time.time() * 1000) % 100000
-                    brand_part = product_data.get('brand', 'UNK')[:3].upper()
-                    model_part = product_data.get('level_2', 'UNK')[:5].upper()
-                    product_data['sku'] = f"{brand_part}{model_part}{timestamp}"
+            # Генерируем SKU если не указан
+            if not product_data.get('sku'):
+                import time
+                timestamp = int(time.time() * 1000) % 100000
+                brand_part = product_data.get('brand', 'UNK')[:3].upper()
+                model_part = product_data.get('level_2', 'UNK')[:5].upper()
+                product_data['sku'] = f"{brand_part}{model_part}{timestamp}"
+            
+            existing_product = existing_products.get(product_data['sku'])
+            
+            if existing_product:
+                # Обновляем существующий товар
+                existing_product.name = product_data['name']
+                # existing_product.description = product_data.get('description', '')  # поле удалено
+                existing_product.level_0 = product_data['level0']
+                existing_product.level_1 = product_data.get('level1', '')
+                existing_product.level_2 = product_data.get('level2', '')
+                existing_product.brand = product_data.get('brand', '')
+                existing_product.stock = product_data.get('stock', 0)
+                # Ensure categories exist for updated levels
+                ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
                 
-                # Проверяем, существует ли товар с таким SKU
-                existing_product = db.query(Product).filter(Product.sku == product_data['sku']).first()
+                # Обновляем характеристики в specifications JSON
+                try:
+                    existing_specs = json.loads(existing_product.specifications) if existing_product.specifications else {}
+                except json.JSONDecodeError:
+                    existing_specs = {}
+                for key in ['color', 'disk', 'ram', 'sim_config']:
+                    if product_data.get(key):
+                        existing_specs[key] = product_data[key]
+                existing_product.specifications = json.dumps(existing_specs)
                 
-                if existing_product:
-                    # Обновляем существующий товар
-                    existing_product.name = product_data['name']
-                    # existing_product.description = product_data.get('description', '')  # поле удалено
-                    existing_product.level_0 = product_data['level0']
-                    existing_product.level_1 = product_data.get('level1', '')
-                    existing_product.level_2 = product_data.get('level2', '')
-                    existing_product.brand = product_data.get('brand', '')
-                    existing_product.stock = product_data.get('stock', 0)
-                    # Ensure categories exist for updated levels
-                    ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
-                    
-                    # Обновляем характеристики в specifications JSON
-                    try:
-                        existing_specs = json.loads(existing_product.specifications) if existing_product.specifications else {}
-                    except json.JSONDecodeError:
-                        existing_specs = {}
-                    for key in ['color', 'disk', 'ram', 'sim_config']:
-                        if product_data.get(key):
-                            existing_specs[key] = product_data[key]
-                    existing_product.specifications = json.dumps(existing_specs)
-                    
-                    # Обновляем изображения если указаны (в таблице ProductImage)
-                    if product_data.get('image_url') and existing_product.level_2 and existing_product.color:
-                        parsed_images = parse_images_from_string(product_data['image_url'])
-                        img_list_json = json.dumps(parsed_images) if parsed_images else '[]'
-                        
-                        # Ищем или создаем запись в ProductImage
-                        product_image = db.query(ProductImage).filter(
-                            ProductImage.level_2 == existing_product.level_2,
-                            ProductImage.color == existing_product.color
-                        ).first()
-                        
-                        if product_image:
-                            product_image.img_list = img_list_json
-                        else:
-                            product_image = ProductImage(
-                                level_2=existing_product.level_2,
-                                color=existing_product.color,
-                                img_list=img_list_json
-                            )
-                            db.add(product_image)
-                    
-                    # Обновляем цену в JSON файле
-                    existing_price = get_price(product_data['sku'])
-                    is_parse = existing_price.get('is_parse', True) if existing_price else True
-                    set_price(
-                        sku=product_data['sku'],
-                        price=product_data['price'],
-                        old_price=product_data.get('old_price', product_data['price']),
-                        currency=product_data.get('currency', 'RUB'),
-                        is_parse=is_parse
-                    )
+                # Обновляем изображения если указаны (в таблице ProductImage)
+                if product_data.get('image_url') and existing_product.level_2 and existing_product.color:
+                    parsed_images = parse_images_from_string(product_data['image_url'])
+                    img_list_json = json.dumps(parsed_images) if parsed_images else '[]'
                     
-                    updated_count += 1
-                else:
-                    # Создаем новый товар
-                    parsed_images = parse_images_from_string(product_data.get('image_url', ''))
+                    # Ищем или создаем запись в ProductImage
+                    product_image = db.query(ProductImage).filter(
+                        ProductImage.level_2 == existing_product.level_2,
+                        ProductImage.color == existing_product.color
+                    ).first()
                     
-                    specs = dict(product_data.get('specifications') or {})
-                    if product_data.get('color'):
-                        specs['color'] = product_data['color']
-                    if product_data.get('ram'):
-                        specs['ram'] = product_data['ram']
-                    if product_data.get('disk'):
-                        specs['disk'] = product_data['disk']
-                    if product_data.get('sim_config'):
-                        specs['sim_config'] = product_data['sim_config']
-
-                    db_product = Product(
-                        sku=product_data['sku'],
-                        name=product_data['name'],
-                        level_0=product_data['level0'],
-                        level_1=product_data.get('level1', ''),
-                        level_2=product_data.get('level2', ''),
-                        brand=product_data.get('brand', ''),
-                        stock=product_data.get('stock', 0),
-                        specifications=json.dumps(specs),
-                        is_available=True
-                    )
-                    db.add(db_product)
-                    # Ensure categories exist
-                    ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
-                    
-                    # Добавляем цену в JSON файле
-                    set_price(
-                        sku=product_data['sku'],
-                        price=product_data['price'],
-                        old_price=product_data.get('old_price', product_data['price']),
-                        currency=product_data.get('currency', 'RUB'),
-                        is_parse=product_data.get('is_parse', True)
-                    )
-                    
-                    # Создать запись изображений в ProductImage если есть изображения
-                    if parsed_images and product_data.get('level_2') and product_data.get('color'):
+                    if product_image:
+                        product_image.img_list = img_list_json
+                    else:
                         product_image = ProductImage(
-                            level_2=product_data['level_2'],
-                            color=product_data['color'],
-                            img_list=json.dumps(parsed_images)
+                            level_2=existing_product.level_2,
+                            color=existing_product.color,
+                            img_list=img_list_json
                         )
                         db.add(product_image)
-                    
-                    added_count += 1
-                    
-            except Exception as e:
-                errors.append(f"Строка {i+2}: {str(e)}")
-        
-        db.commit()
-        
-        # Обрабатываем изображения если они есть
-        images_added = 0
-        images_updated = 0
-        images_errors = []
-        
-        for image_data in images_data:
-            try:
-                # Ищем существующую запись
-                existing_image = db.query(ProductImage).filter(
-                    ProductImage.level_2 == image_data['level_2'],
-                    ProductImage.color == image_data['color']
-                ).first()
                 
-                # Конвертируем список изображений в JSON
-                img_list_json = json.dumps(image_data['img_list'])
+                # Цена (is_parse существующей цены сохраняется)
+                prices[product_data['sku']] = {
+                    "price": product_data['price'],
+                    "old_price": product_data.get('old_price', product_data['price']) or product_data['price'],
+                    "currency": product_data.get('currency', 'RUB')
+                }
                 
-                if existing_image:
-                    # Обновляем существующую запись
-                    existing_image.img_list = img_list_json
-                    images_updated += 1
-                else:
-                    # Создаем новую запись
-                    new_image = ProductImage(
-                        level_2=image_data['level_2'],
-                        color=image_data['color'],
-                        img_list=img_list_json
+                updated_count += 1
+            else:
+                # Создаем новый товар
+                parsed_images = parse_images_from_string(product_data.get('image_url', ''))
+                
+                specs = dict(product_data.get('specifications') or {})
+                if product_data.get('color'):
+                    specs['color'] = product_data['color']
+                if product_data.get('ram'):
+                    specs['ram'] = product_data['ram']
+                if product_data.get('disk'):
+                    specs['disk'] = product_data['disk']
+                if product_data.get('sim_config'):
+                    specs['sim_config'] = product_data['sim_config']
+
+                db_product = Product(
+                    sku=product_data['sku'],
+                    name=product_data['name'],
+                    level_0=product_data['level0'],
+                    level_1=product_data.get('level1', ''),
+                    level_2=product_data.get('level2', ''),
+                    brand=product_data.get('brand', ''),
+                    stock=product_data.get('stock', 0),
+                    specifications=json.dumps(specs),
+                    is_available=True
+                )
+                db.add(db_product)
+                existing_products[db_product.sku] = db_product
+                # Ensure categories exist
+                ensure_category_exists(db, product_data.get('level0'), product_data.get('level1'), product_data.get('level2'))
+                
+                prices[product_data['sku']] = {
+                    "price": product_data['price'],
+                    "old_price": product_data.get('old_price', product_data['price']) or product_data['price'],
+                    "currency": product_data.get('currency', 'RUB'),
+                    "is_parse": product_data.get('is_parse', True)
+                }
+                
+                # Создать запись изображений в ProductImage если есть изображения
+                if parsed_images and product_data.get('level_2') and product_data.get('color'):
+                    product_image = ProductImage(
+                        level_2=product_data['level_2'],
+                        color=product_data['color'],
+                        img_list=json.dumps(parsed_images)
                     )
-                    db.add(new_image)
-                    images_added += 1
-                    
-            except Exception as e:
-                images_errors.append(f"Ошибка при обработке изображений {image_data['level_2']} - {image_data['color']}: {str(e)}")
-        
-        # Сохраняем изменения изображений
-        if images_data:
-            db.commit()
-        
-        return {
-            "success": True,
-            "message": f"Обработка завершена: добавлено {added_count}, обновлено {updated_count}",
-            "added": added_count,
-            "updated": updated_count,
-            "errors": errors,
-            "total_processed": len(products_data),
-            "images_added": images_added,
-            "images_updated": images_updated,
-            "images_errors": images_errors
-        }
-        
+                    db.add(product_image)
+                
+                added_count += 1
+                
+        except Exception as e:
+            errors.append(f"Строка {row['position'] + 2}: {str(e)}")
+    
+    db.commit()
+    if prices:
+        update_prices(prices)
+    
+    return {"added": added_count, "updated": updated_count, "errors": errors}
+
+def apply_image_rows(images_data: List[dict], db: Session) -> dict:
+    """Записать строки листа "Изображения" (level_2 + color -> список URL)"""
+    images_added = 0
+    images_updated = 0
+    images_errors = []
+    
+    for image_data in images_data:
+        try:
+            # Ищем существующую запись
+            existing_image = db.query(ProductImage).filter(
+                ProductImage.level_2 == image_data['level_2'],
+                ProductImage.color == image_data['color']
+            ).first()
+            
+            # Конвертируем список изображений в JSON
+            img_list_json = json.dumps(image_data['img_list'])
+            
+            if existing_image:
+                # Обновляем существующую запись
+                existing_image.img_list = img_list_json
+                images_updated += 1
+            else:
+                # Создаем новую запись
+                new_image = ProductImage(
+                    level_2=image_data['level_2'],
+                    color=image_data['color'],
+                    img_list=img_list_json
+                )
+                db.add(new_image)
+                images_added += 1
+                
+        except Exception as e:
+            images_errors.append(f"Ошибка при обработке изображений {image_data['level_2']} - {image_data['color']}: {str(e)}")
+    
+    # Сохраняем изменения изображений
+    if images_data:
+        db.commit()
+    
+    return {"images_added": images_added, "images_updated": images_updated, "images_errors": images_errors}
+
+def parse_products_sheets(file_content: bytes):
+    """Строки листа "Товары" и (если есть) листа "Изображения" """
+    from excel_handler import ExcelHandler
+    
+    excel_handler = ExcelHandler()
+    products_data = excel_handler.parse_products_excel(file_content)
+    
+    # Также парсим изображения если есть лист "Изображения"
+    images_data = []
+    try:
+        images_data = excel_handler.parse_images_excel(file_content)
+    except Exception as e:
+        print(f"Предупреждение: Не удалось загрузить изображения: {e}")
+    return products_data, images_data
+
+def run_products_update_or_create(file_content: bytes, db: Session, progress=None) -> dict:
+    """
+    Обновление товаров по SKU или добавление новых из Excel; progress(done, total) - для фоновой задачи
+    Записываются только новые и измененные строки (diff с каталогом), неизменившиеся пропускаются
+    """
+    from import_diff import diff_products, diff_images
+    
+    products_data, images_data = parse_products_sheets(file_content)
+    changeset = diff_products(products_data, db)
+    result = apply_product_rows(changeset["apply"], db, progress)
+    # Лист изображений сравнивается уже после записи товаров (они тоже могут менять ProductImage)
+    images_changes = diff_images(images_data, db)
+    images_result = apply_image_rows(images_changes["apply"], db)
+    
+    return {
+        "success": True,
+        "message": f"Обработка завершена: добавлено {result['added']}, обновлено {result['updated']}",
+        **result,
+        "unchanged": changeset["summary"]["unchanged"],
+        "total_processed": len(products_data),
+        **images_result,
+        "images_unchanged": images_changes["summary"]["unchanged"],
+    }
+
+def preview_products_update_or_create(file_content: bytes, db: Session) -> dict:
+    """Dry-run: что update-or-create изменит в каталоге; changeset сохраняется для применения"""
+    from import_diff import diff_products, diff_images, save_changeset, public_changeset
+    
+    products_data, images_data = parse_products_sheets(file_content)
+    changeset = diff_products(products_data, db)
+    images_changes = diff_images(images_data, db)
+    changeset["apply_images"] = images_changes["apply"]
+    changeset["summary"]["images"] = images_changes["summary"]
+    save_changeset(changeset)
+    return public_changeset(changeset)
+
+@app.post("/api/excel/update-or-create/products")
+async def update_or_create_products_from_excel(
+    file: UploadFile = File(...),
+    background: bool = False,
+    dry_run: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Массовое обновление существующих товаров (по SKU) или добавление новых (background=true - фоновой задачей)
+    dry_run=true - только показать изменения (новые/измененные поля/без изменений); применить - /api/excel/changesets/{id}/apply
+    """
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
+    if dry_run:
+        try:
+            return await run_in_threadpool(preview_products_update_or_create, await file.read(), db)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Ошибка при обработке файла: {str(e)}")
+    if background:
+        return await run_in_threadpool(submit_job, "update_or_create_products", file)
+    
+    try:
+        # Читаем содержимое файла
+        file_content = await file.read()
+        return await run_in_threadpool(run_products_update_or_create, file_content, db)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Ошибка при обработке файла: {str(e)}")
@@ -1312,6 +1493,7 @@ async def update_or_create_products_from_excel(file: UploadFile = File(...), db:
 @app.post("/api/excel/import/images")
 async def import_images_from_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """Импортировать изображения из Excel файла"""
+    from excel_handler import ExcelHandler
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
     
@@ -1375,6 +1557,8 @@ async def import_images_from_excel(file: UploadFile = File(...), db: Session = D
 @app.get("/download-price-template")
 async def download_price_template(db: Session = Depends(get_db)):
     """Скачать простой шаблон Excel для обновления цен: SKU - новая цена - старая цена"""
+    import pandas as pd
+    import openpyxl
     try:
         from io import BytesIO
         
@@ -1430,217 +1614,257 @@ async def download_price_template(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка создания шаблона: {str(e)}")
 
+def read_prices_sheet(file_content: bytes):
+    """Лист цен как DataFrame: первые 3 колонки - SKU, новая цена, старая цена"""
+    import pandas as pd
+    
+    # Парсим как DataFrame
+    df = pd.read_excel(io.BytesIO(file_content))
+    
+    # Проверяем наличие нужных колонок
+    if len(df.columns) < 3:
+        raise HTTPException(status_code=400, detail="Файл должен содержать минимум 3 колонки: SKU, Новая цена, Старая цена")
+    return df
+
+def apply_price_rows(rows: List[dict]) -> int:
+    """Записать измененные цены одним сохранением (is_parse существующих цен сохраняется)"""
+    if rows:
+        update_prices({
+            row['data']['sku']: {"price": row['data']['price'], "old_price": row['data']['old_price'], "currency": 'RUB'}
+            for row in rows
+        })
+    return len(rows)
+
+def run_prices_import(file_content: bytes, db: Session, progress=None) -> dict:
+    """
+    Обновление цен из Excel (SKU - новая цена - старая цена); progress(done, total) - для фоновой задачи
+    Записываются только цены, которые отличаются от текущих
+    """
+    from import_diff import diff_prices
+    
+    df = read_prices_sheet(file_content)
+    changeset = diff_prices(df, db)
+    updated_count = apply_price_rows(changeset["apply"])
+    if progress:
+        progress(len(df), len(df))
+    
+    return {
+        "message": "Обновление цен завершено",
+        "updated": updated_count,
+        "unchanged": changeset["summary"]["unchanged"],
+        "errors": changeset["errors"],
+        "not_found": changeset["not_found"],
+        "total_processed": len(df)
+    }
+
+def preview_prices_import(file_content: bytes, db: Session) -> dict:
+    """Dry-run: какие цены изменит лист (с разницей); changeset сохраняется для применения"""
+    from import_diff import diff_prices, save_changeset, public_changeset
+    
+    changeset = diff_prices(read_prices_sheet(file_content), db)
+    save_changeset(changeset)
+    return public_changeset(changeset)
+
 @app.post("/import-prices")
-async def import_prices_simple(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Простое обновление цен из Excel: SKU - новая цена - старая цена"""
+async def import_prices_simple(
+    file: UploadFile = File(...),
+    background: bool = False,
+    dry_run: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Простое обновление цен из Excel: SKU - новая цена - старая цена (background=true - фоновой задачей)
+    dry_run=true - только показать изменения цен; применить - /api/excel/changesets/{id}/apply
+    """
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Файл должен быть в формате Excel (.xlsx или .xls)")
+    if dry_run:
+        try:
+            return await run_in_threadpool(preview_prices_import, await file.read(), db)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Ошибка при обновлении цен: {str(e)}")
+    if background:
+        return await run_in_threadpool(submit_job, "import_prices", file)
     
     try:
         # Читаем содержимое файла
         file_content = await file.read()
-        
-        # Парсим как DataFrame
-        df = pd.read_excel(io.BytesIO(file_content))
-        
-        # Проверяем наличие нужных колонок
-        if len(df.columns) < 3:
-            raise HTTPException(status_code=400, detail="Файл должен содержать минимум 3 колонки: SKU, Новая цена, Старая цена")
-        
-        # Используем первые 3 колонки
-        sku_col = df.columns[0]
-        new_price_col = df.columns[1] 
-        old_price_col = df.columns[2]
-        
-        updated_count = 0
-        errors = []
-        not_found = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Пропускаем пустые строки
-                if pd.isna(row[sku_col]) or pd.isna(row[new_price_col]):
-                    continue
-                
-                sku = str(row[sku_col]).strip()
-                try:
-                    new_price = float(row[new_price_col])
-                except:
-                    errors.append(f"Строка {index + 2}: Неверный формат новой цены")
-                    continue
-                
-                try:
-                    old_price = float(row[old_price_col]) if not pd.isna(row[old_price_col]) else new_price
-                except:
-                    old_price = new_price
-                
-                # Найти товар по SKU
-                product = db.query(Product).filter(Product.sku == sku).first()
-                
-                if not product:
-                    not_found.append(f"Строка {index + 2}: Товар с SKU '{sku}' не найден")
-                    continue
-                
-                # Обновить или создать цену в JSON файле
-                existing_price = get_price(product.sku)
-                is_parse = existing_price.get('is_parse', True) if existing_price else True
-                set_price(
-                    sku=product.sku,
-                    price=new_price,
-                    old_price=old_price,
-                    currency='RUB',
-                    is_parse=is_parse
-                )
-                
-                updated_count += 1
-                
-            except Exception as e:
-                errors.append(f"Строка {index + 2}: {str(e)}")
-        
-        db.commit()
-        
-        return {
-            "message": "Обновление цен завершено",
-            "updated": updated_count,
-            "errors": errors,
-            "not_found": not_found,
-            "total_processed": len(df)
-        }
-        
+        return await run_in_threadpool(run_prices_import, file_content, db)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка при обновлении цен: {str(e)}")
 
-@app.get("/api/excel/export/products")
-async def export_products_to_excel(db: Session = Depends(get_db)):
-    """Экспортировать все товары в формате для редактирования и повторного импорта"""
+@app.post("/api/excel/changesets/{changeset_id}/apply")
+def apply_import_changeset(changeset_id: str, db: Session = Depends(get_db)):
+    """
+    Применить результат dry-run импорта: записываются только новые и измененные строки
+    Строки, которые изменились в каталоге после предпросмотра, пропускаются (conflicts)
+    Синхронный эндпоинт: запись в БД выполняется в пуле потоков, не в event loop
+    """
+    from import_diff import load_changeset, delete_changeset, pending_product_changes, pending_price_changes, diff_images
+    
+    changeset = load_changeset(changeset_id)
+    if not changeset:
+        raise HTTPException(status_code=404, detail="Набор изменений не найден или уже применен")
+    
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        
-        # Получить все товары с ценами
-        results = db.query(Product).all()
-        
-        # Создаем Excel файл
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Товары"
-        
-        # Заголовки (те же что в шаблоне для импорта, но без изображений)
-        headers = [
-            'SKU товара', 'Название товара*', 'Описание', 
-            'Основная категория (level0)*', 'Подкатегория (level1)*', 'Детальная категория (level2)*',
-            'Бренд', 'Цена*', 'Валюта', 'Количество на складе',
-            'Характеристики (JSON)'
-        ]
+        if changeset["kind"] == "prices":
+            ready, conflicts = pending_price_changes(changeset)
+            result = {"message": "Обновление цен завершено", "updated": apply_price_rows(ready)}
+        else:
+            ready, conflicts = pending_product_changes(changeset, db)
+            result = apply_product_rows(ready, db)
+            # Пары, которые после предпросмотра уже получили те же URL, не перезаписываются
+            result.update(apply_image_rows(diff_images(changeset.get("apply_images", []), db)["apply"], db))
+            result["message"] = f"Обработка завершена: добавлено {result['added']}, обновлено {result['updated']}"
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Ошибка при применении изменений: {str(e)}")
+    
+    delete_changeset(changeset_id)
+    result["conflicts"] = [
+        f"SKU '{item['data'].get('sku')}': изменен после предпросмотра, строка пропущена" for item in conflicts
+    ]
+    return result
+
+def build_catalog_export(db: Session, progress=None) -> bytes:
+    """Excel с товарами (лист "Товары") и изображениями для редактирования и повторного импорта"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
+    
+    # Получить все товары с ценами
+    results = db.query(Product).all()
+    
+    # Создаем Excel файл
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Товары"
+    
+    # Заголовки (те же что в шаблоне для импорта, но без изображений)
+    headers = [
+        'SKU товара', 'Название товара*', 'Описание', 
+        'Основная категория (level0)*', 'Подкатегория (level1)*', 'Детальная категория (level2)*',
+        'Бренд', 'Цена*', 'Валюта', 'Количество на складе',
+        'Характеристики (JSON)'
+    ]
+    
+    # Добавляем заголовки со стилем
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+    
+    # Добавляем данные товаров
+    for row_idx, product in enumerate(results, 2):
+        if progress:
+            progress(row_idx - 2, len(results))
+        # Получаем цену из JSON файла
+        price_data = get_price(product.sku)
         
-        # Добавляем заголовки со стилем
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Добавляем данные товаров
-        for row_idx, product in enumerate(results, 2):
-            # Получаем цену из JSON файла
-            price_data = get_price(product.sku)
-            
-            # Получаем характеристики
+        # Получаем характеристики
+        try:
+            specifications = json.loads(product.specifications) if product.specifications else {}
+            specs_str = json.dumps(specifications, ensure_ascii=False) if specifications else ''
+        except:
+            specs_str = ''
+        
+        # Заполняем строку данными (без столбца изображений)
+        ws.cell(row=row_idx, column=1, value=product.sku or '')
+        ws.cell(row=row_idx, column=2, value=product.name or '')
+        ws.cell(row=row_idx, column=3, value='')  # description поле удалено
+        ws.cell(row=row_idx, column=4, value=product.level_0 or '')
+        ws.cell(row=row_idx, column=5, value=product.level_1 or '')
+        ws.cell(row=row_idx, column=6, value=product.level_2 or '')
+        ws.cell(row=row_idx, column=7, value=product.brand or '')
+        ws.cell(row=row_idx, column=8, value=price_data.get('price', 0.0) if price_data else 0.0)
+        ws.cell(row=row_idx, column=9, value=price_data.get('currency', 'RUB') if price_data else 'RUB')
+        ws.cell(row=row_idx, column=10, value=product.stock or 0)
+        ws.cell(row=row_idx, column=11, value=specs_str)
+    
+    # Автоподбор ширины колонок
+    for column in ws.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
             try:
-                specifications = json.loads(product.specifications) if product.specifications else {}
-                specs_str = json.dumps(specifications, ensure_ascii=False) if specifications else ''
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
             except:
-                specs_str = ''
+                pass
+        adjusted_width = min(max_length + 2, 50)
+        ws.column_dimensions[column_letter].width = adjusted_width
+    
+    # Добавляем лист с изображениями
+    images_ws = wb.create_sheet("Изображения")
+    images_headers = [
+        'Модель (level_2)*', 'Цвет*', 'URL изображений (через запятую)*'
+    ]
+    
+    # Добавляем заголовки для изображений
+    for col, header in enumerate(images_headers, 1):
+        cell = images_ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="27ae60", end_color="27ae60", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+    
+    # Получаем все изображения из таблицы ProductImage
+    product_images = db.query(ProductImage).all()
+    
+    # Добавляем данные изображений
+    for row_idx, product_image in enumerate(product_images, 2):
+        try:
+            # Парсим JSON с изображениями
+            images_data = json.loads(product_image.img_list) if product_image.img_list else []
             
-            # Заполняем строку данными (без столбца изображений)
-            ws.cell(row=row_idx, column=1, value=product.sku or '')
-            ws.cell(row=row_idx, column=2, value=product.name or '')
-            ws.cell(row=row_idx, column=3, value='')  # description поле удалено
-            ws.cell(row=row_idx, column=4, value=product.level_0 or '')
-            ws.cell(row=row_idx, column=5, value=product.level_1 or '')
-            ws.cell(row=row_idx, column=6, value=product.level_2 or '')
-            ws.cell(row=row_idx, column=7, value=product.brand or '')
-            ws.cell(row=row_idx, column=8, value=price_data.get('price', 0.0) if price_data else 0.0)
-            ws.cell(row=row_idx, column=9, value=price_data.get('currency', 'RUB') if price_data else 'RUB')
-            ws.cell(row=row_idx, column=10, value=product.stock or 0)
-            ws.cell(row=row_idx, column=11, value=specs_str)
-        
-        # Автоподбор ширины колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Добавляем лист с изображениями
-        images_ws = wb.create_sheet("Изображения")
-        images_headers = [
-            'Модель (level_2)*', 'Цвет*', 'URL изображений (через запятую)*'
-        ]
-        
-        # Добавляем заголовки для изображений
-        for col, header in enumerate(images_headers, 1):
-            cell = images_ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="27ae60", end_color="27ae60", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Получаем все изображения из таблицы ProductImage
-        product_images = db.query(ProductImage).all()
-        
-        # Добавляем данные изображений
-        for row_idx, product_image in enumerate(product_images, 2):
+            # Проверяем, что images_data это список строк, а не список словарей
+            if images_data and isinstance(images_data[0], dict):
+                # Если это список словарей, извлекаем URL
+                image_urls = ', '.join([img.get('url', '') for img in images_data if img.get('url')])
+            else:
+                # Если это список строк
+                image_urls = ', '.join(images_data) if images_data else ''
+            
+            images_ws.cell(row=row_idx, column=1, value=product_image.level_2 or '')
+            images_ws.cell(row=row_idx, column=2, value=product_image.color or '')
+            images_ws.cell(row=row_idx, column=3, value=image_urls)
+        except Exception as e:
+            print(f"Ошибка при обработке изображений для {product_image.level_2} - {product_image.color}: {e}")
+            continue
+    
+    # Автоподбор ширины колонок для изображений
+    for column in images_ws.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
             try:
-                # Парсим JSON с изображениями
-                images_data = json.loads(product_image.img_list) if product_image.img_list else []
-                
-                # Проверяем, что images_data это список строк, а не список словарей
-                if images_data and isinstance(images_data[0], dict):
-                    # Если это список словарей, извлекаем URL
-                    image_urls = ', '.join([img.get('url', '') for img in images_data if img.get('url')])
-                else:
-                    # Если это список строк
-                    image_urls = ', '.join(images_data) if images_data else ''
-                
-                images_ws.cell(row=row_idx, column=1, value=product_image.level_2 or '')
-                images_ws.cell(row=row_idx, column=2, value=product_image.color or '')
-                images_ws.cell(row=row_idx, column=3, value=image_urls)
-            except Exception as e:
-                print(f"Ошибка при обработке изображений для {product_image.level_2} - {product_image.color}: {e}")
-                continue
-        
-        # Автоподбор ширины колонок для изображений
-        for column in images_ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 80)
-            images_ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Сохраняем в BytesIO
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=current_products.xlsx"}
-        )
-        
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+            except:
+                pass
+        adjusted_width = min(max_length + 2, 80)
+        images_ws.column_dimensions[column_letter].width = adjusted_width
+    
+    # Сохраняем в BytesIO
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+@app.get("/api/excel/export/products")
+def export_products_to_excel(background: bool = False, db: Session = Depends(get_db)):
+    """Экспортировать все товары в формате для редактирования и повторного импорта (background=true - фоновой задачей, файл - /jobs/{id}/result)"""
+    if background:
+        return submit_job("export_catalog")
+    
+    try:
+        content = build_catalog_export(db)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
+    
+    return StreamingResponse(
+        io.BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": "attachment; filename=current_products.xlsx"}
+    )
 
 # Additional Price Management API
 @app.get("/api/prices/current")
@@ -1702,54 +1926,184 @@ async def update_single_price(
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Ошибка обновления цены: {str(e)}")
 
-@app.get("/api/orders")
-async def get_all_orders(db: Session = Depends(get_db)):
-    """Получить все заказы с товарами"""
+# Размер страницы /api/orders по умолчанию и максимальный
+ORDERS_PAGE_SIZE = 50
+ORDERS_MAX_PAGE_SIZE = 200
+# Размер пачки при потоковой выгрузке заказов
+ORDERS_STREAM_BATCH_SIZE = 500
+
+def serialize_order(order: Order) -> dict:
+    """Преобразовать заказ с товарами в словарь для ответа API"""
+    items = []
+    for item in order.items:
+        items.append({
+            "id": item.id,
+            "product_id": item.product_id,
+            "name": item.product_name,
+            "price": item.price,
+            "quantity": item.quantity,
+            "color": item.color,
+            "memory": item.memory,
+            "sim": item.sim,
+            "ram": item.ram
+        })
+    
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "customer_name": order.customer_name,
+        "contact_method": order.contact_method,
+        "contact_value": order.contact_value,
+        "address": order.address,
+        "comment": order.comment,
+        "shipping_type": order.shipping_type,
+        "delivery_option": order.delivery_option,
+        "pickup_address": order.pickup_address,
+        "delivery_datetime": order.delivery_datetime.isoformat() if order.delivery_datetime else None,
+        "total": order.total,
+        "promo_code": order.promo_code,
+        "discount_amount": order.discount_amount,
+        "final_total": order.final_total,
+        "status": order.status,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "updated_at": order.updated_at.isoformat() if order.updated_at else None,
+        "items": items
+    }
+
+def build_orders_filters(
+    status: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    promo_code: Optional[str]
+) -> list:
+    """Собрать фильтры для списка заказов (даты в ISO формате)"""
+    filters = []
+    
+    if status:
+        filters.append(Order.status == status)
+    if promo_code:
+        filters.append(func.upper(Order.promo_code) == promo_code.upper())
+    
     try:
-        orders = db.query(Order).order_by(Order.created_at.desc()).all()
-        
-        result = []
-        for order in orders:
-            # Получаем товары заказа
-            order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+        if date_from:
+            filters.append(Order.created_at >= datetime.fromisoformat(date_from))
+        if date_to:
+            parsed_to = datetime.fromisoformat(date_to)
+            # Дата без времени - включаем весь день
+            if len(date_to) == 10:
+                filters.append(Order.created_at < parsed_to + timedelta(days=1))
+            else:
+                filters.append(Order.created_at <= parsed_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Даты должны быть в формате ISO (YYYY-MM-DD или YYYY-MM-DDTHH:MM:SS)")
+    
+    return filters
+
+def iter_orders_batches(filters: list, batch_size: int = ORDERS_STREAM_BATCH_SIZE):
+    """
+    Перебрать заказы пачками по ключу id (от новых к старым)
+    Используется собственная сессия: генератор живет дольше запроса
+    """
+    db = SessionLocal()
+    try:
+        last_id = None
+        while True:
+            query = db.query(Order).options(selectinload(Order.items)).filter(*filters)
+            if last_id is not None:
+                query = query.filter(Order.id < last_id)
+            batch = query.order_by(Order.id.desc()).limit(batch_size).all()
+            if not batch:
+                break
             
-            items = []
-            for item in order_items:
-                items.append({
-                    "id": item.id,
-                    "product_id": item.product_id,
-                    "name": item.product_name,
-                    "price": item.price,
-                    "quantity": item.quantity,
-                    "color": item.color,
-                    "memory": item.memory,
-                    "sim": item.sim,
-                    "ram": item.ram
-                })
+            yield batch
             
-            result.append({
-                "id": order.id,
-                "order_number": order.order_number,
-                "customer_name": order.customer_name,
-                "contact_method": order.contact_method,
-                "contact_value": order.contact_value,
-                "address": order.address,
-                "comment": order.comment,
-                "shipping_type": order.shipping_type,
-                "delivery_option": order.delivery_option,
-                "pickup_address": order.pickup_address,
-                "delivery_datetime": order.delivery_datetime.isoformat() if order.delivery_datetime else None,
-                "total": order.total,
-                "promo_code": order.promo_code,
-                "discount_amount": order.discount_amount,
-                "final_total": order.final_total,
-                "status": order.status,
-                "created_at": order.created_at.isoformat() if order.created_at else None,
-                "updated_at": order.updated_at.isoformat() if order.updated_at else None,
-                "items": items
-            })
+            last_id = batch[-1].id
+            # Освобождаем загруженные объекты, чтобы память не росла с историей заказов
+            db.expunge_all()
+    finally:
+        db.close()
+
+def stream_orders_ndjson(filters: list):
+    """Потоковая выгрузка заказов в NDJSON (один заказ на строку)"""
+    for batch in iter_orders_batches(filters):
+        yield "".join(json.dumps(serialize_order(order), ensure_ascii=False) + "\n" for order in batch)
+
+ORDERS_CSV_COLUMNS = [
+    "id", "order_number", "created_at", "status", "customer_name", "contact_method", "contact_value",
+    "shipping_type", "delivery_option", "address", "total", "promo_code", "discount_amount", "final_total", "items"
+]
+
+def stream_orders_csv(filters: list):
+    """Потоковая выгрузка заказов в CSV (товары заказа в одной колонке)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ORDERS_CSV_COLUMNS)
+    yield "\ufeff" + buffer.getvalue()  # BOM для корректного открытия в Excel
+    
+    for batch in iter_orders_batches(filters):
+        buffer.seek(0)
+        buffer.truncate()
+        for order in batch:
+            data = serialize_order(order)
+            data["items"] = "; ".join(f"{item['name']} x{item['quantity']} ({item['price']})" for item in data["items"])
+            writer.writerow([data.get(column) for column in ORDERS_CSV_COLUMNS])
+        yield buffer.getvalue()
+
+@app.get("/api/orders")
+async def get_all_orders(
+    limit: int = ORDERS_PAGE_SIZE,
+    cursor: Optional[int] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    promo_code: Optional[str] = None,
+    export_format: str = Query("json", alias="format"),
+    db: Session = Depends(get_db)
+):
+    """
+    Получить заказы с товарами (от новых к старым)
+    
+    limit/cursor: постраничная выдача, cursor = next_cursor из предыдущего ответа
+    status, date_from, date_to, promo_code: фильтры
+    format: json (страница), ndjson или csv (потоковая выгрузка всех заказов по фильтрам)
+    total - число всех заказов по фильтрам, count - заказов на этой странице
+    """
+    filters = build_orders_filters(status, date_from, date_to, promo_code)
+    
+    if export_format == "ndjson":
+        return StreamingResponse(stream_orders_ndjson(filters), media_type="application/x-ndjson")
+    if export_format == "csv":
+        return StreamingResponse(
+            stream_orders_csv(filters),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": "attachment; filename=orders.csv"}
+        )
+    if export_format != "json":
+        raise HTTPException(status_code=400, detail="Поддерживаемые форматы: json, ndjson, csv")
+    
+    try:
+        limit = max(1, min(limit, ORDERS_MAX_PAGE_SIZE))
+        
+        # Keyset-пагинация по id: id растет вместе с created_at, OFFSET не нужен
+        query = db.query(Order).options(selectinload(Order.items)).filter(*filters)
+        if cursor is not None:
+            query = query.filter(Order.id < cursor)
+        
+        # Берем на один заказ больше, чтобы понять, есть ли следующая страница
+        orders = query.order_by(Order.id.desc()).limit(limit + 1).all()
+        has_more = len(orders) > limit
+        orders = orders[:limit]
         
-        return {"success": True, "orders": result, "total": len(result)}
+        result = [serialize_order(order) for order in orders]
+        
+        return {
+            "success": True,
+            "orders": result,
+            "total": db.query(func.count(Order.id)).filter(*filters).scalar(),
+            "count": len(result),
+            "has_more": has_more,
+            "next_cursor": orders[-1].id if has_more else None
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения заказов: {str(e)}")
 
@@ -1998,77 +2352,47 @@ async def get_product_images_by_color(model_key: str, color: str, db: Session =
 
 @app.get("/color-schemes/{model_key}")
 async def get_color_schemes(model_key: str, db: Session = Depends(get_db)):
-    """Get color schemes for a product from database"""
-    from models import ModelColorScheme
-    
-    # Ищем схему цветов в базе данных
-    color_scheme = db.query(ModelColorScheme).filter(
-        ModelColorScheme.model_key == model_key
-    ).first()
-    
-    if not color_scheme:
+    """Get color scheme for a model, derived from its variants"""
+    level_2 = variant_matrix.resolve_model_key(model_key, db)
+    if not level_2:
         raise HTTPException(status_code=404, detail=f"Цветовая схема не найдена для {model_key}")
     
-    try:
-        # Парсим JSON с цветами
-        colors_data = json.loads(color_scheme.colors_json)
-        
-        # Определяем цвет по умолчанию (первый в списке)
-        default_color = colors_data[0]["value"] if colors_data else ""
-        
-        return {
-            "colors": colors_data,
-            "default_color": default_color
-        }
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Ошибка парсинга цветовой схемы")
+    return color_scheme(variant_matrix.get(level_2, db))
 
 @app.get("/variant-schemes/{model_key}")
 async def get_variant_schemes(model_key: str, db: Session = Depends(get_db)):
-    """Get variant schemes for a product from database"""
-    from models import ModelVariantScheme
-    
-    # Ищем схему вариантов в базе данных
-    variant_scheme = db.query(ModelVariantScheme).filter(
-        ModelVariantScheme.model_key == model_key
-    ).first()
-    
-    if not variant_scheme:
+    """Get variant scheme for a model, derived from its variants"""
+    level_2 = variant_matrix.resolve_model_key(model_key, db)
+    if not level_2:
         raise HTTPException(status_code=404, detail=f"Схема вариантов не найдена для {model_key}")
     
-    try:
-        # Парсим JSON с вариантами
-        variants_data = json.loads(variant_scheme.variants_json)
-        
-        return {
-            "variants": variants_data
-        }
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Ошибка парсинга схемы вариантов")
+    return variant_scheme(variant_matrix.get(level_2, db))
 
-# Новые endpoints для иерархической фильтрации
+@app.get("/hierarchy/tree")
+async def get_hierarchy_tree(path: str = "", depth: Optional[int] = None):
+    """
+    Дерево каталога level_0 → brand → level_1 → level_2 из памяти (hierarchy_index)
+    
+    path: поддерево, например "Смартфоны/Apple/16 Series" (пусто - все дерево)
+    depth: сколько уровней детей вернуть (по умолчанию все)
+    В каждом узле: sku_count, model_count, min_price
+    """
+    tree = hierarchy_index.tree(path, depth)
+    if tree is None:
+        raise HTTPException(status_code=404, detail=f"Узел иерархии не найден: {path}")
+    return tree
 
 @app.get("/hierarchy/brands")
-async def get_brands(level0: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_brands(level0: Optional[str] = None):
     """Получить бренды, опционально отфильтрованные по категории (level0)"""
-    filters = [
-        Product.brand.isnot(None),
-        Product.is_available == True
-    ]
-    
-    if level0:
-        filters.append(Product.level_0 == level0)
-    
-    brands = db.query(Product.brand.distinct()).filter(*filters).all()
-    return [brand[0] for brand in brands]
+    return hierarchy_index.values("brand", level_0=level0)
 
 @app.get("/hierarchy/levels")
 async def get_hierarchy_levels(
     level: Optional[int] = None,
     brand: Optional[str] = None,
     parent_level0: Optional[str] = None,
-    parent_level1: Optional[str] = None,
-    db: Session = Depends(get_db)
+    parent_level1: Optional[str] = None
 ):
     """
     Получить значения уровней иерархии
@@ -2078,93 +2402,61 @@ async def get_hierarchy_levels(
     parent_level0: для уровня 1 - фильтр по level0
     parent_level1: для уровня 2 - фильтр по level1
     """
+    filters = {"brand": brand, "level_0": parent_level0, "level_1": parent_level1}
     
-    filters = [Product.is_available == True]
-    
-    if brand:
-        filters.append(Product.brand == brand)
-    if parent_level0:
-        filters.append(Product.level_0 == parent_level0)
-    if parent_level1:
-        filters.append(Product.level_1 == parent_level1)
-    
-    query = db.query(Product).filter(and_(*filters))
-    
-    if level == 0:
-        # Получаем все level_0
-        results = query.with_entities(Product.level_0.distinct()).filter(
-            Product.level_0.isnot(None)
-        ).all()
-        return [item[0] for item in results if item[0]]
-        
-    elif level == 1:
-        # Получаем все level_1
-        results = query.with_entities(Product.level_1.distinct()).filter(
-            Product.level_1.isnot(None)
-        ).all()
-        return [item[0] for item in results if item[0]]
-        
-    elif level == 2:
-        # Получаем все level_2
-        results = query.with_entities(Product.level_2.distinct()).filter(
-            Product.level_2.isnot(None)
-        ).all()
-        return [item[0] for item in results if item[0]]
+    if level in (0, 1, 2):
+        return hierarchy_index.values(f"level_{level}", **filters)
     
-    else:
-        # Возвращаем всю иерархию
-        return {
-            "level0": db.query(Product.level_0.distinct()).filter(
-                Product.level_0.isnot(None),
-                Product.is_available == True
-            ).all(),
-            "level1": db.query(Product.level_1.distinct()).filter(
-                Product.level_1.isnot(None),
-                Product.is_available == True
-            ).all(),
-            "level2": db.query(Product.level_2.distinct()).filter(
-                Product.level_2.isnot(None),
-                Product.is_available == True
-            ).all()
-        }
+    # Возвращаем всю иерархию
+    return {
+        "level0": hierarchy_index.values("level_0"),
+        "level1": hierarchy_index.values("level_1"),
+        "level2": hierarchy_index.values("level_2")
+    }
 
 @app.get("/hierarchy/models")
 async def get_models(
     brand: Optional[str] = None,
     level0: Optional[str] = None,
     level1: Optional[str] = None,
-    level2: Optional[str] = None,
-    db: Session = Depends(get_db)
+    level2: Optional[str] = None
 ):
     """Получить все доступные модели с фильтрацией"""
-    
-    filters = [Product.is_available == True]
-    
-    if brand:
-        filters.append(Product.brand == brand)
-    if level0:
-        filters.append(Product.level0 == level0)
-    if level1:
-        filters.append(Product.level1 == level1)
-    if level2:
-        filters.append(Product.level2 == level2)
-    
-    models = db.query(Product.level_2.distinct()).filter(
-        and_(*filters)
-    ).all()
-    
-    return [model[0] for model in models if model[0]]
+    return hierarchy_index.values("level_2", brand=brand, level_0=level0, level_1=level1, level_2=level2)
+
+def sku_info_rows(products: List[Product], enricher: ProductEnricher) -> List[dict]:
+    """Строки /hierarchy/skus для пачки товаров"""
+    enricher.load(products, descriptions=False)
+    skus_info = []
+    for product in products:
+        price_data = enricher.price(product)
+        sku_data = {
+            "sku": product.sku,
+            "name": product.name,
+            "brand": product.brand,
+            "model": product.level_2 or "",
+            "level0": product.level_0 or "",
+            "level1": product.level_1 or "",
+            "level2": product.level_2 or "",
+            "price": price_data.get('price', 0.0) if price_data else 0.0,
+            "currency": price_data.get('currency', 'RUB') if price_data else "RUB",
+            "stock": product.stock
+        }
+        skus_info.append(sku_data)
+    return skus_info
 
 @app.get("/hierarchy/skus")
 async def get_skus_with_info(
+    request: Request,
     brand: Optional[str] = None,
     model: Optional[str] = None,
     level0: Optional[str] = None,
     level1: Optional[str] = None,
     level2: Optional[str] = None,
+    stream: bool = False,
     db: Session = Depends(get_db)
 ):
-    """Получить SKU с детальной информацией"""
+    """Получить SKU с детальной информацией (?stream=1 или Accept: application/x-ndjson - построчно, NDJSON)"""
     
     filters = [Product.is_available == True]
     
@@ -2179,27 +2471,12 @@ async def get_skus_with_info(
     if level2:
         filters.append(Product.level_2 == level2)
     
+    if wants_ndjson(request, stream):
+        return ndjson_response(stream_query_chunks(select(Product).filter(and_(*filters)), sku_info_rows))
+    
     # Получаем SKU с ценами
     results = db.query(Product).filter(and_(*filters)).all()
-    
-    skus_info = []
-    for product in results:
-        price_data = get_price(product.sku)
-        sku_data = {
-            "sku": product.sku,
-            "name": product.name,
-            "brand": product.brand,
-            "model": product.level_2 or "",
-            "level0": product.level_0 or "",
-            "level1": product.level_1 or "",
-            "level2": product.level_2 or "",
-            "price": price_data.get('price', 0.0) if price_data else 0.0,
-            "currency": price_data.get('currency', 'RUB') if price_data else "RUB",
-            "stock": product.stock
-        }
-        skus_info.append(sku_data)
-    
-    return skus_info
+    return sku_info_rows(results, ProductEnricher(db))
 
 @app.get("/debug/db-status")
 async def debug_db_status(db: Session = Depends(get_db)):
@@ -2335,146 +2612,207 @@ async def import_single_product(product_data: dict, db: Session = Depends(get_db
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Ошибка добавления товара: {str(e)}")
 
+def build_products_export(db: Session, progress=None) -> bytes:
+    """Excel с полным ассортиментом (все столбцы)"""
+    import pandas as pd
+    import openpyxl
+    
+    # Получить все товары с ценами
+    results = db.query(Product).all()
+    enricher = ProductEnricher(db).load(results, descriptions=False)
+    
+    products_data = []
+    for index, product in enumerate(results):
+        if progress:
+            progress(index, len(results))
+        price_data = enricher.price(product)
+        specifications = enricher.specifications(product)
+        images = enricher.images(product)
+        
+        products_data.append({
+            'ID': product.id,
+            'SKU': product.sku,
+            'Название': product.name,
+            'Описание': '',  # поле description удалено
+            'Бренд': product.brand,
+            'Категория': product.level_0 or '',
+            'Уровень 0': product.level_0 or '',
+            'Уровень 1': product.level_1 or '',
+            'Уровень 2': product.level_2 or '',
+            'Цвет': specifications.get('color') or '',
+            'Память': specifications.get('disk') or '',
+            'SIM': specifications.get('sim_config') or '',
+            'Цена': price_data.get('price', 0.0) if price_data else 0.0,
+            'Старая цена': price_data.get('old_price', 0.0) if price_data else 0.0,
+            'Валюта': price_data.get('currency', 'RUB') if price_data else 'RUB',
+            'Скидка %': price_data.get('discount_percentage', 0.0) if price_data else 0.0,
+            'Склад': product.stock,
+            'В наличии': 'Да' if product.is_available else 'Нет',
+            'Изображения': ' | '.join(images) if images else '',
+            'Кол-во изображений': len(images),
+            'Создано': product.created_at.strftime('%Y-%m-%d %H:%M:%S') if product.created_at else '',
+            'Обновлено': product.updated_at.strftime('%Y-%m-%d %H:%M:%S') if product.updated_at else ''
+        })
+    
+    # Создать DataFrame и Excel файл
+    from io import BytesIO
+    
+    df = pd.DataFrame(products_data)
+    
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Ассортимент')
+        
+        # Стилизация
+        workbook = writer.book
+        worksheet = writer.sheets['Ассортимент']
+        
+        # Стили для заголовков
+        header_font = openpyxl.styles.Font(bold=True, color="FFFFFF")
+        header_fill = openpyxl.styles.PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        
+        for cell in worksheet[1]:
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = openpyxl.styles.Alignment(horizontal="center", vertical="center")
+    
+    return output.getvalue()
+
 @app.get("/export-products")
-async def export_all_products(db: Session = Depends(get_db)):
-    """Скачать полный ассортимент в Excel с всеми столбцами"""
+def export_all_products(background: bool = False, db: Session = Depends(get_db)):
+    """Скачать полный ассортимент в Excel с всеми столбцами (background=true - фоновой задачей, файл - /jobs/{id}/result)"""
+    if background:
+        return submit_job("export_products")
+    
     try:
-        # Получить все товары с ценами
-        results = db.query(Product).all()
+        content = build_products_export(db)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка экспорта: {str(e)}")
+    
+    return StreamingResponse(
+        io.BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": "attachment; filename=assortment_full.xlsx"}
+    )
+
+def build_prices_export(db: Session, progress=None) -> bytes:
+    """Excel со всеми ценами доступных товаров"""
+    import pandas as pd
+    import openpyxl
+    
+    # Получить все товары с ценами
+    results = db.query(Product).filter(Product.is_available == True).all()
+    enricher = ProductEnricher(db).load(results, descriptions=False)
+    
+    prices_data = []
+    for index, product in enumerate(results):
+        if progress:
+            progress(index, len(results))
+        price_data = enricher.price(product)
         
-        products_data = []
-        for product in results:
-            # Получаем цену из JSON файла
-            price_data = get_price(product.sku)
-            
-            try:
-                specifications = json.loads(product.specifications) if product.specifications else {}
-            except json.JSONDecodeError:
-                specifications = {}
-            
-            # Получить массив изображений
-            images = get_product_images(product, db)
-            
-            products_data.append({
-                'ID': product.id,
+        if price_data:  # Только товары с ценами
+            prices_data.append({
                 'SKU': product.sku,
-                'Название': product.name,
-                'Описание': '',  # поле description удалено
+                'Название товара': product.name,
                 'Бренд': product.brand,
-                'Категория': product.level_0 or '',
-                'Уровень 0': product.level_0 or '',
-                'Уровень 1': product.level_1 or '',
-                'Уровень 2': product.level_2 or '',
-                'Цвет': product.color or '',
-                'Память': product.disk or '',
-                'SIM': product.sim_config or '',
-                'Цена': price_data.get('price', 0.0) if price_data else 0.0,
-                'Старая цена': price_data.get('old_price', 0.0) if price_data else 0.0,
-                'Валюта': price_data.get('currency', 'RUB') if price_data else 'RUB',
-                'Скидка %': price_data.get('discount_percentage', 0.0) if price_data else 0.0,
-                'Склад': product.stock,
-                'В наличии': 'Да' if product.is_available else 'Нет',
-                'Изображения': ' | '.join(images) if images else '',
-                'Кол-во изображений': len(images),
-                'Создано': product.created_at.strftime('%Y-%m-%d %H:%M:%S') if product.created_at else '',
-                'Обновлено': product.updated_at.strftime('%Y-%m-%d %H:%M:%S') if product.updated_at else ''
+                'Текущая цена': price_data.get('price', 0.0),
+                'Старая цена': price_data.get('old_price', 0.0),
+                'Валюта': price_data.get('currency', 'RUB'),
+                'Скидка %': f"{price_data.get('discount_percentage', 0.0):.1f}%",
+                'Разница': f"{price_data.get('old_price', 0.0) - price_data.get('price', 0.0):.0f}" if price_data.get('old_price', 0.0) > price_data.get('price', 0.0) else "0",
+                'Категория': product.level_0 or 'Без категории',
+                'В наличии': product.stock,
+                'Обновлено': 'Неизвестно'  # updated_at больше не хранится
             })
+    
+    if not prices_data:
+        raise HTTPException(status_code=400, detail="Цены не найдены")
+    
+    # Создать DataFrame и Excel файл
+    from io import BytesIO
+    
+    df = pd.DataFrame(prices_data)
+    
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Цены')
         
-        # Создать DataFrame и Excel файл
-        from io import BytesIO
-        
-        df = pd.DataFrame(products_data)
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Ассортимент')
-            
-            # Стилизация
-            workbook = writer.book
-            worksheet = writer.sheets['Ассортимент']
-            
-            # Стили для заголовков
-            header_font = openpyxl.styles.Font(bold=True, color="FFFFFF")
-            header_fill = openpyxl.styles.PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            
-            for cell in worksheet[1]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = openpyxl.styles.Alignment(horizontal="center", vertical="center")
-        
-        output.seek(0)
+        # Стилизация
+        workbook = writer.book
+        worksheet = writer.sheets['Цены']
         
-        return StreamingResponse(
-            BytesIO(output.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=assortment_full.xlsx"}
-        )
+        # Стили для заголовков
+        header_font = openpyxl.styles.Font(bold=True, color="FFFFFF")
+        header_fill = openpyxl.styles.PatternFill(start_color="27ae60", end_color="27ae60", fill_type="solid")
         
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Ошибка экспорта: {str(e)}")
+        for cell in worksheet[1]:
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = openpyxl.styles.Alignment(horizontal="center", vertical="center")
+    
+    return output.getvalue()
 
 @app.get("/export-prices")
-async def export_all_prices(db: Session = Depends(get_db)):
-    """Скачать все цены в Excel"""
+def export_all_prices(background: bool = False, db: Session = Depends(get_db)):
+    """Скачать все цены в Excel (background=true - фоновой задачей, файл - /jobs/{id}/result)"""
+    if background:
+        return submit_job("export_prices")
+    
     try:
-        # Получить все товары с ценами
-        results = db.query(Product).filter(Product.is_available == True).all()
-        
-        prices_data = []
-        for product in results:
-            # Получаем цену из JSON файла
-            price_data = get_price(product.sku)
-            
-            if price_data:  # Только товары с ценами
-                prices_data.append({
-                    'SKU': product.sku,
-                    'Название товара': product.name,
-                    'Бренд': product.brand,
-                    'Текущая цена': price_data.get('price', 0.0),
-                    'Старая цена': price_data.get('old_price', 0.0),
-                    'Валюта': price_data.get('currency', 'RUB'),
-                    'Скидка %': f"{price_data.get('discount_percentage', 0.0):.1f}%",
-                    'Разница': f"{price_data.get('old_price', 0.0) - price_data.get('price', 0.0):.0f}" if price_data.get('old_price', 0.0) > price_data.get('price', 0.0) else "0",
-                    'Категория': product.level_0 or 'Без категории',
-                    'В наличии': product.stock,
-                    'Обновлено': 'Неизвестно'  # updated_at больше не хранится
-                })
-        
-        if not prices_data:
-            raise HTTPException(status_code=400, detail="Цены не найдены")
-        
-        # Создать DataFrame и Excel файл
-        from io import BytesIO
-        
-        df = pd.DataFrame(prices_data)
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Цены')
-            
-            # Стилизация
-            workbook = writer.book
-            worksheet = writer.sheets['Цены']
-            
-            # Стили для заголовков
-            header_font = openpyxl.styles.Font(bold=True, color="FFFFFF")
-            header_fill = openpyxl.styles.PatternFill(start_color="27ae60", end_color="27ae60", fill_type="solid")
-            
-            for cell in worksheet[1]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = openpyxl.styles.Alignment(horizontal="center", vertical="center")
-        
-        output.seek(0)
-        
-        return StreamingResponse(
-            BytesIO(output.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=prices_full.xlsx"}
-        )
-        
+        content = build_prices_export(db)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка экспорта цен: {str(e)}")
+    
+    return StreamingResponse(
+        io.BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": "attachment; filename=prices_full.xlsx"}
+    )
+
+# --- Фоновые задачи: импорт и экспорт Excel (?background=true) ---
+job_runner.register("import_products", lambda job: run_products_import(job.read_input(), job.db, job.progress), resumable=False)
+job_runner.register("update_or_create_products", lambda job: run_products_update_or_create(job.read_input(), job.db, job.progress))
+job_runner.register("import_prices", lambda job: run_prices_import(job.read_input(), job.db, job.progress))
+job_runner.register("export_catalog", lambda job: job.save_result(build_catalog_export(job.db, job.progress), "current_products.xlsx"))
+job_runner.register("export_products", lambda job: job.save_result(build_products_export(job.db, job.progress), "assortment_full.xlsx"))
+job_runner.register("export_prices", lambda job: job.save_result(build_prices_export(job.db, job.progress), "prices_full.xlsx"))
+job_runner.register("image_scan", lambda job: scan_images(job.db, progress=job.progress))
+job_runner.register("image_scan_urls", lambda job: scan_images(job.db, check_urls=True, progress=job.progress))
+
+def submit_job(kind: str, file: Optional[UploadFile] = None):
+    """
+    Поставить задачу в очередь (файл загрузки сохраняется на диск) и сразу вернуть ее id
+    Копирует файл синхронно - из async эндпоинтов вызывается через run_in_threadpool
+    """
+    try:
+        job = job_runner.submit(kind, file.file if file else None, file.filename if file else None)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return JSONResponse(status_code=202, content={**job, "status_url": f"/jobs/{job['id']}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус фоновой задачи: queued/running/done/failed, прогресс, итог импорта или ссылка на файл"""
+    job = job_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Скачать файл, подготовленный фоновой задачей экспорта"""
+    job = job_runner.load(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Задача еще не завершена (статус: {job.status})")
+    if not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=404, detail="У задачи нет файла результата")
+    return FileResponse(
+        job.result_path,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=job.result_filename
+    )
 
 @app.get("/admin/schemes")
 async def get_all_schemes(db: Session = Depends(get_db)):
@@ -2770,35 +3108,21 @@ async def delete_product_by_sku(sku: str, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=400, detail=f"Ошибка удаления товара: {str(e)}")
 
-@app.get("/level2-descriptions/{level_2}")
-async def get_level2_description(level_2: str, db: Session = Depends(get_db)):
-    """Get description and specifications for a level_2 product"""
-    # Декодируем URL и нормализуем
-    from urllib.parse import unquote
-    from sqlalchemy import func, or_
-    
-    # Декодируем URL-кодирование
-    decoded = unquote(level_2)
-    normalized = (decoded or "").strip()
-    
-    # Пробуем найти точное совпадение
-    description = db.query(Level2Description).filter(Level2Description.level_2 == normalized).first()
-    
-    # Если не нашли, пробуем без учета регистра
-    if not description:
-        description = db.query(Level2Description).filter(
-            func.lower(Level2Description.level_2) == normalized.lower()
-        ).first()
-    
-    # Если все еще не нашли, пробуем поиск с LIKE (частичное совпадение)
-    if not description:
-        description = db.query(Level2Description).filter(
-            Level2Description.level_2.ilike(f"%{normalized}%")
-        ).first()
-    
-    if not description:
-        raise HTTPException(status_code=404, detail="Description not found")
-    
+def find_level2_description(db: Session, level_2: str) -> Optional[Level2Description]:
+    """
+    Описание level_2 одним запросом: точное совпадение, затем без учета регистра,
+    затем частичное (LIKE)
+    """
+    normalized = (level_2 or "").strip()
+    return db.query(Level2Description).filter(
+        Level2Description.level_2.ilike(f"%{normalized}%")
+    ).order_by(
+        (Level2Description.level_2 == normalized).desc(),
+        (func.lower(Level2Description.level_2) == normalized.lower()).desc(),
+        Level2Description.id
+    ).first()
+
+def level2_description_payload(description: Level2Description) -> dict:
     # Parse details if it's a JSON string
     details = {}
     if description.details:
@@ -2813,6 +3137,19 @@ async def get_level2_description(level_2: str, db: Session = Depends(get_db)):
         "details": details
     }
 
+@app.get("/level2-descriptions/{level_2}")
+async def get_level2_description(level_2: str, db: Session = Depends(get_db)):
+    """Get description and specifications for a level_2 product"""
+    from urllib.parse import unquote
+    
+    # Декодируем URL-кодирование
+    description = find_level2_description(db, unquote(level_2))
+    
+    if not description:
+        raise HTTPException(status_code=404, detail="Description not found")
+    
+    return level2_description_payload(description)
+
 # Pydantic models for orders
 class OrderItemCreate(BaseModel):
     product_id: int
@@ -2841,9 +3178,10 @@ class OrderCreate(BaseModel):
     shipping: ShippingInfo
     delivery_datetime: Optional[str] = None
     items: List[OrderItemCreate]
-    total: float
+    total: Optional[float] = None  # Не нужен при quote
     promo_code: Optional[str] = None
     discount_amount: Optional[float] = 0.0
+    quote: Optional[str] = None  # Котировка из POST /cart/evaluate: цены и суммы берутся из нее
 
 class OrderResponse(BaseModel):
     id: int
@@ -2872,150 +3210,128 @@ class PromoCodeCheckResponse(BaseModel):
     free_item_sku: Optional[str] = None
     free_item_name: Optional[str] = None
     message: Optional[str] = None
+    code: Optional[str] = None  # Проверенный промокод (в верхнем регистре)
+
+# Максимум промокодов в одном запросе /promo-codes/check-batch
+MAX_PROMO_CODES_PER_CHECK = 20
+
+class PromoCodeBatchCheckRequest(BaseModel):
+    codes: List[str]
+    cart_total: float
+    items: List[OrderItemCreate]
+
+class PromoCodeBatchCheckResponse(BaseModel):
+    results: List[PromoCodeCheckResponse]
+    best_code: Optional[str] = None  # Промокод с максимальной скидкой
 
 @app.post("/promo-codes/check", response_model=PromoCodeCheckResponse)
 async def check_promo_code(request: PromoCodeCheckRequest, db: Session = Depends(get_db)):
     """Проверить и применить промокод"""
     try:
-        # Ищем промокод
-        promo_code = db.query(PromoCode).filter(
-            PromoCode.code == request.code.upper(),
-            PromoCode.is_active == True
-        ).first()
+        result = promo_engine.evaluate(db, request.code, request.cart_total, request.items)
+        return PromoCodeCheckResponse(**result)
         
-        if not promo_code:
-            return PromoCodeCheckResponse(
-                valid=False,
-                message="Промокод не найден или неактивен"
-            )
-        
-        # Проверяем срок действия
-        now = datetime.utcnow()
-        if promo_code.valid_from and promo_code.valid_from > now:
-            return PromoCodeCheckResponse(
-                valid=False,
-                message="Промокод еще не действует"
-            )
-        
-        if promo_code.valid_until and promo_code.valid_until < now:
-            return PromoCodeCheckResponse(
-                valid=False,
-                message="Промокод истек"
-            )
-        
-        # Проверяем лимит использований
-        if promo_code.usage_limit and promo_code.used_count >= promo_code.usage_limit:
-            return PromoCodeCheckResponse(
-                valid=False,
-                message="Промокод исчерпан"
-            )
-        
-        # Проверяем минимальную сумму заказа
-        if promo_code.min_order_amount and request.cart_total < promo_code.min_order_amount:
-            return PromoCodeCheckResponse(
-                valid=False,
-                message=f"Минимальная сумма заказа для этого промокода: {promo_code.min_order_amount:,.0f} ₽"
-            )
-        
-        # Рассчитываем скидку в зависимости от типа
-        discount_amount = 0.0
-        free_item_sku = None
-        free_item_name = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка проверки промокода: {str(e)}")
+
+@app.post("/promo-codes/check-batch", response_model=PromoCodeBatchCheckResponse)
+async def check_promo_codes_batch(request: PromoCodeBatchCheckRequest, db: Session = Depends(get_db)):
+    """Проверить несколько промокодов для одной корзины за один запрос"""
+    if not request.codes:
+        raise HTTPException(status_code=400, detail="Список промокодов пуст")
+    if len(request.codes) > MAX_PROMO_CODES_PER_CHECK:
+        raise HTTPException(status_code=400, detail=f"Можно проверить не более {MAX_PROMO_CODES_PER_CHECK} промокодов за раз")
+    
+    try:
+        results = [
+            PromoCodeCheckResponse(**result)
+            for result in promo_engine.evaluate_many(db, request.codes, request.cart_total, request.items)
+        ]
         
-        if promo_code.discount_type == 'fixed':
-            # Фиксированная скидка
-            discount_amount = min(promo_code.discount_value, request.cart_total)
-            
-        elif promo_code.discount_type == 'percentage':
-            # Процентная скидка
-            discount_amount = request.cart_total * (promo_code.discount_value / 100)
-            
-        elif promo_code.discount_type == 'free_item':
-            # Бесплатный товар
-            # Проверяем условие (например, есть ли смартфон в корзине)
-            if promo_code.free_item_condition:
-                try:
-                    condition = json.loads(promo_code.free_item_condition) if isinstance(promo_code.free_item_condition, str) else promo_code.free_item_condition
-                    category = condition.get('category') or condition.get('level_0')
-                    
-                    # Проверяем, есть ли товар нужной категории в корзине
-                    has_category_item = False
-                    for item in request.items:
-                        # Получаем товар из БД для проверки категории
-                        product = db.query(Product).filter(Product.id == item.product_id).first()
-                        if product and product.level_0 == category:
-                            has_category_item = True
-                            break
-                    
-                    if not has_category_item:
-                        return PromoCodeCheckResponse(
-                            valid=False,
-                            message=f"Промокод действует только при заказе товара категории '{category}'"
-                        )
-                except (json.JSONDecodeError, TypeError):
-                    pass
-            
-            # Ищем товар для бесплатной выдачи
-            if promo_code.free_item_sku:
-                # Сначала проверяем, есть ли адаптер в корзине
-                has_free_item_in_cart = False
-                free_item_in_cart = None
-                
-                for item in request.items:
-                    product = db.query(Product).filter(Product.id == item.product_id).first()
-                    if product and product.sku and promo_code.free_item_sku.lower() in product.sku.lower():
-                        has_free_item_in_cart = True
-                        free_item_in_cart = product
-                        break
-                
-                if not has_free_item_in_cart:
-                    # Адаптера нет в корзине - не даем скидку
-                    return PromoCodeCheckResponse(
-                        valid=False,
-                        message=f"Промокод действует только если адаптер уже добавлен в корзину"
-                    )
-                
-                # Адаптер есть в корзине - даем скидку равную его цене
-                if free_item_in_cart:
-                    free_item_sku = free_item_in_cart.sku
-                    free_item_name = free_item_in_cart.name
-                    # Получаем цену товара из JSON файла
-                    price_data = get_price(free_item_in_cart.sku)
-                    if price_data:
-                        discount_amount = price_data.get('price', 0.0)
-                    else:
-                        return PromoCodeCheckResponse(
-                            valid=False,
-                            message="Не удалось определить цену товара для бесплатной выдачи"
-                        )
-                else:
-                    return PromoCodeCheckResponse(
-                        valid=False,
-                        message="Товар для бесплатной выдачи не найден в корзине"
-                    )
+        # Лучший промокод - с максимальной скидкой среди действующих
+        valid_results = [result for result in results if result.valid]
+        best = max(valid_results, key=lambda result: result.discount_amount or 0.0) if valid_results else None
         
-        return PromoCodeCheckResponse(
-            valid=True,
-            discount_type=promo_code.discount_type,
-            discount_value=promo_code.discount_value,
-            discount_amount=discount_amount,
-            min_order_amount=promo_code.min_order_amount,
-            description=promo_code.description,
-            free_item_sku=free_item_sku,
-            free_item_name=free_item_name,
-            message="Промокод применен успешно"
+        return PromoCodeBatchCheckResponse(
+            results=results,
+            best_code=best.code if best else None
         )
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка проверки промокода: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка проверки промокодов: {str(e)}")
+
+# Pydantic models for cart evaluation
+class CartItemRequest(BaseModel):
+    product_id: int
+    quantity: int
+    color: Optional[str] = None
+    memory: Optional[str] = None
+    sim: Optional[str] = None
+    ram: Optional[str] = None
+
+class CartEvaluateRequest(BaseModel):
+    items: List[CartItemRequest]
+    promo_code: Optional[str] = None
+
+class CartLineResponse(BaseModel):
+    product_id: int
+    sku: Optional[str] = None
+    name: Optional[str] = None
+    quantity: int
+    price: float
+    old_price: float
+    line_total: float
+    available: bool
+    message: Optional[str] = None
+
+class CartEvaluateResponse(BaseModel):
+    valid: bool  # Все позиции доступны и имеют цену - выдана котировка
+    lines: List[CartLineResponse]
+    subtotal: float
+    discount_amount: float
+    final_total: float
+    promo: Optional[PromoCodeCheckResponse] = None
+    quote: Optional[str] = None
+    quote_expires_at: Optional[int] = None  # Unix time; нет котировки - заказ по суммам клиента (total)
+    message: Optional[str] = None
+
+@app.post("/cart/evaluate", response_model=CartEvaluateResponse)
+async def evaluate_cart_endpoint(request: CartEvaluateRequest, db: Session = Depends(get_db)):
+    """
+    Рассчитать корзину по текущим ценам: суммы позиций, скидка по промокоду и итог
+    Если все позиции доступны, в ответе котировка для POST /orders (действует Config.CART_QUOTE_TTL_SECONDS)
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Корзина пуста")
+    if len(request.items) > Config.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Слишком много позиций в корзине (максимум {Config.BATCH_MAX_ITEMS})")
+    
+    try:
+        return CartEvaluateResponse(**evaluate_cart(db, request.items, request.promo_code))
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка расчета корзины: {str(e)}")
 
 @app.post("/orders", response_model=OrderResponse)
 async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
-    """Создать новый заказ"""
+    """
+    Создать новый заказ
+    С quote (POST /cart/evaluate) цены, скидка и итог берутся из котировки без пересчета;
+    котировка просрочена или не совпадает с составом заказа - 409, корзину нужно пересчитать
+    """
+    quote = None
+    if order_data.quote:
+        try:
+            quote = verify_quote(order_data.quote, order_data.items, order_data.promo_code)
+        except InvalidQuote as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    elif order_data.total is None:
+        raise HTTPException(status_code=400, detail="Не указана сумма заказа")
+    
     try:
-        # Генерируем номер заказа
+        # Генерируем номер заказа (атомарный счетчик вместо COUNT по таблице orders)
         from datetime import datetime as dt
-        order_number = f"ORD-{dt.now().strftime('%Y%m%d%H%M%S')}-{db.query(Order).count() + 1}"
+        order_number = allocate_order_number(db)
         
         # Парсим delivery_datetime если указан
         delivery_datetime = None
@@ -3025,15 +3341,25 @@ async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
             except:
                 pass
         
-        # Обновляем счетчик использований промокода, если он применен
-        if order_data.promo_code:
-            promo_code = db.query(PromoCode).filter(PromoCode.code == order_data.promo_code.upper()).first()
-            if promo_code:
-                promo_code.used_count += 1
+        # Суммы из котировки (промокод - только если по нему посчитана скидка) или от клиента
+        if quote:
+            promo_code = quote["promo_code"]
+            total = quote["subtotal"]
+            discount_amount = quote["discount"]
+            final_total = quote["final_total"]
+        else:
+            promo_code = order_data.promo_code
+            total = order_data.total
+            discount_amount = order_data.discount_amount or 0.0
+            final_total = max(0, total - discount_amount)
         
-        # Рассчитываем конечную цену заказа
-        discount_amount = order_data.discount_amount or 0.0
-        final_total = max(0, order_data.total - discount_amount)
+        # Обновляем счетчик использований промокода, если он применен
+        # Условный UPDATE не даст превысить usage_limit при параллельных заказах
+        if promo_code:
+            try:
+                consume_promo_code(db, promo_code)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
         # Создаем заказ
         order = Order(
@@ -3047,8 +3373,8 @@ async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
             delivery_option=order_data.shipping.delivery_option,
             pickup_address=order_data.shipping.pickup_address,
             delivery_datetime=delivery_datetime,
-            total=order_data.total,
-            promo_code=order_data.promo_code,
+            total=total,
+            promo_code=promo_code,
             discount_amount=discount_amount,
             final_total=final_total,
             status="new"
@@ -3058,12 +3384,12 @@ async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
         db.flush()  # Получаем ID заказа
         
         # Создаем товары заказа
-        for item_data in order_data.items:
+        for index, item_data in enumerate(order_data.items):
             order_item = OrderItem(
                 order_id=order.id,
                 product_id=item_data.product_id,
                 product_name=item_data.name,
-                price=item_data.price,
+                price=quote["prices"][index] if quote else item_data.price,
                 quantity=item_data.quantity,
                 color=item_data.color or None,
                 memory=item_data.memory or None,
@@ -3072,11 +3398,20 @@ async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
             )
             db.add(order_item)
         
+        # Формируем ответ до commit: refresh после commit снова занимал бы
+        # соединение из пула до закрытия сессии
+        response = OrderResponse.model_validate(order)
         db.commit()
-        db.refresh(order)
         
-        return order
+        # used_count изменился в обход ORM - сбрасываем кэш правил промокодов
+        if promo_code:
+            promo_engine.invalidate()
+        
+        return response
         
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка создания заказа: {str(e)}")
@@ -3088,43 +3423,44 @@ class ImageUpdateRequest(BaseModel):
     color: str
     images: List[str]  # Список URL изображений
 
+def image_records(product_images: List[ProductImage], enricher: Optional[ProductEnricher] = None) -> List[dict]:
+    """Записи /api/images для пачки ProductImage (enricher не нужен - сигнатура как у остальных потоковых строк)"""
+    result = []
+    for img in product_images:
+        try:
+            images_data = json.loads(img.img_list) if img.img_list else []
+            image_urls = []
+            
+            for img_data in images_data:
+                if isinstance(img_data, dict):
+                    image_urls.append(img_data.get("url", ""))
+                elif isinstance(img_data, str):
+                    image_urls.append(img_data)
+        except (json.JSONDecodeError, TypeError):
+            image_urls = []
+        
+        result.append({
+            "id": img.id,
+            "level_2": img.level_2,
+            "color": img.color,
+            "images": image_urls,
+            "created_at": img.created_at.isoformat() if img.created_at else None,
+            "updated_at": img.updated_at.isoformat() if img.updated_at else None
+        })
+    return result
+
 @app.get("/api/images")
-async def get_all_images(db: Session = Depends(get_db)):
-    """Получить все изображения товаров"""
+async def get_all_images(request: Request, stream: bool = False, db: Session = Depends(get_db)):
+    """
+    Получить все изображения товаров
+    ?stream=1 или Accept: application/x-ndjson - по одной записи на строку (без обертки {"success", "images"})
+    """
+    if wants_ndjson(request, stream):
+        return ndjson_response(stream_query_chunks(select(ProductImage).order_by(ProductImage.id), image_records))
+    
     try:
         product_images = db.query(ProductImage).all()
-        result = []
-        
-        for img in product_images:
-            try:
-                images_data = json.loads(img.img_list) if img.img_list else []
-                image_urls = []
-                
-                for img_data in images_data:
-                    if isinstance(img_data, dict):
-                        image_urls.append(img_data.get("url", ""))
-                    elif isinstance(img_data, str):
-                        image_urls.append(img_data)
-                
-                result.append({
-                    "id": img.id,
-                    "level_2": img.level_2,
-                    "color": img.color,
-                    "images": image_urls,
-                    "created_at": img.created_at.isoformat() if img.created_at else None,
-                    "updated_at": img.updated_at.isoformat() if img.updated_at else None
-                })
-            except (json.JSONDecodeError, TypeError):
-                result.append({
-                    "id": img.id,
-                    "level_2": img.level_2,
-                    "color": img.color,
-                    "images": [],
-                    "created_at": img.created_at.isoformat() if img.created_at else None,
-                    "updated_at": img.updated_at.isoformat() if img.updated_at else None
-                })
-        
-        return {"success": True, "images": result}
+        return {"success": True, "images": image_records(product_images)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения изображений: {str(e)}")
 
@@ -3260,4 +3596,4 @@ async def delete_image(image_id: int, db: Session = Depends(get_db)):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=Config.HOST, port=Config.PORT)
+    uvicorn.run(app, host=Config.HOST, port=Config.PORT, timeout_graceful_shutdown=Config.GRACEFUL_SHUTDOWN_SECONDS)
@@ -5,15 +5,14 @@ Main application entry point with quick start features
 """
 
 import asyncio
+import argparse
 import threading
 import signal
 import sys
 import os
 import time
 from config import Config
-from database import init_database
-from init_db_for_production import create_full_product_catalog
-from init_promo_codes import init_promo_codes
+from startup import run_startup
 # from telegram_bot import ElectronicsStoreBot  # Отключено для тестирования
 import uvicorn
 from api import app
@@ -87,7 +86,8 @@ class ElectronicsStoreApp:
             app=app,
             host=host,
             port=port,
-            log_level="info"
+            log_level="info",
+            timeout_graceful_shutdown=Config.GRACEFUL_SHUTDOWN_SECONDS
         )
         self.api_server = uvicorn.Server(config)
         
@@ -120,17 +120,8 @@ class ElectronicsStoreApp:
         # Setup signal handlers
         self.setup_signal_handlers()
         
-        # Initialize database
-        print("Initializing database...")
-        init_database()
-        
-        # Create full product catalog for production
-        print("Creating full product catalog...")
-        create_full_product_catalog()
-        
-        # Initialize promo codes
-        print("Initializing promo codes...")
-        init_promo_codes()
+        # Initialize database, catalog and promo codes (skipped when schema/seed version is current)
+        run_startup()
         
         # Start components
         api_thread = self.start_api_server()
@@ -156,6 +147,26 @@ class ElectronicsStoreApp:
         except KeyboardInterrupt:
             self.shutdown()
     
+    def run_workers(self, workers: int):
+        """
+        Run the API in several uvicorn worker processes
+        Database initialization runs once here, so workers start without seeding;
+        api is already imported by this module (preload), so import errors surface before forking.
+        Worker caches stay consistent through shared versions (cache_coherence.py).
+        """
+        print(f"🛍️  Starting Yo Store API with {workers} workers...")
+        run_startup()
+        
+        port = int(os.environ.get('PORT', Config.PORT))
+        host = os.environ.get('HOST', Config.HOST)
+        print(f"📱 API Server: http://{host}:{port} ({workers} workers)")
+        print("🤖 Telegram Bot: not started in multi-worker mode")
+        
+        uvicorn.run(
+            "api:app", host=host, port=port, workers=workers, log_level="info",
+            timeout_graceful_shutdown=Config.GRACEFUL_SHUTDOWN_SECONDS
+        )
+    
     def shutdown(self):
         """Shutdown the application gracefully"""
         if not self.running:
@@ -173,6 +184,10 @@ class ElectronicsStoreApp:
 
 def main():
     """Main function with quick start checks"""
+    parser = argparse.ArgumentParser(description="Yo Store Mini App")
+    parser.add_argument('--workers', type=int, default=Config.WORKERS, help='API worker processes (default: WEB_CONCURRENCY or 1)')
+    args = parser.parse_args()
+    
     print("🛍️  Yo Store Mini App - Quick Start")
     print("=" * 50)
     
@@ -196,7 +211,10 @@ def main():
     # Create and run the application
     try:
         app = ElectronicsStoreApp()
-        app.run()
+        if args.workers > 1:
+            app.run_workers(args.workers)
+        else:
+            app.run()
     except KeyboardInterrupt:
         print("\n👋 Application stopped by user")
     except Exception as e:
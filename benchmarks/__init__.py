@@ -0,0 +1,11 @@
+"""
+Бенчмарки Yo Store
+
+- generate_data: детерминированный синтетический каталог (1k/10k/100k SKU) в текущей схеме БД
+- run_scenarios: прогон сессий WebApp внутри процесса с параллельностью и JSON отчет (p50/p95/p99)
+
+Пример:
+    python -m benchmarks.generate_data --scale 10k --out bench_data/10k
+    python -m benchmarks.run_scenarios --data bench_data/10k --sessions 200 --concurrency 20 --output baseline.json
+    python -m benchmarks.run_scenarios --data bench_data/10k --compare baseline.json
+"""
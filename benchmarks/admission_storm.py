@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк контроля допуска: время оформления заказа во время "шторма" выгрузок
+
+Запускает uvicorn с одним воркером на копии бенчмарк-данных и замеряет POST /orders
+(один покупатель, заказы подряд) сначала без нагрузки, затем пока несколько клиентов
+без пауз запрашивают /export-products, /export-prices, /api/excel/export/products и /all-products.
+Прогон повторяется с включенным и выключенным контролем допуска (ADMISSION_CONTROL_ENABLED);
+для шторма печатаются ответы по статусам (200 / 429 / 503).
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import httpx
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from stress_test_orders import find_free_port, build_order
+
+STORM_PATHS = ("/export-products", "/export-prices", "/api/excel/export/products", "/all-products")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def describe(name: str, latencies) -> str:
+    if not latencies:
+        return f"  {name}: нет заказов"
+    return (
+        f"  {name}: {len(latencies)} заказов, p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+        f"p95 {percentile(latencies, 95) * 1000:.1f} мс, p99 {percentile(latencies, 99) * 1000:.1f} мс, "
+        f"max {max(latencies) * 1000:.1f} мс"
+    )
+
+
+async def checkout(client: httpx.AsyncClient, product_id: int, seconds: float, statuses: Counter):
+    """Заказы подряд в течение seconds секунд; время каждого ответа"""
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    index = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.post("/orders", json=build_order(index, product_id))
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+        index += 1
+    return latencies
+
+
+async def storm(client: httpx.AsyncClient, index: int, stop: asyncio.Event, statuses: Counter):
+    """Один клиент выгрузок: запросы без пауз; 429/503 - повтор после короткой паузы"""
+    while not stop.is_set():
+        try:
+            response = await client.get(STORM_PATHS[index % len(STORM_PATHS)])
+            statuses[response.status_code] += 1
+            if response.status_code in (429, 503):
+                await asyncio.sleep(0.2)
+        except httpx.HTTPError:
+            statuses["error"] += 1
+        index += 1
+
+
+async def run_mode(base_url: str, product_id: int, args):
+    timeout = httpx.Timeout(120)
+    limits = httpx.Limits(max_connections=args.storm_clients + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client, \
+            httpx.AsyncClient(base_url=base_url, timeout=timeout) as customer:
+        order_statuses = Counter()
+        await checkout(customer, product_id, 2, order_statuses)  # прогрев
+        baseline = await checkout(customer, product_id, args.seconds, order_statuses)
+
+        stop = asyncio.Event()
+        storm_statuses = Counter()
+        storm_tasks = [asyncio.create_task(storm(client, index, stop, storm_statuses)) for index in range(args.storm_clients)]
+        await asyncio.sleep(1)
+        loaded = await checkout(customer, product_id, args.seconds, order_statuses)
+        stop.set()
+        await asyncio.gather(*storm_tasks)
+
+    return baseline, loaded, storm_statuses, order_statuses
+
+
+def start_server(port: int, enabled: bool):
+    env = dict(os.environ, ADMISSION_CONTROL_ENABLED='true' if enabled else 'false')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--timeout-graceful-shutdown', '5'],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Сервер не запустился")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время оформления заказа во время шторма выгрузок")
+    parser.add_argument('--data', required=True, help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--storm-clients', type=int, default=8, help='Клиентов, запрашивающих выгрузки')
+    parser.add_argument('--seconds', type=float, default=15, help='Длительность каждой фазы замера, с')
+    parser.add_argument('--modes', default='on,off', help='Режимы контроля допуска: on, off или on,off')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='admission_')
+    shutil.copy(os.path.join(args.data, 'bench.db'), os.path.join(work_dir, 'bench.db'))
+    shutil.copy(os.path.join(args.data, 'prices.json'), os.path.join(work_dir, 'prices.json'))
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['PRICES_FILE'] = os.path.join(work_dir, 'prices.json')
+    os.chdir(PROJECT_DIR)
+
+    from sqlalchemy import create_engine, text
+    from models import Base
+    engine = create_engine(os.environ['DATABASE_URL'])
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        product_id = conn.execute(text("SELECT id FROM products ORDER BY id LIMIT 1")).scalar_one()
+    engine.dispose()
+
+    report = [f"Шторм: {args.storm_clients} клиентов ({', '.join(STORM_PATHS)}), фазы по {args.seconds:.0f} с"]
+    try:
+        for mode in args.modes.split(','):
+            server, base_url = start_server(find_free_port(), mode == 'on')
+            try:
+                baseline, loaded, storm_statuses, order_statuses = asyncio.run(run_mode(base_url, product_id, args))
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+                    server.wait()
+            report.append(f"Контроль допуска: {'включен' if mode == 'on' else 'выключен'}")
+            report.append(describe("без нагрузки", baseline))
+            report.append(describe("во время шторма", loaded))
+            report.append(f"  заказы по статусам: {dict(order_statuses)}")
+            report.append(f"  выгрузки по статусам: {dict(storm_statuses)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк Telegram бота: сколько апдейтов в секунду обрабатывают хендлеры
+
+Bot API заменен локальной заглушкой (benchmarks.fake_telegram), каталог берется
+напрямую из процесса (BOT_API_MODE=local) или из запущенного API (--mode remote --api-url).
+Смесь апдейтов: /categories, нажатия кнопок категорий, /search.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import contextlib
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+SEARCH_TERMS = ["iphone", "pro", "macbook", "watch", "airpods", "galaxy", "16", "256"]
+
+
+def build_updates(application, count: int, chats: int, categories, seed: int):
+    from benchmarks.fake_telegram import message_update, callback_update
+
+    rng = random.Random(seed)
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = 1000 + rng.randrange(chats)
+        roll = rng.random()
+        if roll < 0.4:
+            updates.append(message_update(application, update_id, chat_id, "/categories"))
+        elif roll < 0.8:
+            updates.append(callback_update(application, update_id, chat_id, f"cat:{rng.choice(categories)}"))
+        else:
+            updates.append(message_update(application, update_id, chat_id, f"/search {rng.choice(SEARCH_TERMS)}"))
+    return updates
+
+
+async def run(args):
+    from benchmarks.fake_telegram import FakeBotAPI, build_application, process_updates
+    from bot_service import LocalCatalogService, RemoteCatalogService
+    from telegram_bot import ElectronicsStoreBot
+
+    catalog = RemoteCatalogService(args.api_url) if args.mode == "remote" else LocalCatalogService()
+    bot = ElectronicsStoreBot(catalog_service=catalog)
+    if args.no_cache:
+        bot.cache.ttl = 0
+
+    fake_api = FakeBotAPI(latency=args.telegram_latency_ms / 1000)
+    application = build_application(bot, fake_api)
+    await application.initialize()
+
+    categories = [category["level_0"] for category in await bot.catalog.get_categories()]
+    updates = build_updates(application, args.updates, args.chats, categories, args.seed)
+
+    started = time.perf_counter()
+    latencies = await process_updates(application, updates, args.concurrency)
+    duration = time.perf_counter() - started
+
+    await application.shutdown()
+
+    latencies.sort()
+    return [
+        f"🤖 Режим каталога: {args.mode}, кэш по чатам: {'выкл' if args.no_cache else 'вкл'}, "
+        f"задержка Bot API: {args.telegram_latency_ms} мс",
+        f"⏱  {len(updates)} апдейтов за {duration:.2f} c: {len(updates) / duration:.1f} апдейтов/с",
+        f"   p50={statistics.median(latencies) * 1000:.1f} мс, "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс, max={latencies[-1] * 1000:.1f} мс",
+        f"   кэш: попаданий {bot.cache.hits}, промахов {bot.cache.misses}; вызовы Bot API: {fake_api.calls}",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки апдейтов Telegram бота")
+    parser.add_argument('--mode', choices=['local', 'remote'], default='local', help='Доступ к каталогу')
+    parser.add_argument('--api-url', default='http://127.0.0.1:8000', help='Адрес API для --mode remote')
+    parser.add_argument('--data', help='Папка бенчмарк-данных (bench.db, prices.json) для --mode local')
+    parser.add_argument('--updates', type=int, default=1000, help='Количество апдейтов')
+    parser.add_argument('--chats', type=int, default=50, help='Количество разных чатов')
+    parser.add_argument('--concurrency', type=int, default=32, help='Одновременно обрабатываемых апдейтов')
+    parser.add_argument('--telegram-latency-ms', type=float, default=0.0, help='Имитация задержки Bot API')
+    parser.add_argument('--no-cache', action='store_true', help='Отключить кэш ответов по чатам')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--show-app-output', action='store_true', help='Не глушить print() приложения')
+    args = parser.parse_args()
+
+    if args.data:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(os.path.join(args.data, 'bench.db'))}"
+        os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, 'prices.json'))
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    quiet = open(os.devnull, 'w') if not args.show_app_output else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        import logging
+        logging.getLogger("telegram_bot").setLevel(logging.WARNING)
+        report = asyncio.run(run(args))
+    if quiet:
+        quiet.close()
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк серверного расчета корзины: POST /cart/evaluate и заказ по котировке
+
+Запускает uvicorn на копии бенчмарк-данных и сравнивает два способа оформления корзины
+из --items позиций с промокодом:
+- прежний: /promo-codes/check с суммой, посчитанной клиентом, затем /orders с его total;
+- котировка: /cart/evaluate (цены, скидка, итог и котировка за один вызов), затем /orders с quote.
+Затем проверяет устаревшие цены: цена позиции меняется после того, как клиент ее запомнил;
+печатается, с какой ценой и суммой каждый способ сохранил заказ, и что просроченная
+или не совпадающая с заказом котировка отклоняется (409).
+"""
+
+import os
+import sys
+import time
+import shutil
+import secrets
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from stress_test_orders import find_free_port
+
+PROMO_CODE = "BENCHQUOTE"
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def describe(name: str, latencies) -> str:
+    return (
+        f"  {name}: {len(latencies)} оформлений, p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+        f"p95 {percentile(latencies, 95) * 1000:.1f} мс, max {max(latencies) * 1000:.1f} мс"
+    )
+
+
+def start_server(port: int):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=PROJECT_DIR, env=dict(os.environ), stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Сервер не запустился")
+
+
+def customer(index: int) -> dict:
+    return {
+        "customer": {"name": f"Quote {index}", "contact_method": "telegram", "contact_value": f"@quote{index}"},
+        "shipping": {"type": "pickup"},
+    }
+
+
+def order_items(cart):
+    return [{"product_id": item["product_id"], "name": item["name"], "price": item["price"], "quantity": item["quantity"]}
+            for item in cart]
+
+
+def checkout_legacy(client: httpx.Client, cart, index: int) -> dict:
+    """Как WebApp до /cart/evaluate: сумма из запомненных цен, скидка - /promo-codes/check"""
+    subtotal = sum(item["price"] * item["quantity"] for item in cart)
+    promo = client.post("/promo-codes/check", json={
+        "code": PROMO_CODE, "cart_total": subtotal, "items": order_items(cart),
+    }).json()
+    response = client.post("/orders", json={
+        **customer(index), "items": order_items(cart), "total": subtotal,
+        "promo_code": PROMO_CODE, "discount_amount": promo.get("discount_amount") or 0.0,
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def checkout_quote(client: httpx.Client, cart, index: int) -> dict:
+    """Расчет корзины на сервере и заказ по котировке"""
+    evaluation = client.post("/cart/evaluate", json={
+        "items": [{"product_id": item["product_id"], "quantity": item["quantity"]} for item in cart],
+        "promo_code": PROMO_CODE,
+    }).json()
+    response = client.post("/orders", json={
+        **customer(index), "items": order_items(cart), "promo_code": PROMO_CODE, "quote": evaluation["quote"],
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def saved_order(engine, order_id: int):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        total, discount, final_total = conn.execute(
+            text("SELECT total, discount_amount, final_total FROM orders WHERE id = :id"), {"id": order_id}
+        ).one()
+        first_price = conn.execute(
+            text("SELECT price FROM order_items WHERE order_id = :id ORDER BY id LIMIT 1"), {"id": order_id}
+        ).scalar_one()
+    return first_price, total, discount, final_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оформление корзины: клиентский расчет и котировка /cart/evaluate")
+    parser.add_argument('--data', required=True, help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--items', type=int, default=5, help='Позиций в корзине')
+    parser.add_argument('--checkouts', type=int, default=300, help='Оформлений каждым способом')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='cart_quote_')
+    shutil.copy(os.path.join(args.data, 'bench.db'), os.path.join(work_dir, 'bench.db'))
+    shutil.copy(os.path.join(args.data, 'prices.json'), os.path.join(work_dir, 'prices.json'))
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['PRICES_FILE'] = os.path.join(work_dir, 'prices.json')
+    # С ключом по умолчанию котировки отключены
+    os.environ['SECRET_KEY'] = secrets.token_urlsafe(32)
+    os.chdir(PROJECT_DIR)
+
+    from sqlalchemy import create_engine, text
+    from models import Base
+    from price_storage import get_prices, set_price
+    engine = create_engine(os.environ['DATABASE_URL'])
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM promo_codes WHERE code = :code"), {"code": PROMO_CODE})
+        conn.execute(text("""
+            INSERT INTO promo_codes (code, discount_type, discount_value, min_order_amount,
+                                     is_active, usage_limit, used_count, description)
+            VALUES (:code, 'percentage', 5.0, 0.0, 1, NULL, 0, 'Cart quote benchmark')
+        """), {"code": PROMO_CODE})
+        rows = conn.execute(text("SELECT id, sku, name FROM products WHERE is_available = 1 ORDER BY id LIMIT 500")).all()
+    prices = get_prices([row.sku for row in rows])
+    cart = [
+        {"product_id": row.id, "sku": row.sku, "name": row.name, "price": prices[row.sku]["price"], "quantity": 1 + index % 2}
+        for index, row in enumerate(row for row in rows if row.sku in prices)
+    ][:args.items]
+
+    report = [f"Корзина: {len(cart)} позиций, промокод {PROMO_CODE} (5%)"]
+    server, base_url = start_server(find_free_port())
+    try:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            for index in range(20):  # прогрев
+                checkout_legacy(client, cart, index)
+                checkout_quote(client, cart, index)
+
+            timings = {"legacy": [], "quote": []}
+            for index in range(args.checkouts):
+                for name, checkout in (("legacy", checkout_legacy), ("quote", checkout_quote)):
+                    started = time.perf_counter()
+                    checkout(client, cart, index)
+                    timings[name].append(time.perf_counter() - started)
+            report.append("Оформление (2 запроса каждым способом):")
+            report.append(describe("клиентская сумма + /promo-codes/check", timings["legacy"]))
+            report.append(describe("/cart/evaluate + котировка", timings["quote"]))
+
+            started = time.perf_counter()
+            for _ in range(args.checkouts):
+                client.post("/cart/evaluate", json={
+                    "items": [{"product_id": item["product_id"], "quantity": item["quantity"]} for item in cart],
+                    "promo_code": PROMO_CODE,
+                }).raise_for_status()
+            report.append(f"  пересчет при изменении корзины (/cart/evaluate): "
+                          f"{(time.perf_counter() - started) / args.checkouts * 1000:.1f} мс на вызов")
+
+            # Цена первой позиции выросла после того, как клиент ее запомнил
+            stale_price = cart[0]["price"]
+            new_price = round(stale_price * 1.1, 2)
+            set_price(cart[0]["sku"], new_price)
+            report.append(f"Устаревшая цена: {cart[0]['sku']} {stale_price:.2f} -> {new_price:.2f}")
+            for name, checkout in (("прежний способ", checkout_legacy), ("котировка", checkout_quote)):
+                price, total, discount, final_total = saved_order(engine, checkout(client, cart, 0)["id"])
+                report.append(f"  {name}: цена в заказе {price:.2f}, сумма {total:.2f}, скидка {discount:.2f}, итог {final_total:.2f}")
+
+            evaluation = client.post("/cart/evaluate", json={
+                "items": [{"product_id": item["product_id"], "quantity": item["quantity"]} for item in cart],
+            }).json()
+            changed = client.post("/orders", json={**customer(0), "items": order_items(cart[1:]), "quote": evaluation["quote"]})
+            report.append(f"  котировка для другого состава корзины: {changed.status_code} {changed.json()['detail']}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        engine.dispose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
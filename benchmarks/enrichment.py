@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк эндпоинтов, собирающих товары с ценами, характеристиками, описаниями и изображениями
+
+/all-products, /search, /hierarchy/skus, /export-products и /export-prices вызываются
+внутри процесса (TestClient) на бенчмарк-данных. Для каждого эндпоинта - время ответа
+и количество SQL запросов (из заголовка Server-Timing, метрики включаются скриптом).
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import contextlib
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+ENDPOINTS = [
+    ("/all-products", {}),
+    ("/search", {"q": "a", "limit": 10000}),
+    ("/hierarchy/skus", {}),
+    ("/export-products", {}),
+    ("/export-prices", {}),
+]
+
+
+def db_queries(response) -> str:
+    """Количество SQL запросов из Server-Timing: db;dur=...;desc="N queries\""""
+    for part in response.headers.get("server-timing", "").split(","):
+        if part.strip().startswith("db;") and 'desc="' in part:
+            return part.split('desc="')[1].split(" ")[0]
+    return "?"
+
+
+def run(args):
+    from fastapi.testclient import TestClient
+    import api
+
+    client = TestClient(api.app)
+    report = []
+    for path, params in ENDPOINTS:
+        if args.only and path not in args.only:
+            continue
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(path, params=params)
+            durations.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path}: HTTP {response.status_code} {response.text[:200]}")
+        rows = len(response.json()) if response.headers.get("content-type", "").startswith("application/json") else None
+        size = f"{rows} строк" if rows is not None else f"{len(response.content) // 1024} КБ"
+        report.append(
+            f"{path:<18} {size:>12}  p50={statistics.median(durations) * 1000:8.1f} мс  "
+            f"max={max(durations) * 1000:8.1f} мс  SQL запросов: {db_queries(response)}"
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк массовой сборки товаров по эндпоинтам")
+    parser.add_argument('--data', help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--repeat', type=int, default=3, help='Замеров на эндпоинт')
+    parser.add_argument('--only', nargs='*', help='Только указанные эндпоинты (/all-products ...)')
+    args = parser.parse_args()
+
+    if args.data:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(os.path.join(args.data, 'bench.db'))}"
+        os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, 'prices.json'))
+    os.environ['METRICS_ENABLED'] = 'true'
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        report = run(args)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
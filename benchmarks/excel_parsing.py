@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк разбора листов Excel (ExcelHandler.*_from_dataframe) и сверка с построчным разбором
+
+Листы "Товары", "Цены" и "Изображения" генерируются с пустыми ячейками, нечисловыми ценами,
+битым и не-объектным JSON, остатками строками и т.п. Каждый лист разбирается прежним
+способом (DataFrame.iterrows, код ниже - копия прежних parse_*_excel) и по колонкам;
+результаты (или тексты ошибок с номерами строк) должны совпасть. Затем замеряется время
+обоих способов, с --xlsx - еще и полный путь с чтением файла.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import contextlib
+
+import pandas as pd
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+
+# --- Прежний построчный разбор (эталон) ---
+
+def legacy_products(df):
+    required_columns = ['Название товара*', 'Основная категория (level0)*', 'Подкатегория (level1)*', 'Детальная категория (level2)*', 'Цена*']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+    products, errors = [], []
+    for index, row in df.iterrows():
+        try:
+            if (pd.isna(row['Название товара*']) or pd.isna(row['Основная категория (level0)*']) or
+                    pd.isna(row['Подкатегория (level1)*']) or pd.isna(row['Детальная категория (level2)*'])):
+                continue
+            price_value = row['Цена*']
+            if pd.isna(price_value):
+                price_value = row.get('Цена', 0)
+                if pd.isna(price_value):
+                    price_value = 0
+            try:
+                price = float(price_value)
+            except (ValueError, TypeError):
+                price = 0
+            specifications = {}
+            if not pd.isna(row.get('Характеристики (JSON)', '')):
+                try:
+                    specifications = json.loads(str(row['Характеристики (JSON)']))
+                except json.JSONDecodeError:
+                    specifications = {}
+            color = specifications.get('color', '') if specifications else ''
+            disk = specifications.get('disk', specifications.get('memory', '')) if specifications else ''
+            ram = specifications.get('ram', '') if specifications else ''
+            sim_config = specifications.get('sim_config', specifications.get('sim_type', '')) if specifications else ''
+            products.append({
+                'sku': str(row.get('SKU товара', '')).strip() if not pd.isna(row.get('SKU товара', '')) else '',
+                'name': str(row['Название товара*']).strip(),
+                'description': str(row.get('Описание', '')).strip() if not pd.isna(row.get('Описание', '')) else '',
+                'level0': str(row['Основная категория (level0)*']).strip(),
+                'level1': str(row['Подкатегория (level1)*']).strip(),
+                'level2': str(row['Детальная категория (level2)*']).strip(),
+                'brand': str(row.get('Бренд', '')).strip() if not pd.isna(row.get('Бренд', '')) else '',
+                'price': price,
+                'currency': str(row.get('Валюта', 'RUB')).strip().upper() if not pd.isna(row.get('Валюта', 'RUB')) else 'RUB',
+                'stock': int(row.get('Количество на складе', 0)) if not pd.isna(row.get('Количество на складе', 0)) else 0,
+                'image_url': str(row.get('URL изображения (через запятую)', '')).strip() if not pd.isna(row.get('URL изображения (через запятую)', '')) else '',
+                'specifications': specifications,
+                'color': color,
+                'disk': disk,
+                'ram': ram,
+                'sim_config': sim_config
+            })
+        except Exception as e:
+            errors.append(f"Строка {index + 2}: {str(e)}")
+    if errors:
+        raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
+    return products
+
+
+def legacy_prices(df):
+    required_columns = ['SKU товара*', 'Новая цена*']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+    prices, errors = [], []
+    for index, row in df.iterrows():
+        try:
+            if pd.isna(row['SKU товара*']) or pd.isna(row['Новая цена*']):
+                continue
+            prices.append({
+                'sku': str(row['SKU товара*']).strip(),
+                'name': str(row.get('Название товара', '')).strip(),
+                'price': float(row['Новая цена*']),
+                'old_price': float(row.get('Старая цена', row['Новая цена*'])),
+                'currency': str(row.get('Валюта', 'RUB')).strip().upper()
+            })
+        except Exception as e:
+            errors.append(f"Строка {index + 2}: {str(e)}")
+    if errors:
+        raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
+    return prices
+
+
+def legacy_images(df):
+    required_columns = ['Модель (level_2)*', 'Цвет*', 'URL изображений (через запятую)*']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+    images, errors = [], []
+    for index, row in df.iterrows():
+        try:
+            if pd.isna(row['Модель (level_2)*']) or pd.isna(row['Цвет*']) or pd.isna(row['URL изображений (через запятую)*']):
+                continue
+            image_urls_str = str(row['URL изображений (через запятую)*']).strip()
+            if not image_urls_str:
+                continue
+            image_urls = [url.strip() for url in image_urls_str.split(',') if url.strip()]
+            if not image_urls:
+                continue
+            images.append({
+                'level_2': str(row['Модель (level_2)*']).strip(),
+                'color': str(row['Цвет*']).strip(),
+                'img_list': image_urls
+            })
+        except Exception as e:
+            errors.append(f"Строка {index + 2}: {str(e)}")
+    if errors:
+        raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
+    return images
+
+
+# --- Генерация листов ---
+
+COLORS = ["Black", "White", "Desert Titanium", " Pink ", "Ultramarine"]
+
+
+def maybe(rng, value, share=0.05, empty=None):
+    return empty if rng.random() < share else value
+
+
+def products_sheet(rows: int, rng, with_errors: bool, fallback_price: bool):
+    specs_variants = [
+        lambda: json.dumps({"color": rng.choice(COLORS), "disk": rng.choice(["128GB", "256GB"]), "sim_config": "eSIM"}),
+        lambda: json.dumps({"color": rng.choice(COLORS), "memory": "512GB", "sim_type": "SIM", "ram": 8}),
+        lambda: "{битый json",
+        lambda: "null",
+        lambda: "[]",
+        lambda: "0",
+        lambda: None,
+    ]
+    if with_errors:
+        specs_variants.append(lambda: '["a", "b"]')
+    stock_variants = [lambda: rng.randint(0, 50), lambda: None, lambda: float(rng.randint(0, 9)) + 0.5, lambda: " 7 "]
+    if with_errors:
+        stock_variants.append(lambda: "5.5")
+    data = []
+    for index in range(rows):
+        model = f"iPhone {rng.randint(13, 17)}"
+        price = rng.choice([rng.randrange(10000, 200000, 10), None, "abc", " 1500 ", True, "nan", 99.99])
+        row = {
+            'SKU товара': maybe(rng, rng.choice([f"sku{index:06d} ", index]), 0.1),
+            'Название товара*': maybe(rng, f"{model} {rng.choice(COLORS)}"),
+            'Описание': maybe(rng, "Описание", 0.5),
+            'Основная категория (level0)*': maybe(rng, "Смартфоны", 0.02),
+            'Подкатегория (level1)*': maybe(rng, "Apple", 0.02),
+            'Детальная категория (level2)*': maybe(rng, model, 0.02),
+            'Бренд': maybe(rng, " Apple ", 0.2),
+            'Цена*': price,
+            'Валюта': maybe(rng, rng.choice(["rub", "USD "]), 0.3),
+            'Количество на складе': rng.choice(stock_variants)(),
+            'URL изображения (через запятую)': maybe(rng, f"/img/{index}/1.jpg, /img/{index}/2.jpg", 0.3),
+            'Характеристики (JSON)': rng.choice(specs_variants)(),
+        }
+        if fallback_price:
+            row['Цена'] = rng.choice([rng.randrange(10000, 200000, 10), None, "bad"])
+        data.append(row)
+    return pd.DataFrame(data)
+
+
+def prices_sheet(rows: int, rng, with_errors: bool, optional_columns: bool):
+    price_variants = [lambda: rng.randrange(10000, 200000, 10), lambda: None, lambda: " 1200 ", lambda: 99.5]
+    if with_errors:
+        price_variants.append(lambda: "12,5")
+    data = []
+    for index in range(rows):
+        row = {
+            'SKU товара*': maybe(rng, rng.choice([f" sku{index:06d}", index])),
+            'Новая цена*': rng.choice(price_variants)(),
+        }
+        if optional_columns:
+            row['Название товара'] = maybe(rng, f"Товар {index}", 0.2)
+            row['Старая цена'] = maybe(rng, rng.randrange(10000, 200000, 10), 0.3)
+            row['Валюта'] = maybe(rng, " rub", 0.3)
+        data.append(row)
+    return pd.DataFrame(data)
+
+
+def images_sheet(rows: int, rng):
+    data = []
+    for index in range(rows):
+        data.append({
+            'Модель (level_2)*': maybe(rng, f" iPhone {index % 40} "),
+            'Цвет*': maybe(rng, rng.choice(COLORS)),
+            'URL изображений (через запятую)*': maybe(rng, rng.choice([
+                f"/img/{index}/1.jpg, /img/{index}/2.jpg,, /img/{index}/3.jpg",
+                "  ", ", ,", f"/img/{index}.jpg", index,
+            ])),
+        })
+    return pd.DataFrame(data)
+
+
+def outcome(function, df):
+    """Результат разбора или текст ошибки - в виде JSON для точного сравнения (0 и 0.0, NaN)"""
+    try:
+        return json.dumps(function(df), ensure_ascii=False, sort_keys=True)
+    except ValueError as e:
+        return f"ValueError: {e}"
+
+
+def check_equivalence(handler, rows: int, seed: int):
+    """Сверить разбор по колонкам с построчным на вариантах листов; возвращает количество проверенных листов"""
+    rng = random.Random(seed)
+    cases = []
+    for with_errors in (False, True):
+        for variant in (False, True):
+            cases.append(("Товары", legacy_products, handler.products_from_dataframe,
+                          products_sheet(rows, rng, with_errors, variant)))
+            cases.append(("Цены", legacy_prices, handler.prices_from_dataframe,
+                          prices_sheet(rows, rng, with_errors, variant)))
+    cases.append(("Изображения", legacy_images, handler.images_from_dataframe, images_sheet(rows, rng)))
+    cases.append(("Товары", legacy_products, handler.products_from_dataframe, products_sheet(0, rng, False, False)))
+    cases.append(("Товары", legacy_products, handler.products_from_dataframe, pd.DataFrame({'SKU товара': ["x"]})))
+
+    for sheet, legacy, vectorized, df in cases:
+        expected, actual = outcome(legacy, df), outcome(vectorized, df)
+        if expected != actual:
+            raise AssertionError(f"Лист {sheet}: результаты различаются\nбыло:  {expected[:500]}\nстало: {actual[:500]}")
+    return len(cases)
+
+
+def measure(function, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def run(args):
+    from excel_handler import ExcelHandler
+
+    handler = ExcelHandler()
+    report = [f"✅ Сверка с построчным разбором: {check_equivalence(handler, args.check_rows, args.seed)} листов совпадают"]
+
+    rng = random.Random(args.seed)
+    sheets = [
+        ("Товары", legacy_products, handler.products_from_dataframe, handler.parse_products_excel, products_sheet(args.rows, rng, False, False)),
+        ("Цены", legacy_prices, handler.prices_from_dataframe, handler.parse_prices_excel, prices_sheet(args.rows, rng, False, True)),
+        ("Изображения", legacy_images, handler.images_from_dataframe, handler.parse_images_excel, images_sheet(args.rows, rng)),
+    ]
+    report.append(f"⏱️ {args.rows} строк на лист, медиана {args.repeat} замеров")
+    for sheet, legacy, vectorized, parse_file, df in sheets:
+        legacy_ms = measure(lambda: legacy(df), args.repeat)
+        vectorized_ms = measure(lambda: vectorized(df), args.repeat)
+        line = f"   {sheet:<12} iterrows: {legacy_ms:8.1f} мс   по колонкам: {vectorized_ms:7.1f} мс  (x{legacy_ms / vectorized_ms:.1f})"
+        if args.xlsx:
+            content = io.BytesIO()
+            df.to_excel(content, sheet_name=sheet, index=False)
+            content = content.getvalue()
+            line += f"   с чтением xlsx: {measure(lambda: parse_file(content), 1):7.0f} мс"
+        report.append(line)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора листов Excel и сверка с построчным разбором")
+    parser.add_argument('--rows', type=int, default=20000, help='Строк в листе для замера')
+    parser.add_argument('--check-rows', type=int, default=2000, help='Строк в листах для сверки')
+    parser.add_argument('--repeat', type=int, default=3, help='Замеров')
+    parser.add_argument('--xlsx', action='store_true', help='Замерить и полный путь с чтением xlsx (медленно)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        report = run(args)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
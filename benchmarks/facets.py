@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк фасетного индекса (facet_index): построение масок и ответы на фильтры
+
+Сравниваются три операции на случайных комбинациях фильтров (цвет, память, SIM, бренд,
+диапазон цен): пересечение масок + группировка по моделям (search), полный набор
+счетчиков фасетов (facet_counts) и тот же фильтр перебором списка товаров в Python.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import contextlib
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+
+def percentile_line(latencies):
+    latencies = sorted(latencies)
+    return (f"p50={statistics.median(latencies) * 1e6:.0f} мкс, "
+            f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1e6:.0f} мкс, max={latencies[-1] * 1e6:.0f} мкс")
+
+
+def random_queries(index, count: int, seed: int):
+    """Случайные комбинации 1-3 фасетов (по 1-2 значения) и, через раз, диапазон цен"""
+    rng = random.Random(seed)
+    facets = [facet for facet in ("brand", "color", "disk", "sim", "ram") if index.bitsets.get(facet)]
+    prices = index._price_values
+    queries = []
+    for _ in range(count):
+        filters = {}
+        for facet in rng.sample(facets, rng.randint(1, min(3, len(facets)))):
+            values = list(index.bitsets[facet])
+            filters[facet] = rng.sample(values, min(len(values), rng.randint(1, 2)))
+        price_min = price_max = None
+        if prices and rng.random() < 0.5:
+            price_min, price_max = sorted(rng.sample(prices, 2)) if len(prices) > 1 else (prices[0], prices[0])
+        queries.append((filters, price_min, price_max))
+    return queries
+
+
+def scan(rows, prices, filters, price_min, price_max):
+    """Тот же фильтр перебором: для сравнения с масками"""
+    matched = 0
+    for row in rows:
+        if all(row.get(facet) in values for facet, values in filters.items()):
+            price = prices.get(row["sku"], {}).get('price', 0)
+            if price_min is not None and not (price > 0 and price >= price_min):
+                continue
+            if price_max is not None and not (price > 0 and price <= price_max):
+                continue
+            matched += 1
+    return matched
+
+
+def run(args):
+    from facet_index import facet_index, FACETS
+    from price_storage import get_all_prices
+
+    builds = []
+    for _ in range(args.rebuilds):
+        facet_index.invalidate()
+        started = time.perf_counter()
+        facet_index.ensure_fresh()
+        builds.append(time.perf_counter() - started)
+
+    price_rebuilds = []
+    for _ in range(args.rebuilds):
+        facet_index.invalidate_prices()
+        started = time.perf_counter()
+        facet_index.ensure_fresh()
+        price_rebuilds.append(time.perf_counter() - started)
+
+    masks = sum(len(values) for values in facet_index.bitsets.values())
+    report = [
+        f"🧱 Индекс: {facet_index.size} SKU, {len(facet_index.models)} моделей, {masks} масок",
+        f"   полное построение: p50={statistics.median(builds) * 1000:.1f} мс; только цены: p50={statistics.median(price_rebuilds) * 1000:.1f} мс",
+    ]
+
+    queries = random_queries(facet_index, args.queries, args.seed)
+
+    # Строки для перебора в том же виде, что у индекса (значение фасета по позиции)
+    rows = [{"sku": sku} for sku in facet_index.skus]
+    for facet, values in facet_index.bitsets.items():
+        for value, bits in values.items():
+            for position in range(facet_index.size):
+                if bits >> position & 1:
+                    rows[position][facet] = value
+    prices = get_all_prices()
+
+    searches, counts, scans = [], [], []
+    for filters, price_min, price_max in queries:
+        started = time.perf_counter()
+        facet_index.search(filters, price_min, price_max, sort="price")
+        searches.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        result = facet_index.facet_counts(filters, price_min, price_max)
+        counts.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        expected = scan(rows, prices, filters, price_min, price_max)
+        scans.append(time.perf_counter() - started)
+        if expected != result["total_skus"]:
+            raise AssertionError(f"Расхождение для {filters} {price_min}-{price_max}: {result['total_skus']} != {expected}")
+
+    report += [
+        f"🔎 {len(queries)} случайных фильтров ({len(FACETS)} фасетов), результаты совпадают с перебором",
+        f"   search (модели, sort=price): {percentile_line(searches)}",
+        f"   facet_counts (все счетчики): {percentile_line(counts)}",
+        f"   перебор в Python:            {percentile_line(scans)}",
+    ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк фасетного индекса")
+    parser.add_argument('--data', help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--queries', type=int, default=500, help='Количество случайных фильтров')
+    parser.add_argument('--rebuilds', type=int, default=5, help='Замеров построения индекса')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.data:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(os.path.join(args.data, 'bench.db'))}"
+        os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, 'prices.json'))
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        report = run(args)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Telegram Bot API для бенчмарков бота
+
+FakeBotAPI подменяет HTTP слой python-telegram-bot: запросы бота к api.telegram.org
+не уходят в сеть, а получают корректные ответы (с опциональной задержкой "сети").
+Апдейты создаются локально и подаются в Application.process_update.
+"""
+
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+FAKE_TOKEN = "123456:TEST-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Yo Store", "username": "yo_store_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": True}
+
+
+class FakeBotAPI(BaseRequest):
+    """Заглушка Bot API: считает вызовы по методам и возвращает минимальные валидные ответы"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.last_parameters: Dict[str, dict] = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        self.last_parameters[api_method] = parameters
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": parameters.get("chat_id", 1), "type": "private"},
+                "text": parameters.get("text", ""),
+            }
+        else:
+            # answerCallbackQuery, answerInlineQuery, deleteWebhook и т.п.
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def build_application(bot, fake_api: FakeBotAPI) -> Application:
+    """Application бота, подключенный к заглушке вместо api.telegram.org"""
+    builder = Application.builder().token(FAKE_TOKEN).request(fake_api).get_updates_request(fake_api)
+    return bot.build_application(builder)
+
+
+def _user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+
+
+def message_update(application: Application, update_id: int, chat_id: int, text: str) -> Update:
+    """Апдейт с текстовым сообщением (команды распознаются по entity bot_command)"""
+    entities = []
+    if text.startswith("/"):
+        entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": _user(chat_id),
+            "text": text,
+            "entities": entities,
+        },
+    }, application.bot)
+
+
+def callback_update(application: Application, update_id: int, chat_id: int, data: str) -> Update:
+    """Апдейт с нажатием inline кнопки"""
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }, application.bot)
+
+
+def inline_query_update(application: Application, update_id: int, user_id: int, query: str,
+                        offset: str = "") -> Update:
+    """Апдейт inline запроса (@bot <query>)"""
+    return Update.de_json({
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "query": query,
+            "offset": offset,
+        },
+    }, application.bot)
+
+
+async def process_updates(application: Application, updates: List[Update], concurrency: int) -> List[float]:
+    """Обработать апдейты не более чем по concurrency одновременно; вернуть время каждого"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[Optional[float]] = [None] * len(updates)
+
+    async def handle(index: int, update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies[index] = time.perf_counter() - started
+
+    await asyncio.gather(*(handle(index, update) for index, update in enumerate(updates)))
+    return latencies
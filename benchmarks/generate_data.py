@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетического каталога для бенчмарков
+
+Создает SQLite БД в текущей схеме (Category, Product, ProductImage, Level2Description,
+PromoCode, Order/OrderItem) и файл цен в формате price_storage.
+Результат полностью определяется seed и количеством SKU.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from models import Base, Category, Product, ProductImage, Level2Description, PromoCode, Order, OrderItem
+
+# Готовые масштабы каталога
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+
+DB_FILENAME = "bench.db"
+PRICES_FILENAME = "prices.json"
+MANIFEST_FILENAME = "manifest.json"
+
+# Фиксированная точка отсчета для created_at - одинаковые данные при каждом запуске
+BASE_TIME = datetime(2025, 1, 1, 12, 0, 0)
+
+COLORS = [
+    "Black", "White", "Silver", "Midnight", "Starlight", "Blue", "Deep Blue", "Teal",
+    "Pink", "Green", "Purple", "Titanium Desert", "Titanium Natural", "Cosmic Orange",
+]
+
+# level_0 -> (бренды, серии level_1, оси вариантов, значения осей, диапазон цен)
+CATALOG_LAYOUT = {
+    "Смартфоны": {
+        "brands": ["Apple", "Samsung", "Google", "Xiaomi"],
+        "series": ["15 Series", "16 Series", "17 Series", "Galaxy S", "Pixel", "Redmi Note"],
+        "models": ["", " Plus", " Pro", " Pro Max", " Mini"],
+        "axes": {
+            "color": COLORS,
+            "disk": ["128GB", "256GB", "512GB", "1TB"],
+            "sim_config": ["SIM + eSIM", "eSIM"],
+        },
+        "price_range": (40_000, 200_000),
+        "icon": "📱",
+    },
+    "Ноутбуки": {
+        "brands": ["Apple", "Asus", "Lenovo"],
+        "series": ["MacBook Air", "MacBook Pro", "ZenBook", "ThinkPad"],
+        "models": [" M3", " M4", " 14", " 16"],
+        "axes": {
+            "color": COLORS[:6],
+            "disk": ["256GB", "512GB", "1TB"],
+            "ram": ["8GB", "16GB", "24GB"],
+            "screen_size": ['13"', '15"'],
+        },
+        "price_range": (80_000, 400_000),
+        "icon": "💻",
+    },
+    "Планшеты": {
+        "brands": ["Apple", "Samsung"],
+        "series": ["iPad", "iPad Air", "iPad Pro", "Galaxy Tab"],
+        "models": ["", " 11", " 13"],
+        "axes": {
+            "color": COLORS[:5],
+            "disk": ["128GB", "256GB", "512GB"],
+            "sim_config": ["Wi-Fi", "Wi-Fi + Cellular"],
+        },
+        "price_range": (30_000, 180_000),
+        "icon": "📱",
+    },
+    "Умные часы": {
+        "brands": ["Apple", "Samsung", "Garmin"],
+        "series": ["Watch Series", "Watch Ultra", "Galaxy Watch", "Fenix"],
+        "models": [" 9", " 10", " 11"],
+        "axes": {
+            "color": COLORS[:8],
+            "screen_size": ["41mm", "45mm", "49mm"],
+            "band_size": ["S/M", "M/L"],
+        },
+        "price_range": (20_000, 120_000),
+        "icon": "⌚",
+    },
+    "Наушники": {
+        "brands": ["Apple", "Sony", "Bose"],
+        "series": ["AirPods", "WH", "QuietComfort"],
+        "models": [" 4", " Pro 2", " Max", " 1000XM5"],
+        "axes": {"color": COLORS[:6]},
+        "price_range": (8_000, 60_000),
+        "icon": "🎧",
+    },
+    "Игровые приставки": {
+        "brands": ["Sony", "Microsoft", "Nintendo"],
+        "series": ["PlayStation", "Xbox", "Switch"],
+        "models": [" 5", " 5 Pro", " Series X", " OLED"],
+        "axes": {"color": ["Black", "White"], "disk": ["512GB", "825GB", "1TB", "2TB"]},
+        "price_range": (30_000, 90_000),
+        "icon": "🎮",
+    },
+}
+
+# SKU, который используют промокоды вида free_item (как в init_promo_codes.py)
+ADAPTER_SKU = "adapter20w"
+
+
+def _sku_grid(axes: Dict[str, List[str]]) -> List[Dict[str, str]]:
+    """Декартово произведение значений осей в стабильном порядке"""
+    grid = [{}]
+    for axis, values in axes.items():
+        grid = [{**combo, axis: value} for combo in grid for value in values]
+    return grid
+
+
+def _model_axes(rng: random.Random, layout: Dict) -> Dict[str, List[str]]:
+    """Подмножество значений осей для одной модели (у разных моделей разные цвета/объемы)"""
+    axes = {}
+    for axis, values in layout["axes"].items():
+        count = rng.randint(min(2, len(values)), len(values)) if axis == "color" else rng.randint(1, len(values))
+        axes[axis] = sorted(rng.sample(values, count), key=values.index)
+    return axes
+
+
+def build_catalog(skus: int, seed: int) -> Tuple[List[Dict], List[Dict], List[Dict], List[Dict], Dict[str, Dict]]:
+    """
+    Построить строки каталога в памяти
+    Возвращает (categories, products, product_images, level2_descriptions, prices)
+    """
+    rng = random.Random(seed)
+    categories, products, images, descriptions = [], [], [], []
+    prices: Dict[str, Dict] = {}
+
+    level0_names = list(CATALOG_LAYOUT)
+    model_index = 0
+
+    while len(products) < skus:
+        level_0 = level0_names[model_index % len(level0_names)]
+        layout = CATALOG_LAYOUT[level_0]
+        brand = layout["brands"][model_index % len(layout["brands"])]
+        level_1 = layout["series"][(model_index // len(level0_names)) % len(layout["series"])]
+        level_2 = f"{brand} {level_1}{rng.choice(layout['models'])} Gen {model_index}"
+        base_price = rng.randrange(*layout["price_range"], 1000)
+
+        categories.append({
+            "level_0": level_0,
+            "level_1": level_1,
+            "level_2": level_2,
+            "description": f"Линейка {level_2}",
+            "icon": layout["icon"],
+        })
+        descriptions.append({
+            "level_2": level_2,
+            "description": f"{level_2} - синтетическая модель для нагрузочного тестирования.",
+            "details": json.dumps({
+                "Процессор": f"Chip {rng.randint(1, 20)}",
+                "Гарантия": "1 год",
+                "Вес": f"{rng.randint(100, 2500)} г",
+            }, ensure_ascii=False),
+            "created_at": BASE_TIME,
+            "updated_at": BASE_TIME,
+        })
+
+        axes = _model_axes(rng, layout)
+        for color in axes["color"]:
+            images.append({
+                "level_2": level_2,
+                "color": color,
+                "img_list": json.dumps([
+                    f"https://cdn.example.com/bench/{model_index}/{color.lower().replace(' ', '-')}/{n}.jpg"
+                    for n in range(1, rng.randint(2, 5) + 1)
+                ]),
+                "created_at": BASE_TIME,
+                "updated_at": BASE_TIME,
+            })
+
+        for variant_index, variant in enumerate(_sku_grid(axes)):
+            if len(products) >= skus:
+                break
+            sku = f"bench{model_index:05d}v{variant_index:03d}"
+            options = " ".join(v for k, v in variant.items() if k != "color")
+            products.append({
+                "sku": sku,
+                "name": f"{level_2} {options} {variant['color']}".replace("  ", " ").strip(),
+                "brand": brand,
+                "level_0": level_0,
+                "level_1": level_1,
+                "level_2": level_2,
+                "specifications": json.dumps(variant, ensure_ascii=False),
+                "stock": rng.randint(0, 50),
+                "is_available": rng.random() > 0.05,
+                "created_at": BASE_TIME,
+                "updated_at": BASE_TIME,
+            })
+
+            price = float(base_price + variant_index * 1500)
+            has_discount = rng.random() < 0.3
+            prices[sku] = {
+                "price": price,
+                "old_price": round(price * 1.15, -2) if has_discount else price,
+                "currency": "RUB",
+                "is_parse": rng.random() < 0.8,
+            }
+
+        model_index += 1
+
+    # Адаптер для промокодов free_item (не считается в размер каталога)
+    products.append({
+        "sku": ADAPTER_SKU,
+        "name": "Адаптер питания 20W",
+        "brand": "Apple",
+        "level_0": "Аксессуары",
+        "level_1": "Адаптеры",
+        "level_2": "Адаптер 20W",
+        "specifications": json.dumps({"color": "White"}),
+        "stock": 100,
+        "is_available": True,
+        "created_at": BASE_TIME,
+        "updated_at": BASE_TIME,
+    })
+    prices[ADAPTER_SKU] = {"price": 2990.0, "old_price": 2990.0, "currency": "RUB", "is_parse": False}
+    categories.append({"level_0": "Аксессуары", "level_1": "Адаптеры", "level_2": "Адаптер 20W",
+                       "description": "Аксессуары", "icon": "🔌"})
+
+    return categories, products, images, descriptions, prices
+
+
+def build_promo_codes() -> List[Dict]:
+    """Промокоды всех типов, которые проверяет сценарий"""
+    return [
+        {"code": "BENCH1000", "discount_type": "fixed", "discount_value": 1000.0, "min_order_amount": 5000.0,
+         "is_active": True, "used_count": 0, "description": "Бенчмарк: фиксированная скидка"},
+        {"code": "BENCH10", "discount_type": "percentage", "discount_value": 10.0, "min_order_amount": 0.0,
+         "is_active": True, "used_count": 0, "description": "Бенчмарк: процентная скидка"},
+        {"code": "BENCHADAPTER", "discount_type": "free_item", "discount_value": 0.0, "min_order_amount": 0.0,
+         "free_item_sku": ADAPTER_SKU, "free_item_condition": json.dumps({"category": "Смартфоны"}, ensure_ascii=False),
+         "is_active": True, "used_count": 0, "description": "Бенчмарк: адаптер в подарок"},
+    ]
+
+
+def build_orders(rng: random.Random, products: List[Dict], prices: Dict[str, Dict], count: int):
+    """Исторические заказы (нужны для /api/orders и нумерации)"""
+    orders, items = [], []
+    statuses = ["new", "processing", "completed", "cancelled"]
+    for order_id in range(1, count + 1):
+        created_at = BASE_TIME + timedelta(minutes=order_id * 7)
+        total = 0.0
+        for _ in range(rng.randint(1, 3)):
+            product_id = rng.randrange(len(products)) + 1
+            product = products[product_id - 1]
+            price = prices[product["sku"]]["price"]
+            quantity = rng.randint(1, 2)
+            total += price * quantity
+            items.append({
+                "order_id": order_id,
+                "product_id": product_id,
+                "product_name": product["name"],
+                "price": price,
+                "quantity": quantity,
+                "color": json.loads(product["specifications"]).get("color"),
+                "created_at": created_at,
+            })
+        orders.append({
+            "id": order_id,
+            "order_number": f"ORD-BENCH-{order_id}",
+            "customer_name": f"Покупатель {order_id}",
+            "contact_method": "telegram",
+            "contact_value": f"@bench{order_id}",
+            "shipping_type": rng.choice(["delivery", "pickup"]),
+            "total": total,
+            "discount_amount": 0.0,
+            "final_total": total,
+            "status": rng.choice(statuses),
+            "created_at": created_at,
+            "updated_at": created_at,
+        })
+    return orders, items
+
+
+def generate(out_dir: str, skus: int, seed: int = 42, orders: int = None) -> Dict:
+    """Сгенерировать БД и файл цен в out_dir, вернуть манифест"""
+    os.makedirs(out_dir, exist_ok=True)
+    db_path = os.path.abspath(os.path.join(out_dir, DB_FILENAME))
+    prices_path = os.path.abspath(os.path.join(out_dir, PRICES_FILENAME))
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    categories, products, images, descriptions, prices = build_catalog(skus, seed)
+    order_rows, order_items = build_orders(random.Random(seed + 1), products, prices,
+                                           orders if orders is not None else max(100, skus // 10))
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+
+    # Пакетные INSERT через Core - ORM для 100k строк слишком медленный
+    with engine.begin() as conn:
+        conn.execute(Category.__table__.insert(), categories)
+        conn.execute(Product.__table__.insert(), products)
+        conn.execute(ProductImage.__table__.insert(), images)
+        conn.execute(Level2Description.__table__.insert(), descriptions)
+        conn.execute(PromoCode.__table__.insert(), build_promo_codes())
+        conn.execute(Order.__table__.insert(), order_rows)
+        conn.execute(OrderItem.__table__.insert(), order_items)
+    engine.dispose()
+
+    with open(prices_path, 'w', encoding='utf-8') as f:
+        json.dump(prices, f, ensure_ascii=False, indent=2)
+
+    manifest = {
+        "skus": skus,
+        "seed": seed,
+        "database": DB_FILENAME,
+        "prices_file": PRICES_FILENAME,
+        "counts": {
+            "products": len(products),
+            "models": len(descriptions),
+            "product_images": len(images),
+            "categories": len(categories),
+            "orders": len(order_rows),
+            "order_items": len(order_items),
+        },
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_scale(value: str) -> int:
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетический каталог для бенчмарков")
+    parser.add_argument('--scale', type=parse_scale, default=SCALES["1k"], help='Количество SKU: 1k, 10k, 100k или число')
+    parser.add_argument('--out', required=True, help='Папка для bench.db, prices.json и manifest.json')
+    parser.add_argument('--seed', type=int, default=42, help='Seed генератора')
+    parser.add_argument('--orders', type=int, default=None, help='Количество заказов (по умолчанию skus/10)')
+    args = parser.parse_args()
+
+    manifest = generate(args.out, args.scale, args.seed, args.orders)
+    print(f"✅ Каталог создан в {args.out}: {json.dumps(manifest['counts'], ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
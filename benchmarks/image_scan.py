@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк проверки ссылок на изображения (image_integrity.scan_images)
+
+На копии бенчмарк-данных ссылки ProductImage.img_list переписываются на локальные файлы
+/static/images/products/..., которые создаются во временной папке static; часть файлов
+намеренно отсутствует, пуста, слишком велика или повторяет другой файл. Замеряются:
+- последовательная проверка (1 поток) и пул потоков, оба без кэша;
+- повторный запуск с кэшем и после изменения части файлов;
+- проверка внешних URL заглушкой с задержкой (имитация сети) - 1 поток и пул.
+Печатается, совпадают ли отчеты и найдены ли все внесенные дефекты.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+ISSUE_KEYS = ("missing", "corrupt", "oversized", "duplicates", "broken_urls")
+
+
+def prepare(data_dir: str, work_dir: str, files: int, size_kb: int, seed: int):
+    """Копия БД с локальными ссылками и файлы изображений с дефектами; возвращает ожидаемые дефекты"""
+    db_path = os.path.join(work_dir, 'bench.db')
+    shutil.copy(os.path.join(data_dir, 'bench.db'), db_path)
+    os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+    os.environ['PRICES_FILE'] = os.path.join(data_dir, 'prices.json')
+
+    from sqlalchemy import create_engine, text
+    engine = create_engine(os.environ['DATABASE_URL'])
+    rng = random.Random(seed)
+    static_dir = os.path.join(work_dir, 'static')
+    expected = {"missing": set(), "corrupt": set(), "oversized": set(), "duplicates": set()}
+    external = []
+    created = []
+
+    with engine.begin() as conn:
+        rows = conn.execute(text("SELECT id, img_list FROM product_images ORDER BY id")).all()
+        index = 0
+        for image_id, img_list in rows:
+            urls = json.loads(img_list) if img_list else []
+            local_urls = []
+            for url in urls:
+                if index >= files:
+                    external.append(url)
+                    local_urls.append(url)
+                    continue
+                local_url = f"/static/images/products/bench/{image_id}/{index}.jpg"
+                local_urls.append(local_url)
+                path = os.path.join(static_dir, local_url[len('/static/'):])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                roll = rng.random()
+                if roll < 0.02:
+                    expected["missing"].add(local_url)
+                elif roll < 0.03:
+                    open(path, 'wb').close()
+                    expected["corrupt"].add(local_url)
+                elif roll < 0.035:
+                    with open(path, 'wb') as f:
+                        f.write(b'\xff\xd8\xff' + os.urandom(4 * 1024 * 1024))
+                    expected["oversized"].add(local_url)
+                elif roll < 0.055 and created:
+                    source_url, source_path = rng.choice(created)
+                    shutil.copy(source_path, path)
+                    expected["duplicates"].add(local_url)
+                    expected["duplicates"].add(source_url)
+                else:
+                    with open(path, 'wb') as f:
+                        f.write(b'\xff\xd8\xff' + os.urandom(size_kb * 1024))
+                    created.append((local_url, path))
+                index += 1
+            conn.execute(text("UPDATE product_images SET img_list = :img_list WHERE id = :id"),
+                         {"img_list": json.dumps(local_urls), "id": image_id})
+    engine.dispose()
+    return static_dir, expected, external, [path for _, path in created]
+
+
+def issues(report):
+    """Найденные дефекты в виде множеств URL (для сравнения прогонов)"""
+    found = {key: {issue["url"] for issue in report[key]} for key in ("missing", "corrupt", "oversized", "broken_urls")}
+    found["duplicates"] = {url for duplicate in report["duplicates"] for url in duplicate["urls"]}
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Последовательная и параллельная проверка изображений, кэш по mtime")
+    parser.add_argument('--data', required=True, help='Папка бенчмарк-данных (bench.db)')
+    parser.add_argument('--files', type=int, default=5000, help='Сколько ссылок сделать локальными файлами')
+    parser.add_argument('--size-kb', type=int, default=64, help='Размер обычного файла, КБ')
+    parser.add_argument('--workers', type=int, default=8, help='Потоков в пуле')
+    parser.add_argument('--url-latency-ms', type=float, default=20, help='Задержка заглушки внешних URL, мс')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='image_scan_')
+    try:
+        static_dir, expected, external, created = prepare(args.data, work_dir, args.files, args.size_kb, args.seed)
+        cache_file = os.path.join(work_dir, 'image_scan_cache.json')
+
+        from database import SessionLocal
+        from image_integrity import scan_images
+        db = SessionLocal()
+        report_lines = [f"Ссылок на локальные файлы: {args.files}, внешних URL: {len(external)}, "
+                        f"обычный файл {args.size_kb} КБ, пул {args.workers} потоков"]
+
+        def run(name, **kwargs):
+            started = time.perf_counter()
+            report = scan_images(db, static_dir=static_dir, cache_file=cache_file, **kwargs)
+            elapsed = time.perf_counter() - started
+            report_lines.append(
+                f"  {name}: {elapsed:.2f} с (проверено файлов {report['checked_files']}, из кэша {report['cached_files']}, "
+                f"URL {report['checked_urls']})"
+            )
+            return report
+
+        serial = run("1 поток, без кэша", workers=1, use_cache=False)
+        parallel = run(f"{args.workers} потоков, без кэша", workers=args.workers, use_cache=False)
+        run(f"{args.workers} потоков, первый запуск с кэшем", workers=args.workers)
+        cached = run(f"{args.workers} потоков, повторный запуск", workers=args.workers)
+        for path in created[:max(1, len(created) // 100)]:
+            os.utime(path)
+        run(f"{args.workers} потоков, изменен 1% файлов", workers=args.workers)
+
+        same = issues(serial) == issues(parallel) == issues(cached)
+        found = issues(parallel)
+        report_lines.append(f"  отчеты {'совпадают' if same else 'ОТЛИЧАЮТСЯ'}; дефекты: " + ", ".join(
+            f"{key} {len(found[key] & expected[key])}/{len(expected[key])}" for key in expected
+        ))
+
+        if external:
+            delay = args.url_latency_ms / 1000
+
+            def slow_fetcher(url):
+                time.sleep(delay)
+                return {"ok": not url.endswith("/1.jpg"), "status": 404, "error": "HTTP 404"}
+
+            report_lines.append(f"Внешние URL (заглушка {args.url_latency_ms:.0f} мс на запрос):")
+            serial_urls = run("1 поток", workers=1, check_urls=True, fetcher=slow_fetcher)
+            parallel_urls = run(f"{args.workers} потоков", workers=args.workers, check_urls=True, fetcher=slow_fetcher)
+            report_lines.append(f"  недоступных URL: {len(serial_urls['broken_urls'])} / {len(parallel_urls['broken_urls'])}")
+        db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("\n".join(report_lines))
+
+
+if __name__ == "__main__":
+    main()
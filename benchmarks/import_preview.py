@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк предпросмотра импорта (import_diff): diff листа товаров и листа цен с каталогом
+
+Лист строится из текущего каталога бенчмарк-данных: часть строк без изменений, часть
+с измененными ценами, названиями, остатками и цветом, остальное - новые SKU. Замеряется
+только сравнение (чтение xlsx не входит); количество найденных изменений сверяется
+с тем, что было внесено в лист.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import contextlib
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+
+def build_sheets(current, rows: int, changed_share: float, seed: int):
+    """Строки листа товаров (как parse_products_excel) и лист цен (DataFrame) с известным числом изменений"""
+    import pandas as pd
+
+    rng = random.Random(seed)
+    existing = current.reset_index().to_dict("records")
+    products, prices, expected_changed = [], [], 0
+    for index in range(rows):
+        if index < len(existing):
+            row = dict(existing[index])
+            price = row["price"] if row["price"] == row["price"] else 0.0
+            changed = rng.random() < changed_share
+            if changed:
+                expected_changed += 1
+                field = rng.choice(("price", "name", "stock", "color"))
+                if field == "price":
+                    price += rng.choice((-1000, 500, 2000))
+                elif field == "stock":
+                    row["stock"] += 1
+                else:
+                    row[field] = f"{row[field]} (новое)"
+            # Старая цена остается текущей, чтобы изменения были только внесенными
+            old_price = row["old_price"] if row["old_price"] == row["old_price"] else price
+            prices.append((row["sku"], price, old_price))
+        else:
+            row = {
+                "sku": f"NEW{index:07d}", "name": f"Новый товар {index}", "level0": "Смартфоны",
+                "level1": "Новинки", "level2": f"Модель {index % 50}", "brand": "Brand",
+                "stock": 1, "color": "Black", "disk": "", "ram": "", "sim_config": "",
+            }
+            price = old_price = float(rng.randrange(10000, 200000, 10))
+        products.append({
+            **{key: row.get(key, "") for key in ("sku", "name", "level0", "level1", "level2", "brand", "color", "disk", "ram", "sim_config")},
+            "description": "", "stock": int(row["stock"]), "price": float(price), "old_price": float(old_price),
+            "currency": "RUB", "image_url": "", "specifications": {},
+        })
+    prices_sheet = pd.DataFrame(prices, columns=["SKU", "Новая цена", "Старая цена"])
+    return products, prices_sheet, expected_changed
+
+
+def measure(function, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started)
+    return result, durations
+
+
+def run(args):
+    from database import SessionLocal
+    from import_diff import catalog_frame, diff_products, diff_prices
+
+    db = SessionLocal()
+    try:
+        current = catalog_frame(db)
+        products, prices_sheet, expected_changed = build_sheets(current, args.rows, args.changed, args.seed)
+        products_diff, product_durations = measure(lambda: diff_products(products, db), args.repeat)
+        prices_diff, price_durations = measure(lambda: diff_prices(prices_sheet, db), args.repeat)
+    finally:
+        db.close()
+
+    summary = products_diff["summary"]
+    price_summary = prices_diff["summary"]
+    if summary["new"] != max(0, args.rows - len(current)):
+        raise AssertionError(f"Новых строк {summary['new']}, ожидалось {args.rows - len(current)}")
+    if summary["changed"] != expected_changed:
+        raise AssertionError(f"Измененных строк {summary['changed']}, внесено {expected_changed}")
+    return [
+        f"📦 Каталог: {len(current)} SKU; лист товаров: {len(products)} строк, лист цен: {len(prices_sheet)} строк",
+        f"   товары: новых {summary['new']}, изменено {summary['changed']} ({summary['fields']}), без изменений {summary['unchanged']}",
+        f"   diff_products: p50={statistics.median(product_durations) * 1000:.0f} мс, max={max(product_durations) * 1000:.0f} мс",
+        f"   цены: изменено {price_summary['changed']}, без изменений {price_summary['unchanged']}, "
+        f"разница {price_summary['price']['delta_total']:+.0f}",
+        f"   diff_prices: p50={statistics.median(price_durations) * 1000:.0f} мс, max={max(price_durations) * 1000:.0f} мс",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк предпросмотра импорта (diff с каталогом)")
+    parser.add_argument('--data', help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--rows', type=int, default=20000, help='Строк в листе (сверх каталога - новые SKU)')
+    parser.add_argument('--changed', type=float, default=0.1, help='Доля измененных строк каталога')
+    parser.add_argument('--repeat', type=int, default=3, help='Замеров')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.data:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(os.path.join(args.data, 'bench.db'))}"
+        os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, 'prices.json'))
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        report = run(args)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
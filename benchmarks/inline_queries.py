@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк inline режима бота: время от inline запроса до answerInlineQuery
+
+Bot API заменен локальной заглушкой (benchmarks.fake_telegram). Запросы имитируют
+набор текста: каждое слово приходит префиксами ("i", "ip", ... "iphone 16").
+Отдельно измеряется перестроение карточек (после изменения каталога/цен).
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import contextlib
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+TYPED_QUERIES = ["iphone 16 pro", "macbook air", "galaxy s25", "airpods", "watch ultra", "ipad", "256", "dyson"]
+
+
+def typed_prefixes(query: str):
+    """Все префиксы запроса, как их отправляет Telegram при наборе"""
+    return [query[:length] for length in range(1, len(query) + 1) if not query[:length].endswith(" ")]
+
+
+def build_updates(application, count: int, users: int, seed: int):
+    from benchmarks.fake_telegram import inline_query_update
+
+    rng = random.Random(seed)
+    updates = []
+    while len(updates) < count:
+        user_id = 1000 + rng.randrange(users)
+        for text in typed_prefixes(rng.choice(TYPED_QUERIES)):
+            updates.append(inline_query_update(application, len(updates) + 1, user_id, text))
+    return updates[:count]
+
+
+def percentile_line(latencies):
+    latencies = sorted(latencies)
+    return (f"p50={statistics.median(latencies) * 1000:.2f} мс, "
+            f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f} мс, max={latencies[-1] * 1000:.2f} мс")
+
+
+async def run(args):
+    from benchmarks.fake_telegram import FakeBotAPI, build_application, process_updates
+    from bot_service import LocalCatalogService, RemoteCatalogService
+    from telegram_bot import ElectronicsStoreBot
+
+    catalog = RemoteCatalogService(args.api_url) if args.mode == "remote" else LocalCatalogService()
+    bot = ElectronicsStoreBot(catalog_service=catalog)
+    fake_api = FakeBotAPI(latency=args.telegram_latency_ms / 1000)
+    application = build_application(bot, fake_api)
+    await application.initialize()
+
+    report = [f"🔎 Режим каталога: {args.mode}, задержка Bot API: {args.telegram_latency_ms} мс"]
+
+    if args.mode == "local":
+        from catalog_cards import catalog_cards
+        rebuilds = []
+        for _ in range(args.rebuilds):
+            started = time.perf_counter()
+            catalog_cards.refresh(force=True)
+            rebuilds.append(time.perf_counter() - started)
+        report.append(f"🧱 Перестроение {len(catalog_cards)} карточек: {percentile_line(rebuilds)}")
+
+    # Первый запрос отдельно: в remote режиме прогревает соединение и карточки на сервере
+    await application.process_update(build_updates(application, 1, 1, args.seed)[0])
+
+    updates = build_updates(application, args.updates, args.users, args.seed)
+    started = time.perf_counter()
+    latencies = await process_updates(application, updates, args.concurrency)
+    duration = time.perf_counter() - started
+
+    answer = fake_api.last_parameters.get("answerInlineQuery", {})
+    await application.shutdown()
+
+    report += [
+        f"⏱  {len(updates)} inline запросов за {duration:.2f} c: {len(updates) / duration:.1f} запросов/с",
+        f"   запрос → answerInlineQuery: {percentile_line(latencies)}",
+        f"   вызовы Bot API: {fake_api.calls}; cache_time последнего ответа: {answer.get('cache_time')}",
+    ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк inline запросов Telegram бота")
+    parser.add_argument('--mode', choices=['local', 'remote'], default='local', help='Доступ к каталогу')
+    parser.add_argument('--api-url', default='http://127.0.0.1:8000', help='Адрес API для --mode remote')
+    parser.add_argument('--data', help='Папка бенчмарк-данных (bench.db, prices.json) для --mode local')
+    parser.add_argument('--updates', type=int, default=2000, help='Количество inline запросов')
+    parser.add_argument('--users', type=int, default=50, help='Количество разных пользователей')
+    parser.add_argument('--concurrency', type=int, default=32, help='Одновременно обрабатываемых запросов')
+    parser.add_argument('--rebuilds', type=int, default=5, help='Замеров полного перестроения карточек')
+    parser.add_argument('--telegram-latency-ms', type=float, default=0.0, help='Имитация задержки Bot API')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--show-app-output', action='store_true', help='Не глушить print() приложения')
+    args = parser.parse_args()
+
+    if args.data:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(os.path.join(args.data, 'bench.db'))}"
+        os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, 'prices.json'))
+    os.chdir(PROJECT_DIR)
+
+    # print() приложения глушится, отчет печатается после прогона
+    quiet = open(os.devnull, 'w') if not args.show_app_output else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        import logging
+        logging.getLogger("telegram_bot").setLevel(logging.WARNING)
+        report = asyncio.run(run(args))
+    if quiet:
+        quiet.close()
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк потокового режима (NDJSON) списков без пагинации: /all-products, /api/images, /hierarchy/skus
+
+Для каждого каталога (--data, можно несколько) и режима (обычный JSON / NDJSON) запускается
+отдельный uvicorn, делается один запрос и замеряются время до первого байта, полное время,
+размер ответа и прирост пиковой памяти воркера (VmHWM после запроса минус VmRSS до него).
+Перед замерами проверяется, что NDJSON содержит те же строки, что и обычный ответ.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import httpx
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from stress_test_orders import find_free_port
+
+ENDPOINTS = ("/all-products", "/api/images", "/hierarchy/skus")
+
+
+def memory_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":"))
+
+
+def start_server(data_dir: str):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.abspath(os.path.join(data_dir, 'bench.db'))}",
+        PRICES_FILE=os.path.abspath(os.path.join(data_dir, 'prices.json')),
+    )
+    port = find_free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Сервер не запустился")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def fetch(base_url: str, path: str, ndjson: bool):
+    """(время до первого байта, полное время, тело)"""
+    headers = {"Accept": "application/x-ndjson"} if ndjson else {}
+    started = time.perf_counter()
+    first_byte = None
+    body = bytearray()
+    with httpx.stream("GET", base_url + path, headers=headers, timeout=600) as response:
+        response.raise_for_status()
+        for chunk in response.iter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            body += chunk
+    return first_byte, time.perf_counter() - started, bytes(body)
+
+
+def rows_of(path: str, body: bytes, ndjson: bool):
+    if ndjson:
+        return [json.loads(line) for line in body.splitlines()]
+    data = json.loads(body)
+    return data["images"] if path == "/api/images" else data
+
+
+def measure(data_dir: str, path: str, ndjson: bool):
+    server, base_url = start_server(data_dir)
+    try:
+        fetch(base_url, "/health", False)
+        rss_before = memory_kb(server.pid, "VmRSS")
+        first_byte, total, body = fetch(base_url, path, ndjson)
+        peak = memory_kb(server.pid, "VmHWM")
+    finally:
+        stop_server(server)
+    return {
+        "first_byte": first_byte, "total": total, "bytes": len(body),
+        "peak_growth_mb": (peak - rss_before) / 1024, "rows": rows_of(path, body, ndjson),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обычный JSON и NDJSON для списков без пагинации")
+    parser.add_argument('--data', action='append', required=True, help='Папка бенчмарк-данных (можно несколько)')
+    parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Эндпоинт (по умолчанию все)')
+    args = parser.parse_args()
+
+    report = []
+    for data_dir in args.data:
+        with open(os.path.join(data_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        report.append(f"Каталог {data_dir}: {manifest.get('skus', manifest.get('products', '?'))} SKU")
+        for path in args.endpoint or ENDPOINTS:
+            plain = measure(data_dir, path, ndjson=False)
+            streamed = measure(data_dir, path, ndjson=True)
+            same = sorted(plain["rows"], key=json.dumps) == sorted(streamed["rows"], key=json.dumps)
+            report.append(f"  {path} ({len(plain['rows'])} строк, NDJSON {'совпадает' if same else 'ОТЛИЧАЕТСЯ'}):")
+            for name, result in (("JSON  ", plain), ("NDJSON", streamed)):
+                report.append(
+                    f"    {name}: первый байт {result['first_byte'] * 1000:.0f} мс, всего {result['total'] * 1000:.0f} мс, "
+                    f"{result['bytes'] / 1024 / 1024:.1f} МБ, пик памяти +{result['peak_growth_mb']:.0f} МБ"
+                )
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
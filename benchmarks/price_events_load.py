@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест ленты /events/prices (SSE): тысячи простаивающих соединений на одном воркере
+
+Запускает uvicorn с одним воркером на копии бенчмарк-данных, открывает N SSE соединений
+(часть без фильтра, часть с фильтром по SKU) и замеряет:
+- память воркера (VmRSS) до и после открытия соединений;
+- загрузку CPU воркера, пока соединения простаивают (только keep-alive комментарии);
+- время доставки изменения цены всем соединениям: запись через /update-price (тот же процесс)
+  и через price_storage из этого процесса (как скрипт обновления цен или другой воркер).
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+import httpx
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from stress_test_orders import find_free_port
+
+
+def process_stats(pid: int):
+    """RSS (МБ) и процессорное время (с) процесса из /proc"""
+    with open(f"/proc/{pid}/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return rss_kb / 1024, cpu
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def open_stream(host: str, port: int, path: str, limit: asyncio.Semaphore):
+    """Открыть SSE соединение и дождаться первого сообщения (retry)"""
+    async with limit:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        await writer.drain()
+        await asyncio.wait_for(reader.readuntil(b"retry: 3000"), 30)
+        return reader, writer
+
+
+async def wait_for_marker(reader: asyncio.StreamReader, marker: bytes, timeout: float):
+    try:
+        await asyncio.wait_for(reader.readuntil(marker), timeout)
+        return time.perf_counter()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return None
+
+
+async def fan_out_round(streams, write, marker: bytes, timeout: float):
+    """Записать цену и замерить, через сколько ее получит каждое соединение"""
+    waiters = [asyncio.create_task(wait_for_marker(reader, marker, timeout)) for reader, _ in streams]
+    await asyncio.sleep(0.1)
+    started = time.perf_counter()
+    await write()
+    written = time.perf_counter() - started
+    received = [at - started for at in await asyncio.gather(*waiters) if at is not None]
+    return received, written
+
+
+def describe(name: str, received, written: float, total: int) -> str:
+    """Время доставки считается от начала записи; запись файла цен - отдельно"""
+    if not received:
+        return f"  {name}: доставлено 0/{total}"
+    return (
+        f"  {name}: запись {written * 1000:.0f} мс, доставлено {len(received)}/{total}, "
+        f"p50 {percentile(received, 50) * 1000:.1f} мс, p99 {percentile(received, 99) * 1000:.1f} мс, "
+        f"max {max(received) * 1000:.1f} мс"
+    )
+
+
+async def run(args, base_url: str, port: int, pid: int, sku: str):
+    report = []
+    rss_before, _ = process_stats(pid)
+
+    limit = asyncio.Semaphore(200)
+    paths = [
+        f"/events/prices?skus={sku}" if index % 100 < args.filtered else "/events/prices"
+        for index in range(args.connections)
+    ]
+    started = time.perf_counter()
+    streams = await asyncio.gather(*(open_stream("127.0.0.1", port, path, limit) for path in paths))
+    opened = time.perf_counter() - started
+    rss_after, cpu_before = process_stats(pid)
+    report.append(f"Соединений: {len(streams)} ({args.filtered}% с фильтром по SKU), открыты за {opened:.1f} с")
+    report.append(
+        f"Память воркера: {rss_before:.0f} МБ -> {rss_after:.0f} МБ "
+        f"(~{(rss_after - rss_before) * 1024 / len(streams):.1f} КБ на соединение)"
+    )
+
+    await asyncio.sleep(args.idle)
+    _, cpu_after = process_stats(pid)
+    report.append(f"CPU воркера за {args.idle:.0f} с простоя: {(cpu_after - cpu_before) / args.idle * 100:.1f}%")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        report.append("Доставка изменения цены:")
+        for round_index in range(args.rounds):
+            price = 900000 + round_index
+
+            async def write_via_api():
+                response = await client.post("/update-price", json={"sku": sku, "price": price, "old_price": price})
+                response.raise_for_status()
+
+            received, written = await fan_out_round(streams, write_via_api, f'"price":{float(price)}'.encode(), args.timeout)
+            report.append(describe(f"/update-price #{round_index + 1}", received, written, len(streams)))
+
+    # Запись из другого процесса: воркер замечает ее по общей версии "prices" (PRICE_EVENTS_POLL_SECONDS)
+    from price_storage import set_price
+
+    price = 950000.0
+
+    async def write_via_storage():
+        with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+            await asyncio.to_thread(set_price, sku, price, price)
+
+    received, written = await fan_out_round(streams, write_via_storage, f'"price":{price}'.encode(), args.timeout)
+    report.append(describe("другой процесс", received, written, len(streams)))
+
+    for _, writer in streams:
+        writer.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест ленты /events/prices")
+    parser.add_argument('--data', required=True, help='Папка бенчмарк-данных (bench.db, prices.json)')
+    parser.add_argument('--connections', type=int, default=5000, help='SSE соединений')
+    parser.add_argument('--filtered', type=int, default=20, help='Процент соединений с фильтром по SKU')
+    parser.add_argument('--idle', type=float, default=20, help='Секунд простоя для замера CPU')
+    parser.add_argument('--rounds', type=int, default=5, help='Записей цены через /update-price')
+    parser.add_argument('--timeout', type=float, default=10, help='Сколько ждать доставки, с')
+    args = parser.parse_args()
+
+    # Каждое соединение - дескриптор и у клиента, и у сервера (сервер наследует лимит)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.connections + 1000
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    work_dir = tempfile.mkdtemp(prefix='price_events_')
+    shutil.copy(os.path.join(args.data, 'bench.db'), os.path.join(work_dir, 'bench.db'))
+    shutil.copy(os.path.join(args.data, 'prices.json'), os.path.join(work_dir, 'prices.json'))
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['PRICES_FILE'] = os.path.join(work_dir, 'prices.json')
+    os.chdir(PROJECT_DIR)
+
+    port = find_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--timeout-graceful-shutdown', '5'],
+        cwd=PROJECT_DIR, env=dict(os.environ), stdout=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(150):
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        else:
+            raise RuntimeError("Сервер не запустился")
+
+        from sqlalchemy import create_engine, text
+        engine = create_engine(os.environ['DATABASE_URL'])
+        with engine.connect() as conn:
+            sku = conn.execute(text("SELECT sku FROM products ORDER BY id LIMIT 1")).scalar_one()
+        engine.dispose()
+
+        report = asyncio.run(run(args, base_url, port, server.pid, sku))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print("\n".join(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Прогон пользовательских сценариев WebApp против API внутри процесса
+
+Каждая сессия повторяет путь покупателя:
+категории -> бренды -> товары -> варианты модели -> изображения цвета -> проверка промокода -> заказ.
+Сессии выполняются параллельно через httpx + ASGI транспорт (без сети), как в одном воркере uvicorn.
+Отчет: пропускная способность и p50/p95/p99 по каждому эндпоинту в JSON, пригодном для сравнения.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import contextlib
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import httpx
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from benchmarks.generate_data import generate, parse_scale, DB_FILENAME, PRICES_FILENAME, MANIFEST_FILENAME
+
+PROMO_CODES = ["BENCH1000", "BENCH10", "BENCHADAPTER", "NOSUCHCODE"]
+
+
+class LatencyRecorder:
+    """Времена ответов по эндпоинтам (ключ - шаблон маршрута, а не конкретный URL)"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.enabled = True
+
+    async def call(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            response = None
+        elapsed = time.perf_counter() - started
+
+        if self.enabled:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if response is None or response.status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        if response is None or response.status_code >= 400:
+            return None
+        return response
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def run_session(client: httpx.AsyncClient, recorder: LatencyRecorder, rng: random.Random, session_index: int):
+    """Одна сессия покупателя; при ошибке шага сессия завершается"""
+    response = await recorder.call(client, "GET /categories", "GET", "/categories")
+    if response is None or not response.json():
+        return
+    level_0 = rng.choice(response.json())["level_0"]
+
+    response = await recorder.call(client, "GET /hierarchy/brands", "GET", "/hierarchy/brands", params={"level0": level_0})
+    if response is None or not response.json():
+        return
+    brand = rng.choice(response.json())
+
+    response = await recorder.call(client, "GET /products", "GET", "/products",
+                                   params={"brand": brand, "level0": level_0, "limit": 20})
+    if response is None or not response.json():
+        return
+    product = rng.choice(response.json())
+    model = product.get("level_2") or product["model"]
+
+    response = await recorder.call(client, "GET /products/{model}/variants", "GET",
+                                   f"/products/{quote(model, safe='')}/variants")
+    variant = None
+    if response is not None and response.json().get("variants"):
+        variant = rng.choice(response.json()["variants"])
+    color = (variant or {}).get("color") or product.get("specifications", {}).get("color")
+
+    if color:
+        await recorder.call(client, "GET /product-images/{model_key}/{color}", "GET",
+                            f"/product-images/{quote(model, safe='')}/{quote(color, safe='')}")
+
+    price = (variant or {}).get("price") or product.get("price") or 1000.0
+    quantity = rng.randint(1, 2)
+    items = [{
+        "product_id": product["id"],
+        "name": (variant or product)["name"],
+        "price": price,
+        "quantity": quantity,
+        "color": color,
+    }]
+    total = price * quantity
+
+    promo_code = rng.choice(PROMO_CODES)
+    response = await recorder.call(client, "POST /promo-codes/check", "POST", "/promo-codes/check",
+                                   json={"code": promo_code, "cart_total": total, "items": items})
+    promo = response.json() if response is not None else {}
+    discount = (promo.get("discount_amount") or 0.0) if promo.get("valid") else 0.0
+
+    await recorder.call(client, "POST /orders", "POST", "/orders", json={
+        "customer": {"name": f"Bench {session_index}", "contact_method": "telegram", "contact_value": f"@bench{session_index}"},
+        "shipping": {"type": "pickup"},
+        "items": items,
+        "total": total,
+        "promo_code": promo_code if promo.get("valid") else None,
+        "discount_amount": discount,
+    })
+
+
+async def run_sessions(app, sessions: int, concurrency: int, seed: int, recorder: LatencyRecorder) -> float:
+    """Выполнить sessions сессий не более чем по concurrency одновременно; вернуть время прогона"""
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def limited(index):
+            async with semaphore:
+                await run_session(client, recorder, random.Random(seed + index), index)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(index) for index in range(sessions)))
+        return time.perf_counter() - started
+
+
+def build_report(recorder: LatencyRecorder, duration: float, args, manifest: Dict) -> Dict:
+    endpoints = {}
+    total_requests = 0
+    for endpoint, samples in sorted(recorder.samples.items()):
+        samples = sorted(samples)
+        total_requests += len(samples)
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(endpoint, 0),
+            "rps": round(len(samples) / duration, 2),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2),
+        }
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "dataset": manifest,
+        },
+        "total": {
+            "duration_s": round(duration, 3),
+            "requests": total_requests,
+            "errors": sum(recorder.errors.values()),
+            "rps": round(total_requests / duration, 2),
+            "sessions_per_s": round(args.sessions / duration, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    total = report["total"]
+    print(f"⏱  {total['duration_s']} c, {total['requests']} запросов, {total['rps']} req/s, "
+          f"{total['sessions_per_s']} сессий/с, ошибок: {total['errors']}")
+    print(f"{'Эндпоинт':42} {'N':>6} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for endpoint, stats in report["endpoints"].items():
+        line = f"{endpoint:42} {stats['requests']:>6} {stats['errors']:>5} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}"
+        old = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if old and old["p95_ms"]:
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {old['p95_ms']} -> {stats['p95_ms']} ({change:+.1f}%)"
+        print(line)
+    if baseline:
+        old_rps = baseline["total"]["rps"]
+        print(f"📊 Пропускная способность: {old_rps} -> {total['rps']} req/s ({(total['rps'] - old_rps) / old_rps * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сценарный бенчмарк API")
+    parser.add_argument('--data', required=True, help='Папка с bench.db/prices.json (создается, если ее нет)')
+    parser.add_argument('--scale', type=parse_scale, default=1_000, help='Размер каталога при генерации: 1k, 10k, 100k')
+    parser.add_argument('--sessions', type=int, default=100, help='Количество сессий')
+    parser.add_argument('--concurrency', type=int, default=10, help='Одновременных сессий')
+    parser.add_argument('--warmup', type=int, default=5, help='Сессий прогрева (не попадают в отчет)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed сценариев')
+    parser.add_argument('--output', help='Сохранить отчет в JSON')
+    parser.add_argument('--compare', help='Сравнить с ранее сохраненным отчетом')
+    parser.add_argument('--show-app-output', action='store_true', help='Не глушить print() приложения')
+    args = parser.parse_args()
+
+    manifest_path = os.path.join(args.data, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        print(f"🛠  Генерация каталога {args.scale} SKU в {args.data}")
+        generate(args.data, args.scale)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    # Заказы пишутся в БД - работаем на копии, чтобы прогоны были сравнимы
+    work_db = os.path.abspath(os.path.join(args.data, f"run_{DB_FILENAME}"))
+    with open(os.path.join(args.data, DB_FILENAME), 'rb') as src, open(work_db, 'wb') as dst:
+        dst.write(src.read())
+
+    # Окружение должно быть задано до импорта api (database.py и price_storage читают его при импорте)
+    os.environ['DATABASE_URL'] = f"sqlite:///{work_db}"
+    os.environ['PRICES_FILE'] = os.path.abspath(os.path.join(args.data, PRICES_FILENAME))
+    os.chdir(PROJECT_DIR)
+
+    quiet = open(os.devnull, 'w') if not args.show_app_output else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        import api
+        recorder = LatencyRecorder()
+        recorder.enabled = False
+        asyncio.run(run_sessions(api.app, args.warmup, args.concurrency, args.seed + 1_000_000, recorder))
+        recorder.enabled = True
+        duration = asyncio.run(run_sessions(api.app, args.sessions, args.concurrency, args.seed, recorder))
+    if quiet:
+        quiet.close()
+
+    report = build_report(recorder, duration, args, manifest)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчет сохранен в {args.output}")
+
+    os.remove(work_db)
+
+
+if __name__ == "__main__":
+    main()
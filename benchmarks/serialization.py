@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк сериализации списка карточек товаров (без БД и HTTP)
+
+Сравниваются два пути ответа горячих списков (/all-products, /products, /search):
+- прежний: ProductResponse на строку -> проверка response_model=List[ProductResponse]
+  -> jsonable_encoder -> JSONResponse (стандартный json)
+- новый: строки ProductRow (dict) -> ORJSONResponse
+Тела ответов сравниваются после разбора, чтобы убедиться, что JSON одинаковый.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import contextlib
+from typing import List
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+COLORS = ["Black", "White", "Desert Titanium", "Natural Titanium", "Ultramarine", "Pink"]
+DISKS = ["128GB", "256GB", "512GB", "1TB"]
+
+
+def build_rows(count: int, seed: int):
+    """Карточки как у /all-products: характеристики, 3-5 изображений, цены"""
+    from api import product_row
+
+    rng = random.Random(seed)
+    rows = []
+    for index in range(count):
+        model = f"iPhone {rng.randint(13, 17)} Pro"
+        color, disk = rng.choice(COLORS), rng.choice(DISKS)
+        price = float(rng.randrange(50000, 250000, 10))
+        old_price = price + rng.choice([0, 0, 5000, 10000])
+        images = [f"/static/images/products/{index}/{photo}.jpg" for photo in range(rng.randint(3, 5))]
+        rows.append(product_row(
+            id=index + 1,
+            sku=f"sku{index:06d}",
+            name=f"{model} {disk} {color}",
+            description="",
+            brand="Apple",
+            model=model,
+            category_name=f"Смартфоны / Apple / {model}",
+            level_2=model,
+            image_url=images[0],
+            images=images,
+            specifications={"color": color, "disk": disk, "sim_config": "SIM + eSIM", "images": images},
+            price=price,
+            old_price=old_price,
+            discount_percentage=(old_price - price) / old_price * 100,
+            currency="RUB",
+        ))
+    return rows
+
+
+def pydantic_path(rows, response_field) -> bytes:
+    """Прежний путь: модели + проверка response_model + jsonable_encoder + стандартный json"""
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from api import ProductResponse
+
+    models = [ProductResponse(**row) for row in rows]
+    content = asyncio.run(serialize_response(field=response_field, response_content=models))
+    return JSONResponse(content).body
+
+
+def orjson_path(rows) -> bytes:
+    from fastapi.responses import ORJSONResponse
+    return ORJSONResponse(rows).body
+
+
+def measure(function, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = function()
+        durations.append(time.perf_counter() - started)
+    return body, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк сериализации карточек товаров")
+    parser.add_argument('--rows', type=int, default=10000, help='Количество карточек')
+    parser.add_argument('--repeat', type=int, default=5, help='Замеров на путь')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    os.chdir(PROJECT_DIR)
+
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        from fastapi.utils import create_response_field
+        from api import ProductResponse
+
+        rows = build_rows(args.rows, args.seed)
+        response_field = create_response_field(name="Response_get_all_products", type_=List[ProductResponse])
+        old_body, old_durations = measure(lambda: pydantic_path(rows, response_field), args.repeat)
+        new_body, new_durations = measure(lambda: orjson_path(rows), args.repeat)
+
+    if json.loads(old_body) != json.loads(new_body):
+        raise AssertionError("Тела ответов различаются")
+
+    old_ms, new_ms = statistics.median(old_durations) * 1000, statistics.median(new_durations) * 1000
+    print(f"📦 {args.rows} карточек, ответы совпадают ({len(new_body) // 1024} КБ orjson, {len(old_body) // 1024} КБ json)")
+    print(f"   ProductResponse + response_model + json: p50={old_ms:.1f} мс")
+    print(f"   ProductRow + ORJSONResponse:             p50={new_ms:.1f} мс  (x{old_ms / new_ms:.1f})")
+
+
+if __name__ == "__main__":
+    main()
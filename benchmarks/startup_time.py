@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта: время импорта api (python -X importtime) и проверки версии БД
+
+Каждый замер - отдельный процесс, как при запуске воркера Passenger/uvicorn.
+С --max-import-ms и списком запрещенных модулей скрипт завершается с ошибкой при регрессии.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Тяжелые модули, которые не должны загружаться при импорте api (нужны только Excel эндпоинтам)
+DEFAULT_FORBIDDEN = ["pandas", "openpyxl", "numpy"]
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.+)$")
+
+STARTUP_SNIPPET = """
+import time
+started = time.perf_counter()
+from startup import run_startup
+run_startup()
+print("STARTUP_MS", (time.perf_counter() - started) * 1000)
+"""
+
+
+def measure_import(env: Dict[str, str]) -> Tuple[float, Dict[str, int]]:
+    """Один холодный импорт api: (общее время мс, {модуль: cumulative мкс})"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт api завершился ошибкой:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            name = match.group(3).strip()
+            modules[name] = int(match.group(2))
+    return modules.get("api", 0) / 1000, modules
+
+
+def measure_startup(env: Dict[str, str]) -> float:
+    """Время run_startup() в свежем процессе (мс)"""
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SNIPPET],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP_MS"):
+            return float(line.split()[1])
+    raise RuntimeError(f"run_startup завершился ошибкой:\n{result.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени старта")
+    parser.add_argument('--db', default=os.path.join(PROJECT_DIR, 'electronics_store.db'), help='Исходная SQLite БД (копируется)')
+    parser.add_argument('--runs', type=int, default=5, help='Количество замеров')
+    parser.add_argument('--top', type=int, default=15, help='Сколько самых тяжелых модулей показать')
+    parser.add_argument('--max-import-ms', type=float, default=None, help='Порог медианы импорта api (регрессия -> exit 1)')
+    parser.add_argument('--forbid', default=",".join(DEFAULT_FORBIDDEN), help='Модули, которые не должны импортироваться (через запятую)')
+    parser.add_argument('--output', help='Сохранить результат в JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='yo_startup_')
+    db_path = os.path.join(work_dir, 'startup.db')
+    shutil.copy(args.db, db_path)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", PRICES_FILE=os.path.join(work_dir, 'prices.json'),
+               PYTHONDONTWRITEBYTECODE="1")
+
+    try:
+        # Первый запуск проставляет версии в app_metadata, дальше - "горячий" путь
+        first_startup_ms = measure_startup(env)
+        startup_runs = [measure_startup(env) for _ in range(args.runs)]
+        import_runs: List[float] = []
+        modules: Dict[str, int] = {}
+        for _ in range(args.runs):
+            total_ms, modules = measure_import(env)
+            import_runs.append(total_ms)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    import_median = statistics.median(import_runs)
+    startup_median = statistics.median(startup_runs)
+    heaviest = sorted(modules.items(), key=lambda item: item[1], reverse=True)
+    forbidden = [name for name in args.forbid.split(",") if name and name in modules]
+
+    print(f"📦 import api: медиана {import_median:.0f} мс (min {min(import_runs):.0f}, max {max(import_runs):.0f}), модулей: {len(modules)}")
+    print(f"🗄  run_startup: первый запуск {first_startup_ms:.0f} мс, повторный (версия актуальна) медиана {startup_median:.0f} мс")
+    print(f"🐘 Самые тяжелые импорты (cumulative, мс):")
+    for name, cumulative in heaviest[:args.top]:
+        print(f"   {cumulative / 1000:8.1f}  {name}")
+
+    result = {
+        "import_api_ms": {"median": round(import_median, 1), "runs": [round(v, 1) for v in import_runs]},
+        "run_startup_ms": {"first": round(first_startup_ms, 1), "median": round(startup_median, 1)},
+        "heaviest_imports_ms": {name: round(cumulative / 1000, 1) for name, cumulative in heaviest[:args.top]},
+        "forbidden_imported": forbidden,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    problems = []
+    if forbidden:
+        problems.append(f"при импорте api загружаются: {', '.join(forbidden)}")
+    if args.max_import_ms is not None and import_median > args.max_import_ms:
+        problems.append(f"импорт api {import_median:.0f} мс > порога {args.max_import_ms:.0f} мс")
+    if problems:
+        print("❌ " + "; ".join(problems))
+        sys.exit(1)
+    print("✅ Регрессий времени старта нет")
+
+
+if __name__ == "__main__":
+    main()
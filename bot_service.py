@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Сервисный слой Telegram бота: доступ к каталогу без блокировки event loop бота
+
+- LocalCatalogService: бот работает в одном процессе с API - функции эндпоинтов вызываются
+  напрямую в пуле потоков (без HTTP и без блокировки цикла бота синхронными запросами к БД)
+- RemoteCatalogService: API на другом сервере - асинхронный httpx клиент с пулом соединений
+- ChatResponseCache: кэш ответов по чатам (повторные нажатия кнопок не ходят в каталог)
+- search_cards: inline поиск по предрасчитанным карточкам моделей (catalog_cards)
+"""
+
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from config import Config
+from cache_coherence import shared_versions
+
+# Время жизни закэшированных списков категорий/товаров для чата (сек)
+CHAT_CACHE_TTL = 60
+
+# Максимум записей в кэше (чаты x запросы), старые вытесняются
+CHAT_CACHE_MAX_ENTRIES = 10_000
+
+
+class CatalogService(ABC):
+    """Интерфейс доступа к каталогу для бота"""
+
+    @abstractmethod
+    async def get_categories(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_category_products(self, level_0: str, limit: int = 10) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def search_cards(self, query: str, limit: int, offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Карточки моделей для inline запроса и следующий offset (None - больше нет)"""
+
+    async def close(self):
+        pass
+
+
+class LocalCatalogService(CatalogService):
+    """
+    Вызов функций api.py в том же процессе
+    Списки товаров - функции строк (product_model_rows, search_product_rows), а не эндпоинты:
+    эндпоинты отдают готовый ORJSONResponse. Работа с БД синхронная, поэтому каждый вызов
+    выполняется в пуле потоков со своей сессией (async эндпоинт - со своим циклом),
+    а цикл бота остается свободным
+    """
+
+    def __init__(self):
+        # Импорт api только в этом режиме - удаленному боту приложение FastAPI не нужно
+        import api
+        from catalog_cards import catalog_cards
+        self._api = api
+        self._cards = catalog_cards
+
+    @staticmethod
+    def _run_in_session(function: Callable[..., Any], kwargs: Dict[str, Any]):
+        from fastapi.encoders import jsonable_encoder
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            result = function(db=db, **kwargs)
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            return jsonable_encoder(result)
+        finally:
+            db.close()
+
+    async def _call(self, function, **kwargs):
+        return await asyncio.to_thread(self._run_in_session, function, kwargs)
+
+    async def get_categories(self):
+        return await self._call(self._api.get_categories)
+
+    async def get_category_products(self, level_0: str, limit: int = 10):
+        return await self._call(self._api.product_model_rows, level0=level_0, limit=limit)
+
+    async def search(self, query: str, limit: int = 10):
+        return await self._call(self._api.search_product_rows, q=query, limit=limit)
+
+    async def search_cards(self, query: str, limit: int, offset: int = 0):
+        # Перестроение карточек читает БД - в пуле потоков; сам поиск идет по памяти
+        if self._cards.is_stale:
+            await asyncio.to_thread(self._cards.refresh)
+        return self._cards.search(query, limit=limit, offset=offset)
+
+
+class RemoteCatalogService(CatalogService):
+    """HTTP доступ к API через общий асинхронный клиент (keep-alive пул соединений)"""
+
+    def __init__(self, base_url: str, timeout: float = 10.0, max_connections: int = 20):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def _get(self, path: str, **params):
+        response = await self._client.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_categories(self):
+        return await self._get("/categories")
+
+    async def get_category_products(self, level_0: str, limit: int = 10):
+        return await self._get("/products", level0=level_0, limit=limit)
+
+    async def search(self, query: str, limit: int = 10):
+        return await self._get("/search", q=query, limit=limit)
+
+    async def search_cards(self, query: str, limit: int, offset: int = 0):
+        data = await self._get("/search/cards", q=query, limit=limit, offset=offset)
+        return data["cards"], data["next_offset"]
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class ChatResponseCache:
+    """
+    Кэш ответов каталога по чатам: ключ (chat_id, запрос), TTL и ограничение размера (LRU)
+    При изменении каталога/цен в этом процессе или других воркерах кэш сбрасывается целиком
+    """
+
+    def __init__(self, ttl: float = CHAT_CACHE_TTL, max_entries: int = CHAT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        shared_versions.subscribe("catalog", self.clear)
+        shared_versions.subscribe("prices", self.clear)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_load(self, chat_id: int, key: Tuple, loader: Callable[[], Awaitable[Any]]):
+        shared_versions.check()
+        cache_key = (chat_id, *key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+
+        self.misses += 1
+        value = await loader()
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic(), value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def create_catalog_service(mode: Optional[str] = None) -> CatalogService:
+    """Выбрать реализацию: BOT_API_MODE=local (по умолчанию) или remote (BOT_API_URL)"""
+    mode = (mode or Config.BOT_API_MODE).lower()
+    if mode == "remote":
+        return RemoteCatalogService(Config.BOT_API_URL)
+    return LocalCatalogService()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Согласование in-process кэшей между воркерами
+
+Общие счетчики версий хранятся в маленьком файле, отображенном в память (mmap).
+Процесс, изменивший данные, увеличивает счетчик своей области ("catalog", "prices", "promo");
+каждый воркер на каждом запросе сравнивает счетчики со своими (несколько байт из памяти, без syscalls)
+и сбрасывает локальные кэши подписчиков, если версия изменилась.
+
+Счетчики увеличиваются автоматически:
+- после commit сессии SQLAlchemy, изменившей товары/изображения/описания/категории/промокоды
+- после записи файла цен (price_storage)
+"""
+
+import os
+import mmap
+import struct
+import threading
+from typing import Callable, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import Config
+from models import Product, ProductImage, Level2Description, Category, SkuVariant, PromoCode
+
+try:
+    import fcntl
+except ImportError:  # Windows - блокировка только внутри процесса
+    fcntl = None
+
+# Области версий (порядок = позиция счетчика в файле, менять только добавлением в конец)
+VERSION_SLOTS = ("catalog", "prices", "promo")
+
+# Какие модели относятся к какой области
+MODEL_SLOTS = {
+    Product: "catalog",
+    ProductImage: "catalog",
+    Level2Description: "catalog",
+    Category: "catalog",
+    SkuVariant: "catalog",
+    PromoCode: "promo",
+}
+
+_COUNTER = struct.Struct("<Q")
+
+
+def _default_versions_path() -> str:
+    """Файл версий рядом с SQLite БД (у каждой БД свой), иначе в папке проекта"""
+    explicit = os.getenv('CACHE_VERSIONS_FILE')
+    if explicit:
+        return explicit
+    url = Config.DATABASE_URL
+    if url.startswith("sqlite:///"):
+        db_path = url[len("sqlite:///"):]
+        if db_path and db_path != ":memory:":
+            return os.path.abspath(db_path) + ".versions"
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.versions")
+
+
+class SharedVersions:
+    """Счетчики версий, общие для всех процессов на одном сервере"""
+
+    def __init__(self, path: str, slots=VERSION_SLOTS):
+        self.path = path
+        self.slots = {name: index for index, name in enumerate(slots)}
+        self._buffer = None
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = {}
+        self._subscribers: Dict[str, List[Callable[[], None]]] = {name: [] for name in slots}
+
+    def _map(self):
+        if self._buffer is not None:
+            return self._buffer
+        with self._lock:
+            if self._buffer is None:
+                size = _COUNTER.size * len(self.slots)
+                try:
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    try:
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                        self._buffer = mmap.mmap(fd, size)
+                    finally:
+                        os.close(fd)
+                except (OSError, ValueError) as e:
+                    # Без общего файла кэши согласованы только внутри процесса
+                    print(f"⚠️  Не удалось открыть файл версий {self.path}: {e}")
+                    self._buffer = bytearray(size)
+        return self._buffer
+
+    def get(self, name: str) -> int:
+        """Текущая версия области (чтение из памяти)"""
+        return _COUNTER.unpack_from(self._map(), self.slots[name] * _COUNTER.size)[0]
+
+    def bump(self, name: str) -> int:
+        """Увеличить версию области для всех процессов и сразу сбросить свои кэши"""
+        buffer = self._map()
+        offset = self.slots[name] * _COUNTER.size
+        with self._lock:
+            lock_fd = None
+            if fcntl is not None and isinstance(buffer, mmap.mmap):
+                lock_fd = os.open(self.path, os.O_RDWR)
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                value = _COUNTER.unpack_from(buffer, offset)[0] + 1
+                _COUNTER.pack_into(buffer, offset, value)
+            finally:
+                if lock_fd is not None:
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                    os.close(lock_fd)
+        self.check()
+        return value
+
+    def subscribe(self, name: str, callback: Callable[[], None]):
+        """Вызывать callback при изменении версии области (в любом процессе)"""
+        self._subscribers[name].append(callback)
+        self._seen.setdefault(name, self.get(name))
+
+    def check(self):
+        """Сверить версии с общим файлом; вызывается на каждом запросе"""
+        for name, callbacks in self._subscribers.items():
+            if not callbacks:
+                continue
+            current = self.get(name)
+            if self._seen.get(name) != current:
+                self._seen[name] = current
+                for callback in callbacks:
+                    callback()
+
+
+# Глобальный экземпляр для процесса
+shared_versions = SharedVersions(_default_versions_path())
+
+
+class CacheCoherenceMiddleware:
+    """ASGI middleware: проверка общих версий перед обработкой каждого HTTP запроса"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            shared_versions.check()
+        await self.app(scope, receive, send)
+
+
+def _mark_dirty(session: Session, slot: str):
+    session.info.setdefault("yo_dirty_versions", set()).add(slot)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_slots(session, flush_context):
+    # В after_flush списки new/dirty/deleted еще содержат состояние до flush
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        slot = MODEL_SLOTS.get(type(obj))
+        if slot:
+            _mark_dirty(session, slot)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_slots(orm_execute_state):
+    # UPDATE/DELETE/INSERT выражения (update(PromoCode)..., query.delete()) идут мимо flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    slot = MODEL_SLOTS.get(mapper.class_) if mapper is not None else None
+    if slot:
+        _mark_dirty(orm_execute_state.session, slot)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_slots(session):
+    for slot in session.info.pop("yo_dirty_versions", ()):
+        shared_versions.bump(slot)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_slots(session):
+    session.info.pop("yo_dirty_versions", None)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Расчет корзины на сервере и подписанная котировка (quote) для оформления заказа
+
+POST /cart/evaluate считает корзину по текущим ценам: товары - одним IN запросом,
+цены - одним пакетным чтением, скидка - движком промокодов. Вместе с суммами выдается
+котировка: позиции, цены и итоги, подписанные HMAC (Config.SECRET_KEY) и действующие
+Config.CART_QUOTE_TTL_SECONDS. POST /orders с действующей котировкой берет цены и суммы
+из нее без пересчета; просроченная, чужая или не совпадающая с составом заказа - отказ,
+клиент пересчитывает корзину.
+
+Пока SECRET_KEY - заглушка из config.py/.env/документации или короче MIN_SECRET_KEY_LENGTH,
+котировку может подделать кто угодно: такие ключи котировки не выдают и не принимают
+(расчет корзины работает, заказ оформляется по суммам клиента, как раньше).
+"""
+
+import hmac
+import time
+import base64
+import binascii
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from sqlalchemy.orm import Session
+
+from config import Config
+from promo_engine import promo_engine, CartSnapshot
+
+# Формат котировки (меняется при изменении полей payload)
+QUOTE_VERSION = 1
+
+# Поля позиции, от которых зависит котировка (помимо товара и количества)
+VARIANT_FIELDS = ("color", "memory", "sim", "ram")
+
+# Значения SECRET_KEY по умолчанию и из примеров .env в документации - публично известны
+PLACEHOLDER_SECRET_KEYS = frozenset({
+    "your-secret-key-change-this", "your_secret_key", "your_secret_key_here",
+    "ваш_секретный_ключ", "ваш_секретный_ключ_минимум_32_символа", "сгенерируйте_случайный_ключ_здесь",
+})
+MIN_SECRET_KEY_LENGTH = 16
+
+QUOTES_DISABLED_MESSAGE = "Котировки корзины отключены: на сервере не задан собственный SECRET_KEY"
+
+
+class InvalidQuote(ValueError):
+    """Котировка не может быть принята (текст - для клиента)"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def quotes_enabled() -> bool:
+    """Котировки подписываются только собственным ключом сервера (не заглушкой и не коротким)"""
+    key = Config.SECRET_KEY or ""
+    return key not in PLACEHOLDER_SECRET_KEYS and len(key) >= MIN_SECRET_KEY_LENGTH
+
+
+def _signature(payload: str) -> str:
+    return _b64encode(hmac.new(Config.SECRET_KEY.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def _item_key(item: Any) -> list:
+    """Позиция корзины в котировке: товар, количество и выбранный вариант"""
+    return [item.product_id, item.quantity, *[getattr(item, field, None) or None for field in VARIANT_FIELDS]]
+
+
+def sign_quote(payload: Dict[str, Any]) -> str:
+    encoded = _b64encode(orjson.dumps(payload))
+    return f"{encoded}.{_signature(encoded)}"
+
+
+def evaluate_cart(db: Session, items: Iterable[Any], promo_code: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Суммы корзины по текущим ценам и котировка (если все позиции доступны)
+    items - позиции с product_id, quantity и полями варианта (как OrderItemCreate)
+    """
+    items = list(items)
+    cart = CartSnapshot(db, items)
+    prices = cart.load_prices()
+
+    lines = []
+    for item in items:
+        product = cart.products.get(item.product_id)
+        price_data = prices.get(product.sku) if product is not None and product.sku else None
+        line = {
+            "product_id": item.product_id,
+            "sku": product.sku if product is not None else None,
+            "name": product.name if product is not None else getattr(item, "name", None),
+            "quantity": item.quantity,
+            "price": 0.0,
+            "old_price": 0.0,
+            "line_total": 0.0,
+            "available": False,
+            "message": None,
+        }
+        if item.quantity < 1:
+            line["message"] = "Некорректное количество"
+        elif product is None:
+            line["message"] = "Товар не найден"
+        elif not product.is_available:
+            line["message"] = "Товар недоступен для заказа"
+        elif not price_data or not price_data.get("price"):
+            line["message"] = "Цена товара не найдена"
+        else:
+            price = float(price_data["price"])
+            line.update(
+                price=price,
+                old_price=float(price_data.get("old_price") or price),
+                line_total=round(price * item.quantity, 2),
+                available=True,
+            )
+        lines.append(line)
+
+    subtotal = round(sum(line["line_total"] for line in lines), 2)
+    promo = None
+    discount_amount = 0.0
+    if promo_code:
+        promo = promo_engine.evaluate(db, promo_code, subtotal, items, cart=cart)
+        if promo["valid"]:
+            discount_amount = round(promo.get("discount_amount") or 0.0, 2)
+    final_total = round(max(0.0, subtotal - discount_amount), 2)
+
+    valid = bool(lines) and all(line["available"] for line in lines)
+    quote = None
+    expires_at = None
+    message = None if valid else "Некоторые товары недоступны для заказа"
+    if valid and not quotes_enabled():
+        message = QUOTES_DISABLED_MESSAGE
+    elif valid:
+        expires_at = int(time.time() + Config.CART_QUOTE_TTL_SECONDS)
+        quote = sign_quote({
+            "v": QUOTE_VERSION,
+            "exp": expires_at,
+            "items": [_item_key(item) for item in items],
+            "prices": [line["price"] for line in lines],
+            "promo_code": promo_code.upper() if promo_code and discount_amount else None,
+            "subtotal": subtotal,
+            "discount": discount_amount,
+            "final_total": final_total,
+        })
+
+    return {
+        "valid": valid,
+        "lines": lines,
+        "subtotal": subtotal,
+        "discount_amount": discount_amount,
+        "final_total": final_total,
+        "promo": promo,
+        "quote": quote,
+        "quote_expires_at": expires_at,
+        "message": message,
+    }
+
+
+def verify_quote(token: str, items: List[Any], promo_code: Optional[str]) -> Dict[str, Any]:
+    """
+    Проверить котировку для оформляемого заказа и вернуть ее payload
+    Бросает InvalidQuote: подпись не сходится, срок истек, состав корзины или промокод другие
+    """
+    if not quotes_enabled():
+        raise InvalidQuote(QUOTES_DISABLED_MESSAGE)
+    encoded, _, signature = (token or "").partition(".")
+    # Котировка приходит от клиента: не-ASCII символы или битый base64 - та же недействительная котировка
+    try:
+        if not encoded or not hmac.compare_digest(signature.encode("ascii"), _signature(encoded).encode("ascii")):
+            raise InvalidQuote("Котировка недействительна, пересчитайте корзину")
+        payload = orjson.loads(_b64decode(encoded))
+    except (UnicodeEncodeError, binascii.Error, orjson.JSONDecodeError):
+        raise InvalidQuote("Котировка недействительна, пересчитайте корзину")
+    if not isinstance(payload, dict):
+        raise InvalidQuote("Котировка недействительна, пересчитайте корзину")
+
+    if payload.get("v") != QUOTE_VERSION:
+        raise InvalidQuote("Котировка недействительна, пересчитайте корзину")
+    if payload["exp"] < time.time():
+        raise InvalidQuote("Срок действия расчета корзины истек, пересчитайте корзину")
+    if payload["items"] != [_item_key(item) for item in items]:
+        raise InvalidQuote("Состав корзины изменился после расчета, пересчитайте корзину")
+    # Промокод без скидки в котировку не попадает - и при заказе не учитывается
+    if payload["promo_code"] and payload["promo_code"] != (promo_code or "").upper():
+        raise InvalidQuote("Промокод изменился после расчета, пересчитайте корзину")
+    return payload
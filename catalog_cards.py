@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Предрасчитанные карточки моделей для inline поиска бота (@bot iphone 16)
+
+Одна карточка на модель (level_2): название, минимальная цена, миниатюра и ссылка
+на страницу модели в WebApp. Список строится целиком за один проход по каталогу
+(один запрос товаров, один запрос изображений, одно чтение файла цен) и хранится в памяти;
+поиск - проверка подстрок по заранее подготовленному тексту, без запросов к БД.
+При изменении каталога или цен (в любом воркере) список помечается устаревшим
+и перестраивается при следующем поиске.
+"""
+
+import json
+import hashlib
+import threading
+from urllib.parse import quote, urlencode
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from database import SessionLocal
+from models import Product, ProductImage
+from price_storage import get_all_prices
+from cache_coherence import shared_versions
+
+# Telegram принимает не больше 50 результатов в одном ответе на inline запрос
+MAX_INLINE_RESULTS = 50
+
+
+def _normalize_image_key(level_2: str, color: str) -> Tuple[str, str]:
+    """Ключ для сопоставления изображений без учета регистра, пробелов и дефисов"""
+    level_2_key = level_2.lower().replace(' ', '').replace('-', '').replace('series', '')
+    color_key = color.lower().replace(' ', '').replace('-', '').replace('/', '').replace('_', '')
+    return level_2_key, color_key
+
+
+def parse_image_list(raw) -> List[str]:
+    """URL из img_list / specifications.images (строки или {"url": ...}, в т.ч. двойной JSON)"""
+    try:
+        images_data = json.loads(raw) if isinstance(raw, str) else raw
+        if isinstance(images_data, str):
+            images_data = json.loads(images_data)
+    except (json.JSONDecodeError, TypeError):
+        return []
+    if not isinstance(images_data, list):
+        return []
+    urls = []
+    for img_data in images_data:
+        if isinstance(img_data, dict) and img_data.get("url"):
+            urls.append(img_data["url"])
+        elif isinstance(img_data, str) and img_data:
+            urls.append(img_data)
+    return urls
+
+
+def _absolute_url(url: str) -> str:
+    """Telegram загружает миниатюры сам - относительные пути превращаем в полные"""
+    if url.startswith(("http://", "https://")):
+        return url
+    return f"{Config.PUBLIC_URL}/{url.lstrip('/')}"
+
+
+def model_deep_link(level_2: str) -> str:
+    """Ссылка на детальную страницу модели в WebApp (формат hash-роутинга webapp.html)"""
+    return f"{Config.PUBLIC_URL}/webapp#product_detail?{urlencode({'model': level_2}, quote_via=quote)}"
+
+
+class CatalogCardIndex:
+    """Список карточек моделей в памяти процесса с ленивым перестроением"""
+
+    def __init__(self):
+        self._cards: List[Dict[str, Any]] = []
+        self._haystacks: List[str] = []
+        self._stale = True
+        self._lock = threading.Lock()
+        shared_versions.subscribe("catalog", self.invalidate)
+        shared_versions.subscribe("prices", self.invalidate)
+
+    def invalidate(self):
+        self._stale = True
+
+    @property
+    def is_stale(self) -> bool:
+        shared_versions.check()
+        return self._stale
+
+    def refresh(self, force: bool = False):
+        """Перестроить карточки, если каталог или цены изменились (или force)"""
+        with self._lock:
+            if not force and not self.is_stale:
+                return
+            # Сбрасываем флаг до чтения: изменение во время сборки снова пометит список устаревшим
+            self._stale = False
+            try:
+                cards = self._build_cards()
+            except Exception:
+                self._stale = True
+                raise
+            self._cards = cards
+            self._haystacks = [card.pop("_haystack") for card in cards]
+
+    def _build_cards(self) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            products = db.query(
+                Product.sku, Product.name, Product.brand, Product.level_0,
+                Product.level_1, Product.level_2, Product.specifications
+            ).filter(Product.is_available == True).order_by(Product.level_0, Product.level_2, Product.id).all()
+            image_rows = db.query(ProductImage.level_2, ProductImage.color, ProductImage.img_list).all()
+        finally:
+            db.close()
+
+        prices = get_all_prices()
+        images_by_key = {}
+        for level_2, color, img_list in image_rows:
+            images_by_key.setdefault(_normalize_image_key(level_2, color), img_list)
+
+        models: Dict[str, Dict[str, Any]] = {}
+        for sku, name, brand, level_0, level_1, level_2, specifications in products:
+            model_name = level_2 or name
+            card = models.get(model_name)
+            if card is None:
+                card = models[model_name] = {
+                    "title": model_name,
+                    "level_2": model_name,
+                    "brand": brand,
+                    "level_0": level_0,
+                    "level_1": level_1,
+                    "min_price": None,
+                    "old_price": None,
+                    "currency": "RUB",
+                    "variants_count": 0,
+                    "thumbnail_url": None,
+                    "_search_parts": {model_name.lower(), (brand or "").lower(), (level_0 or "").lower(), (level_1 or "").lower()},
+                }
+            card["variants_count"] += 1
+            card["_search_parts"].add(sku.lower())
+
+            price_data = prices.get(sku)
+            if price_data and price_data.get('price', 0) > 0 and (card["min_price"] is None or price_data['price'] < card["min_price"]):
+                card["min_price"] = price_data['price']
+                card["old_price"] = price_data.get('old_price', 0.0)
+                card["currency"] = price_data.get('currency', 'RUB')
+
+            if card["thumbnail_url"] is None:
+                try:
+                    specs = json.loads(specifications) if specifications else {}
+                except json.JSONDecodeError:
+                    specs = {}
+                images = parse_image_list(specs.get('images', []))
+                if not images and specs.get('color'):
+                    images = parse_image_list(images_by_key.get(_normalize_image_key(model_name, specs['color'])))
+                if images:
+                    card["thumbnail_url"] = _absolute_url(images[0])
+
+        cards = []
+        for card in models.values():
+            card["id"] = hashlib.md5(card["level_2"].encode('utf-8')).hexdigest()
+            card["url"] = model_deep_link(card["level_2"])
+            card["_haystack"] = " ".join(sorted(card.pop("_search_parts")))
+            cards.append(card)
+        return cards
+
+    def search(self, query: str, limit: int = MAX_INLINE_RESULTS, offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Карточки, содержащие все слова запроса (название, бренд, категория, SKU)
+        Модели, название которых начинается с запроса, идут первыми
+        Возвращает (карточки, следующий offset или None)
+        """
+        if self.is_stale:
+            self.refresh()
+        cards, haystacks = self._cards, self._haystacks
+
+        query = query.strip().lower()
+        terms = query.split()
+        if terms:
+            matches = [card for card, haystack in zip(cards, haystacks) if all(term in haystack for term in terms)]
+            matches.sort(key=lambda card: not card["title"].lower().startswith(query))
+        else:
+            matches = cards
+
+        page = matches[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(matches) else None
+        return page, next_offset
+
+    def __len__(self):
+        return len(self._cards)
+
+
+# Глобальный экземпляр для процесса
+catalog_cards = CatalogCardIndex()
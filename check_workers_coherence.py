@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Проверка согласованности кэшей между воркерами
+Запускает uvicorn с N воркерами на копии БД, прогревает их кэши, затем меняет данные
+из отдельного процесса (как price updater или админка на другом воркере) и проверяет,
+что все воркеры начинают отдавать новые значения:
+- цену товара (кэш файла цен, версия "prices")
+- скидку промокода (кэш правил промокодов, версия "promo")
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import requests
+from sqlalchemy import create_engine, text
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PROJECT_DIR)
+
+from stress_test_orders import find_free_port, start_server
+
+PROMO_CODE = "COHERENCE"
+
+
+def prepare_data(source_db: str, work_dir: str):
+    """Скопировать БД, создать файл цен и тестовый промокод"""
+    db_path = os.path.join(work_dir, 'coherence.db')
+    shutil.copy(source_db, db_path)
+    database_url = f"sqlite:///{db_path}"
+    prices_file = os.path.join(work_dir, 'current_prices.json')
+
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        product_id, sku = conn.execute(text("SELECT id, sku FROM products ORDER BY id LIMIT 1")).one()
+        skus = [row[0] for row in conn.execute(text("SELECT sku FROM products"))]
+        conn.execute(text("DELETE FROM promo_codes WHERE code = :code"), {"code": PROMO_CODE})
+        conn.execute(text("""
+            INSERT INTO promo_codes (code, discount_type, discount_value, min_order_amount, is_active, used_count, description)
+            VALUES (:code, 'fixed', 100.0, 0.0, 1, 0, 'Coherence check')
+        """), {"code": PROMO_CODE})
+    engine.dispose()
+
+    prices = {s: {"price": 1000.0, "old_price": 1000.0, "currency": "RUB", "is_parse": True} for s in skus}
+    with open(prices_file, 'w', encoding='utf-8') as f:
+        json.dump(prices, f)
+
+    return database_url, prices_file, product_id, sku
+
+
+def fetch_price(base_url: str, product_id: int) -> float:
+    # Новое соединение на каждый запрос - запросы распределяются между воркерами
+    return requests.get(f"{base_url}/products/{product_id}", headers={"Connection": "close"}, timeout=10).json()["price"]
+
+
+def fetch_discount(base_url: str) -> float:
+    response = requests.post(
+        f"{base_url}/promo-codes/check",
+        json={"code": PROMO_CODE, "cart_total": 10000.0, "items": []},
+        headers={"Connection": "close"},
+        timeout=10
+    )
+    return response.json()["discount_amount"]
+
+
+def wait_for_convergence(probe, expected, probes: int, deadline: float):
+    """
+    Опрашивать воркеров, пока probes ответов подряд не совпадут с ожидаемым значением
+    Возвращает (сошлось ли, время до сходимости, число устаревших ответов)
+    """
+    started = time.perf_counter()
+    stale = 0
+    streak = 0
+    while time.perf_counter() - started < deadline:
+        if probe() == expected:
+            streak += 1
+            if streak >= probes:
+                return True, time.perf_counter() - started, stale
+        else:
+            stale += 1
+            streak = 0
+    return False, time.perf_counter() - started, stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка согласованности кэшей между воркерами")
+    parser.add_argument('--db', default=os.path.join(PROJECT_DIR, 'electronics_store.db'), help='Исходная SQLite БД (копируется)')
+    parser.add_argument('--workers', type=int, default=4, help='Воркеров uvicorn')
+    parser.add_argument('--warmup', type=int, default=100, help='Запросов прогрева (кэши во всех воркерах)')
+    parser.add_argument('--probes', type=int, default=100, help='Сколько ответов подряд должны быть актуальными')
+    parser.add_argument('--deadline', type=float, default=10.0, help='Максимальное время сходимости, с')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='yo_coherence_')
+    database_url, prices_file, product_id, sku = prepare_data(args.db, work_dir)
+
+    # Этот процесс выступает внешним писателем - модули должны смотреть на ту же БД и файл цен
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['PRICES_FILE'] = prices_file
+    from price_storage import set_price
+    from database import SessionLocal
+    from models import PromoCode
+
+    print(f"🧪 Согласованность кэшей: {args.workers} воркеров, БД {database_url}")
+    process, base_url = start_server(database_url, prices_file, find_free_port(), args.workers)
+
+    problems = []
+    try:
+        # Прогрев: каждый воркер кэширует цены и правила промокодов
+        for _ in range(args.warmup):
+            assert fetch_price(base_url, product_id) == 1000.0
+            assert fetch_discount(base_url) == 100.0
+
+        # 1. Цена меняется внешним процессом
+        set_price(sku, 1500.0, 2000.0)
+        ok, elapsed, stale = wait_for_convergence(lambda: fetch_price(base_url, product_id), 1500.0, args.probes, args.deadline)
+        print(f"{'✅' if ok else '❌'} Цена: {args.probes} актуальных ответов подряд через {elapsed * 1000:.0f} мс, устаревших ответов: {stale}")
+        if not ok:
+            problems.append("воркеры не увидели новую цену")
+
+        # 2. Промокод меняется через ORM в другом процессе (TTL кэша правил 60 с - сходимость только через версии)
+        db = SessionLocal()
+        try:
+            promo = db.query(PromoCode).filter(PromoCode.code == PROMO_CODE).one()
+            promo.discount_value = 777.0
+            db.commit()
+        finally:
+            db.close()
+        ok, elapsed, stale = wait_for_convergence(lambda: fetch_discount(base_url), 777.0, args.probes, args.deadline)
+        print(f"{'✅' if ok else '❌'} Промокод: {args.probes} актуальных ответов подряд через {elapsed * 1000:.0f} мс, устаревших ответов: {stale}")
+        if not ok:
+            problems.append("воркеры не увидели изменение промокода")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if problems:
+        print("❌ " + "; ".join(problems))
+        sys.exit(1)
+    print("✅ Все воркеры сошлись к актуальным данным")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,88 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
     
+    # How the bot reaches the catalog: 'local' (same process as the API) or 'remote' (HTTP to BOT_API_URL)
+    BOT_API_MODE = os.getenv('BOT_API_MODE', 'local')
+    BOT_API_URL = os.getenv('BOT_API_URL', f"http://{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}")
+    
+    # Public address of the shop: inline query links and thumbnails must be absolute URLs
+    PUBLIC_URL = os.getenv('PUBLIC_URL', f"http://{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}").rstrip('/')
+    # How long Telegram may serve a cached answer to the same inline query, seconds
+    INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+    
     # Database Configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./electronics_store.db')
     
     # App Configuration
+    # Signs cart quotes (/cart/evaluate): must be a private random value of 16+ characters,
+    # with the default or a documented placeholder quotes are neither issued nor accepted
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
     DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 8000))
     
+    # Validate hot list responses (/all-products, /products, /search) through Pydantic models instead of
+    # returning lean rows straight to orjson; enable in tests to catch schema drift
+    STRICT_RESPONSE_VALIDATION = os.getenv('STRICT_RESPONSE_VALIDATION', 'False').lower() == 'true'
+    
+    # Rows per database fetch and per written chunk in NDJSON streaming mode
+    # (?stream=1 or Accept: application/x-ndjson on /all-products, /api/images, /hierarchy/skus)
+    NDJSON_CHUNK_SIZE = int(os.getenv('NDJSON_CHUNK_SIZE', 500))
+    
+    # Maximum number of ids/SKUs/models in one batch request (/products/batch, /variants/batch, /prices/batch)
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 200))
+    
+    # How long a signed cart quote from POST /cart/evaluate is honoured by POST /orders (prices are locked for this time)
+    CART_QUOTE_TTL_SECONDS = int(os.getenv('CART_QUOTE_TTL_SECONDS', 300))
+    
+    # Background jobs (Excel imports/exports): worker threads per process, max queued jobs,
+    # where uploads and results are stored and how long finished job files are kept
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_MAX_QUEUED = int(os.getenv('JOB_MAX_QUEUED', 20))
+    JOBS_DIR = os.getenv('JOBS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs'))
+    JOB_RETENTION_HOURS = float(os.getenv('JOB_RETENTION_HOURS', 24))
+
+    # Image reference scanner (image_integrity.py, /api/admin/image-integrity): parallel file checks,
+    # where per-file results are cached (reused while path, mtime and size are unchanged),
+    # limits above which an image is reported as oversized and the external URL check timeout
+    IMAGE_SCAN_WORKERS = int(os.getenv('IMAGE_SCAN_WORKERS', 8))
+    IMAGE_SCAN_CACHE_FILE = os.getenv('IMAGE_SCAN_CACHE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_scan_cache.json'))
+    IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 3 * 1024 * 1024))
+    IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 4000))
+    IMAGE_URL_CHECK_TIMEOUT = float(os.getenv('IMAGE_URL_CHECK_TIMEOUT', 5))
+
+    # Price/stock change feed (/events/prices, SSE): changes kept for Last-Event-ID resume,
+    # keep-alive comment interval and how often changes made by other processes are picked up
+    PRICE_EVENTS_BUFFER = int(os.getenv('PRICE_EVENTS_BUFFER', 10000))
+    PRICE_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('PRICE_EVENTS_HEARTBEAT_SECONDS', 15))
+    PRICE_EVENTS_POLL_SECONDS = float(os.getenv('PRICE_EVENTS_POLL_SECONDS', 1))
+
+    # Admission control (admission.py): per-class concurrent request limits and wait queue sizes,
+    # total concurrent limited requests per worker and how long a request may wait for a slot
+    ADMISSION_CONTROL_ENABLED = os.getenv('ADMISSION_CONTROL_ENABLED', 'True').lower() == 'true'
+    ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', 32))
+    ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 10))
+    ADMISSION_ORDERS_LIMIT = int(os.getenv('ADMISSION_ORDERS_LIMIT', 16))
+    ADMISSION_ORDERS_QUEUE = int(os.getenv('ADMISSION_ORDERS_QUEUE', 200))
+    ADMISSION_CATALOG_LIMIT = int(os.getenv('ADMISSION_CATALOG_LIMIT', 32))
+    ADMISSION_CATALOG_QUEUE = int(os.getenv('ADMISSION_CATALOG_QUEUE', 200))
+    ADMISSION_HEAVY_LIMIT = int(os.getenv('ADMISSION_HEAVY_LIMIT', 1))
+    ADMISSION_HEAVY_QUEUE = int(os.getenv('ADMISSION_HEAVY_QUEUE', 4))
+
+    # Number of API worker processes (WEB_CONCURRENCY is the common convention on PaaS)
+    WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+    # Seconds to wait for open requests on shutdown; SSE streams (/events/prices) never finish by themselves
+    GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv('GRACEFUL_SHUTDOWN_SECONDS', 5))
+    
+    # Performance metrics (/metrics, Server-Timing); disabled by default
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False').lower() == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    # Slow query log (/api/admin/slow-queries); disabled by default
+    SLOW_QUERY_LOG_ENABLED = os.getenv('SLOW_QUERY_LOG_ENABLED', 'False').lower() == 'true'
+    # Slow query log threshold in milliseconds (0 disables the log)
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    
     # Price Update Configuration - REMOVED
     # Automatic price updates removed - now only manual via Excel API
     # PRICE_UPDATE_INTERVAL = 10  # minutes
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base
 from config import Config
+import cache_coherence  # registers session hooks that bump shared cache versions on commit
 
 # Create database engine
 engine = create_engine(Config.DATABASE_URL)
@@ -12,6 +13,18 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 def create_tables():
     """Create all tables in the database"""
     Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+
+def ensure_indexes():
+    """
+    Create indexes added to models after their tables already existed
+    (create_all skips existing tables, so their new indexes are never created)
+    """
+    from models import Order
+    
+    for table in (Order.__table__,):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def get_db():
     """Dependency to get database session"""
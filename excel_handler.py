@@ -2,6 +2,7 @@
 Модуль для работы с Excel файлами (XLSX) в Yo Store
 """
 
+import numpy as np
 import pandas as pd
 import openpyxl
 from openpyxl import Workbook
@@ -12,6 +13,59 @@ import json
 from datetime import datetime
 import io
 
+def _text_column(df: pd.DataFrame, column: str, default: str = '', upper: bool = False, keep_empty: bool = False) -> List[str]:
+    """str(значение).strip() для всей колонки; пустые ячейки и отсутствующая колонка - default"""
+    if column not in df.columns:
+        return [default] * len(df)
+    values = df[column]
+    # astype(str) у дат отбрасывает время - для них str() по ячейкам, как у построчного разбора
+    text = values.astype(str) if values.dtype.kind in 'Oifbu' else values.map(str)
+    text = text.str.strip()
+    if upper:
+        text = text.str.upper()
+    if not keep_empty:
+        text = text.where(values.notna(), default)
+    return text.tolist()
+
+
+def _float_column(values: pd.Series):
+    """
+    float() для всей колонки: to_numeric для колонки целиком, ячейки, которые он не разобрал,
+    проверяются float() по одной. Возвращает (список значений, {позиция: текст ошибки})
+    """
+    numbers = pd.to_numeric(values, errors='coerce').astype(float)
+    raw = values.to_numpy()
+    unparsed = np.flatnonzero(numbers.isna().to_numpy() & values.notna().to_numpy())
+    numbers = numbers.tolist()
+    errors = {}
+    for position in unparsed:
+        try:
+            numbers[position] = float(raw[position])
+        except (ValueError, TypeError) as e:
+            errors[position] = str(e)
+    return numbers, errors
+
+
+def _int_column(values: pd.Series):
+    """
+    int() для всей колонки (дробные числа отбрасывают дробную часть). Строки, бесконечности
+    и очень большие числа проверяются int() по одной. Возвращает (список значений, {позиция: текст ошибки})
+    """
+    numbers = pd.to_numeric(values, errors='coerce').astype(float)
+    slow = ~np.isfinite(numbers.to_numpy()) | (numbers.abs() >= 2 ** 63).to_numpy()
+    if values.dtype == object:
+        slow |= values.map(type).eq(str).to_numpy()
+    result = np.trunc(numbers.where(~slow, 0)).astype(np.int64).tolist()
+    raw = values.to_numpy()
+    errors = {}
+    for position in np.flatnonzero(slow):
+        try:
+            result[position] = int(raw[position])
+        except (ValueError, TypeError, OverflowError) as e:
+            errors[position] = str(e)
+    return result, errors
+
+
 class ExcelHandler:
     """Класс для работы с Excel файлами"""
     
@@ -190,176 +244,184 @@ class ExcelHandler:
         try:
             # Читаем Excel файл
             df = pd.read_excel(io.BytesIO(file_content), sheet_name='Товары')
-            
-            # Проверяем обязательные колонки
-            required_columns = ['Название товара*', 'Основная категория (level0)*', 'Подкатегория (level1)*', 'Детальная категория (level2)*', 'Цена*']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
-            
-            products = []
-            errors = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Пропускаем пустые строки (проверяем обязательные поля, кроме цены)
-                    if (pd.isna(row['Название товара*']) or 
-                        pd.isna(row['Основная категория (level0)*']) or 
-                        pd.isna(row['Подкатегория (level1)*']) or 
-                        pd.isna(row['Детальная категория (level2)*'])):
-                        continue
-                    
-                    # Обработка цены: если пустая, используем 0 или пропускаем строку
-                    price_value = row['Цена*']
-                    if pd.isna(price_value):
-                        # Пытаемся найти цену в других колонках или используем 0
-                        price_value = row.get('Цена', 0)
-                        if pd.isna(price_value):
-                            price_value = 0
-                    try:
-                        price = float(price_value)
-                    except (ValueError, TypeError):
-                        price = 0
-                    
-                    # Парсим характеристики
-                    specifications = {}
-                    if not pd.isna(row.get('Характеристики (JSON)', '')):
-                        try:
-                            specifications = json.loads(str(row['Характеристики (JSON)']))
-                        except json.JSONDecodeError:
-                            specifications = {}
-                    
-                    # Извлекаем специфичные поля из specifications или из отдельных колонок
-                    color = specifications.get('color', '') if specifications else ''
-                    disk = specifications.get('disk', specifications.get('memory', '')) if specifications else ''
-                    ram = specifications.get('ram', '') if specifications else ''
-                    sim_config = specifications.get('sim_config', specifications.get('sim_type', '')) if specifications else ''
-                    
-                    product = {
-                        'sku': str(row.get('SKU товара', '')).strip() if not pd.isna(row.get('SKU товара', '')) else '',
-                        'name': str(row['Название товара*']).strip(),
-                        'description': str(row.get('Описание', '')).strip() if not pd.isna(row.get('Описание', '')) else '',
-                        'level0': str(row['Основная категория (level0)*']).strip(),
-                        'level1': str(row['Подкатегория (level1)*']).strip(),
-                        'level2': str(row['Детальная категория (level2)*']).strip(),
-                        'brand': str(row.get('Бренд', '')).strip() if not pd.isna(row.get('Бренд', '')) else '',
-                        'price': price,
-                        'currency': str(row.get('Валюта', 'RUB')).strip().upper() if not pd.isna(row.get('Валюта', 'RUB')) else 'RUB',
-                        'stock': int(row.get('Количество на складе', 0)) if not pd.isna(row.get('Количество на складе', 0)) else 0,
-                        'image_url': str(row.get('URL изображения (через запятую)', '')).strip() if not pd.isna(row.get('URL изображения (через запятую)', '')) else '',
-                        'specifications': specifications,
-                        'color': color,
-                        'disk': disk,
-                        'ram': ram,
-                        'sim_config': sim_config
-                    }
-                    
-                    products.append(product)
-                    
-                except Exception as e:
-                    errors.append(f"Строка {index + 2}: {str(e)}")
-            
-            if errors:
-                raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
-            
-            return products
-            
+            return self.products_from_dataframe(df)
         except Exception as e:
             raise ValueError(f"Ошибка при чтении Excel файла: {str(e)}")
     
+    def products_from_dataframe(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Строки листа "Товары": проверка и приведение типов по колонкам, номера строк в ошибках - как в Excel"""
+        # Проверяем обязательные колонки
+        required_columns = ['Название товара*', 'Основная категория (level0)*', 'Подкатегория (level1)*', 'Детальная категория (level2)*', 'Цена*']
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+        
+        # Пропускаем пустые строки (проверяем обязательные поля, кроме цены)
+        rows = np.flatnonzero(df[required_columns[:4]].notna().all(axis=1).to_numpy())
+        df = df.iloc[rows]
+        
+        # Цена: если пустая - колонка "Цена", иначе 0; нечисловая - 0
+        price_values = df['Цена*']
+        fallback = df['Цена'] if 'Цена' in df.columns else 0
+        price_values = price_values.where(price_values.notna(), fallback)
+        price_values = price_values.where(price_values.notna(), 0)
+        prices, price_errors = _float_column(price_values)
+        for position in price_errors:
+            prices[position] = 0
+        
+        # Характеристики: JSON разбирается только в непустых ячейках
+        specifications = [{} for _ in range(len(df))]
+        if 'Характеристики (JSON)' in df.columns:
+            specs_values = df['Характеристики (JSON)']
+            raw_specs = specs_values.to_numpy()
+            for position in np.flatnonzero(specs_values.notna().to_numpy()):
+                try:
+                    specifications[position] = json.loads(str(raw_specs[position]))
+                except json.JSONDecodeError:
+                    pass
+        
+        errors = {}
+        spec_fields = []
+        for position, specs in enumerate(specifications):
+            # Извлекаем специфичные поля из specifications
+            try:
+                spec_fields.append((
+                    specs.get('color', '') if specs else '',
+                    specs.get('disk', specs.get('memory', '')) if specs else '',
+                    specs.get('ram', '') if specs else '',
+                    specs.get('sim_config', specs.get('sim_type', '')) if specs else ''
+                ))
+            except Exception as e:
+                errors[position] = str(e)
+                spec_fields.append(None)
+        
+        stock_values = df['Количество на складе'] if 'Количество на складе' in df.columns else pd.Series(0, index=df.index)
+        stocks, stock_errors = _int_column(stock_values.where(stock_values.notna(), 0))
+        for position, error in stock_errors.items():
+            errors.setdefault(position, error)
+        
+        if errors:
+            raise ValueError("Ошибки при парсинге: " + '; '.join(
+                f"Строка {rows[position] + 2}: {errors[position]}" for position in sorted(errors)
+            ))
+        
+        columns = zip(
+            _text_column(df, 'SKU товара'),
+            _text_column(df, 'Название товара*'),
+            _text_column(df, 'Описание'),
+            _text_column(df, 'Основная категория (level0)*'),
+            _text_column(df, 'Подкатегория (level1)*'),
+            _text_column(df, 'Детальная категория (level2)*'),
+            _text_column(df, 'Бренд'),
+            prices,
+            _text_column(df, 'Валюта', 'RUB', upper=True),
+            stocks,
+            _text_column(df, 'URL изображения (через запятую)'),
+            specifications,
+            spec_fields
+        )
+        return [
+            {
+                'sku': sku,
+                'name': name,
+                'description': description,
+                'level0': level0,
+                'level1': level1,
+                'level2': level2,
+                'brand': brand,
+                'price': price,
+                'currency': currency,
+                'stock': stock,
+                'image_url': image_url,
+                'specifications': specs,
+                'color': color,
+                'disk': disk,
+                'ram': ram,
+                'sim_config': sim_config
+            }
+            for (sku, name, description, level0, level1, level2, brand, price, currency, stock, image_url, specs,
+                 (color, disk, ram, sim_config)) in columns
+        ]
+    
     def parse_prices_excel(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Парсить Excel файл с ценами"""
         try:
             # Читаем Excel файл
             df = pd.read_excel(io.BytesIO(file_content), sheet_name='Цены')
-            
-            # Проверяем обязательные колонки
-            required_columns = ['SKU товара*', 'Новая цена*']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
-            
-            prices = []
-            errors = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Пропускаем пустые строки
-                    if pd.isna(row['SKU товара*']) or pd.isna(row['Новая цена*']):
-                        continue
-                    
-                    price_data = {
-                        'sku': str(row['SKU товара*']).strip(),
-                        'name': str(row.get('Название товара', '')).strip(),
-                        'price': float(row['Новая цена*']),
-                        'old_price': float(row.get('Старая цена', row['Новая цена*'])),
-                        'currency': str(row.get('Валюта', 'RUB')).strip().upper()
-                    }
-                    
-                    prices.append(price_data)
-                    
-                except Exception as e:
-                    errors.append(f"Строка {index + 2}: {str(e)}")
-            
-            if errors:
-                raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
-            
-            return prices
-            
+            return self.prices_from_dataframe(df)
         except Exception as e:
             raise ValueError(f"Ошибка при чтении Excel файла: {str(e)}")
     
+    def prices_from_dataframe(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Строки листа "Цены" (проверка и приведение типов по колонкам)"""
+        # Проверяем обязательные колонки
+        required_columns = ['SKU товара*', 'Новая цена*']
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+        
+        # Пропускаем пустые строки
+        rows = np.flatnonzero(df[required_columns].notna().all(axis=1).to_numpy())
+        df = df.iloc[rows]
+        
+        prices, errors = _float_column(df['Новая цена*'])
+        # Старая цена: если колонки нет - новая цена; пустая ячейка остается NaN
+        old_prices, old_price_errors = _float_column(df['Старая цена'] if 'Старая цена' in df.columns else df['Новая цена*'])
+        for position, error in old_price_errors.items():
+            errors.setdefault(position, error)
+        
+        if errors:
+            raise ValueError("Ошибки при парсинге: " + '; '.join(
+                f"Строка {rows[position] + 2}: {errors[position]}" for position in sorted(errors)
+            ))
+        
+        # Название и валюта приводятся к строке без проверки на пустоту (как раньше: 'nan' / 'NAN')
+        names = _text_column(df, 'Название товара', keep_empty=True) if 'Название товара' in df.columns else [''] * len(df)
+        currencies = _text_column(df, 'Валюта', upper=True, keep_empty=True) if 'Валюта' in df.columns else ['RUB'] * len(df)
+        return [
+            {
+                'sku': sku,
+                'name': name,
+                'price': price,
+                'old_price': old_price,
+                'currency': currency
+            }
+            for sku, name, price, old_price, currency in zip(_text_column(df, 'SKU товара*'), names, prices, old_prices, currencies)
+        ]
+    
     def parse_images_excel(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Парсить Excel файл с изображениями"""
         try:
             # Читаем Excel файл
             df = pd.read_excel(io.BytesIO(file_content), sheet_name='Изображения')
-            
-            # Проверяем обязательные колонки
-            required_columns = ['Модель (level_2)*', 'Цвет*', 'URL изображений (через запятую)*']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
-            
-            images = []
-            errors = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Пропускаем пустые строки
-                    if pd.isna(row['Модель (level_2)*']) or pd.isna(row['Цвет*']) or pd.isna(row['URL изображений (через запятую)*']):
-                        continue
-                    
-                    # Парсим URL изображений
-                    image_urls_str = str(row['URL изображений (через запятую)*']).strip()
-                    if not image_urls_str:
-                        continue
-                    
-                    # Разделяем URL по запятой и очищаем от пробелов
-                    image_urls = [url.strip() for url in image_urls_str.split(',') if url.strip()]
-                    
-                    if not image_urls:
-                        continue
-                    
-                    image_data = {
-                        'level_2': str(row['Модель (level_2)*']).strip(),
-                        'color': str(row['Цвет*']).strip(),
-                        'img_list': image_urls
-                    }
-                    
-                    images.append(image_data)
-                    
-                except Exception as e:
-                    errors.append(f"Строка {index + 2}: {str(e)}")
-            
-            if errors:
-                raise ValueError(f"Ошибки при парсинге: {'; '.join(errors)}")
-            
-            return images
-            
+            return self.images_from_dataframe(df)
         except Exception as e:
             raise ValueError(f"Ошибка при чтении Excel файла: {str(e)}")
     
+    def images_from_dataframe(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Строки листа "Изображения": URL разделяются по запятой для всей колонки сразу"""
+        # Проверяем обязательные колонки
+        required_columns = ['Модель (level_2)*', 'Цвет*', 'URL изображений (через запятую)*']
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Отсутствуют обязательные колонки: {', '.join(missing_columns)}")
+        
+        # Пропускаем пустые строки
+        df = df[df[required_columns].notna().all(axis=1)]
+        
+        # Разделяем URL по запятой и очищаем от пробелов; строки без URL пропускаются
+        urls = pd.Series(_text_column(df, 'URL изображений (через запятую)*'), index=df.index, dtype=object)
+        img_lists = [[url.strip() for url in parts if url.strip()] for parts in urls.str.split(',')]
+        return [
+            {
+                'level_2': level_2,
+                'color': color,
+                'img_list': img_list
+            }
+            for level_2, color, img_list in zip(_text_column(df, 'Модель (level_2)*'), _text_column(df, 'Цвет*'), img_lists)
+            if img_list
+        ]
+    
     def export_products_to_excel(self, products: List[Dict[str, Any]]) -> bytes:
         """Экспортировать товары в Excel файл"""
         wb = Workbook()
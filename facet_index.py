@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Фасетный поиск по каталогу на битовых масках (Python int)
+
+Каждый SKU получает позицию i; для каждого значения фасета (бренд, уровни, цвет, память,
+SIM, RAM, диагональ, размер ремешка) хранится int, в котором выставлен бит i у подходящих SKU.
+Фильтр - пересечение масок (AND между фасетами, OR между значениями одного фасета),
+диапазон цен - маска из префиксных блоков по SKU, отсортированным по цене.
+Счетчики значений считаются "дизъюнктивно": для фасета F - по пересечению всех фильтров,
+кроме самого F, поэтому выбранный цвет не обнуляет счетчики остальных цветов.
+
+Индекс строится одним запросом; при изменении каталога перестраивается целиком,
+при изменении цен - только ценовая часть (без запроса к БД).
+"""
+
+import json
+import bisect
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database import SessionLocal
+from models import Product
+from price_storage import get_prices
+from cache_coherence import shared_versions
+
+# Фасет -> где взять значение: колонка товара или ключи в specifications (первый непустой)
+FACETS = {
+    "brand": ("column", "brand"),
+    "level0": ("column", "level_0"),
+    "level1": ("column", "level_1"),
+    "level2": ("column", "level_2"),
+    "color": ("spec", ("color",)),
+    "disk": ("spec", ("disk", "memory")),
+    "sim": ("spec", ("sim_config", "sim_type")),
+    "ram": ("spec", ("ram",)),
+    "screen_size": ("spec", ("screen_size",)),
+    "band_size": ("spec", ("band_size",)),
+}
+
+# Размер блока префиксных масок цен (память ~ n * n / PRICE_BLOCK бит)
+PRICE_BLOCK = 256
+
+SORTS = ("price", "-price")
+
+
+def _bits_from_positions(positions: Iterable[int], size: int) -> int:
+    """Маска из списка позиций за O(n) (без многократного OR больших int)"""
+    buffer = bytearray(size // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def iter_positions(mask: int) -> List[int]:
+    """Позиции выставленных бит по возрастанию"""
+    bits = bin(mask)[:1:-1]
+    positions = []
+    position = bits.find("1")
+    while position != -1:
+        positions.append(position)
+        position = bits.find("1", position + 1)
+    return positions
+
+
+class FacetIndex:
+    """Битовые маски фасетов и ценовой индекс в памяти процесса"""
+
+    def __init__(self):
+        self.size = 0
+        self.all_mask = 0
+        self.product_ids: List[int] = []
+        self.skus: List[str] = []
+        self.model_of: List[int] = []  # позиция -> номер модели в self.models
+        self.models: List[Tuple[Optional[str], str]] = []  # (level_2, brand)
+        self.model_bits: List[int] = []  # маска SKU каждой модели (для подсчета моделей)
+        self.bitsets: Dict[str, Dict[str, int]] = {}
+        self.prices: List[Optional[Dict[str, Any]]] = []
+        self._price_values: List[float] = []
+        self._price_order: List[int] = []
+        self._price_prefix: List[int] = []
+        self._catalog_stale = True
+        self._prices_stale = True
+        self._lock = threading.Lock()
+        shared_versions.subscribe("catalog", self.invalidate)
+        shared_versions.subscribe("prices", self.invalidate_prices)
+
+    def invalidate(self):
+        self._catalog_stale = True
+
+    def invalidate_prices(self):
+        self._prices_stale = True
+
+    def ensure_fresh(self):
+        shared_versions.check()
+        if not (self._catalog_stale or self._prices_stale):
+            return
+        with self._lock:
+            if self._catalog_stale:
+                self._catalog_stale = False
+                self._prices_stale = False
+                try:
+                    self._rebuild()
+                except Exception:
+                    self._catalog_stale = True
+                    raise
+            elif self._prices_stale:
+                self._prices_stale = False
+                self._rebuild_prices()
+
+    def _rebuild(self):
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Product.id, Product.sku, Product.brand, Product.level_0, Product.level_1,
+                Product.level_2, Product.specifications
+            ).order_by(Product.id).all()
+        finally:
+            db.close()
+
+        positions_by_value: Dict[str, Dict[str, List[int]]] = {facet: {} for facet in FACETS}
+        model_numbers: Dict[Tuple[Optional[str], str], int] = {}
+        product_ids, skus, model_of = [], [], []
+
+        for position, (product_id, sku, brand, level_0, level_1, level_2, raw_specifications) in enumerate(rows):
+            product_ids.append(product_id)
+            skus.append(sku)
+            model_of.append(model_numbers.setdefault((level_2, brand), len(model_numbers)))
+
+            try:
+                specifications = json.loads(raw_specifications) if raw_specifications else {}
+            except json.JSONDecodeError:
+                specifications = {}
+            columns = {"brand": brand, "level_0": level_0, "level_1": level_1, "level_2": level_2}
+
+            for facet, (source, keys) in FACETS.items():
+                if source == "column":
+                    value = columns[keys]
+                else:
+                    value = next((specifications[key] for key in keys if specifications.get(key)), None)
+                if value:
+                    positions_by_value[facet].setdefault(str(value), []).append(position)
+
+        size = len(rows)
+        self.bitsets = {
+            facet: {value: _bits_from_positions(values[value], size) for value in sorted(values)}
+            for facet, values in positions_by_value.items()
+        }
+        self.size = size
+        self.all_mask = (1 << size) - 1
+        self.product_ids, self.skus, self.model_of = product_ids, skus, model_of
+        self.models = list(model_numbers)
+        model_positions: List[List[int]] = [[] for _ in model_numbers]
+        for position, model in enumerate(model_of):
+            model_positions[model].append(position)
+        self.model_bits = [_bits_from_positions(positions, size) for positions in model_positions]
+        self._rebuild_prices()
+
+    def _rebuild_prices(self):
+        prices = get_prices(self.skus)
+        self.prices = [prices.get(sku) for sku in self.skus]
+
+        # SKU с положительной ценой, отсортированные по цене, и префиксные маски по блокам
+        order = sorted(
+            (position for position, price in enumerate(self.prices) if price and price.get('price', 0) > 0),
+            key=lambda position: self.prices[position]['price']
+        )
+        prefix = [0]
+        for start in range(0, len(order), PRICE_BLOCK):
+            prefix.append(prefix[-1] | _bits_from_positions(order[start:start + PRICE_BLOCK], self.size))
+        self._price_order = order
+        self._price_values = [self.prices[position]['price'] for position in order]
+        self._price_prefix = prefix
+
+    def _prefix_mask(self, count: int) -> int:
+        """Маска первых count SKU в порядке цены"""
+        block, rest = divmod(count, PRICE_BLOCK)
+        mask = self._price_prefix[block]
+        if rest:
+            start = block * PRICE_BLOCK
+            mask |= _bits_from_positions(self._price_order[start:start + rest], self.size)
+        return mask
+
+    def price_mask(self, price_min: Optional[float], price_max: Optional[float]) -> int:
+        """SKU с ценой в [price_min, price_max]"""
+        low = bisect.bisect_left(self._price_values, price_min) if price_min is not None else 0
+        high = bisect.bisect_right(self._price_values, price_max) if price_max is not None else len(self._price_values)
+        if high <= low:
+            return 0
+        return self._prefix_mask(high) & ~self._prefix_mask(low)
+
+    def _price_bounds(self, mask: int) -> Tuple[Optional[float], Optional[float]]:
+        """Минимальная и максимальная цена среди SKU маски: поиск по блокам префиксных масок"""
+        prefix, order, values = self._price_prefix, self._price_order, self._price_values
+        if not mask & prefix[-1]:
+            return None, None
+        first = next(block for block in range(1, len(prefix)) if mask & prefix[block]) - 1
+        last = next(block for block in range(len(prefix) - 1, 0, -1) if mask & prefix[block] & ~prefix[block - 1]) - 1
+        start = first * PRICE_BLOCK
+        low = next(start + offset for offset, position in enumerate(order[start:start + PRICE_BLOCK]) if mask >> position & 1)
+        start = last * PRICE_BLOCK
+        block = order[start:start + PRICE_BLOCK]
+        high = next(start + offset for offset in range(len(block) - 1, -1, -1) if mask >> block[offset] & 1)
+        return values[low], values[high]
+
+    def _facet_mask(self, facet: str, values: List[str]) -> int:
+        mask = 0
+        bitsets = self.bitsets.get(facet, {})
+        for value in values:
+            mask |= bitsets.get(value, 0)
+        return mask
+
+    def _filter_masks(self, filters: Dict[str, List[str]], price_min: Optional[float],
+                      price_max: Optional[float]) -> Dict[str, int]:
+        masks = {facet: self._facet_mask(facet, values) for facet, values in filters.items() if values}
+        if price_min is not None or price_max is not None:
+            masks["price"] = self.price_mask(price_min, price_max)
+        return masks
+
+    def _intersect(self, masks: Dict[str, int], skip: Optional[str] = None) -> int:
+        result = self.all_mask
+        for facet, mask in masks.items():
+            if facet != skip:
+                result &= mask
+        return result
+
+    def search(self, filters: Dict[str, List[str]], price_min: Optional[float] = None,
+               price_max: Optional[float] = None, sort: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Модели (level_2 + brand), у которых есть SKU под все фильтры
+        Для каждой: представительный товар (минимальный id среди подходящих), подходящий SKU
+        с минимальной ценой. Порядок: как у /products (level_2 по убыванию) или по цене
+        """
+        self.ensure_fresh()
+        mask = self._intersect(self._filter_masks(filters, price_min, price_max))
+
+        cards: Dict[int, Dict[str, Any]] = {}
+        for position in iter_positions(mask):
+            model = self.model_of[position]
+            card = cards.get(model)
+            if card is None:
+                card = cards[model] = {"product_id": self.product_ids[position], "best": None, "sku_count": 0}
+            card["sku_count"] += 1
+            price = self.prices[position]
+            if price and price.get('price', 0) > 0 and (card["best"] is None or price['price'] < card["best"]['price']):
+                card["best"] = price
+
+        result = [
+            {"level_2": self.models[model][0], "brand": self.models[model][1], **card}
+            for model, card in cards.items()
+        ]
+        if sort in SORTS:
+            with_price = [card for card in result if card["best"]]
+            with_price.sort(key=lambda card: card["best"]['price'], reverse=(sort == "-price"))
+            result = with_price + [card for card in result if not card["best"]]
+        else:
+            result.sort(key=lambda card: card["product_id"])
+            result.sort(key=lambda card: card["level_2"] or "", reverse=True)
+        return result
+
+    def facet_counts(self, filters: Dict[str, List[str]], price_min: Optional[float] = None,
+                     price_max: Optional[float] = None) -> Dict[str, Any]:
+        """Счетчики SKU для каждого значения каждого фасета при текущих фильтрах"""
+        self.ensure_fresh()
+        masks = self._filter_masks(filters, price_min, price_max)
+        matched = self._intersect(masks)
+
+        facets = {}
+        for facet, bitsets in self.bitsets.items():
+            base = self._intersect(masks, skip=facet)
+            counts = {value: (base & bits).bit_count() for value, bits in bitsets.items()}
+            facets[facet] = {value: count for value, count in counts.items() if count}
+
+        low, high = self._price_bounds(self._intersect(masks, skip="price"))
+        return {
+            "total_skus": matched.bit_count(),
+            "total_models": sum(1 for bits in self.model_bits if matched & bits),
+            "price": {"min": low, "max": high},
+            "facets": facets,
+        }
+
+
+# Глобальный экземпляр для процесса
+facet_index = FacetIndex()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Дерево каталога в памяти: level_0 → brand → level_1 → level_2
+
+Строится одним запросом по доступным товарам; в каждом узле - количество SKU и моделей
+и минимальная цена. Эндпоинты /hierarchy/* отвечают из памяти без DISTINCT запросов.
+При изменении каталога (в любом воркере) дерево перестраивается при следующем обращении,
+при изменении цен пересчитываются только минимальные цены (без запроса к БД).
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import SessionLocal
+from models import Product
+from price_storage import get_prices
+from cache_coherence import shared_versions
+
+# Уровни дерева сверху вниз
+TREE_LEVELS = ("level_0", "brand", "level_1", "level_2")
+
+# Разделитель в пути узла (?path=Смартфоны/Apple/16 Series)
+PATH_SEPARATOR = "/"
+
+
+class HierarchyNode:
+    """Узел дерева каталога"""
+
+    __slots__ = ("name", "level", "path", "children", "skus", "sku_count", "model_count", "min_price")
+
+    def __init__(self, name: Optional[str], level: Optional[str], path: List[Optional[str]]):
+        self.name = name
+        self.level = level
+        self.path = path
+        self.children: Dict[Optional[str], "HierarchyNode"] = {}
+        self.skus: List[str] = []  # только у узлов level_2
+        self.sku_count = 0
+        self.model_count = 0
+        self.min_price: Optional[float] = None
+
+    def to_dict(self, depth: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "name": self.name,
+            "level": self.level,
+            "path": PATH_SEPARATOR.join(part or "" for part in self.path),
+            "sku_count": self.sku_count,
+            "model_count": self.model_count,
+            "min_price": self.min_price,
+        }
+        if self.level != "level_2":
+            if depth is None or depth > 0:
+                next_depth = None if depth is None else depth - 1
+                data["children"] = [child.to_dict(next_depth) for child in self.children.values()]
+            else:
+                data["children_count"] = len(self.children)
+        return data
+
+
+class HierarchyIndex:
+    """Дерево каталога и список уникальных веток (level_0, brand, level_1, level_2) в памяти процесса"""
+
+    def __init__(self):
+        self._root = HierarchyNode(None, None, [])
+        self._branches: List[Tuple[str, str, Optional[str], Optional[str]]] = []
+        self._catalog_stale = True
+        self._prices_stale = True
+        self._lock = threading.Lock()
+        shared_versions.subscribe("catalog", self.invalidate)
+        shared_versions.subscribe("prices", self.invalidate_prices)
+
+    def invalidate(self):
+        self._catalog_stale = True
+
+    def invalidate_prices(self):
+        self._prices_stale = True
+
+    def _ensure_fresh(self):
+        shared_versions.check()
+        if not (self._catalog_stale or self._prices_stale):
+            return
+        with self._lock:
+            if self._catalog_stale:
+                self._catalog_stale = False
+                self._prices_stale = False
+                try:
+                    self._rebuild()
+                except Exception:
+                    self._catalog_stale = True
+                    raise
+            elif self._prices_stale:
+                self._prices_stale = False
+                self._update_prices(self._root, get_prices(self._all_skus(self._root)))
+
+    def _rebuild(self):
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Product.level_0, Product.brand, Product.level_1, Product.level_2, Product.sku
+            ).filter(Product.is_available == True).order_by(Product.id).all()
+        finally:
+            db.close()
+
+        root = HierarchyNode(None, None, [])
+        branches = {}
+        for level_0, brand, level_1, level_2, sku in rows:
+            node = root
+            for level, name in zip(TREE_LEVELS, (level_0, brand, level_1, level_2)):
+                child = node.children.get(name)
+                if child is None:
+                    child = node.children[name] = HierarchyNode(name, level, node.path + [name])
+                node = child
+            node.skus.append(sku)
+            branches.setdefault((level_0, brand, level_1, level_2), None)
+
+        self._update_prices(root, get_prices(sku for _, _, _, _, sku in rows))
+        self._root = root
+        self._branches = list(branches)
+
+    def _all_skus(self, node: HierarchyNode) -> List[str]:
+        if node.level == "level_2":
+            return list(node.skus)
+        return [sku for child in node.children.values() for sku in self._all_skus(child)]
+
+    def _update_prices(self, node: HierarchyNode, prices: Dict[str, Dict]):
+        """Пересчитать счетчики и минимальные цены поддерева (снизу вверх)"""
+        if node.level == "level_2":
+            positive = [prices[sku]['price'] for sku in node.skus if sku in prices and prices[sku].get('price', 0) > 0]
+            node.sku_count = len(node.skus)
+            node.model_count = 1
+            node.min_price = min(positive) if positive else None
+            return
+
+        node.sku_count = node.model_count = 0
+        node.min_price = None
+        for child in node.children.values():
+            self._update_prices(child, prices)
+            node.sku_count += child.sku_count
+            node.model_count += child.model_count
+            if child.min_price is not None and (node.min_price is None or child.min_price < node.min_price):
+                node.min_price = child.min_price
+
+    def find(self, path: str) -> Optional[HierarchyNode]:
+        """
+        Узел по пути "level_0/brand/level_1/level_2" (можно указать только начало пути)
+        Названия с "/" внутри распознаются: сегменты склеиваются, пока не найдется узел
+        """
+        self._ensure_fresh()
+        node = self._root
+        parts = path.split(PATH_SEPARATOR) if path else []
+        while parts:
+            for size in range(1, len(parts) + 1):
+                name = PATH_SEPARATOR.join(parts[:size])
+                child = node.children.get(name)
+                if child is None and name == "":
+                    child = node.children.get(None)
+                if child is not None:
+                    node = child
+                    parts = parts[size:]
+                    break
+            else:
+                return None
+        return node
+
+    def tree(self, path: str = "", depth: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        node = self.find(path)
+        return node.to_dict(depth) if node is not None else None
+
+    def values(self, level: str, brand: Optional[str] = None, level_0: Optional[str] = None,
+               level_1: Optional[str] = None, level_2: Optional[str] = None) -> List[str]:
+        """
+        Уникальные непустые значения уровня (level_0/brand/level_1/level_2) по фильтрам
+        Без фильтров - по алфавиту (как DISTINCT по индексу), с фильтрами - в порядке каталога
+        """
+        self._ensure_fresh()
+        index = TREE_LEVELS.index(level)
+        filters = {0: level_0, 1: brand, 2: level_1, 3: level_2}
+        active = [(position, value) for position, value in filters.items() if value]
+
+        result = {}
+        for branch in self._branches:
+            if all(branch[position] == value for position, value in active) and branch[index]:
+                result.setdefault(branch[index], None)
+        return list(result) if active else sorted(result)
+
+
+# Глобальный экземпляр для процесса
+hierarchy_index = HierarchyIndex()
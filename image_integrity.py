@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Проверка ссылок на изображения товаров: отсутствующие, битые, слишком большие и дубликаты
+
+Ссылки берутся из ProductImage.img_list и specifications.images товаров. Локальные файлы
+(/static/...) проверяются параллельно пулом потоков (Config.IMAGE_SCAN_WORKERS): stat,
+хеш содержимого (для поиска дубликатов) и заголовок через Pillow (формат и размеры).
+Результат по каждому файлу кэшируется (Config.IMAGE_SCAN_CACHE_FILE) по пути, mtime и размеру -
+повторный запуск заново проверяет только измененные файлы. Внешние URL проверяются только
+если передан fetcher (по умолчанию - HEAD запрос, в тестах подменяется заглушкой).
+
+Запуск: python image_integrity.py [--check-urls] [--no-cache] [--json]
+Из админки: GET /api/admin/image-integrity (?background=true - фоновой задачей).
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote, urlsplit
+
+import requests
+from sqlalchemy.orm import Session
+
+from config import Config
+from models import Product, ProductImage
+from catalog_cards import parse_image_list
+
+# Pillow - зависимость проекта (requirements.txt). Без него проверка работает в урезанном режиме
+# (только наличие, размер файла и дубликаты), и отчет помечает это в "degraded"
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEGRADED_NO_PILLOW = "Pillow не установлен - формат и размеры изображений не проверялись (pip install Pillow)"
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(PROJECT_DIR, 'static')
+
+# Формат записей кэша (меняется при изменении проверок)
+CACHE_VERSION = 1
+
+# Сколько ссылающихся записей показывать в отчете для одного изображения
+MAX_REFERRERS = 5
+
+# Строк, читаемых из БД за раз при сборе ссылок
+REFERENCE_BATCH_SIZE = 1000
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Векторные форматы: Pillow их не читает, браузер показывает
+VECTOR_EXTENSIONS = ('.svg',)
+
+# Проверка внешнего URL: url -> {"ok": bool, "status": HTTP статус или None, "error": текст или None}
+UrlFetcher = Callable[[str], Dict[str, Any]]
+
+# Один скан на процесс: параллельные запуски перезаписывали бы кэш друг друга
+_scan_lock = threading.Lock()
+
+
+def http_head_fetcher(url: str) -> Dict[str, Any]:
+    """Проверка внешнего URL HEAD запросом (GET, если сервер не поддерживает HEAD)"""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=Config.IMAGE_URL_CHECK_TIMEOUT)
+        if response.status_code == 405:
+            response = requests.get(url, stream=True, timeout=Config.IMAGE_URL_CHECK_TIMEOUT)
+            response.close()
+    except requests.RequestException as e:
+        return {"ok": False, "status": None, "error": str(e)}
+
+    content_type = response.headers.get('content-type', '')
+    if response.status_code >= 400:
+        return {"ok": False, "status": response.status_code, "error": f"HTTP {response.status_code}"}
+    if content_type and not content_type.startswith('image/'):
+        return {"ok": False, "status": response.status_code, "error": f"Не изображение: {content_type}"}
+    return {"ok": True, "status": response.status_code, "error": None}
+
+
+# Проверка внешних URL при check_urls=True без явного fetcher (подменяется заглушкой в тестах)
+url_fetcher: UrlFetcher = http_head_fetcher
+
+
+def collect_references(db: Session) -> Dict[str, Dict[str, Any]]:
+    """Все ссылки на изображения: {url: {"count": сколько раз встречается, "referrers": первые записи}}"""
+    references: Dict[str, Dict[str, Any]] = {}
+
+    def add(url: str, referrer: str):
+        reference = references.get(url)
+        if reference is None:
+            reference = references[url] = {"count": 0, "referrers": []}
+        reference["count"] += 1
+        if len(reference["referrers"]) < MAX_REFERRERS:
+            reference["referrers"].append(referrer)
+
+    rows = db.query(ProductImage.id, ProductImage.level_2, ProductImage.color, ProductImage.img_list)
+    for image_id, level_2, color, img_list in rows.yield_per(REFERENCE_BATCH_SIZE):
+        for url in parse_image_list(img_list) if img_list else []:
+            add(url, f"product_images#{image_id} ({level_2} / {color})")
+
+    for sku, specifications in db.query(Product.sku, Product.specifications).yield_per(REFERENCE_BATCH_SIZE):
+        # Большинство товаров без своих изображений - JSON не разбираем
+        if not specifications or '"images"' not in specifications:
+            continue
+        try:
+            specs = json.loads(specifications)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(specs, dict):
+            for url in parse_image_list(specs.get('images', [])):
+                add(url, f"SKU {sku}")
+
+    return references
+
+
+def is_external(url: str) -> bool:
+    return url.startswith(("http://", "https://", "//"))
+
+
+def local_path(url: str, static_dir: str = STATIC_DIR) -> Optional[str]:
+    """Файл для ссылки /static/... (None - ссылка ведет не в static или выходит за ее пределы)"""
+    path = unquote(urlsplit(url).path)
+    for prefix in ("/static/", "static/"):
+        if path.startswith(prefix):
+            full_path = os.path.normpath(os.path.join(static_dir, path[len(prefix):]))
+            if full_path.startswith(os.path.normpath(static_dir) + os.sep):
+                return full_path
+    return None
+
+
+def check_file(path: str, cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Проверить файл: {"status": ok/missing/corrupt, size, mtime_ns, md5, format, width, height, error}
+    cached - прошлый результат; если mtime и размер не изменились, он возвращается без чтения файла
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {"status": "missing"}
+    if cached and cached.get("mtime_ns") == stat.st_mtime_ns and cached.get("size") == stat.st_size:
+        return {**cached, "from_cache": True}
+
+    entry = {
+        "status": "ok", "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "md5": None, "format": None, "width": None, "height": None, "error": None,
+    }
+    try:
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        entry["md5"] = digest.hexdigest()
+    except OSError as e:
+        return {**entry, "status": "corrupt", "error": f"Не удалось прочитать файл: {e}"}
+
+    if stat.st_size == 0:
+        return {**entry, "status": "corrupt", "error": "Пустой файл"}
+    if path.lower().endswith(VECTOR_EXTENSIONS):
+        return {**entry, "format": "SVG"}
+    if Image is not None:
+        # open читает только заголовок - формат и размеры без декодирования всего изображения
+        try:
+            with Image.open(path) as img:
+                entry["format"] = img.format
+                entry["width"], entry["height"] = img.size
+        except Exception as e:  # UnidentifiedImageError, обрезанный заголовок и т.п.
+            return {**entry, "status": "corrupt", "error": str(e) or type(e).__name__}
+    return entry
+
+
+def _load_cache(cache_file: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Файлы, проверенные без Pillow, после его установки проверяются заново
+    if cache.get("version") != CACHE_VERSION or cache.get("pillow") != (Image is not None):
+        return {}
+    return cache.get("files", {})
+
+
+def _save_cache(cache_file: str, files: Dict[str, Dict[str, Any]]):
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({"version": CACHE_VERSION, "pillow": Image is not None, "files": files}, f, ensure_ascii=False)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        print(f"❌ Ошибка при сохранении кэша проверки изображений в {cache_file}: {e}")
+
+
+def _issue(url: str, reference: Dict[str, Any], **details) -> Dict[str, Any]:
+    return {"url": url, "references": reference["count"], "referrers": reference["referrers"], **details}
+
+
+def _check_url(fetcher: UrlFetcher, url: str) -> Dict[str, Any]:
+    try:
+        return fetcher(url)
+    except Exception as e:  # заглушка или свой fetcher не должны ронять весь скан
+        return {"ok": False, "status": None, "error": str(e)}
+
+
+def scan_images(db: Session, check_urls: bool = False, fetcher: Optional[UrlFetcher] = None,
+                use_cache: bool = True, workers: Optional[int] = None, static_dir: str = STATIC_DIR,
+                cache_file: Optional[str] = None, progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Проверить все ссылки на изображения и вернуть отчет
+    check_urls - проверять внешние URL (fetcher или url_fetcher модуля); progress(done, total) - как у фоновых задач
+    """
+    started = time.perf_counter()
+    cache_file = cache_file or Config.IMAGE_SCAN_CACHE_FILE
+    if check_urls and fetcher is None:
+        fetcher = url_fetcher
+
+    with _scan_lock:
+        references = collect_references(db)
+        cache = _load_cache(cache_file) if use_cache else {}
+
+        # Разные ссылки на один файл (/static/x и static/x, %-кодирование) проверяются один раз
+        paths: Dict[str, List[str]] = {}
+        external: List[str] = []
+        outside_static: List[str] = []
+        for url in references:
+            if is_external(url):
+                external.append(url)
+                continue
+            path = local_path(url, static_dir)
+            if path is None:
+                outside_static.append(url)
+            else:
+                paths.setdefault(path, []).append(url)
+
+        url_checks = external if fetcher is not None else []
+        total = len(paths) + len(url_checks)
+        results: Dict[str, Dict[str, Any]] = {}
+        url_results: Dict[str, Dict[str, Any]] = {}
+        with ThreadPoolExecutor(max_workers=workers or Config.IMAGE_SCAN_WORKERS, thread_name_prefix="image-scan") as pool:
+            futures = {pool.submit(check_file, path, cache.get(path)): path for path in paths}
+            url_futures = {pool.submit(_check_url, fetcher, url): url for url in url_checks}
+            for done, future in enumerate(as_completed([*futures, *url_futures]), 1):
+                if future in futures:
+                    results[futures[future]] = future.result()
+                else:
+                    url_results[url_futures[future]] = future.result()
+                if progress:
+                    progress(done, total)
+
+        if use_cache:
+            _save_cache(cache_file, {
+                path: {key: value for key, value in entry.items() if key != "from_cache"}
+                for path, entry in results.items() if entry["status"] != "missing"
+            })
+
+    missing = [_issue(url, references[url], error="Ссылка не ведет в /static") for url in outside_static]
+    corrupt, oversized = [], []
+    by_digest: Dict[str, List[str]] = {}
+    for path, entry in results.items():
+        url = paths[path][0]
+        reference = references[url]
+        if entry["status"] == "missing":
+            missing.extend(_issue(path_url, references[path_url]) for path_url in paths[path])
+            continue
+        if entry["status"] == "corrupt":
+            corrupt.append(_issue(url, reference, error=entry["error"], size=entry["size"]))
+            continue
+        largest_side = max(entry["width"] or 0, entry["height"] or 0)
+        if entry["size"] > Config.IMAGE_MAX_BYTES or largest_side > Config.IMAGE_MAX_DIMENSION:
+            oversized.append(_issue(url, reference, size=entry["size"], width=entry["width"], height=entry["height"]))
+        by_digest.setdefault(entry["md5"], []).append(url)
+
+    duplicates = [
+        {"md5": digest, "urls": sorted(urls)}
+        for digest, urls in by_digest.items() if len(urls) > 1
+    ]
+    broken_urls = [
+        _issue(url, references[url], status=result.get("status"), error=result.get("error"))
+        for url, result in url_results.items() if not result.get("ok")
+    ]
+
+    return {
+        "references": sum(reference["count"] for reference in references.values()),
+        "unique_urls": len(references),
+        "local_files": len(paths),
+        "checked_files": sum(1 for entry in results.values() if entry["status"] != "missing" and not entry.get("from_cache")),
+        "cached_files": sum(1 for entry in results.values() if entry.get("from_cache")),
+        "external_urls": len(external),
+        "checked_urls": len(url_results),
+        "headers_decoded": Image is not None,
+        "degraded": None if Image is not None else DEGRADED_NO_PILLOW,
+        "limits": {"max_bytes": Config.IMAGE_MAX_BYTES, "max_dimension": Config.IMAGE_MAX_DIMENSION},
+        "missing": sorted(missing, key=lambda issue: issue["url"]),
+        "corrupt": sorted(corrupt, key=lambda issue: issue["url"]),
+        "oversized": sorted(oversized, key=lambda issue: issue["url"]),
+        "duplicates": sorted(duplicates, key=lambda duplicate: duplicate["urls"][0]),
+        "broken_urls": sorted(broken_urls, key=lambda issue: issue["url"]),
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"🖼️  Проверка изображений: {report['unique_urls']} ссылок "
+          f"({report['local_files']} локальных файлов, {report['external_urls']} внешних URL)")
+    print(f"   Проверено файлов: {report['checked_files']}, из кэша: {report['cached_files']}, "
+          f"внешних URL: {report['checked_urls']}, за {report['duration_seconds']:.2f} с")
+    if report["degraded"]:
+        print(f"   ⚠️  Урезанная проверка: {report['degraded']}")
+    if report["external_urls"] and not report["checked_urls"]:
+        print("   ℹ️  Внешние URL не проверялись (--check-urls)")
+
+    sections = (
+        ("missing", "❌ Отсутствуют"), ("corrupt", "💥 Повреждены"),
+        ("oversized", "📏 Слишком большие"), ("broken_urls", "🌐 Недоступные внешние URL"),
+    )
+    for key, title in sections:
+        if report[key]:
+            print(f"{title}: {len(report[key])}")
+            for issue in report[key]:
+                details = ", ".join(
+                    f"{name}: {issue[name]}" for name in ("error", "status", "size", "width", "height") if issue.get(name)
+                )
+                print(f"   {issue['url']} ({details + '; ' if details else ''}ссылок: {issue['references']}; "
+                      f"{', '.join(issue['referrers'])})")
+    if report["duplicates"]:
+        print(f"♻️  Дубликаты: {len(report['duplicates'])}")
+        for duplicate in report["duplicates"]:
+            print(f"   {' = '.join(duplicate['urls'])}")
+
+    if not any(report[key] for key, _ in sections) and not report["duplicates"]:
+        print("✅ Проблем не найдено" + (" (проверка урезанная, см. выше)" if report["degraded"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка ссылок на изображения товаров")
+    parser.add_argument('--check-urls', action='store_true', help='Проверять внешние URL (HEAD запросы)')
+    parser.add_argument('--no-cache', action='store_true', help='Проверить все файлы заново, не используя кэш')
+    parser.add_argument('--workers', type=int, help='Потоков проверки (по умолчанию Config.IMAGE_SCAN_WORKERS)')
+    parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON')
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        report = scan_images(db, check_urls=args.check_urls, use_cache=not args.no_cache, workers=args.workers)
+    finally:
+        db.close()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    problems = report["missing"] or report["corrupt"] or report["oversized"] or report["broken_urls"]
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
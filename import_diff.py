@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Предпросмотр изменений импорта из Excel (dry-run): что лист поменяет в каталоге и ценах
+
+Строки листа и текущие данные (товары из БД, цены из price_storage) загружаются в DataFrame
+и сравниваются одним merge по SKU: строка новая, измененная (поля: было/стало, разница цены)
+или без изменений. Лист "Изображения" сравнивается с ProductImage по паре (level_2, color).
+Обычный импорт тоже сначала строит diff и записывает только новые и измененные строки -
+повторная загрузка того же листа ничего не перезаписывает.
+
+Результат предпросмотра сохраняется (Config.JOBS_DIR/changesets) и применяется позже по id.
+Для каждой строки запоминается хэш текущих значений товара: если товар изменили после
+предпросмотра, строка при применении пропускается как конфликт.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from config import Config
+from models import Product, ProductImage
+from price_storage import get_all_prices
+from catalog_cards import parse_image_list
+
+# Поля товара, которые update-or-create перезаписывает всегда
+CATALOG_FIELDS = ("name", "level0", "level1", "level2", "brand", "stock")
+# Поля specifications - перезаписываются, только если заполнены в листе
+SPEC_FIELDS = ("color", "disk", "ram", "sim_config")
+PRICE_FIELDS = ("price", "old_price", "currency")
+
+SHEET_TEXT_FIELDS = ("sku", "name", "level0", "level1", "level2", "brand", "image_url") + SPEC_FIELDS
+
+CHANGESET_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def _spec_values(raw) -> tuple:
+    try:
+        specifications = orjson.loads(raw) if raw else {}
+    except (orjson.JSONDecodeError, TypeError):
+        specifications = {}
+    if not isinstance(specifications, dict):
+        specifications = {}
+    return tuple(str(specifications.get(field) or '') for field in SPEC_FIELDS)
+
+
+def price_frame() -> pd.DataFrame:
+    """Текущие цены: индекс - SKU, колонки price, old_price, currency"""
+    prices = get_all_prices()
+    frame = pd.DataFrame(
+        {field: [price_data.get(field) for price_data in prices.values()] for field in PRICE_FIELDS},
+        index=pd.Index(list(prices), dtype=object)
+    )
+    frame["price"] = pd.to_numeric(frame["price"], errors="coerce")
+    frame["old_price"] = pd.to_numeric(frame["old_price"], errors="coerce")
+    frame["currency"] = frame["currency"].fillna("RUB").astype(str)
+    return frame
+
+
+def catalog_frame(db: Session) -> pd.DataFrame:
+    """Текущий каталог с ценами: индекс - SKU, колонки как у строки листа товаров"""
+    rows = db.query(
+        Product.sku, Product.name, Product.level_0, Product.level_1, Product.level_2,
+        Product.brand, Product.stock, Product.specifications
+    ).order_by(Product.id).all()
+    frame = pd.DataFrame(rows, columns=["sku", "name", "level0", "level1", "level2", "brand", "stock", "specifications"])
+    specifications = [_spec_values(raw) for raw in frame.pop("specifications")]
+    frame = frame.join(pd.DataFrame(specifications, columns=list(SPEC_FIELDS), index=frame.index))
+    for field in ("name", "level0", "level1", "level2", "brand"):
+        frame[field] = frame[field].fillna('').astype(str)
+    frame["stock"] = frame["stock"].fillna(0).astype(int)
+    frame = frame.drop_duplicates("sku").set_index("sku")
+    return frame.join(price_frame())
+
+
+def row_hashes(frame: pd.DataFrame) -> pd.Series:
+    """Хэш значений строки каталога (для проверки, что товар не менялся после предпросмотра)"""
+    columns = list(CATALOG_FIELDS + SPEC_FIELDS + PRICE_FIELDS)
+    return pd.util.hash_pandas_object(frame[columns], index=False).astype(str)
+
+
+def _price_hashes(current: pd.DataFrame) -> List[str]:
+    return pd.util.hash_pandas_object(current[list(PRICE_FIELDS)], index=False).astype(str).tolist()
+
+
+def _values(series: pd.Series) -> list:
+    """Значения колонки для JSON (NaN -> None)"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _image_lists(db: Session, level2: pd.Series, color: pd.Series) -> List[Optional[List[str]]]:
+    """Текущие изображения ProductImage для пар (level_2, color); None - записи нет"""
+    rows = db.query(ProductImage.level_2, ProductImage.color, ProductImage.img_list).order_by(ProductImage.id).all()
+    images = pd.DataFrame(rows, columns=["level2", "color", "img_list"]).drop_duplicates(["level2", "color"])
+    lookup = images.set_index(["level2", "color"])["img_list"]
+    found = lookup.reindex(pd.MultiIndex.from_arrays([level2, color])).tolist()
+    return [parse_image_list(value) if isinstance(value, str) else None for value in found]
+
+
+def _summary(status: np.ndarray, masks: Dict[str, np.ndarray], delta: np.ndarray) -> Dict[str, Any]:
+    changed = status == "changed"
+    delta = delta[~np.isnan(delta)]
+    return {
+        "total": int(len(status)),
+        "new": int((status == "new").sum()),
+        "changed": int(changed.sum()),
+        "unchanged": int((status == "unchanged").sum()),
+        "duplicates": int((status == "duplicate").sum()),
+        "fields": {field: int((mask & changed).sum()) for field, mask in masks.items() if (mask & changed).any()},
+        "price": {
+            "up": int((delta > 0).sum()),
+            "down": int((delta < 0).sum()),
+            "delta_total": round(float(delta.sum()), 2),
+        },
+    }
+
+
+def _changes(frame: pd.DataFrame, status: np.ndarray, masks: Dict[str, np.ndarray],
+             delta: np.ndarray, old_values: Dict[str, list], extra: Optional[Dict[str, list]] = None) -> List[dict]:
+    """Записи changeset для новых и измененных строк: поля было/стало и разница цены"""
+    actionable = np.flatnonzero((status == "new") | (status == "changed"))
+    skus = frame["sku"].tolist()
+    names = frame["name"].tolist() if "name" in frame else None
+    changes = {}
+    for position in actionable.tolist():
+        change = {"sku": skus[position], "status": str(status[position]), "fields": {}, "price_delta": None}
+        if names is not None:
+            change["name"] = names[position]
+        for key, values in (extra or {}).items():
+            change[key] = values[position]
+        if status[position] == "changed" and not np.isnan(delta[position]):
+            change["price_delta"] = round(float(delta[position]), 2)
+        changes[position] = change
+
+    changed = status == "changed"
+    for field, mask in masks.items():
+        selected = np.flatnonzero(mask & changed)
+        new_values = frame[field].to_numpy()[selected].tolist()
+        for position, new_value in zip(selected.tolist(), new_values):
+            changes[position]["fields"][field] = {"old": old_values[field][position], "new": new_value}
+    return [changes[position] for position in actionable.tolist()]
+
+
+def diff_products(products_data: List[Dict[str, Any]], db: Session) -> Dict[str, Any]:
+    """
+    Сравнить строки листа товаров (ExcelHandler.parse_products_excel) с каталогом
+    Строки без SKU и с неизвестным SKU - новые; из повторов SKU применяется последняя строка
+    """
+    sheet = pd.DataFrame(products_data, columns=list(SHEET_TEXT_FIELDS) + ["stock", "price", "old_price", "currency"])
+    for field in SHEET_TEXT_FIELDS:
+        sheet[field] = sheet[field].fillna('').astype(str)
+    sheet["stock"] = pd.to_numeric(sheet["stock"], errors="coerce").fillna(0).astype(int)
+    sheet["price"] = pd.to_numeric(sheet["price"], errors="coerce").fillna(0).astype(float)
+    # Как set_price: пустая или нулевая старая цена равна новой
+    old_price = pd.to_numeric(sheet["old_price"], errors="coerce")
+    sheet["old_price"] = old_price.where(old_price.notna() & (old_price != 0), sheet["price"]).astype(float)
+    sheet["currency"] = sheet["currency"].fillna("RUB").astype(str)
+
+    current = catalog_frame(db)
+    hashes = row_hashes(current)
+    merged = sheet.join(current.add_suffix("_current"), on="sku")
+    exists = sheet["sku"].ne('').to_numpy() & sheet["sku"].isin(current.index).to_numpy()
+    duplicate = (sheet["sku"].ne('') & sheet["sku"].duplicated(keep="last")).to_numpy()
+
+    masks = {}
+    for field in CATALOG_FIELDS + PRICE_FIELDS:
+        masks[field] = (merged[field] != merged[f"{field}_current"]).to_numpy() & exists
+    for field in SPEC_FIELDS:
+        masks[field] = (merged[field].ne('') & (merged[field] != merged[f"{field}_current"])).to_numpy() & exists
+    old_values = {field: _values(merged[f"{field}_current"]) for field in masks}
+
+    # Изображения: update-or-create пишет ProductImage по (level_2, итоговый цвет), если в строке есть URL
+    color = merged["color"].where(merged["color"].ne(''), merged["color_current"].fillna(''))
+    with_images = exists & ~duplicate & (merged["image_url"].ne('') & merged["level2"].ne('') & color.ne('')).to_numpy()
+    selected = np.flatnonzero(with_images)
+    images_mask = np.zeros(len(sheet), dtype=bool)
+    sheet["images"] = None
+    old_values["images"] = [None] * len(sheet)
+    if len(selected):
+        current_images = _image_lists(db, merged["level2"].iloc[selected], color.iloc[selected])
+        new_images = [
+            [url.strip() for url in urls if url.strip()]
+            for urls in merged["image_url"].iloc[selected].str.split(',')
+        ]
+        for position, old_list, new_list in zip(selected.tolist(), current_images, new_images):
+            if old_list != new_list:
+                images_mask[position] = True
+                sheet.at[position, "images"] = new_list
+                old_values["images"][position] = old_list
+    masks["images"] = images_mask
+
+    changed_any = np.logical_or.reduce(list(masks.values()))
+    status = np.where(duplicate, "duplicate", np.where(~exists, "new", np.where(changed_any, "changed", "unchanged")))
+    delta = np.where(exists & masks["price"], merged["price"] - merged["price_current"], np.nan).astype(float)
+
+    base = hashes.reindex(sheet["sku"]).tolist()
+    actionable = np.flatnonzero((status == "new") | (status == "changed")).tolist()
+    return {
+        "kind": "products",
+        "summary": _summary(status, masks, delta),
+        "changes": _changes(sheet, status, masks, delta, old_values),
+        "apply": [
+            {
+                "position": position,
+                "base": base[position] if exists[position] else None,
+                "data": products_data[position],
+            }
+            for position in actionable
+        ],
+    }
+
+
+def diff_images(images_data: List[Dict[str, Any]], db: Session) -> Dict[str, Any]:
+    """
+    Сравнить строки листа "Изображения" (ExcelHandler.parse_images_excel) с ProductImage
+    Применяются только новые пары (level_2, color) и пары с другим списком URL; из повторов - последняя строка
+    """
+    sheet = pd.DataFrame(images_data, columns=["level_2", "color", "img_list"])
+    last = ~sheet.duplicated(["level_2", "color"], keep="last").to_numpy()
+    current = _image_lists(db, sheet["level_2"], sheet["color"]) if len(sheet) else []
+    new = np.array([old_list is None for old_list in current], dtype=bool)
+    changed = np.array([
+        old_list is not None and old_list != new_list for old_list, new_list in zip(current, sheet["img_list"])
+    ], dtype=bool)
+    return {
+        "summary": {
+            "total": int(last.sum()),
+            "new": int((new & last).sum()),
+            "changed": int((changed & last).sum()),
+            "unchanged": int((~new & ~changed & last).sum()),
+        },
+        "apply": [images_data[position] for position in np.flatnonzero((new | changed) & last).tolist()],
+    }
+
+
+def diff_prices(df: pd.DataFrame, db: Session) -> Dict[str, Any]:
+    """
+    Сравнить лист цен (первые три колонки: SKU, новая цена, старая цена) с текущими ценами
+    Ошибки формата и ненайденные SKU - с номерами строк листа, как у построчного импорта
+    """
+    sku_column, new_price_column, old_price_column = df.columns[:3]
+    rows = np.arange(len(df)) + 2
+    skipped = (df[sku_column].isna() | df[new_price_column].isna()).to_numpy()
+    sku = df[sku_column].astype(str).str.strip()
+    price = pd.to_numeric(df[new_price_column], errors="coerce")
+    invalid = ~skipped & price.isna().to_numpy()
+    old_price = pd.to_numeric(df[old_price_column], errors="coerce")
+    old_price = old_price.where(old_price.notna() & (old_price != 0), price)
+
+    known = set(sku for (sku,) in db.query(Product.sku))
+    found = sku.isin(known).to_numpy()
+    not_found = ~skipped & ~invalid & ~found
+    valid = ~skipped & ~invalid & found
+    duplicate = valid & sku.where(valid).duplicated(keep="last").to_numpy()
+
+    current = price_frame().reindex(sku).reset_index(drop=True)
+    frame = pd.DataFrame({"sku": sku, "price": price, "old_price": old_price, "currency": "RUB"})
+    masks = {
+        field: valid & (frame[field] != current[field]).to_numpy()
+        for field in PRICE_FIELDS
+    }
+    old_values = {field: _values(current[field]) for field in masks}
+    changed_any = np.logical_or.reduce(list(masks.values()))
+    status = np.where(~valid, "skipped", np.where(duplicate, "duplicate", np.where(changed_any, "changed", "unchanged")))
+    delta = np.where(masks["price"], price - current["price"], np.nan).astype(float)
+
+    actionable = np.flatnonzero(status == "changed").tolist()
+    hashes = _price_hashes(current)
+    summary = _summary(status, masks, delta)
+    summary.update(total=int(len(df)), not_found=int(not_found.sum()), errors=int(invalid.sum()))
+    return {
+        "kind": "prices",
+        "summary": summary,
+        "changes": _changes(frame, status, masks, delta, old_values, {"row": rows.tolist()}),
+        "errors": [f"Строка {row}: Неверный формат новой цены" for row in rows[invalid].tolist()],
+        "not_found": [
+            f"Строка {row}: Товар с SKU '{value}' не найден"
+            for row, value in zip(rows[not_found].tolist(), sku[not_found].tolist())
+        ],
+        "apply": [
+            {
+                "position": position,
+                "base": hashes[position],
+                "data": {"sku": sku.iat[position], "price": float(price.iat[position]), "old_price": float(old_price.iat[position])},
+            }
+            for position in actionable
+        ],
+    }
+
+
+def pending_price_changes(changeset: Dict[str, Any]) -> tuple:
+    """Строки сохраненного changeset цен, которые можно применить, и конфликты (цена изменилась после предпросмотра)"""
+    items = changeset["apply"]
+    hashes = _price_hashes(price_frame().reindex([item["data"]["sku"] for item in items]))
+    ready, conflicts = [], []
+    for item, current_hash in zip(items, hashes):
+        (ready if current_hash == item["base"] else conflicts).append(item)
+    return ready, conflicts
+
+
+def pending_product_changes(changeset: Dict[str, Any], db: Session) -> tuple:
+    """Строки сохраненного changeset товаров, которые можно применить, и конфликты (товар изменился или появился)"""
+    hashes = row_hashes(catalog_frame(db))
+    ready, conflicts = [], []
+    for item in changeset["apply"]:
+        sku = item["data"].get("sku")
+        if item["base"] is None:
+            conflict = bool(sku) and sku in hashes.index
+        else:
+            conflict = hashes.get(sku) != item["base"]
+        (conflicts if conflict else ready).append(item)
+    return ready, conflicts
+
+
+def public_changeset(changeset: Dict[str, Any]) -> Dict[str, Any]:
+    """Changeset для ответа API (без данных строк для применения)"""
+    return {key: value for key, value in changeset.items() if not key.startswith("apply")}
+
+
+def _changesets_dir() -> str:
+    path = os.path.join(Config.JOBS_DIR, "changesets")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_changeset(changeset: Dict[str, Any]) -> str:
+    """Сохранить changeset для применения по id; старые (JOB_RETENTION_HOURS) удаляются"""
+    directory = _changesets_dir()
+    expired_before = time.time() - Config.JOB_RETENTION_HOURS * 3600
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.getmtime(path) < expired_before:
+            os.remove(path)
+
+    changeset_id = uuid.uuid4().hex
+    changeset["changeset_id"] = changeset_id
+    changeset["created_at"] = datetime.utcnow().isoformat()
+    with open(os.path.join(directory, f"{changeset_id}.json"), 'w', encoding='utf-8') as changeset_file:
+        json.dump(changeset, changeset_file, ensure_ascii=False, default=str)
+    return changeset_id
+
+
+def load_changeset(changeset_id: str) -> Optional[Dict[str, Any]]:
+    if not CHANGESET_ID.fullmatch(changeset_id):
+        return None
+    path = os.path.join(_changesets_dir(), f"{changeset_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as changeset_file:
+        return json.load(changeset_file)
+
+
+def delete_changeset(changeset_id: str):
+    """Changeset применяется один раз"""
+    path = os.path.join(_changesets_dir(), f"{changeset_id}.json")
+    if CHANGESET_ID.fullmatch(changeset_id) and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Метрики производительности для Yo Store API
+
+- ASGI middleware: гистограммы времени ответа и счетчики статусов по маршрутам
+- SQLAlchemy события: число запросов к БД и время в БД на каждый HTTP запрос
+- время загрузки файла цен (price_storage)
+- экспорт в формате Prometheus (/metrics) и заголовок Server-Timing
+
+Включается переменной METRICS_ENABLED=true. Когда выключено, middleware и
+обработчики событий не устанавливаются, а record_price_load - пустая проверка флага.
+Метрики считаются в памяти процесса: при нескольких воркерах каждый отдает свои.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from config import Config
+
+# Границы корзин гистограмм (сек), как у стандартных клиентов Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Границы корзин для числа SQL запросов на HTTP запрос
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+# Метка для запросов, не попавших ни в один маршрут (404, статика и т.п.)
+UNMATCHED_ROUTE = "<unmatched>"
+
+METRICS_ENABLED = Config.METRICS_ENABLED
+
+
+class Histogram:
+    """Кумулятивная гистограмма в стиле Prometheus (без внешних зависимостей)"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина = +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class RequestStats:
+    """Счетчики одного HTTP запроса (хранятся в contextvar)"""
+
+    __slots__ = ("db_queries", "db_time", "price_loads", "price_load_time")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.price_loads = 0
+        self.price_load_time = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("yo_request_stats", default=None)
+
+
+class MetricsRegistry:
+    """Агрегированные метрики процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_status: Dict[Tuple[str, str, int], int] = {}
+        self.db_queries: Dict[Tuple[str, str], int] = {}
+        self.db_time: Dict[Tuple[str, str], float] = {}
+        self.db_queries_per_request: Dict[Tuple[str, str], Histogram] = {}
+        self.price_loads = Histogram()
+
+    def observe_request(self, route: str, method: str, status: int, duration: float, stats: RequestStats):
+        key = (route, method)
+        with self._lock:
+            histogram = self.request_latency.get(key)
+            if histogram is None:
+                histogram = self.request_latency[key] = Histogram()
+                self.db_queries_per_request[key] = Histogram(QUERY_COUNT_BUCKETS)
+            histogram.observe(duration)
+
+            status_key = (route, method, status)
+            self.request_status[status_key] = self.request_status.get(status_key, 0) + 1
+
+            self.db_queries[key] = self.db_queries.get(key, 0) + stats.db_queries
+            self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+            self.db_queries_per_request[key].observe(stats.db_queries)
+
+    def observe_price_load(self, duration: float):
+        with self._lock:
+            self.price_loads.observe(duration)
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            lines.append("# HELP yo_http_request_duration_seconds Время обработки HTTP запроса")
+            lines.append("# TYPE yo_http_request_duration_seconds histogram")
+            for (route, method), histogram in sorted(self.request_latency.items()):
+                _render_histogram(lines, "yo_http_request_duration_seconds", f'route="{_escape(route)}",method="{method}"', histogram)
+
+            lines.append("# HELP yo_http_requests_total Количество HTTP запросов по статусам")
+            lines.append("# TYPE yo_http_requests_total counter")
+            for (route, method, status), count in sorted(self.request_status.items()):
+                lines.append(f'yo_http_requests_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}')
+
+            lines.append("# HELP yo_db_queries_total Количество SQL запросов, выполненных при обработке маршрута")
+            lines.append("# TYPE yo_db_queries_total counter")
+            for (route, method), count in sorted(self.db_queries.items()):
+                lines.append(f'yo_db_queries_total{{route="{_escape(route)}",method="{method}"}} {count}')
+
+            lines.append("# HELP yo_db_query_duration_seconds_total Суммарное время SQL запросов по маршруту")
+            lines.append("# TYPE yo_db_query_duration_seconds_total counter")
+            for (route, method), total in sorted(self.db_time.items()):
+                lines.append(f'yo_db_query_duration_seconds_total{{route="{_escape(route)}",method="{method}"}} {total:.6f}')
+
+            lines.append("# HELP yo_db_queries_per_request Количество SQL запросов на один HTTP запрос")
+            lines.append("# TYPE yo_db_queries_per_request histogram")
+            for (route, method), histogram in sorted(self.db_queries_per_request.items()):
+                _render_histogram(lines, "yo_db_queries_per_request", f'route="{_escape(route)}",method="{method}"', histogram)
+
+            lines.append("# HELP yo_price_file_load_seconds Время чтения файла цен")
+            lines.append("# TYPE yo_price_file_load_seconds histogram")
+            _render_histogram(lines, "yo_price_file_load_seconds", "", self.price_loads)
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.__init__()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram):
+    prefix = f"{labels}," if labels else ""
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.total:.6f}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+# Глобальный реестр метрик процесса
+metrics = MetricsRegistry()
+
+
+def record_price_load(duration: float):
+    """Учесть чтение файла цен (вызывается из price_storage)"""
+    if not METRICS_ENABLED:
+        return
+    metrics.observe_price_load(duration)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.price_loads += 1
+        stats.price_load_time += duration
+
+
+# Время старта хранится в контексте выполнения, а не в conn.info: у упавшего запроса
+# after_cursor_execute не вызывается, и запись в соединении пула осталась бы навсегда
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.yo_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "yo_query_start", None)
+    stats = _current_request.get()
+    if stats is not None and started is not None:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Чистое ASGI middleware (без BaseHTTPMiddleware, чтобы не буферизовать стриминговые ответы)
+    Маршрут берется из шаблона пути (/products/{product_id}), а не из фактического URL
+    """
+
+    def __init__(self, app, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+        self._route_paths: Dict[int, str] = {}
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(id(endpoint))
+        if path is None:
+            # Маршрутизатор Starlette кладет в scope только endpoint - ищем его шаблон один раз
+            path = UNMATCHED_ROUTE
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint or getattr(route, "app", None) is endpoint:
+                    path = route.path
+                    break
+            self._route_paths[id(endpoint)] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    timing = (
+                        f'app;dur={elapsed_ms:.1f}, '
+                        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_queries} queries"'
+                    )
+                    if stats.price_loads:
+                        timing += f', prices;dur={stats.price_load_time * 1000:.1f};desc="{stats.price_loads} loads"'
+                    message.setdefault("headers", []).append((b"server-timing", timing.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            metrics.observe_request(self._route_template(scope), scope["method"], status_code, duration, stats)
+            _current_request.reset(token)
+
+
+def install_instrumentation(app, engine, server_timing: bool = True):
+    """Подключить middleware и обработчики SQL событий (только при METRICS_ENABLED)"""
+    if not METRICS_ENABLED:
+        return False
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(MetricsMiddleware, server_timing=server_timing)
+    return True
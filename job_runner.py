@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Фоновые задачи для долгих операций с Excel (импорт каталога и цен, экспорт)
+
+Эндпоинт с ?background=true сохраняет загруженный файл на диск (Config.JOBS_DIR/<id>/),
+создает запись в таблице jobs и сразу возвращает ее id; работу выполняет ограниченный пул
+потоков (Config.JOB_WORKERS), очередь ограничена Config.JOB_MAX_QUEUED.
+Статус и прогресс - GET /jobs/{id}, готовый файл экспорта - GET /jobs/{id}/result.
+
+Задачу забирает тот процесс, который первым переведет ее из queued в running
+(условный UPDATE), поэтому при нескольких воркерах задача не выполнится дважды.
+После перезапуска задачи, прерванные на этом хосте, перезапускаются, если операция
+повторяемая (экспорт, обновление цен, update-or-create), иначе помечаются failed.
+
+Прогресс не трогает транзакцию обработчика: в PostgreSQL он пишется отдельной сессией,
+в SQLite (писатель один, импорт держит запись до своего коммита) - в файл progress.json
+папки задачи, который читают все воркеры хоста; в таблицу он попадает по завершении задачи.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+from config import Config
+from database import SessionLocal, engine
+from models import Job
+
+# Как часто прогресс задачи записывается в БД (секунды)
+PROGRESS_INTERVAL = 1.0
+
+# Файл прогресса в папке задачи (SQLite)
+PROGRESS_FILE = "progress.json"
+
+INTERRUPTED_ERROR = "Задача прервана перезапуском сервера"
+
+
+class JobQueueFull(Exception):
+    """В очереди уже Config.JOB_MAX_QUEUED задач"""
+
+
+class JobContext:
+    """То, что получает обработчик задачи: входной файл, сессия БД, прогресс, сохранение результата"""
+
+    def __init__(self, runner: "JobRunner", job: Job, db):
+        self.runner = runner
+        self.job_id = job.id
+        self.input_path = job.input_path
+        self.filename = job.filename
+        self.db = db
+        self.result_path: Optional[str] = None
+        self.result_filename: Optional[str] = None
+        self._last_progress = 0.0
+
+    def read_input(self) -> bytes:
+        with open(self.input_path, 'rb') as input_file:
+            return input_file.read()
+
+    def progress(self, done: int, total: int):
+        """Сообщить прогресс (в памяти - сразу, в БД - не чаще PROGRESS_INTERVAL)"""
+        self.runner._progress[self.job_id] = (done, total)
+        now = time.monotonic()
+        if done < total and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        self.runner._store_progress(self.job_id, done, total)
+
+    def save_result(self, content: bytes, filename: str):
+        """Сохранить файл результата (экспорт) для /jobs/{id}/result"""
+        path = os.path.join(self.runner.job_dir(self.job_id), filename)
+        with open(path, 'wb') as result_file:
+            result_file.write(content)
+        self.result_path = path
+        self.result_filename = filename
+
+
+class JobRunner:
+    """Очередь фоновых задач процесса: регистрация обработчиков, запуск, восстановление после рестарта"""
+
+    def __init__(self):
+        self._handlers: Dict[str, Dict[str, Any]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._active = set()
+        self._progress: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, kind: str, handler: Callable[[JobContext], Optional[dict]], resumable: bool = True):
+        """
+        handler(context) выполняет задачу и возвращает итог (dict) или сохраняет файл через context.save_result
+        resumable - можно ли запустить задачу заново после перезапуска сервера
+        """
+        self._handlers[kind] = {"handler": handler, "resumable": resumable}
+
+    def job_dir(self, job_id: str) -> str:
+        path = os.path.join(Config.JOBS_DIR, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def start(self):
+        """
+        Создать пул потоков и восстановить прерванные задачи (при старте воркера или первой задаче)
+        Таблица jobs создается здесь, как order_counters в order_service: под Passenger
+        (api.application) lifespan не приходит и run_startup не вызывается
+        """
+        with self._lock:
+            if self._executor is not None:
+                return
+            Job.__table__.create(bind=engine, checkfirst=True)
+            self._executor = ThreadPoolExecutor(max_workers=Config.JOB_WORKERS, thread_name_prefix="job")
+        self.recover()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind: str, upload: Optional[BinaryIO] = None, filename: Optional[str] = None) -> dict:
+        """Поставить задачу в очередь; upload - файл загрузки (копируется на диск по частям)"""
+        if kind not in self._handlers:
+            raise ValueError(f"Неизвестный тип задачи: {kind}")
+        self.start()
+
+        db = SessionLocal()
+        try:
+            queued = db.query(Job).filter(Job.status == "queued").count()
+            if queued >= Config.JOB_MAX_QUEUED:
+                raise JobQueueFull(f"В очереди уже {queued} задач, попробуйте позже")
+
+            job = Job(id=uuid.uuid4().hex, kind=kind, status="queued", filename=filename)
+            if upload is not None:
+                job.input_path = os.path.join(self.job_dir(job.id), "input" + os.path.splitext(filename or "")[1])
+                with open(job.input_path, 'wb') as input_file:
+                    shutil.copyfileobj(upload, input_file, 1024 * 1024)
+            db.add(job)
+            db.commit()
+            data = self._job_to_dict(job)
+        finally:
+            db.close()
+
+        self._executor.submit(self._run, data["id"])
+        return data
+
+    def _claim(self, job_id: str) -> bool:
+        """Перевести задачу queued -> running; False, если ее уже забрал другой процесс"""
+        db = SessionLocal()
+        try:
+            claimed = db.query(Job).filter(Job.id == job_id, Job.status == "queued").update({
+                Job.status: "running",
+                Job.worker: self.worker_id,
+                Job.started_at: datetime.utcnow(),
+                Job.attempts: Job.attempts + 1,
+            }, synchronize_session=False)
+            db.commit()
+            return claimed == 1
+        finally:
+            db.close()
+
+    def _run(self, job_id: str):
+        if not self._claim(job_id):
+            return
+        self._active.add(job_id)
+        db = SessionLocal()
+        context = None
+        try:
+            job = db.get(Job, job_id)
+            context = JobContext(self, job, db)
+            result = self._handlers[job.kind]["handler"](context)
+            db.commit()
+            self._finish(job_id, "done", result=result, context=context)
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Фоновая задача {job_id} завершилась с ошибкой: {e}")
+            self._finish(job_id, "failed", error=str(e), context=context)
+        finally:
+            db.close()
+            self._active.discard(job_id)
+            self._progress.pop(job_id, None)
+
+    def _finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None,
+                context: Optional[JobContext] = None):
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            if result is not None:
+                job.result_json = json.dumps(result, ensure_ascii=False, default=str)
+            if context is not None and context.result_path:
+                job.result_path = context.result_path
+                job.result_filename = context.result_filename
+            done, total = self._progress.get(job_id, (job.progress_done, job.progress_total))
+            job.progress_done, job.progress_total = (total, total) if status == "done" and total else (done, total)
+            # Загруженный файл больше не нужен (повторно задача не запускается)
+            if job.input_path and os.path.exists(job.input_path):
+                os.remove(job.input_path)
+            db.commit()
+        finally:
+            db.close()
+
+    def _store_progress(self, job_id: str, done: int, total: int):
+        # В SQLite запись из другого соединения ждала бы конца транзакции задачи -
+        # прогресс пишется в файл папки задачи (атомарная замена), в БД - при завершении
+        if engine.dialect.name == "sqlite":
+            path = os.path.join(self.job_dir(job_id), PROGRESS_FILE)
+            try:
+                with open(path + ".tmp", 'w') as progress_file:
+                    json.dump([done, total], progress_file)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                print(f"⚠️ Не удалось сохранить прогресс задачи {job_id}: {e}")
+            return
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.id == job_id).update(
+                {Job.progress_done: done, Job.progress_total: total}, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Не удалось сохранить прогресс задачи {job_id}: {e}")
+        finally:
+            db.close()
+
+    def _is_orphaned(self, job: Job) -> bool:
+        """Задача в running, но выполнявший ее процесс этого хоста уже не существует"""
+        host, _, pid = (job.worker or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            # PID мог достаться новому процессу (контейнеры) - своя задача выполняется, только если она в пуле
+            return job.id not in self._active
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def recover(self):
+        """Вернуть в очередь или завершить прерванные задачи, запустить ожидающие, удалить старые файлы"""
+        db = SessionLocal()
+        try:
+            for job in db.query(Job).filter(Job.status == "running").all():
+                if not self._is_orphaned(job):
+                    continue
+                handler = self._handlers.get(job.kind)
+                if handler and handler["resumable"] and (not job.input_path or os.path.exists(job.input_path)):
+                    print(f"🔁 Задача {job.id} ({job.kind}) прервана перезапуском - запускаем заново")
+                    job.status = "queued"
+                    job.worker = None
+                else:
+                    job.status = "failed"
+                    job.error = INTERRUPTED_ERROR
+                    job.finished_at = datetime.utcnow()
+            db.commit()
+
+            queued = [job_id for (job_id,) in db.query(Job.id).filter(Job.status == "queued").order_by(Job.created_at)]
+
+            expired_before = datetime.utcnow() - timedelta(hours=Config.JOB_RETENTION_HOURS)
+            for job in db.query(Job).filter(Job.status.in_(("done", "failed")), Job.finished_at < expired_before):
+                shutil.rmtree(os.path.join(Config.JOBS_DIR, job.id), ignore_errors=True)
+                db.delete(job)
+            db.commit()
+        finally:
+            db.close()
+
+        for job_id in queued:
+            self._executor.submit(self._run, job_id)
+
+    def load(self, job_id: str) -> Optional[Job]:
+        """Запись задачи (отсоединенная от сессии) или None"""
+        self.start()
+        db = SessionLocal()
+        try:
+            return db.get(Job, job_id)
+        finally:
+            db.close()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self.load(job_id)
+        return self._job_to_dict(job) if job else None
+
+    def _load_progress(self, job: Job) -> tuple:
+        """Прогресс задачи: из памяти процесса, у выполняемой в SQLite - из файла, иначе из таблицы"""
+        if job.id in self._progress:
+            return self._progress[job.id]
+        if job.status == "running" and engine.dialect.name == "sqlite":
+            try:
+                with open(os.path.join(Config.JOBS_DIR, job.id, PROGRESS_FILE)) as progress_file:
+                    done, total = json.load(progress_file)
+                return done, total
+            except (OSError, ValueError):
+                pass
+        return job.progress_done or 0, job.progress_total or 0
+
+    def _job_to_dict(self, job: Job) -> dict:
+        done, total = self._load_progress(job)
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "filename": job.filename,
+            "progress": {
+                "done": done,
+                "total": total,
+                "percent": round(done / total * 100, 1) if total else (100.0 if job.status == "done" else 0.0),
+            },
+            "result": json.loads(job.result_json) if job.result_json else None,
+            "result_url": f"/jobs/{job.id}/result" if job.result_path else None,
+            "error": job.error,
+            "attempts": job.attempts or 0,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+
+# Глобальный экземпляр для процесса
+job_runner = JobRunner()
@@ -174,8 +174,8 @@ class Order(Base):
     promo_code = Column(String(50))  # Примененный промокод
     discount_amount = Column(Float, default=0.0)  # Сумма скидки
     final_total = Column(Float, nullable=False)  # Конечная цена заказа (total - discount_amount)
-    status = Column(String(50), default="new")  # new, processing, completed, cancelled
-    created_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String(50), default="new", index=True)  # new, processing, completed, cancelled
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связь с товарами заказа
@@ -202,3 +202,49 @@ class OrderItem(Base):
     # Связи
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
+
+class OrderCounter(Base):
+    """
+    Счетчики для номеров заказов (эмуляция sequence)
+    Значение увеличивается атомарным UPDATE, без COUNT по таблице orders
+    """
+    __tablename__ = "order_counters"
+    
+    name = Column(String(50), primary_key=True)  # Имя счетчика (например, "orders")
+    value = Column(Integer, nullable=False, default=0)  # Последнее выданное значение
+
+class AppMetadata(Base):
+    """
+    Служебные значения приложения (ключ - значение)
+    Например: версия схемы и начальных данных, чтобы не запускать инициализацию при каждом старте
+    """
+    __tablename__ = "app_metadata"
+    
+    key = Column(String(100), primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Job(Base):
+    """
+    Фоновые задачи (импорт и экспорт Excel): статус, прогресс, результат
+    Файлы задачи (загруженный файл, готовый экспорт) лежат в Config.JOBS_DIR/<id>/
+    """
+    __tablename__ = "jobs"
+    
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    kind = Column(String(50), nullable=False, index=True)  # import_products, export_prices, ...
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, running, done, failed
+    filename = Column(String(255))  # Имя загруженного файла
+    input_path = Column(Text)  # Загруженный файл на диске
+    result_path = Column(Text)  # Готовый файл экспорта
+    result_filename = Column(String(255))  # Имя файла для скачивания
+    result_json = Column(Text)  # Итог импорта (как ответ синхронного эндпоинта)
+    error = Column(Text)
+    progress_done = Column(Integer, default=0)
+    progress_total = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)  # Сколько раз задача запускалась (после перезапуска - повторно)
+    worker = Column(String(100))  # host:pid процесса, выполняющего задачу
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
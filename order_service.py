@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Атомарные операции для оформления заказов:
+выдача номеров заказов без COUNT и учет использований промокодов без гонок
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Order, OrderCounter, PromoCode
+
+# Имя счетчика для номеров заказов в таблице order_counters
+ORDER_COUNTER_NAME = "orders"
+
+# Флаг: таблица счетчиков уже проверена/создана в этом процессе
+_counter_table_ready = False
+
+
+def _ensure_counter_table(db: Session) -> None:
+    """Создать таблицу order_counters, если ее нет (один раз на процесс)"""
+    global _counter_table_ready
+    if _counter_table_ready:
+        return
+    OrderCounter.__table__.create(bind=db.connection(), checkfirst=True)
+    _counter_table_ready = True
+
+
+def _seed_counter(db: Session, name: str) -> None:
+    """
+    Создать строку счетчика
+    Начальное значение = MAX(orders.id), чтобы номера продолжали существующую нумерацию
+    """
+    start_value = db.query(func.max(Order.id)).scalar() or 0
+    try:
+        with db.begin_nested():
+            db.add(OrderCounter(name=name, value=start_value))
+    except IntegrityError:
+        # Счетчик уже создан параллельным запросом - просто используем его
+        pass
+
+
+def next_counter_value(db: Session, name: str = ORDER_COUNTER_NAME) -> int:
+    """
+    Получить следующее значение счетчика одним атомарным UPDATE ... RETURNING
+    Значение фиксируется вместе с транзакцией заказа
+    """
+    _ensure_counter_table(db)
+
+    stmt = (
+        update(OrderCounter)
+        .where(OrderCounter.name == name)
+        .values(value=OrderCounter.value + 1)
+        .returning(OrderCounter.value)
+        .execution_options(synchronize_session=False)
+    )
+
+    value = db.execute(stmt).scalar()
+    if value is None:
+        _seed_counter(db, name)
+        value = db.execute(stmt).scalar()
+
+    return value
+
+
+def allocate_order_number(db: Session) -> str:
+    """Сгенерировать уникальный номер заказа вида ORD-<timestamp>-<seq>"""
+    sequence_value = next_counter_value(db, ORDER_COUNTER_NAME)
+    return f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}-{sequence_value}"
+
+
+def consume_promo_code(db: Session, code: Optional[str]) -> bool:
+    """
+    Атомарно увеличить used_count промокода с проверкой usage_limit:
+    UPDATE promo_codes SET used_count = used_count + 1 WHERE used_count < usage_limit
+
+    Возвращает True, если использование засчитано, False если промокод не найден.
+    Бросает ValueError, если лимит использований исчерпан.
+    """
+    if not code:
+        return False
+
+    code_upper = code.upper()
+    used_count = func.coalesce(PromoCode.used_count, 0)
+
+    result = db.execute(
+        update(PromoCode)
+        .where(
+            PromoCode.code == code_upper,
+            or_(
+                PromoCode.usage_limit.is_(None),
+                PromoCode.usage_limit == 0,  # 0 = безлимит, как в /promo-codes/check
+                used_count < PromoCode.usage_limit
+            )
+        )
+        .values(used_count=used_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount == 1:
+        return True
+
+    # UPDATE не затронул строк: либо промокода нет, либо лимит исчерпан
+    exists = db.query(PromoCode.id).filter(PromoCode.code == code_upper).first()
+    if exists:
+        raise ValueError("Промокод исчерпан")
+    return False
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Лента изменений цен и остатков для открытых сессий WebApp (/events/prices, Server-Sent Events)
+
+Запись файла цен (price_storage) публикует новый набор цен в PriceEventHub: он сравнивает его
+с последним известным и рассылает подписчикам компактные изменения {sku, price, old_price}.
+Изменения другого процесса (другой воркер, скрипт обновления цен) и изменения остатков
+замечаются по общим версиям cache_coherence: пока есть подписчики, фоновая задача раз
+в Config.PRICE_EVENTS_POLL_SECONDS сверяет версии и сравнивает цены и остатки с последними известными.
+
+У каждого изменения свой номер; последние Config.PRICE_EVENTS_BUFFER изменений хранятся
+в кольцевом буфере, и переподключившийся клиент (Last-Event-ID) получает пропущенные.
+Номер из другого процесса, до перезапуска или уже вытесненный из буфера - событие reset:
+клиент должен перечитать цены целиком.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+from cache_coherence import shared_versions
+
+# Сообщений в очереди одного подписчика; медленный клиент при переполнении получает reset
+SUBSCRIBER_QUEUE_SIZE = 256
+
+_LAGGING = object()
+
+
+def _sse(event: str, event_id: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+
+def _deliver(deliveries: List[tuple]):
+    for subscription, seq, message in deliveries:
+        subscription.put(seq, message)
+
+
+class Subscription:
+    """Одно SSE соединение: фильтр SKU и очередь готовых сообщений в event loop соединения"""
+
+    def __init__(self, skus: Optional[Set[str]]):
+        self.skus = skus
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.sent = 0
+
+    def put(self, seq: int, message: str):
+        """Положить сообщение в очередь (в event loop соединения)"""
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((seq, _LAGGING))
+            return
+        self.queue.put_nowait((seq, message))
+
+
+class PriceEventHub:
+    """Изменения цен и остатков процесса: кольцевой буфер и рассылка подписчикам"""
+
+    def __init__(self, buffer_size: int = Config.PRICE_EVENTS_BUFFER):
+        # Номера событий действительны только в этом процессе
+        self.stream_id = f"{os.getpid():x}{int(time.time() * 1000):x}"
+        self._buffer = deque(maxlen=buffer_size)  # (seq, event, item)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._prices: Optional[Dict[str, tuple]] = None
+        self._stocks: Optional[Dict[str, int]] = None
+        self._stale: Set[str] = set()
+        self._subscribers: Set[Subscription] = set()
+        self._pump: Optional[asyncio.Task] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.stream_id}-{seq}"
+
+    def parse_event_id(self, value: Optional[str]) -> Optional[int]:
+        """Номер события из Last-Event-ID; None - чужой или битый идентификатор"""
+        stream_id, _, seq = (value or "").rpartition("-")
+        if stream_id != self.stream_id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    # --- Источники изменений ---
+
+    def start(self):
+        """Запомнить текущие цены и остатки (с этого момента изменения попадают в ленту)"""
+        from price_storage import get_all_prices
+
+        with self._lock:
+            if self._prices is not None:
+                return
+        prices = {sku: (data.get('price'), data.get('old_price')) for sku, data in get_all_prices().items()}
+        stocks = self._load_stocks()
+        with self._lock:
+            if self._prices is None:
+                self._prices, self._stocks = prices, stocks
+                shared_versions.subscribe("prices", lambda: self._stale.add("prices"))
+                shared_versions.subscribe("catalog", lambda: self._stale.add("catalog"))
+
+    def _load_stocks(self) -> Dict[str, int]:
+        from database import SessionLocal
+        from models import Product
+
+        db = SessionLocal()
+        try:
+            return {sku: stock or 0 for sku, stock in db.query(Product.sku, Product.stock)}
+        finally:
+            db.close()
+
+    def publish_prices(self, prices: Dict[str, Dict]):
+        """Новый полный набор цен (вызывается price_storage после записи файла)"""
+        if self._prices is None:
+            return  # лента в этом процессе еще не запускалась
+        current = {sku: (data.get('price'), data.get('old_price')) for sku, data in prices.items()}
+        with self._lock:
+            previous, self._prices = self._prices, current
+        changes = [
+            {"sku": sku, "price": price, "old_price": old_price}
+            for sku, (price, old_price) in current.items() if previous.get(sku) != (price, old_price)
+        ]
+        changes += [{"sku": sku, "price": None, "old_price": None} for sku in previous.keys() - current.keys()]
+        self._emit("price", changes)
+
+    def publish_stocks(self, stocks: Dict[str, int]):
+        if self._stocks is None:
+            return
+        with self._lock:
+            previous, self._stocks = self._stocks, stocks
+        self._emit("stock", [
+            {"sku": sku, "stock": stock} for sku, stock in stocks.items() if previous.get(sku) != stock
+        ])
+
+    def refresh(self):
+        """Сравнить цены и остатки с последними известными, если их изменил кто-то еще (в потоке пула)"""
+        from price_storage import get_all_prices
+
+        stale, self._stale = self._stale, set()
+        if "prices" in stale:
+            self.publish_prices(get_all_prices())
+        if "catalog" in stale:
+            self.publish_stocks(self._load_stocks())
+
+    # --- Рассылка ---
+
+    def _emit(self, event: str, items: List[dict]):
+        if not items:
+            return
+        with self._lock:
+            first = self._seq + 1
+            self._seq += len(items)
+            self._buffer.extend((first + offset, event, item) for offset, item in enumerate(items))
+            subscribers = list(self._subscribers)
+        last = first + len(items) - 1
+
+        # Подписчики без фильтра получают одно общее сообщение; доставка - одним вызовом на event loop
+        shared_message = None
+        by_sku = None
+        deliveries: Dict[asyncio.AbstractEventLoop, List[tuple]] = {}
+        for subscription in subscribers:
+            if subscription.skus is None:
+                if shared_message is None:
+                    shared_message = _sse(event, self.event_id(last), items)
+                deliveries.setdefault(subscription.loop, []).append((subscription, last, shared_message))
+                continue
+            if by_sku is None:
+                by_sku = {item["sku"]: (first + offset, item) for offset, item in enumerate(items)}
+            if len(subscription.skus) < len(by_sku):
+                matched = sorted(by_sku[sku] for sku in subscription.skus if sku in by_sku)
+            else:
+                matched = [(first + offset, item) for offset, item in enumerate(items) if item["sku"] in subscription.skus]
+            if matched:
+                message = _sse(event, self.event_id(matched[-1][0]), [item for _, item in matched])
+                deliveries.setdefault(subscription.loop, []).append((subscription, matched[-1][0], message))
+
+        for loop, batch in deliveries.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, batch)
+            except RuntimeError:
+                pass  # event loop уже закрыт
+
+    def replay(self, after_seq: int, skus: Optional[Set[str]]) -> Optional[List[tuple]]:
+        """Сообщения с изменениями после after_seq из буфера; None - часть уже вытеснена (нужен reset)"""
+        with self._lock:
+            if after_seq > self._seq:
+                return None
+            if after_seq < self._seq and (not self._buffer or self._buffer[0][0] > after_seq + 1):
+                return None
+            pending = [entry for entry in self._buffer if entry[0] > after_seq and (skus is None or entry[2]["sku"] in skus)]
+
+        messages, batch = [], []
+        for seq, event, item in pending:
+            if batch and batch[-1][1] != event:
+                messages.append((batch[-1][0], _sse(batch[-1][1], self.event_id(batch[-1][0]), [entry[2] for entry in batch])))
+                batch = []
+            batch.append((seq, event, item))
+        if batch:
+            messages.append((batch[-1][0], _sse(batch[-1][1], self.event_id(batch[-1][0]), [entry[2] for entry in batch])))
+        return messages
+
+    async def _run_pump(self):
+        """Пока есть подписчики - подхватывать изменения других процессов"""
+        while self._subscribers:
+            await asyncio.sleep(Config.PRICE_EVENTS_POLL_SECONDS)
+            shared_versions.check()
+            if self._stale:
+                try:
+                    await run_in_threadpool(self.refresh)
+                except Exception as e:
+                    print(f"⚠️ Не удалось проверить изменения цен для ленты: {e}")
+
+    async def stream(self, skus: Optional[Iterable[str]] = None, last_event_id: Optional[str] = None):
+        """Тело SSE ответа: пропущенные изменения (Last-Event-ID), затем новые и keep-alive комментарии"""
+        await run_in_threadpool(self.start)
+        skus = set(skus) if skus is not None else None
+        subscription = Subscription(skus)
+        with self._lock:
+            self._subscribers.add(subscription)
+        if self._pump is None or self._pump.done() or self._pump.get_loop() is not subscription.loop:
+            self._pump = subscription.loop.create_task(self._run_pump())
+
+        getter = None
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id:
+                after_seq = self.parse_event_id(last_event_id)
+                messages = self.replay(after_seq, skus) if after_seq is not None else None
+                if messages is None:
+                    yield self._reset(subscription)
+                else:
+                    for seq, message in messages:
+                        subscription.sent = seq
+                        yield message
+
+            while True:
+                # Ожидание не отменяется по таймауту keep-alive, чтобы не потерять пришедшее сообщение
+                if getter is None:
+                    getter = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait({getter}, timeout=Config.PRICE_EVENTS_HEARTBEAT_SECONDS)
+                if not done:
+                    yield ": ping\n\n"
+                    continue
+                seq, message = getter.result()
+                getter = None
+                if message is _LAGGING:
+                    yield self._reset(subscription)
+                elif seq > subscription.sent:
+                    subscription.sent = seq
+                    yield message
+        finally:
+            if getter is not None:
+                getter.cancel()
+            with self._lock:
+                self._subscribers.discard(subscription)
+
+    def _reset(self, subscription: Subscription) -> str:
+        with self._lock:
+            seq = self._seq
+        subscription.sent = seq
+        return _sse("reset", self.event_id(seq), {})
+
+
+# Глобальный экземпляр для процесса
+price_events = PriceEventHub()
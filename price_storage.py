@@ -7,9 +7,14 @@
 import json
 import os
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, Optional, List
 from pathlib import Path
 import threading
+import time
+
+from instrumentation import record_price_load
+from cache_coherence import shared_versions
+from price_events import price_events
 
 # Путь к файлу с ценами
 PRICES_FILE = os.getenv('PRICES_FILE', 'current_prices.json')
@@ -17,6 +22,10 @@ PRICES_FILE = os.getenv('PRICES_FILE', 'current_prices.json')
 # Блокировка для потокобезопасности
 _lock = threading.Lock()
 
+# Кэш разобранного файла цен: ((версия "prices", mtime_ns, размер), {sku: {...}})
+# Версия меняется при любой записи через этот модуль (в любом процессе), mtime/размер - при ручной правке файла
+_prices_cache = None
+
 
 def _get_prices_file_path() -> str:
     """Получить полный путь к файлу с ценами"""
@@ -46,6 +55,7 @@ def _load_prices() -> Dict[str, Dict]:
     if not os.path.exists(file_path):
         return {}
     
+    started = time.perf_counter()
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
@@ -58,6 +68,8 @@ def _load_prices() -> Dict[str, Dict]:
     except (json.JSONDecodeError, IOError) as e:
         print(f"⚠️  Ошибка при загрузке цен из {file_path}: {e}")
         return {}
+    finally:
+        record_price_load(time.perf_counter() - started)
 
 
 def _save_prices(prices: Dict[str, Dict]) -> bool:
@@ -73,10 +85,43 @@ def _save_prices(prices: Dict[str, Dict]) -> bool:
         # Сохраняем с форматированием
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(prices, f, ensure_ascii=False, indent=2)
+        # Изменения цен - в ленту /events/prices открытых сессий
+        price_events.publish_prices(prices)
         return True
     except IOError as e:
         print(f"❌ Ошибка при сохранении цен в {file_path}: {e}")
         return False
+    finally:
+        # Сообщаем всем воркерам, что их кэш цен устарел
+        shared_versions.bump("prices")
+
+
+def _get_cached_prices() -> Dict[str, Dict]:
+    """
+    Цены из кэша процесса (с вычисленным discount_percentage)
+    Файл перечитывается только если его изменили; вызывать под _lock
+    """
+    global _prices_cache
+    file_path = _get_prices_file_path()
+    
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        _prices_cache = None
+        return {}
+    
+    cache_key = (shared_versions.get("prices"), stat.st_mtime_ns, stat.st_size)
+    if _prices_cache is not None and _prices_cache[0] == cache_key:
+        return _prices_cache[1]
+    
+    prices = _load_prices()
+    for price_data in prices.values():
+        old_price = price_data.get('old_price', 0.0)
+        price = price_data.get('price', 0.0)
+        price_data['discount_percentage'] = _calculate_discount_percentage(old_price, price)
+    
+    _prices_cache = (cache_key, prices)
+    return prices
 
 
 def get_price(sku: str) -> Optional[Dict]:
@@ -85,14 +130,9 @@ def get_price(sku: str) -> Optional[Dict]:
     Возвращает словарь с полями: price, old_price, currency, discount_percentage (вычисляется), is_parse
     """
     with _lock:
-        prices = _load_prices()
-        price_data = prices.get(sku)
-        if price_data:
-            # Вычисляем discount_percentage динамически
-            old_price = price_data.get('old_price', 0.0)
-            price = price_data.get('price', 0.0)
-            price_data['discount_percentage'] = _calculate_discount_percentage(old_price, price)
-        return price_data
+        price_data = _get_cached_prices().get(sku)
+        # Копия, чтобы вызывающий код не мог изменить кэш
+        return dict(price_data) if price_data else price_data
 
 
 def get_all_prices() -> Dict[str, Dict]:
@@ -101,13 +141,18 @@ def get_all_prices() -> Dict[str, Dict]:
     Возвращает словарь всех цен: {sku: {price, old_price, currency, discount_percentage (вычисляется), is_parse}}
     """
     with _lock:
-        prices = _load_prices()
-        # Вычисляем discount_percentage для всех записей
-        for sku, price_data in prices.items():
-            old_price = price_data.get('old_price', 0.0)
-            price = price_data.get('price', 0.0)
-            price_data['discount_percentage'] = _calculate_discount_percentage(old_price, price)
-        return prices
+        # Копии записей, чтобы вызывающий код не мог изменить кэш
+        return {sku: dict(price_data) for sku, price_data in _get_cached_prices().items()}
+
+
+def get_prices(skus: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Получить цены для набора SKU за одно обращение к кэшу
+    Возвращает {sku: {price, old_price, currency, discount_percentage, is_parse}} только для найденных SKU
+    """
+    with _lock:
+        prices = _get_cached_prices()
+        return {sku: dict(prices[sku]) for sku in skus if sku in prices}
 
 
 def set_price(
@@ -174,7 +219,7 @@ def get_prices_by_parse_flag(is_parse: bool = True) -> List[str]:
     Получить список SKU с флагом is_parse
     """
     with _lock:
-        prices = _load_prices()
+        prices = _get_cached_prices()
         return [sku for sku, data in prices.items() if data.get('is_parse', True) == is_parse]
 
 
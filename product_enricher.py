@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Пакетное дополнение списка товаров ценами, характеристиками, описаниями и изображениями
+
+Эндпоинты, отдающие много товаров (/all-products, /search, /hierarchy/skus, экспорт в Excel),
+раньше для каждой строки отдельно читали цену, разбирали specifications, запрашивали
+Level2Description и искали ProductImage. ProductEnricher создается на один запрос:
+load() делает по одному пакетному чтению на каждый вид данных (цены - одно чтение кэша,
+описания - один IN запрос, изображения - одна загрузка таблицы, а для небольшого числа
+товаров - IN запрос по их моделям), а разобранные характеристики и найденные изображения
+запоминаются до конца запроса.
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Product, ProductImage, Level2Description
+from price_storage import get_prices
+from catalog_cards import parse_image_list
+from variant_matrix import ImageRowMatcher
+
+# Размер пачки значений в IN (лимит переменных SQLite)
+IN_CHUNK_SIZE = 500
+
+
+def category_name(product) -> str:
+    """Название категории из level полей: "Смартфоны / Apple 16 Series / iPhone 16 Pro" """
+    name = product.level_0 or "Без категории"
+    if product.level_1:
+        name += f" / {product.level_1}"
+    if product.level_2:
+        name += f" / {product.level_2}"
+    return name
+
+
+class ProductEnricher:
+    """Данные для списка товаров в рамках одного запроса (создается в эндпоинте)"""
+
+    def __init__(self, db: Session, stream: bool = False):
+        """
+        stream=True - потоковый ответ пачками: таблица изображений загружается без списков URL,
+        списки читаются для пар (level_2, color) каждой пачки и забываются вместе с ней
+        """
+        self.db = db
+        self.stream = stream
+        self._prices: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._specifications: Dict[int, Dict[str, Any]] = {}
+        self._descriptions: Dict[str, Optional[Level2Description]] = {}
+        self._level2_details: Dict[str, Dict[str, Any]] = {}
+        self._image_matcher: Optional[ImageRowMatcher] = None
+        self._table_images: Dict[tuple, List[str]] = {}
+
+    def load(self, products: Iterable[Product], prices: bool = True, descriptions: bool = True,
+             images: bool = False) -> "ProductEnricher":
+        """
+        Пакетно загрузить цены и описания level_2 для товаров (уже загруженное не читается повторно)
+        images=True - сразу найти изображения из таблицы ProductImage для всех товаров
+        """
+        products = list(products)
+
+        if prices:
+            skus = [product.sku for product in products if product.sku not in self._prices]
+            if skus:
+                loaded = get_prices(skus)
+                for sku in skus:
+                    self._prices[sku] = loaded.get(sku)
+
+        if descriptions:
+            level2_values = list({
+                product.level_2 for product in products
+                if product.level_2 and product.level_2 not in self._descriptions
+            })
+            for start in range(0, len(level2_values), IN_CHUNK_SIZE):
+                chunk = level2_values[start:start + IN_CHUNK_SIZE]
+                rows = self.db.query(Level2Description).filter(
+                    Level2Description.level_2.in_(chunk)
+                ).order_by(Level2Description.id).all()
+                for description in rows:
+                    self._descriptions.setdefault(description.level_2, description)
+            for level_2 in level2_values:
+                self._descriptions.setdefault(level_2, None)
+
+        if images:
+            self._load_table_images({
+                key for key in map(self._table_image_key, products)
+                if key is not None and key not in self._table_images
+            })
+        return self
+
+    def forget_products(self):
+        """
+        Забыть цены и характеристики уже отданных товаров (потоковые ответы обрабатывают каталог
+        пачками - память не растет с каталогом); описания и изображения моделей остаются
+        """
+        self._prices.clear()
+        self._specifications.clear()
+        if self.stream:
+            self._table_images.clear()
+
+    def price(self, product: Product) -> Optional[Dict[str, Any]]:
+        """Цена SKU (как get_price) или None"""
+        if product.sku not in self._prices:
+            self.load([product], descriptions=False)
+        return self._prices[product.sku]
+
+    def specifications(self, product: Product) -> Dict[str, Any]:
+        """Разобранные specifications товара ({} при пустом или битом JSON)"""
+        specifications = self._specifications.get(product.id)
+        if specifications is None:
+            try:
+                specifications = json.loads(product.specifications) if product.specifications else {}
+            except json.JSONDecodeError:
+                specifications = {}
+            self._specifications[product.id] = specifications
+        return specifications
+
+    def description(self, product: Product) -> Optional[Level2Description]:
+        """Запись Level2Description модели товара или None"""
+        if not product.level_2:
+            return None
+        if product.level_2 not in self._descriptions:
+            self.load([product], prices=False)
+        return self._descriptions[product.level_2]
+
+    def description_text(self, product: Product) -> str:
+        description = self.description(product)
+        return (description.description or "") if description else ""
+
+    def level2_details(self, product: Product) -> Dict[str, Any]:
+        """Характеристики модели из Level2Description.details ({} если нет)"""
+        description = self.description(product)
+        if not description or not description.details:
+            return {}
+        details = self._level2_details.get(description.level_2)
+        if details is None:
+            try:
+                details = json.loads(description.details) if isinstance(description.details, str) else description.details
+            except json.JSONDecodeError:
+                details = {}
+            self._level2_details[description.level_2] = details
+        return details
+
+    def images(self, product: Product) -> List[str]:
+        """
+        Изображения товара: specifications.images, иначе ProductImage
+        по (level_2, color). Записи ProductImage читаются пакетно (см. load), совпадение по паре запоминается
+        """
+        specifications = self.specifications(product)
+        images = parse_image_list(specifications.get('images', []))
+        key = self._table_image_key(product)
+        if images or key is None:
+            return images
+
+        table_images = self._table_images.get(key)
+        if table_images is None:
+            self._load_table_images([key])
+            table_images = self._table_images[key]
+        return list(table_images)
+
+    def _table_image_key(self, product: Product) -> Optional[tuple]:
+        """Пара (level_2, color) для поиска в таблице ProductImage; None - изображения из specifications или искать не по чему"""
+        specifications = self.specifications(product)
+        color = specifications.get('color', '')
+        if not product.level_2 or not color or parse_image_list(specifications.get('images', [])):
+            return None
+        return (product.level_2, color)
+
+    def _load_table_images(self, keys: Iterable[tuple]):
+        keys = list(keys)
+        if self._image_matcher is None and not self.stream and len(keys) <= IN_CHUNK_SIZE:
+            # Немного товаров (карточка, пачка, поиск): сначала записи только их моделей,
+            # вся таблица читается, лишь если для какой-то пары нет точного совпадения
+            keys = self._load_exact_table_images(keys)
+            if not keys:
+                return
+
+        if self._image_matcher is None:
+            columns = (ProductImage.id, ProductImage.level_2, ProductImage.color)
+            if not self.stream:
+                columns += (ProductImage.img_list,)
+            self._image_matcher = ImageRowMatcher(self.db.query(*columns).all())
+
+        matched = {key: self._image_matcher.match(*key) for key in keys}
+        if not self.stream:
+            for key, image_row in matched.items():
+                self._table_images[key] = parse_image_list(image_row.img_list) if image_row and image_row.img_list else []
+            return
+
+        # Списки URL только для совпавших записей пачки
+        ids = list({image_row.id for image_row in matched.values() if image_row is not None})
+        img_lists = {}
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            img_lists.update(self.db.query(ProductImage.id, ProductImage.img_list).filter(
+                ProductImage.id.in_(ids[start:start + IN_CHUNK_SIZE])
+            ))
+        for key, image_row in matched.items():
+            img_list = img_lists.get(image_row.id) if image_row is not None else None
+            self._table_images[key] = parse_image_list(img_list) if img_list else []
+
+    def _load_exact_table_images(self, keys: List[tuple]) -> List[tuple]:
+        """Точные пары (level_2, color) одним IN запросом по level_2; возвращает ненайденные пары"""
+        level2_values = list({level_2 for level_2, _ in keys})
+        img_lists = {}
+        if level2_values:
+            for row in self.db.query(ProductImage.level_2, ProductImage.color, ProductImage.img_list).filter(
+                ProductImage.level_2.in_(level2_values)
+            ):
+                img_lists.setdefault((row.level_2, row.color), row.img_list)
+
+        missing = []
+        for key in keys:
+            if key not in img_lists:
+                missing.append(key)
+                continue
+            img_list = img_lists[key]
+            self._table_images[key] = parse_image_list(img_list) if img_list else []
+        return missing
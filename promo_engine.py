@@ -0,0 +1,219 @@
+"""
+Движок проверки промокодов для Yo Store
+Активные промокоды компилируются в правила и кэшируются в памяти,
+товары корзины загружаются одним IN-запросом, цены - одним чтением JSON файла
+"""
+
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Product, PromoCode
+from price_storage import get_all_prices, get_prices
+from cache_coherence import shared_versions
+
+# Максимальное время жизни кэша правил (сек) - страховка для изменений мимо ORM (ручной SQL)
+PROMO_RULES_TTL = 60
+
+
+class CompiledPromoRule:
+    """Промокод, подготовленный для многократной проверки (JSON условия разобран один раз)"""
+
+    def __init__(self, promo_code: PromoCode):
+        self.code = promo_code.code
+        self.discount_type = promo_code.discount_type
+        self.discount_value = promo_code.discount_value
+        self.min_order_amount = promo_code.min_order_amount
+        self.usage_limit = promo_code.usage_limit
+        self.used_count = promo_code.used_count or 0
+        self.valid_from = promo_code.valid_from
+        self.valid_until = promo_code.valid_until
+        self.description = promo_code.description
+        self.free_item_sku = promo_code.free_item_sku
+        self.free_item_sku_lower = promo_code.free_item_sku.lower() if promo_code.free_item_sku else None
+
+        # Условие для бесплатного товара: None - условия нет или оно не разбирается
+        self.has_condition = False
+        self.condition_category = None
+        if promo_code.free_item_condition:
+            try:
+                condition = json.loads(promo_code.free_item_condition) if isinstance(promo_code.free_item_condition, str) else promo_code.free_item_condition
+                self.condition_category = condition.get('category') or condition.get('level_0')
+                self.has_condition = True
+            except (json.JSONDecodeError, TypeError, AttributeError):
+                pass
+
+
+class CartSnapshot:
+    """Товары корзины и их текущие цены, загруженные один раз на запрос"""
+
+    def __init__(self, db: Session, items: Iterable[Any]):
+        self.items = list(items)
+
+        product_ids = {item.product_id for item in self.items}
+        self.products: Dict[int, Product] = {}
+        if product_ids:
+            # Один запрос вместо db.query(Product) на каждый товар
+            for product in db.query(Product).filter(Product.id.in_(product_ids)).all():
+                self.products[product.id] = product
+
+        self._prices: Optional[Dict[str, Dict]] = None
+
+    def cart_products(self) -> List[Product]:
+        """Товары корзины в порядке позиций (без ненайденных)"""
+        return [self.products[item.product_id] for item in self.items if item.product_id in self.products]
+
+    def load_prices(self) -> Dict[str, Dict]:
+        """Цены только товаров корзины одним пакетным чтением (вместо копии всего файла цен)"""
+        self._prices = get_prices([product.sku for product in self.products.values() if product.sku])
+        return self._prices
+
+    def get_price(self, sku: str) -> Optional[Dict]:
+        """Цена товара; файл цен читается не больше одного раза"""
+        if self._prices is None:
+            self._prices = get_all_prices()
+        return self._prices.get(sku)
+
+
+class PromoEngine:
+    """Проверка промокодов по закэшированным правилам"""
+
+    def __init__(self, ttl: float = PROMO_RULES_TTL):
+        self.ttl = ttl
+        self._rules: Dict[str, CompiledPromoRule] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Сбросить кэш правил (вызывается при изменении промокодов)"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _get_rules(self, db: Session) -> Dict[str, CompiledPromoRule]:
+        """Получить правила, перезагрузив их из БД если кэш сброшен или устарел"""
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._rules
+
+            promo_codes = db.query(PromoCode).filter(PromoCode.is_active == True).all()
+            self._rules = {promo_code.code: CompiledPromoRule(promo_code) for promo_code in promo_codes}
+            self._loaded_at = time.monotonic()
+            return self._rules
+
+    def evaluate(self, db: Session, code: str, cart_total: float, items: Iterable[Any],
+                 cart: Optional[CartSnapshot] = None) -> Dict[str, Any]:
+        """Проверить один промокод для корзины (cart - уже загруженная корзина тех же позиций)"""
+        if cart is None:
+            cart = CartSnapshot(db, items)
+        return {**self._evaluate_rule(self._get_rules(db).get(code.upper()), cart_total, cart), "code": code.upper()}
+
+    def evaluate_many(self, db: Session, codes: List[str], cart_total: float, items: Iterable[Any]) -> List[Dict[str, Any]]:
+        """Проверить несколько промокодов для одной корзины (корзина и цены загружаются один раз)"""
+        cart = CartSnapshot(db, items)
+        rules = self._get_rules(db)
+        return [
+            {**self._evaluate_rule(rules.get(code.upper()), cart_total, cart), "code": code.upper()}
+            for code in codes
+        ]
+
+    def _evaluate_rule(self, rule: Optional[CompiledPromoRule], cart_total: float, cart: CartSnapshot) -> Dict[str, Any]:
+        """Рассчитать скидку по правилу; формат ответа совпадает с PromoCodeCheckResponse"""
+        if not rule:
+            return {"valid": False, "message": "Промокод не найден или неактивен"}
+
+        # Проверяем срок действия
+        now = datetime.utcnow()
+        if rule.valid_from and rule.valid_from > now:
+            return {"valid": False, "message": "Промокод еще не действует"}
+
+        if rule.valid_until and rule.valid_until < now:
+            return {"valid": False, "message": "Промокод истек"}
+
+        # Проверяем лимит использований
+        if rule.usage_limit and rule.used_count >= rule.usage_limit:
+            return {"valid": False, "message": "Промокод исчерпан"}
+
+        # Проверяем минимальную сумму заказа
+        if rule.min_order_amount and cart_total < rule.min_order_amount:
+            return {
+                "valid": False,
+                "message": f"Минимальная сумма заказа для этого промокода: {rule.min_order_amount:,.0f} ₽"
+            }
+
+        discount_amount = 0.0
+        free_item_sku = None
+        free_item_name = None
+
+        if rule.discount_type == 'fixed':
+            discount_amount = min(rule.discount_value, cart_total)
+
+        elif rule.discount_type == 'percentage':
+            discount_amount = cart_total * (rule.discount_value / 100)
+
+        elif rule.discount_type == 'free_item':
+            cart_products = cart.cart_products()
+
+            # Проверяем, есть ли товар нужной категории в корзине
+            if rule.has_condition:
+                if not any(product.level_0 == rule.condition_category for product in cart_products):
+                    return {
+                        "valid": False,
+                        "message": f"Промокод действует только при заказе товара категории '{rule.condition_category}'"
+                    }
+
+            if rule.free_item_sku_lower:
+                free_item_in_cart = next(
+                    (product for product in cart_products if product.sku and rule.free_item_sku_lower in product.sku.lower()),
+                    None
+                )
+
+                if not free_item_in_cart:
+                    return {
+                        "valid": False,
+                        "message": "Промокод действует только если адаптер уже добавлен в корзину"
+                    }
+
+                # Скидка равна цене бесплатного товара
+                price_data = cart.get_price(free_item_in_cart.sku)
+                if not price_data:
+                    return {
+                        "valid": False,
+                        "message": "Не удалось определить цену товара для бесплатной выдачи"
+                    }
+
+                free_item_sku = free_item_in_cart.sku
+                free_item_name = free_item_in_cart.name
+                discount_amount = price_data.get('price', 0.0)
+
+        return {
+            "valid": True,
+            "discount_type": rule.discount_type,
+            "discount_value": rule.discount_value,
+            "discount_amount": discount_amount,
+            "min_order_amount": rule.min_order_amount,
+            "description": rule.description,
+            "free_item_sku": free_item_sku,
+            "free_item_name": free_item_name,
+            "message": "Промокод применен успешно"
+        }
+
+
+# Глобальный экземпляр для использования в API
+promo_engine = PromoEngine()
+
+
+def _invalidate_promo_rules(mapper, connection, target):
+    """Сбросить кэш при изменении промокода через ORM"""
+    promo_engine.invalidate()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(PromoCode, _event_name, _invalidate_promo_rules)
+
+# Изменения промокодов в других воркерах (в т.ч. used_count при оформлении заказа)
+shared_versions.subscribe("promo", promo_engine.invalidate)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Журнал медленных SQL запросов для Yo Store
+
+Включается SLOW_QUERY_LOG_ENABLED=true (по умолчанию выключен, как и метрики).
+Запросы дольше порога (SLOW_QUERY_THRESHOLD_MS) записываются вместе с параметрами,
+группируются по "отпечатку" (SQL без литералов и с длинными IN (...) свернутыми),
+а для каждого отпечатка один раз снимается план: EXPLAIN QUERY PLAN (SQLite) или EXPLAIN (PostgreSQL).
+План снимается на соединении запроса; на PostgreSQL - внутри SAVEPOINT, чтобы ошибка EXPLAIN
+не прерывала транзакцию вызывающего кода.
+"""
+
+import re
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import event
+
+from config import Config
+
+# Сколько последних медленных запросов хранить с параметрами
+RECENT_SLOW_QUERIES = 200
+
+# Максимальная длина параметров в журнале
+MAX_PARAMS_LENGTH = 500
+
+# Запросы, для которых можно безопасно снять план (EXPLAIN их не выполняет)
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+# Точка сохранения вокруг EXPLAIN в транзакции вызывающего кода (PostgreSQL)
+_EXPLAIN_SAVEPOINT = "yo_slow_query_explain"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))*\s*\)")
+_POSTCOMPILE = re.compile(r"\(?\s*__\[POSTCOMPILE_\w+\]\s*\)?")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Нормализовать SQL: литералы -> ?, списки IN (?, ?, ...) -> (...), пробелы схлопнуты"""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _POSTCOMPILE.sub(" (...)", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(...)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+class SlowQueryStats:
+    """Агрегат по одному отпечатку запроса"""
+
+    def __init__(self, fingerprint_sql: str, statement: str):
+        self.fingerprint = fingerprint_sql
+        self.statement = statement
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_params: Optional[str] = None
+        self.first_seen = datetime.utcnow()
+        self.last_seen = self.first_seen
+        self.plan: Optional[List[str]] = None
+        self.plan_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total_time * 1000, 2),
+            "avg_ms": round(self.total_time * 1000 / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_time * 1000, 2),
+            "last_params": self.last_params,
+            "first_seen": self.first_seen.isoformat(),
+            "last_seen": self.last_seen.isoformat(),
+            "plan": self.plan,
+            "plan_error": self.plan_error,
+            "full_scan": any(_is_full_scan(line) for line in self.plan or []),
+        }
+
+
+def _is_full_scan(plan_line: str) -> bool:
+    """Признак полного прохода по таблице в строке плана"""
+    line = plan_line.strip().upper()
+    if line.startswith("SCAN "):
+        # SQLite: "SCAN products" (без индекса) vs "SCAN products USING INDEX ..."
+        return "INDEX" not in line
+    return "SEQ SCAN" in line
+
+
+def _format_params(parameters) -> str:
+    text = repr(parameters)
+    if len(text) > MAX_PARAMS_LENGTH:
+        text = text[:MAX_PARAMS_LENGTH] + "..."
+    return text
+
+
+class SlowQueryLog:
+    """Сбор медленных запросов через события SQLAlchemy"""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold = threshold_ms / 1000
+        self._lock = threading.Lock()
+        self._stats: Dict[str, SlowQueryStats] = {}
+        self._recent = deque(maxlen=RECENT_SLOW_QUERIES)
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    # Старт - в контексте выполнения: у упавшего запроса after_cursor_execute не вызывается
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.yo_slow_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "yo_slow_query_start", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+
+        key = fingerprint(statement)
+        params = _format_params(parameters)
+        now = datetime.utcnow()
+
+        with self._lock:
+            stats = self._stats.get(key)
+            need_plan = stats is None
+            if stats is None:
+                stats = self._stats[key] = SlowQueryStats(key, statement)
+            stats.count += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.last_params = params
+            stats.last_seen = now
+            self._recent.append({
+                "fingerprint": key,
+                "duration_ms": round(duration * 1000, 2),
+                "params": params,
+                "at": now.isoformat(),
+            })
+
+        print(f"🐢 Медленный запрос {duration * 1000:.1f} мс: {key[:200]} params={params[:200]}")
+
+        if need_plan and not executemany:
+            plan, error = self._explain(conn, statement, parameters)
+            with self._lock:
+                stats.plan, stats.plan_error = plan, error
+
+    def _explain(self, conn, statement: str, parameters):
+        """Снять план запроса на том же соединении (только один раз на отпечаток), не ломая его транзакцию"""
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return None, "План не снимается для этого типа запроса"
+
+        dialect = conn.dialect.name
+        if dialect == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        elif dialect == "postgresql":
+            prefix = "EXPLAIN "
+        else:
+            return None, f"EXPLAIN не поддерживается для {dialect}"
+
+        dbapi_connection = conn.connection.dbapi_connection
+        # PostgreSQL: ошибка EXPLAIN прервала бы открытую транзакцию запроса ("current transaction
+        # is aborted") - план снимается внутри SAVEPOINT, при ошибке откатываемся только к нему
+        savepoint = dialect == "postgresql" and not getattr(dbapi_connection, "autocommit", False)
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                if savepoint:
+                    cursor.execute(f"SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+                try:
+                    cursor.execute(prefix + statement, parameters)
+                    rows = cursor.fetchall()
+                except Exception:
+                    if savepoint:
+                        cursor.execute(f"ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+                    raise
+                finally:
+                    if savepoint:
+                        cursor.execute(f"RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+            finally:
+                cursor.close()
+        except Exception as e:
+            return None, str(e)
+
+        if dialect == "sqlite":
+            # (id, parent, notused, detail) - отступ по уровню вложенности
+            depth = {0: -1}
+            plan = []
+            for row in rows:
+                level = depth.get(row[1], -1) + 1
+                depth[row[0]] = level
+                plan.append("  " * level + str(row[3]))
+            return plan, None
+        return [str(row[0]) for row in rows], None
+
+    def report(self, limit: int = 50, sort: str = "total") -> Dict[str, Any]:
+        """Отпечатки, отсортированные по суммарному (или максимальному/количеству) времени"""
+        sort_keys = {
+            "total": lambda s: s.total_time,
+            "max": lambda s: s.max_time,
+            "count": lambda s: s.count,
+        }
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=sort_keys.get(sort, sort_keys["total"]), reverse=True)
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "fingerprints": [stats.to_dict() for stats in ranked[:limit]],
+                "recent": list(self._recent)[-limit:][::-1],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._recent.clear()
+
+
+# Глобальный журнал (None - выключен: SLOW_QUERY_LOG_ENABLED не задан или SLOW_QUERY_THRESHOLD_MS=0)
+slow_query_log: Optional[SlowQueryLog] = (
+    SlowQueryLog(Config.SLOW_QUERY_THRESHOLD_MS)
+    if Config.SLOW_QUERY_LOG_ENABLED and Config.SLOW_QUERY_THRESHOLD_MS > 0 else None
+)
+
+
+def install_slow_query_log(engine) -> bool:
+    """Подключить журнал к engine, если он включен"""
+    if slow_query_log is None:
+        return False
+    slow_query_log.install(engine)
+    return True
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Быстрый и идемпотентный запуск приложения
+
+Инициализация БД (create_all, тестовый каталог, промокоды) выполняется только если
+версия схемы или начальных данных в таблице app_metadata отличается от текущей.
+Обычный перезапуск стоит одного SELECT.
+"""
+
+import time
+import argparse
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from database import engine, SessionLocal
+from models import AppMetadata
+
+# Увеличить при изменении моделей (новые таблицы/индексы)
+SCHEMA_VERSION = 3
+
+# Увеличить при изменении начальных данных (init_database, каталог, промокоды)
+SEED_VERSION = 1
+
+SCHEMA_VERSION_KEY = "schema_version"
+SEED_VERSION_KEY = "seed_version"
+
+
+def get_metadata_values(keys) -> dict:
+    """Прочитать значения из app_metadata; пустой словарь, если таблицы еще нет"""
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(select(AppMetadata.key, AppMetadata.value).where(AppMetadata.key.in_(keys)))
+            return {key: value for key, value in rows}
+    except (OperationalError, ProgrammingError):
+        return {}
+
+
+def set_metadata_values(values: dict):
+    """Записать значения в app_metadata"""
+    db = SessionLocal()
+    try:
+        for key, value in values.items():
+            db.merge(AppMetadata(key=key, value=str(value)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def is_startup_current() -> bool:
+    """Схема и начальные данные уже соответствуют текущим версиям"""
+    values = get_metadata_values([SCHEMA_VERSION_KEY, SEED_VERSION_KEY])
+    return (
+        values.get(SCHEMA_VERSION_KEY) == str(SCHEMA_VERSION)
+        and values.get(SEED_VERSION_KEY) == str(SEED_VERSION)
+    )
+
+
+def run_startup(force: bool = False) -> bool:
+    """
+    Подготовить БД к работе
+    Возвращает True, если инициализация выполнялась, False если версия актуальна
+    """
+    started = time.perf_counter()
+
+    if not force and is_startup_current():
+        print(f"✅ Схема v{SCHEMA_VERSION} и данные v{SEED_VERSION} актуальны, инициализация пропущена "
+              f"({(time.perf_counter() - started) * 1000:.0f} мс)")
+        return False
+
+    # Модули инициализации импортируются только когда они действительно нужны
+    from database import init_database
+    from init_db_for_production import create_full_product_catalog
+    from init_promo_codes import init_promo_codes
+
+    print("Initializing database...")
+    init_database()
+
+    print("Creating full product catalog...")
+    create_full_product_catalog()
+
+    print("Initializing promo codes...")
+    init_promo_codes()
+
+    set_metadata_values({SCHEMA_VERSION_KEY: SCHEMA_VERSION, SEED_VERSION_KEY: SEED_VERSION})
+    print(f"✅ Инициализация завершена за {time.perf_counter() - started:.2f} c "
+          f"(схема v{SCHEMA_VERSION}, данные v{SEED_VERSION})")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инициализация БД Yo Store")
+    parser.add_argument('--force', action='store_true', help='Выполнить инициализацию даже если версия актуальна')
+    args = parser.parse_args()
+    run_startup(force=args.force)
+
+
+if __name__ == "__main__":
+    main()
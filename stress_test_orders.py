@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка POST /orders
+Запускает локальный сервер на копии БД, отправляет сотни параллельных заказов и проверяет:
+- все номера заказов уникальны
+- промокод с usage_limit не использован больше лимита
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import create_engine, text
+
+# Добавляем путь к проекту для импорта модулей
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PROJECT_DIR)
+
+
+def find_free_port() -> int:
+    """Найти свободный порт для локального сервера"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare_database(source_db: str, work_dir: str, promo_code: str, promo_limit: int):
+    """Скопировать БД во временную папку и создать тестовый промокод с лимитом"""
+    db_path = os.path.join(work_dir, 'stress.db')
+    shutil.copy(source_db, db_path)
+    database_url = f"sqlite:///{db_path}"
+
+    # Создаем таблицы (в т.ч. order_counters)
+    os.environ['DATABASE_URL'] = database_url
+    from models import Base
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM promo_codes WHERE code = :code"), {"code": promo_code})
+        conn.execute(text("""
+            INSERT INTO promo_codes (code, discount_type, discount_value, min_order_amount,
+                                     is_active, usage_limit, used_count, description)
+            VALUES (:code, 'fixed', 100.0, 0.0, 1, :limit, 0, 'Stress test')
+        """), {"code": promo_code, "limit": promo_limit})
+        product_id = conn.execute(text("SELECT id FROM products ORDER BY id LIMIT 1")).scalar()
+
+    return database_url, engine, product_id
+
+
+def start_server(database_url: str, prices_file: str, port: int, workers: int):
+    """Запустить uvicorn с несколькими воркерами на временной БД"""
+    env = dict(os.environ, DATABASE_URL=database_url, PRICES_FILE=prices_file)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api:app',
+         '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=PROJECT_DIR,
+        env=env
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("Сервер не запустился")
+
+
+def build_order(index: int, product_id: int, promo_code: str = None) -> dict:
+    """Сформировать тело заказа"""
+    return {
+        "customer": {
+            "name": f"Stress {index}",
+            "contact_method": "telegram",
+            "contact_value": f"@stress{index}"
+        },
+        "shipping": {"type": "pickup"},
+        "items": [{
+            "product_id": product_id,
+            "name": "Stress item",
+            "price": 1000.0,
+            "quantity": 1
+        }],
+        "total": 1000.0,
+        "promo_code": promo_code,
+        "discount_amount": 100.0 if promo_code else 0.0
+    }
+
+
+def run_stress(base_url: str, product_id: int, orders: int, concurrency: int, promo_code: str):
+    """Отправить заказы параллельно; каждый второй - с промокодом"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def place(index):
+        code = promo_code if index % 2 == 0 else None
+        started = time.perf_counter()
+        response = session.post(f"{base_url}/orders", json=build_order(index, product_id, code), timeout=60)
+        elapsed = time.perf_counter() - started
+        body = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+        return code, response.status_code, body, elapsed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(place, range(orders)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка POST /orders")
+    parser.add_argument('--db', default=os.path.join(PROJECT_DIR, 'electronics_store.db'), help='Исходная SQLite БД (копируется)')
+    parser.add_argument('--orders', type=int, default=300, help='Количество заказов')
+    parser.add_argument('--concurrency', type=int, default=50, help='Параллельных запросов')
+    parser.add_argument('--workers', type=int, default=4, help='Воркеров uvicorn')
+    parser.add_argument('--promo-limit', type=int, default=25, help='usage_limit тестового промокода')
+    args = parser.parse_args()
+
+    promo_code = 'STRESSLIMIT'
+    work_dir = tempfile.mkdtemp(prefix='yo_stress_')
+    prices_file = os.path.join(work_dir, 'current_prices.json')
+
+    print(f"🧪 Нагрузочная проверка /orders: {args.orders} заказов, {args.concurrency} параллельно, {args.workers} воркеров")
+
+    database_url, engine, product_id = prepare_database(args.db, work_dir, promo_code, args.promo_limit)
+    process, base_url = start_server(database_url, prices_file, find_free_port(), args.workers)
+
+    try:
+        started = time.perf_counter()
+        results = run_stress(base_url, product_id, args.orders, args.concurrency, promo_code)
+        duration = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    ok = [r for r in results if r[1] == 200]
+    promo_ok = [r for r in ok if r[0]]
+    promo_rejected = [r for r in results if r[0] and r[1] == 400]
+    failures = [r for r in results if r[1] not in (200, 400)]
+    order_numbers = [r[2].get('order_number') for r in ok]
+    latencies = sorted(r[3] for r in results)
+
+    with engine.connect() as conn:
+        used_count = conn.execute(text("SELECT used_count FROM promo_codes WHERE code = :code"), {"code": promo_code}).scalar()
+
+    print(f"⏱  {duration:.2f} c, {len(results) / duration:.1f} заказов/с, p50={latencies[len(latencies) // 2] * 1000:.0f} мс, max={latencies[-1] * 1000:.0f} мс")
+    print(f"✅ Успешно: {len(ok)}, с промокодом: {len(promo_ok)}, отклонено по лимиту: {len(promo_rejected)}, ошибок: {len(failures)}")
+    print(f"🎟  used_count={used_count}, usage_limit={args.promo_limit}")
+
+    problems = []
+    if len(set(order_numbers)) != len(order_numbers):
+        problems.append("дублирующиеся номера заказов")
+    if len(promo_ok) > args.promo_limit:
+        problems.append("промокод использован больше лимита")
+    if used_count != len(promo_ok):
+        problems.append(f"used_count ({used_count}) не совпадает с числом заказов с промокодом ({len(promo_ok)})")
+    if failures:
+        problems.append(f"{len(failures)} запросов завершились ошибкой: {json.dumps(failures[0][2], ensure_ascii=False)}")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    if problems:
+        print("❌ " + "; ".join(problems))
+        sys.exit(1)
+    print("✅ Номера заказов уникальны, лимит промокода соблюден")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo,
+    InlineQueryResultArticle, InputTextMessageContent
+)
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, ContextTypes
 from config import Config
-import requests
-import json
+from bot_service import create_catalog_service, ChatResponseCache
 
 # Configure logging
 logging.basicConfig(
@@ -12,10 +14,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Результатов в одной странице ответа на inline запрос (Telegram допускает до 50)
+INLINE_PAGE_SIZE = 20
+
+# Категории главного меню (callback_data = "cat:<level_0>")
+MAIN_MENU_CATEGORIES = [
+    ("📱", "Смартфоны"),
+    ("💻", "Ноутбуки"),
+    ("🎮", "Игровые приставки"),
+    ("🎧", "Наушники"),
+    ("📱", "Планшеты"),
+    ("🔊", "Умные колонки"),
+]
+
 class ElectronicsStoreBot:
-    def __init__(self):
+    def __init__(self, catalog_service=None):
         self.token = Config.TELEGRAM_BOT_TOKEN
         self.api_url = f"http://{Config.HOST}:{Config.PORT}"
+        # Каталог: напрямую в процессе API или через асинхронный HTTP клиент (BOT_API_MODE)
+        self.catalog = catalog_service or create_catalog_service()
+        self.cache = ChatResponseCache()
+    
+    def main_menu_markup(self):
+        """Клавиатура главного меню"""
+        keyboard = [[InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))]]
+        for icon, level_0 in MAIN_MENU_CATEGORIES:
+            keyboard.append([InlineKeyboardButton(f"{icon} {level_0}", callback_data=f"cat:{level_0}")])
+        return InlineKeyboardMarkup(keyboard)
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -34,21 +59,9 @@ class ElectronicsStoreBot:
 Цены обновляются каждые 10 минут!
         """
         
-        keyboard = [
-            [InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))],
-            [InlineKeyboardButton("📱 Смартфоны", callback_data="category_1")],
-            [InlineKeyboardButton("💻 Ноутбуки", callback_data="category_2")],
-            [InlineKeyboardButton("🎮 Игровые приставки", callback_data="category_3")],
-            [InlineKeyboardButton("🎧 Наушники", callback_data="category_4")],
-            [InlineKeyboardButton("📱 Планшеты", callback_data="category_5")],
-            [InlineKeyboardButton("🔊 Умные колонки", callback_data="category_6")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             welcome_text,
-            reply_markup=reply_markup
+            reply_markup=self.main_menu_markup()
         )
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -60,6 +73,7 @@ class ElectronicsStoreBot:
 /help - Эта справка
 /categories - Показать все категории
 /search <запрос> - Поиск товаров
+@бот <запрос> - Поиск товаров в любом чате
 
 💡 Используйте кнопки для навигации по магазину
 💡 Цены обновляются автоматически каждые 10 минут
@@ -70,28 +84,25 @@ class ElectronicsStoreBot:
     async def categories_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /categories command"""
         try:
-            response = requests.get(f"{self.api_url}/categories")
-            if response.status_code == 200:
-                categories = response.json()
+            categories = await self.cache.get_or_load(update.effective_chat.id, ("categories",), self.catalog.get_categories)
+            
+            text = "📂 Категории товаров:\n\n"
+            keyboard = []
+            
+            for category in categories:
+                text += f"{category['icon']} {category['name']} ({category['product_count']} товаров)\n"
+                text += f"   {category['description']}\n\n"
                 
-                text = "📂 Категории товаров:\n\n"
-                keyboard = []
-                
-                for category in categories:
-                    text += f"{category['icon']} {category['name']} ({category['product_count']} товаров)\n"
-                    text += f"   {category['description']}\n\n"
-                    
-                    keyboard.append([InlineKeyboardButton(
-                        f"{category['icon']} {category['name']}",
-                        callback_data=f"category_{category['id']}"
-                    )])
-                
-                keyboard.append([InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))])
-                
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(text, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text("❌ Ошибка загрузки категорий")
+                # level_0 вместо id: id категории - хэш, он различается между процессами
+                keyboard.append([InlineKeyboardButton(
+                    f"{category['icon']} {category['name']}",
+                    callback_data=f"cat:{category['level_0']}"
+                )])
+            
+            keyboard.append([InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))])
+            
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(text, reply_markup=reply_markup)
                 
         except Exception as e:
             logger.error(f"Error fetching categories: {e}")
@@ -105,29 +116,25 @@ class ElectronicsStoreBot:
         
         query = " ".join(context.args)
         try:
-            response = requests.get(f"{self.api_url}/search", params={"q": query, "limit": 10})
-            if response.status_code == 200:
-                products = response.json()
-                
-                if not products:
-                    await update.message.reply_text(f"🔍 По запросу '{query}' ничего не найдено")
-                    return
-                
-                text = f"🔍 Результаты поиска по запросу '{query}':\n\n"
-                
-                for product in products:
-                    discount_text = f" (скидка {product['discount_percentage']:.0f}%)" if product['discount_percentage'] > 0 else ""
-                    text += f"📱 {product['name']}\n"
-                    text += f"💰 {product['price']:,.0f} ₽{discount_text}\n"
-                    text += f"🏷️ {product['brand']} {product['model']}\n"
-                    text += f"📂 {product['category_name']}\n\n"
-                
-                keyboard = [[InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(text, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text("❌ Ошибка поиска")
+            products = await self.catalog.search(query, limit=10)
+            
+            if not products:
+                await update.message.reply_text(f"🔍 По запросу '{query}' ничего не найдено")
+                return
+            
+            text = f"🔍 Результаты поиска по запросу '{query}':\n\n"
+            
+            for product in products:
+                discount_text = f" (скидка {product['discount_percentage']:.0f}%)" if product['discount_percentage'] > 0 else ""
+                text += f"📱 {product['name']}\n"
+                text += f"💰 {product['price']:,.0f} ₽{discount_text}\n"
+                text += f"🏷️ {product['brand']} {product['model']}\n"
+                text += f"📂 {product['category_name']}\n\n"
+            
+            keyboard = [[InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.message.reply_text(text, reply_markup=reply_markup)
                 
         except Exception as e:
             logger.error(f"Error searching products: {e}")
@@ -138,67 +145,113 @@ class ElectronicsStoreBot:
         query = update.callback_query
         await query.answer()
         
-        if query.data.startswith("category_"):
-            category_id = int(query.data.split("_")[1])
-            await self.show_category_products(query, category_id)
+        if query.data.startswith("cat:"):
+            await self.show_category_products(query, query.data[len("cat:"):])
+        elif query.data == "back_to_main":
+            await query.edit_message_text("🛍️ Выберите категорию:", reply_markup=self.main_menu_markup())
     
-    async def show_category_products(self, query, category_id: int):
-        """Show products in a specific category"""
+    async def show_category_products(self, query, level_0: str):
+        """Show products in a specific category (one catalog call, cached per chat)"""
         try:
-            response = requests.get(f"{self.api_url}/products", params={"category_id": category_id, "limit": 10})
-            if response.status_code == 200:
-                products = response.json()
-                
-                if not products:
-                    await query.edit_message_text("❌ В этой категории пока нет товаров")
-                    return
-                
-                # Get category name
-                category_response = requests.get(f"{self.api_url}/categories")
-                category_name = "Товары"
-                if category_response.status_code == 200:
-                    categories = category_response.json()
-                    for cat in categories:
-                        if cat['id'] == category_id:
-                            category_name = cat['name']
-                            break
-                
-                text = f"📂 {category_name}:\n\n"
-                
-                for product in products:
-                    discount_text = f" (скидка {product['discount_percentage']:.0f}%)" if product['discount_percentage'] > 0 else ""
-                    text += f"📱 {product['name']}\n"
-                    text += f"💰 {product['price']:,.0f} ₽{discount_text}\n"
-                    text += f"🏷️ {product['brand']} {product['model']}\n\n"
-                
-                keyboard = [
-                    [InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))],
-                    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await query.edit_message_text(text, reply_markup=reply_markup)
-            else:
-                await query.edit_message_text("❌ Ошибка загрузки товаров")
+            products = await self.cache.get_or_load(
+                query.message.chat.id if query.message else query.from_user.id,
+                ("category_products", level_0),
+                lambda: self.catalog.get_category_products(level_0, limit=10)
+            )
+            
+            if not products:
+                await query.edit_message_text("❌ В этой категории пока нет товаров")
+                return
+            
+            text = f"📂 {level_0}:\n\n"
+            
+            for product in products:
+                discount_text = f" (скидка {product['discount_percentage']:.0f}%)" if product['discount_percentage'] > 0 else ""
+                text += f"📱 {product['name']}\n"
+                text += f"💰 {product['price']:,.0f} ₽{discount_text}\n"
+                text += f"🏷️ {product['brand']} {product['model']}\n\n"
+            
+            keyboard = [
+                [InlineKeyboardButton("🛍️ Открыть магазин", web_app=WebAppInfo(url=f"{self.api_url}/webapp"))],
+                [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await query.edit_message_text(text, reply_markup=reply_markup)
                 
         except Exception as e:
             logger.error(f"Error fetching category products: {e}")
             await query.edit_message_text("❌ Ошибка подключения к серверу")
     
-    def run(self):
-        """Run the bot"""
-        if not self.token:
-            logger.error("TELEGRAM_BOT_TOKEN not set!")
-            return
+    def card_to_inline_result(self, card) -> InlineQueryResultArticle:
+        """Inline результат из карточки модели (web_app кнопки в inline режиме недоступны - обычная ссылка)"""
+        if card['min_price']:
+            price_text = f"от {card['min_price']:,.0f} ₽"
+        else:
+            price_text = "Цена по запросу"
+        variants_text = f"{card['variants_count']} вариантов" if card['variants_count'] > 1 else card['brand']
         
-        application = Application.builder().token(self.token).build()
+        return InlineQueryResultArticle(
+            id=card['id'],
+            title=card['title'],
+            description=f"{price_text} · {variants_text}",
+            thumbnail_url=card['thumbnail_url'],
+            url=card['url'],
+            input_message_content=InputTextMessageContent(f"📱 {card['title']}\n💰 {price_text}\n🏷️ {card['brand']}"),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🛍️ Открыть в магазине", url=card['url'])]]),
+        )
+    
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle inline queries (@bot iphone 16)"""
+        inline_query = update.inline_query
+        try:
+            offset = int(inline_query.offset) if inline_query.offset else 0
+        except ValueError:
+            offset = 0
         
-        # Add handlers
+        try:
+            cards, next_offset = await self.catalog.search_cards(inline_query.query, limit=INLINE_PAGE_SIZE, offset=offset)
+        except Exception as e:
+            logger.error(f"Error searching inline cards: {e}")
+            # Ошибку не кэшируем - пользователь повторит запрос
+            await inline_query.answer([], cache_time=0)
+            return
+        
+        # Ответы одинаковы для всех пользователей - Telegram отдает повторные запросы из своего кэша
+        await inline_query.answer(
+            [self.card_to_inline_result(card) for card in cards],
+            cache_time=Config.INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=str(next_offset) if next_offset is not None else "",
+        )
+    
+    def add_handlers(self, application: Application):
+        """Register command and callback handlers"""
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("categories", self.categories_command))
         application.add_handler(CommandHandler("search", self.search_command))
         application.add_handler(CallbackQueryHandler(self.button_callback))
+        application.add_handler(InlineQueryHandler(self.inline_query))
+    
+    async def shutdown(self, application: Application):
+        """Close the catalog client (HTTP pool in remote mode)"""
+        await self.catalog.close()
+    
+    def build_application(self, builder=None) -> Application:
+        """Build the bot application; handlers run concurrently since they no longer block the loop"""
+        builder = builder or Application.builder().token(self.token)
+        application = builder.concurrent_updates(True).post_shutdown(self.shutdown).build()
+        self.add_handlers(application)
+        return application
+    
+    def run(self):
+        """Run the bot"""
+        if not self.token:
+            logger.error("TELEGRAM_BOT_TOKEN not set!")
+            return
+        
+        application = self.build_application()
         
         logger.info("Starting bot...")
         application.run_polling()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Матрица вариантов модели (level_2) для /products/{model}/variants
+
+Для каждой модели в памяти хранится:
+- оси выбора: color, memory, sim_type, ram, screen_size, band_size (значения в порядке показа)
+- сетка SKU: комбинация значений осей -> SKU, строки вариантов с наличием
+- изображения по цветам
+
+Структура модели строится один раз из одного запроса по индексу level_2 (для нескольких
+моделей - одним запросом level_2 IN); цены подставляются при выдаче из кэша цен процесса
+(одно обращение на ответ), поэтому изменение цены
+не требует перестроения. При изменении каталога (в любом воркере) сверяются штампы
+моделей (COUNT/MAX(id)/MAX(updated_at) одним GROUP BY) и перестраиваются только
+модели, у которых изменились товары; изменение таблицы изображений сбрасывает
+только изображения.
+"""
+
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from database import SessionLocal
+from models import Product, ProductImage
+from price_storage import get_prices
+from cache_coherence import shared_versions
+from catalog_cards import parse_image_list
+
+# Оси выбора варианта (ключи совпадают с полями варианта в ответе)
+VARIANT_AXES = ("color", "memory", "sim_type", "ram", "screen_size", "band_size")
+
+
+def _normalize_level2(level_2: str) -> str:
+    return level_2.lower().replace(' ', '').replace('-', '').replace('series', '').replace('s11', 'series11').replace('sportband', '')
+
+
+def _normalize_color(color: str) -> str:
+    return color.lower().replace(' ', '').replace('-', '').replace('/', '').replace('_', '')
+
+
+def _match_normalized(level_2: str, color: str, normalized_rows):
+    """Нормализованное сопоставление по (запись, level_2 записи, цвет записи) в исходном порядке"""
+    product_level2_normalized = _normalize_level2(level_2)
+    product_color_normalized = _normalize_color(color)
+    for img, img_level2_normalized, img_color_normalized in normalized_rows:
+        # Если цвет содержит "/", пробуем первую часть
+        if '/' in color:
+            color_first_part = color.split('/')[0].lower().replace(' ', '').replace('-', '')
+            if color_first_part in img_color_normalized or img_color_normalized in color_first_part:
+                product_color_normalized = img_color_normalized
+
+        level2_match = (img_level2_normalized == product_level2_normalized or
+                        product_level2_normalized in img_level2_normalized or
+                        img_level2_normalized in product_level2_normalized)
+
+        color_match = (img_color_normalized == product_color_normalized or
+                       product_color_normalized in img_color_normalized or
+                       img_color_normalized in product_color_normalized)
+
+        if level2_match and color_match:
+            return img
+    return None
+
+
+def match_image_row(level_2: str, color: str, image_rows):
+    """
+    Найти запись ProductImage для (level_2, color): точное совпадение, затем нормализованное
+    (без регистра/пробелов/дефисов, вхождение строк). image_rows - записи с level_2, color, img_list
+    """
+    for img in image_rows:
+        if img.level_2 == level_2 and img.color == color:
+            return img
+    return _match_normalized(level_2, color, (
+        (img, _normalize_level2(img.level_2), _normalize_color(img.color)) for img in image_rows
+    ))
+
+
+class ImageRowMatcher:
+    """
+    match_image_row для многих поисков по одной таблице изображений: точные пары в словаре,
+    нормализация записей один раз, кандидаты по level_2 запоминаются
+    """
+
+    def __init__(self, image_rows):
+        self._exact = {}
+        for img in image_rows:
+            self._exact.setdefault((img.level_2, img.color), img)
+        self._normalized = [(img, _normalize_level2(img.level_2), _normalize_color(img.color)) for img in image_rows]
+        self._level2_candidates: Dict[str, List[tuple]] = {}
+
+    def match(self, level_2: str, color: str):
+        img = self._exact.get((level_2, color))
+        if img is not None:
+            return img
+        if '/' in color:
+            # Цвет с "/" подстраивается под каждую запись по порядку - нужен полный проход
+            return _match_normalized(level_2, color, self._normalized)
+
+        product_level2_normalized = _normalize_level2(level_2)
+        candidates = self._level2_candidates.get(product_level2_normalized)
+        if candidates is None:
+            candidates = self._level2_candidates[product_level2_normalized] = [
+                row for row in self._normalized
+                if (row[1] == product_level2_normalized or product_level2_normalized in row[1] or row[1] in product_level2_normalized)
+            ]
+        return _match_normalized(level_2, color, candidates)
+
+
+def model_key(name: str) -> str:
+    """Ключ модели как в webapp (getModelKey): нижний регистр, без пробелов, дефисов и кавычек"""
+    return re.sub(r'["\'«»–—\-\s]', '', str(name or '').lower())
+
+
+def grid_key(variant: Dict[str, Any]) -> str:
+    """Ключ ячейки сетки: значения осей через '|'"""
+    return "|".join(str(variant.get(axis) or '') for axis in VARIANT_AXES)
+
+
+class VariantMatrixStore:
+    """Матрицы вариантов моделей в памяти процесса"""
+
+    def __init__(self):
+        self._matrices: Dict[str, Dict[str, Any]] = {}
+        self._stamps: Optional[Dict[str, Tuple]] = None
+        self._images_stamp: Optional[Tuple] = None
+        self._image_matcher: Optional[ImageRowMatcher] = None
+        self._model_keys: Dict[str, str] = {}
+        self._catalog_changed = True
+        self._lock = threading.Lock()
+        self.builds = 0
+        shared_versions.subscribe("catalog", self.invalidate)
+
+    def invalidate(self):
+        self._catalog_changed = True
+
+    def _sync(self, db):
+        """После изменения каталога: выбросить матрицы только изменившихся моделей"""
+        if not self._catalog_changed:
+            return
+        self._catalog_changed = False
+
+        stamps = {}
+        model_keys = {}
+        for level_2, brand, count, max_id, max_updated, available in db.query(
+            Product.level_2, func.max(Product.brand), func.count(Product.id), func.max(Product.id),
+            func.max(Product.updated_at), func.sum(Product.is_available)
+        ).group_by(Product.level_2):
+            stamps[level_2] = (count, max_id, str(max_updated), available)
+            if level_2:
+                model_keys.setdefault(model_key(level_2), level_2)
+                model_keys.setdefault(model_key(f"{brand} {level_2}"), level_2)
+        self._model_keys = model_keys
+        images_stamp = tuple(str(value) for value in db.query(
+            func.count(ProductImage.id), func.max(ProductImage.id), func.max(ProductImage.updated_at)
+        ).one())
+
+        if images_stamp != self._images_stamp:
+            # Изображения подбираются нечетко (по нормализованным названиям) - пересчитываем у всех моделей
+            self._images_stamp = images_stamp
+            self._image_matcher = None
+            for matrix in self._matrices.values():
+                matrix["images_by_color"] = None
+
+        if self._stamps is not None:
+            for level_2 in list(self._matrices):
+                if stamps.get(level_2) != self._stamps.get(level_2):
+                    del self._matrices[level_2]
+        else:
+            self._matrices.clear()
+        self._stamps = stamps
+
+    def _get_image_matcher(self, db) -> ImageRowMatcher:
+        if self._image_matcher is None:
+            self._image_matcher = ImageRowMatcher(
+                db.query(ProductImage.level_2, ProductImage.color, ProductImage.img_list).all()
+            )
+        return self._image_matcher
+
+    def _build_structure(self, products) -> Dict[str, Any]:
+        """Строки вариантов модели без цен; products - (id, sku, name, stock, is_available, specifications)"""
+        rows = []
+        for product_id, sku, name, stock, is_available, raw_specifications in products:
+            try:
+                specifications = json.loads(raw_specifications) if raw_specifications else {}
+            except json.JSONDecodeError:
+                specifications = {}
+
+            if isinstance(specifications.get('variants'), list):
+                # Старый формат: основной товар с вложенными вариантами - он задает всю модель
+                return {"rows": self._nested_variant_rows(specifications), "nested": True}
+
+            rows.append({
+                "product_id": product_id,
+                "sku": sku,
+                "name": name,
+                "stock": stock,
+                "is_available": is_available,
+                "color": specifications.get('color', ''),
+                "memory": specifications.get('disk', specifications.get('memory', '')),
+                "sim_type": specifications.get('sim_config', specifications.get('sim_type', '')),
+                "ram": specifications.get('ram', ''),  # RAM для ноутбуков
+                "screen_size": specifications.get('screen_size', ''),  # Размер экрана
+                "band_size": specifications.get('band_size', ''),  # Размер ремешка
+                "_spec_images": parse_image_list(specifications.get('images', [])),
+            })
+
+        # Сортируем варианты по цвету (стабильно, после сортировки по specifications)
+        rows.sort(key=lambda row: row.get('color', ''))
+        return {"rows": rows, "nested": False}
+
+    @staticmethod
+    def _nested_variant_rows(specifications: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = []
+        for variant_info in sorted(specifications['variants'], key=lambda x: x.get('specifications', {}).get('color', '')):
+            variant_specs = variant_info.get('specifications', {})
+            variant_color_normalized = variant_specs.get('color', '').lower().replace(' ', '-')
+            variant_images = []
+            for img_info in specifications.get('images', []):
+                if isinstance(img_info, dict) and 'color' in img_info:
+                    if img_info.get('color', '').lower() == variant_color_normalized:
+                        variant_images.append(img_info.get('url', ''))
+                elif isinstance(img_info, str) and variant_color_normalized in img_info.lower():
+                    variant_images.append(img_info)
+
+            rows.append({
+                "product_id": variant_info.get('id'),
+                "sku": variant_info['sku'],
+                "name": variant_info['name'],
+                "stock": variant_info.get('stock', 0),
+                "is_available": variant_info.get('is_available', True),
+                "color": variant_specs.get('color', ''),
+                "memory": variant_specs.get('memory', ''),
+                "sim_type": variant_specs.get('sim_type', ''),
+                "ram": variant_specs.get('ram', ''),
+                "screen_size": variant_specs.get('screen_size', ''),
+                "band_size": variant_specs.get('band_size', ''),
+                "_images": variant_images,
+            })
+        return rows
+
+    def _build_images(self, model: str, structure: Dict[str, Any], db) -> Dict[str, Any]:
+        """Изображения строк: из specifications варианта, иначе из ProductImage по (level_2, color)"""
+        by_color: Dict[str, List[str]] = {}
+        table_images: Dict[str, List[str]] = {}
+        row_images = []
+        for row in structure["rows"]:
+            if structure["nested"]:
+                images = row["_images"]
+            else:
+                images = row["_spec_images"]
+                if not images and row["color"]:
+                    if row["color"] not in table_images:
+                        image_row = self._get_image_matcher(db).match(model, row["color"])
+                        table_images[row["color"]] = parse_image_list(image_row.img_list) if image_row and image_row.img_list else []
+                    images = table_images[row["color"]]
+            row_images.append(images)
+            if row["color"] and images:
+                by_color.setdefault(row["color"], images)
+        return {"images_by_color": by_color, "row_images": row_images}
+
+    def _build(self, products) -> Dict[str, Any]:
+        structure = self._build_structure(products)
+        axes = {axis: [] for axis in VARIANT_AXES}
+        for row in structure["rows"]:
+            for axis in VARIANT_AXES:
+                value = row.get(axis)
+                if value and value not in axes[axis]:
+                    axes[axis].append(value)
+        self.builds += 1
+        return {
+            "structure": structure,
+            "axes": {axis: values for axis, values in axes.items() if values},
+            "grid": {grid_key(row): row["sku"] for row in structure["rows"]},
+            "images_by_color": None,
+        }
+
+    def resolve_model_key(self, key: str, db) -> Optional[str]:
+        """level_2 по ключу модели webapp ("iphone16pro", "appleiphone16pro")"""
+        with self._lock:
+            self._sync(db)
+            return self._model_keys.get(model_key(key))
+
+    def get(self, model: str, db=None) -> Dict[str, Any]:
+        """Ответ /products/{model}/variants: варианты с актуальными ценами, оси, сетка, изображения"""
+        return self.get_many([model], db)[model]
+
+    def get_many(self, models: List[str], db=None) -> Dict[str, Dict[str, Any]]:
+        """
+        Матрицы нескольких моделей: недостающие строятся одним запросом (level_2 IN ...),
+        цены всех SKU берутся одним обращением к кэшу цен
+        """
+        shared_versions.check()
+        models = list(dict.fromkeys(models))
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            with self._lock:
+                self._sync(db)
+                missing = [model for model in models if model not in self._matrices]
+                uncached = {}
+                if missing:
+                    products_by_model = {model: [] for model in missing}
+                    for level_2, *product in db.query(
+                        Product.level_2, Product.id, Product.sku, Product.name, Product.stock,
+                        Product.is_available, Product.specifications
+                    ).filter(Product.level_2.in_(missing)).order_by(Product.specifications):
+                        products_by_model[level_2].append(product)
+                    for model in missing:
+                        matrix = self._build(products_by_model[model])
+                        # Несуществующие модели не кэшируем - иначе кэш растет от произвольных запросов
+                        if model in self._stamps:
+                            self._matrices[model] = matrix
+                        else:
+                            uncached[model] = matrix
+
+                matrices = {}
+                for model in models:
+                    matrix = self._matrices.get(model) or uncached[model]
+                    if matrix["images_by_color"] is None:
+                        images = self._build_images(model, matrix["structure"], db)
+                        matrix["row_images"] = images["row_images"]
+                        matrix["images_by_color"] = images["images_by_color"]
+                    matrices[model] = matrix
+        finally:
+            if own_session:
+                db.close()
+
+        prices = get_prices(row["sku"] for matrix in matrices.values() for row in matrix["structure"]["rows"])
+        return {model: self._render(model, matrix, prices) for model, matrix in matrices.items()}
+
+    @staticmethod
+    def _render(model: str, matrix: Dict[str, Any], prices: Dict[str, Dict]) -> Dict[str, Any]:
+        variants = []
+        for row, images in zip(matrix["structure"]["rows"], matrix["row_images"]):
+            price_data = prices.get(row["sku"]) or {}
+            variants.append({
+                "product_id": row["product_id"],
+                "sku": row["sku"],
+                "name": row["name"],
+                "price": price_data.get('price', 0.0),
+                "old_price": price_data.get('old_price', 0.0),
+                "discount_percentage": price_data.get('discount_percentage', 0.0),
+                "currency": price_data.get('currency', 'RUB'),
+                "stock": row["stock"],
+                "is_available": row["is_available"],
+                **{axis: row[axis] for axis in VARIANT_AXES},
+                "images": images,
+                "main_image": images[0] if images else "",
+            })
+
+        return {
+            "model": model,
+            "variants": variants,
+            "total_variants": len(variants),
+            "axes": matrix["axes"],
+            "grid": matrix["grid"],
+            "images_by_color": matrix["images_by_color"],
+        }
+
+
+# Глобальный экземпляр для процесса
+variant_matrix = VariantMatrixStore()
+
+
+# Ключи осей в схеме вариантов webapp (labels в createVariantsForProduct)
+SCHEME_AXIS_KEYS = {
+    "color": "color",
+    "memory": "memory",
+    "sim_type": "sim",
+    "ram": "ram",
+    "screen_size": "screen",
+    "band_size": "band_size",
+}
+
+
+def color_scheme(matrix: Dict[str, Any]) -> Dict[str, Any]:
+    """Цветовая схема модели из ее вариантов (раньше хранилась в таблице ModelColorScheme)"""
+    images_by_color = matrix["images_by_color"]
+    colors = [
+        {"value": color, "name": color, "image": (images_by_color.get(color) or [""])[0]}
+        for color in matrix["axes"].get("color", [])
+    ]
+    available = [variant["color"] for variant in matrix["variants"] if variant["is_available"] and variant["color"]]
+    default_color = available[0] if available else (colors[0]["value"] if colors else "")
+    return {"colors": colors, "default_color": default_color}
+
+
+def variant_scheme(matrix: Dict[str, Any]) -> Dict[str, Any]:
+    """Схема вариантов модели из ее вариантов (раньше хранилась в таблице ModelVariantScheme)"""
+    return {"variants": {SCHEME_AXIS_KEYS[axis]: values for axis, values in matrix["axes"].items()}}